@@ -44,6 +44,7 @@ from common.constants import RetCode, VALID_TASK_STATUS, ParserType, TaskStatus
 from api.utils.web_utils import CONTENT_TYPE_MAP, html2pdf, is_valid_url
 from deepdoc.parser.html_parser import RAGFlowHtmlParser
 from rag.nlp import search, rag_tokenizer
+from rag.utils.artifact_cache import ARTIFACT_CACHE
 from common import settings
 
 
@@ -121,6 +122,7 @@ async def web_crawl():
         while settings.STORAGE_IMPL.obj_exist(kb_id, location):
             location += "_"
         settings.STORAGE_IMPL.put(kb_id, location, blob)
+        ARTIFACT_CACHE.forget(kb_id, location)
         doc = {
             "id": get_uuid(),
             "kb_id": kb.id,
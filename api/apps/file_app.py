@@ -33,6 +33,7 @@ from api.utils.api_utils import get_json_result
 from api.utils.file_utils import filename_type
 from api.utils.web_utils import CONTENT_TYPE_MAP
 from common import settings
+from rag.utils.artifact_cache import ARTIFACT_CACHE
 
 
 @manager.route('/upload', methods=['POST'])  # noqa: F821
@@ -103,6 +104,7 @@ async def upload():
                 name=file_obj_names[file_len - 1],
                 parent_id=last_folder.id)
             settings.STORAGE_IMPL.put(last_folder.id, location, blob)
+            ARTIFACT_CACHE.forget(last_folder.id, location)
             file = {
                 "id": get_uuid(),
                 "parent_id": last_folder.id,
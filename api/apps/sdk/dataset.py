@@ -530,7 +530,7 @@ def delete_knowledge_graph(tenant_id, dataset_id):
             code=RetCode.AUTHENTICATION_ERROR
         )
     _, kb = KnowledgebaseService.get_by_id(dataset_id)
-    settings.docStoreConn.delete({"knowledge_graph_kwd": ["graph", "subgraph", "entity", "relation"]},
+    settings.docStoreConn.delete({"knowledge_graph_kwd": ["graph", "graph_segment", "subgraph", "entity", "relation"]},
                                  search.index_name(kb.tenant_id), dataset_id)
 
     return get_result(data=True)
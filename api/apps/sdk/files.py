@@ -32,6 +32,7 @@ from api.utils.api_utils import get_json_result
 from api.utils.file_utils import filename_type
 from common import settings
 from common.constants import RetCode
+from rag.utils.artifact_cache import ARTIFACT_CACHE
 
 @manager.route('/file/upload', methods=['POST'])  # noqa: F821
 @token_required
@@ -143,6 +144,7 @@ async def upload(tenant_id):
             }
             file = FileService.insert(file)
             settings.STORAGE_IMPL.put(last_folder.id, location, blob)
+            ARTIFACT_CACHE.forget(last_folder.id, location)
             file_res.append(file.to_json())
         return get_json_result(data=file_res)
     except Exception as e:
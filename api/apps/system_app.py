@@ -34,6 +34,7 @@ from common.time_utils import current_timestamp, datetime_format
 from timeit import default_timer as timer
 
 from rag.utils.redis_conn import REDIS_CONN
+from rag.utils.retrieval_cache import RETRIEVAL_CACHE
 from quart import jsonify
 from api.utils.health_utils import run_health_checks
 from common import settings
@@ -167,6 +168,7 @@ def status():
     except Exception:
         logging.exception("get task executor heartbeats failed!")
     res["task_executor_heartbeats"] = task_executor_heartbeats
+    res["retrieval_cache"] = RETRIEVAL_CACHE.stats()
 
     return get_json_result(data=res)
 
@@ -15,6 +15,7 @@
 #
 import json
 import logging
+import os
 import random
 import re
 from concurrent.futures import ThreadPoolExecutor
@@ -31,16 +32,20 @@ from api.db import PIPELINE_SPECIAL_PROGRESS_FREEZE_TASK_TYPES, FileType, UserTe
 from api.db.db_models import DB, Document, Knowledgebase, Task, Tenant, UserTenant, File2Document, File, UserCanvas, \
     User
 from api.db.db_utils import bulk_insert_into_db
-from api.db.services.common_service import CommonService
+from api.db.services.common_service import CommonService, retry_db_operation
 from api.db.services.knowledgebase_service import KnowledgebaseService
 from common.misc_utils import get_uuid
-from common.time_utils import current_timestamp, get_format_time
+from common.time_utils import current_timestamp, datetime_format, get_format_time
 from common.constants import LLMType, ParserType, StatusEnum, TaskStatus, SVR_CONSUMER_GROUP_NAME
 from rag.nlp import rag_tokenizer, search
-from rag.utils.redis_conn import REDIS_CONN
+from rag.utils import fair_queue
+from rag.utils.artifact_cache import ARTIFACT_CACHE
 from rag.utils.doc_store_conn import OrderByExpr
 from common import settings
 
+# Documents per IN query and per update transaction when syncing parsing progress.
+SYNC_PROGRESS_BATCH_SIZE = int(os.environ.get("SYNC_PROGRESS_BATCH_SIZE", 500))
+
 
 class DocumentService(CommonService):
     model = Document
@@ -299,8 +304,14 @@ class DocumentService(CommonService):
     @classmethod
     @DB.connection_context()
     def remove_document(cls, doc, tenant_id):
+        from api.db.services.file2document_service import File2DocumentService
         from api.db.services.task_service import TaskService
         cls.clear_chunk_num(doc.id)
+        try:
+            # A later upload may reuse the storage location of the document.
+            ARTIFACT_CACHE.forget(*File2DocumentService.get_storage_address(doc_id=doc.id))
+        except Exception:
+            logging.exception(f"Forget the staged copy of document {doc.id}")
         try:
             TaskService.filter_delete([Task.doc_id == doc.id])
             page = 0
@@ -680,62 +691,110 @@ class DocumentService(CommonService):
     @classmethod
     @DB.connection_context()
     def _sync_progress(cls, docs:list[dict]):
-        from api.db.services.task_service import TaskService
-
+        # Set based: the tasks and current state of all the docs are fetched with a few IN queries,
+        # the queue length is looked up once per priority and the updates share one transaction per batch.
+        if not docs:
+            return
+        doc_ids = [d["id"] for d in docs]
+        tasks = {}
+        current = {}
+        for ids in cls.cut_list(doc_ids, SYNC_PROGRESS_BATCH_SIZE):
+            task_fields = [Task.doc_id, Task.task_type, Task.progress, Task.progress_msg, Task.priority]
+            for t in Task.select(*task_fields).where(Task.doc_id.in_(ids)).order_by(Task.create_time).dicts():
+                tasks.setdefault(t["doc_id"], []).append(t)
+            for r in cls.model.select(cls.model.id, cls.model.run, cls.model.progress).where(cls.model.id.in_(ids)).dicts():
+                current[r["id"]] = r
+
+        queue_lengths = {}
+
+        def queue_length(priority):
+            if priority not in queue_lengths:
+                queue_lengths[priority] = get_queue_length(priority)
+            return queue_lengths[priority]
+
+        updates = []
         for d in docs:
             try:
-                tsks = TaskService.query(doc_id=d["id"], order_by=Task.create_time)
-                if not tsks:
+                tsks = tasks.get(d["id"])
+                doc = current.get(d["id"])
+                if not tsks or not doc:
                     continue
-                msg = []
-                prg = 0
-                finished = True
-                bad = 0
-                e, doc = DocumentService.get_by_id(d["id"])
-                status = doc.run  # TaskStatus.RUNNING.value
-                doc_progress = doc.progress if doc and doc.progress else 0.0
-                special_task_running = False
-                priority = 0
-                for t in tsks:
-                    task_type = (t.task_type or "").lower()
-                    if task_type in PIPELINE_SPECIAL_PROGRESS_FREEZE_TASK_TYPES:
-                        special_task_running = True
-                    if 0 <= t.progress < 1:
-                        finished = False
-                    if t.progress == -1:
-                        bad += 1
-                    prg += t.progress if t.progress >= 0 else 0
-                    if t.progress_msg.strip():
-                        msg.append(t.progress_msg)
-                    priority = max(priority, t.priority)
-                prg /= len(tsks)
-                if finished and bad:
-                    prg = -1
-                    status = TaskStatus.FAIL.value
-                elif finished:
-                    prg = 1
-                    status = TaskStatus.DONE.value
-
-                # only for special task and parsed docs and unfinished
-                freeze_progress = special_task_running and doc_progress >= 1 and not finished
-                msg = "\n".join(sorted(msg))
-                info = {
-                    "process_duration": datetime.timestamp(
-                        datetime.now()) -
-                                       d["process_begin_at"].timestamp(),
-                    "run": status}
-                if prg != 0 and not freeze_progress:
-                    info["progress"] = prg
-                if msg:
-                    info["progress_msg"] = msg
-                    if msg.endswith("created task graphrag") or msg.endswith("created task raptor") or msg.endswith("created task mindmap"):
-                        info["progress_msg"] += "\n%d tasks are ahead in the queue..."%get_queue_length(priority)
-                else:
-                    info["progress_msg"] = "%d tasks are ahead in the queue..."%get_queue_length(priority)
-                cls.update_by_id(d["id"], info)
+                info = cls._aggregate_progress(d, doc, tsks, queue_length)
+                updates.append((d["id"], doc["run"], info))
             except Exception as e:
                 if str(e).find("'0'") < 0:
                     logging.exception("fetch task exception")
+        for batch in cls.cut_list(updates, SYNC_PROGRESS_BATCH_SIZE):
+            try:
+                retry_db_operation(cls._write_progress)(batch)
+            except Exception:
+                logging.exception("update document progress exception, retry document by document")
+                # a bad row costs its own progress, not the one of the whole batch
+                for row in batch:
+                    try:
+                        cls._write_progress([row])
+                    except Exception:
+                        logging.exception(f"update progress of document {row[0]} exception")
+
+    @classmethod
+    @DB.connection_context()
+    def _write_progress(cls, rows: list[tuple[str, str, dict]]):
+        """
+        Writes the progress of (doc_id, run read, info) rows in one transaction. A document whose run
+        changed since it was read, canceled meanwhile for instance, is left as it is.
+        """
+        with DB.atomic():
+            for doc_id, run, info in rows:
+                info = dict(info, update_time=current_timestamp(), update_date=datetime_format(datetime.now()))
+                cls.model.update(info).where((cls.model.id == doc_id) & (cls.model.run == run)).execute()
+
+    @staticmethod
+    def _aggregate_progress(d: dict, doc: dict, tsks: list[dict], queue_length) -> dict:
+        msg = []
+        prg = 0
+        finished = True
+        bad = 0
+        status = doc["run"]  # TaskStatus.RUNNING.value
+        doc_progress = doc["progress"] if doc["progress"] else 0.0
+        special_task_running = False
+        priority = 0
+        for t in tsks:
+            task_type = (t["task_type"] or "").lower()
+            if task_type in PIPELINE_SPECIAL_PROGRESS_FREEZE_TASK_TYPES:
+                special_task_running = True
+            if 0 <= t["progress"] < 1:
+                finished = False
+            if t["progress"] == -1:
+                bad += 1
+            prg += t["progress"] if t["progress"] >= 0 else 0
+            if t["progress_msg"].strip():
+                msg.append(t["progress_msg"])
+            priority = max(priority, t["priority"])
+        prg /= len(tsks)
+        if finished and bad:
+            prg = -1
+            status = TaskStatus.FAIL.value
+        elif finished:
+            prg = 1
+            status = TaskStatus.DONE.value
+
+        # only for special task and parsed docs and unfinished
+        freeze_progress = special_task_running and doc_progress >= 1 and not finished
+        msg = "\n".join(sorted(msg))
+        info = {
+            "process_duration": datetime.timestamp(
+                datetime.now()) -
+                               d["process_begin_at"].timestamp(),
+            "run": status}
+        if prg != 0 and not freeze_progress:
+            info["progress"] = prg
+        if msg:
+            info["progress_msg"] = msg
+            if msg.endswith("created task graphrag") or msg.endswith("created task raptor") or msg.endswith("created task mindmap"):
+                info["progress_msg"] += "\n%d tasks are ahead in the queue..."%queue_length(priority)
+        else:
+            info["progress_msg"] = "%d tasks are ahead in the queue..."%queue_length(priority)
+        return info
 
     @classmethod
     @DB.connection_context()
@@ -875,15 +934,12 @@ def queue_raptor_o_graphrag_tasks(sample_doc_id, ty, priority, fake_doc_id="", d
     task["doc_id"] = fake_doc_id
     task["doc_ids"] = doc_ids
     DocumentService.begin2parse(sample_doc_id["id"], keep_progress=True)
-    assert REDIS_CONN.queue_product(settings.get_svr_queue_name(priority), message=task), "Can't access Redis. Please check the Redis' status."
+    assert fair_queue.queue_product(settings.get_svr_queue_name(priority), message=task, tenant_id=chunking_config["tenant_id"]), "Can't access Redis. Please check the Redis' status."
     return task["id"]
 
 
 def get_queue_length(priority):
-    group_info = REDIS_CONN.queue_info(settings.get_svr_queue_name(priority), SVR_CONSUMER_GROUP_NAME)
-    if not group_info:
-        return 0
-    return int(group_info.get("lag", 0) or 0)
+    return fair_queue.queue_stats(settings.get_svr_queue_name(priority), SVR_CONSUMER_GROUP_NAME)["lag"]
 
 
 def doc_upload_and_parse(conversation_id, file_objs, user_id):
@@ -37,6 +37,7 @@ from api.db.services.knowledgebase_service import KnowledgebaseService
 from api.db.services.task_service import TaskService
 from api.utils.file_utils import filename_type, read_potential_broken_pdf, thumbnail_img, sanitize_path
 from rag.llm.cv_model import GptV4
+from rag.utils.artifact_cache import ARTIFACT_CACHE
 from common import settings
 
 
@@ -454,6 +455,7 @@ class FileService(CommonService):
                 if filetype == FileType.PDF.value:
                     blob = read_potential_broken_pdf(blob)
                 settings.STORAGE_IMPL.put(kb.id, location, blob)
+                ARTIFACT_CACHE.forget(kb.id, location)
 
                 doc_id = get_uuid()
 
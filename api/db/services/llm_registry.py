@@ -0,0 +1,68 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Process-wide registry of what building an LLMBundle resolves.
+
+It caches tenant model configs and authenticated Langfuse clients for
+LLM_REGISTRY_TTL seconds. Entries are also keyed by a generation counter in
+Redis. Any change to tenant LLM settings, default models or Langfuse keys
+bumps the counter, which invalidates the entries of every process at once.
+"""
+
+import logging
+import os
+import threading
+
+from cachetools import TTLCache
+
+from rag.utils.redis_conn import REDIS_CONN
+
+LLM_REGISTRY_TTL = int(os.environ.get("LLM_REGISTRY_TTL", 300))
+LLM_REGISTRY_SIZE = int(os.environ.get("LLM_REGISTRY_SIZE", 4096))
+
+
+class LLMRegistry:
+    GENERATION_KEY = "tenant_llm_generation"
+
+    def __init__(self, ttl=LLM_REGISTRY_TTL, maxsize=LLM_REGISTRY_SIZE):
+        self.enabled = ttl > 0
+        self._cache = TTLCache(maxsize=maxsize, ttl=max(ttl, 1))
+        self._lock = threading.Lock()
+
+    def _generation(self) -> str:
+        return REDIS_CONN.get(self.GENERATION_KEY) or "0"
+
+    def get_or_load(self, kind: str, key: tuple, loader):
+        """Return the cached value of (kind, key), calling `loader()` on a miss. Exceptions are not cached."""
+        if not self.enabled:
+            return loader()
+        k = (kind, self._generation()) + tuple(key)
+        with self._lock:
+            if k in self._cache:
+                return self._cache[k]
+        value = loader()
+        with self._lock:
+            self._cache[k] = value
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._cache.clear()
+        if REDIS_CONN.incrby(self.GENERATION_KEY, 1) is None:
+            logging.warning("LLMRegistry can't bump the generation, other processes keep their entries until they expire.")
+
+
+LLM_REGISTRY = LLMRegistry()
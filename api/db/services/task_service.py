@@ -21,7 +21,7 @@ from datetime import datetime
 
 from api.db.db_utils import bulk_insert_into_db
 from deepdoc.parser import PdfParser
-from peewee import JOIN
+from peewee import JOIN, fn
 from api.db.db_models import DB, File2Document, File
 from api.db import FileType
 from api.db.db_models import Task, Document, Knowledgebase, Tenant
@@ -31,12 +31,16 @@ from common.misc_utils import get_uuid
 from common.time_utils import current_timestamp
 from common.constants import StatusEnum, TaskStatus
 from deepdoc.parser.excel_parser import RAGFlowExcelParser
+from rag.utils import fair_queue, task_cost
+from rag.utils.artifact_cache import ARTIFACT_CACHE
 from rag.utils.redis_conn import REDIS_CONN
 from common import settings
 from rag.nlp import search
 
 CANVAS_DEBUG_DOC_ID = "dataflow_x"
 GRAPH_RAPTOR_FAKE_DOC_ID = "graph_raptor_x"
+# Count the pages or rows of PDFs and tables in a task executor rather than in the API.
+PLAN_TASKS_IN_EXECUTOR = int(os.environ.get("PLAN_TASKS_IN_EXECUTOR", "1"))
 
 def trim_header_by_lines(text: str, max_length) -> str:
     # Trim header text to maximum length while preserving line breaks
@@ -96,6 +100,7 @@ class TaskService(CommonService):
             cls.model.from_page,
             cls.model.to_page,
             cls.model.retry_count,
+            cls.model.priority,
             Document.kb_id,
             Document.parser_id,
             Document.parser_config,
@@ -186,6 +191,19 @@ class TaskService(CommonService):
         """
         cls.model.update(chunk_ids=chunk_ids).where(cls.model.id == id).execute()
 
+    @classmethod
+    @DB.connection_context()
+    def append_chunk_ids(cls, id: str, chunk_ids: list[str]):
+        """Append chunk IDs to a task without rewriting the ones already recorded.
+
+        Args:
+            id (str): The unique identifier of the task.
+            chunk_ids (list[str]): Chunk identifiers to add.
+        """
+        if not chunk_ids:
+            return
+        cls.model.update(chunk_ids=fn.CONCAT(fn.COALESCE(cls.model.chunk_ids, ""), " " + " ".join(chunk_ids))).where(cls.model.id == id).execute()
+
     @classmethod
     @DB.connection_context()
     def get_ongoing_doc_name(cls):
@@ -338,56 +356,111 @@ def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
         priority (int, optional): Priority level for task queueing (default is 0).
 
     Note:
-        - For PDF documents, tasks are created per page range based on configuration
+        - PDF and table documents are split by a task executor: a single "plan" task is
+          queued, which counts the pages or rows off the request path, see `plan_tasks`
+        - For PDF documents, tasks are created per page range of even expected run time
         - For Excel documents, tasks are created per row range
         - Task digests are calculated for optimization and reuse
         - Previous task chunks may be reused if available
     """
+    if PLAN_TASKS_IN_EXECUTOR and (doc["type"] == FileType.PDF.value or doc["parser_id"] == "table"):
+        task = _new_task(doc)
+        task["task_type"] = "plan"
+        task["priority"] = priority
+        bulk_insert_into_db(Task, [task], True)
+        DocumentService.begin2parse(doc["id"])
+        assert fair_queue.queue_product(
+            settings.get_svr_queue_name(priority), message=task, tenant_id=doc.get("tenant_id")
+        ), "Can't access Redis. Please check the Redis' status."
+        return
+    _queue_parse_tasks(doc, bucket, name, priority)
+
+
+def plan_tasks(task: dict):
+    """Split the document of a "plan" task into its processing tasks, queued in its place.
 
-    def new_task():
-        return {
-            "id": get_uuid(),
-            "doc_id": doc["id"],
-            "progress": 0.0,
-            "from_page": 0,
-            "to_page": 100000000,
-            "begin_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        }
+    Run by a task executor, which stages the file for the tasks to come.
 
+    Args:
+        task (dict): The plan task, as returned by `TaskService.get_task`.
+    """
+    from api.db.services.file2document_service import File2DocumentService
+
+    e, doc = DocumentService.get_by_id(task["doc_id"])
+    if not e:
+        raise LookupError(f"Document {task['doc_id']} not found")
+    doc = doc.to_dict()
+    doc["tenant_id"] = task["tenant_id"]
+    bucket, name = File2DocumentService.get_storage_address(doc_id=doc["id"])
+    _queue_parse_tasks(doc, bucket, name, task.get("priority", 0), plan_task_id=task["id"])
+    if has_canceled(task["id"]) or DocumentService.do_cancel(doc["id"]):
+        cancel_all_task_of(doc["id"])
+
+
+def _new_task(doc: dict) -> dict:
+    return {
+        "id": get_uuid(),
+        "doc_id": doc["id"],
+        "progress": 0.0,
+        "from_page": 0,
+        "to_page": 100000000,
+        "begin_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def _page_ranges(doc: dict, file_bin: bytes) -> list[tuple[int, int]]:
+    do_layout = doc["parser_config"].get("layout_recognize", "DeepDOC")
+    page_size = doc["parser_config"].get("task_page_size")
+    if page_size == task_cost.LEGACY_PAGE_SIZE and task_cost.TASK_TARGET_SECONDS > 0:
+        # the default the web UI sends, sized by cost instead
+        page_size = None
+    whole = doc["parser_id"] in ["one", "knowledge_graph"] or do_layout != "DeepDOC" or doc["parser_config"].get("toc_extraction", False)
+    profiles = None
+    if not whole and not page_size and task_cost.TASK_TARGET_SECONDS > 0:
+        profiles = PdfParser.page_profiles(doc["name"], file_bin)
+    pages = len(profiles) if profiles is not None else PdfParser.total_page_number(doc["name"], file_bin)
+    if pages is None:
+        pages = 0
+    if whole:
+        page_size = 10 ** 9
+    elif profiles is None and not page_size:
+        page_size = task_cost.LEGACY_PAPER_PAGE_SIZE if doc["parser_id"] == "paper" else task_cost.LEGACY_PAGE_SIZE
+
+    ranges = []
+    page_ranges = doc["parser_config"].get("pages") or [(1, 10 ** 5)]
+    for s, e in page_ranges:
+        s -= 1
+        s = max(0, s)
+        e = min(e - 1, pages)
+        if page_size:
+            ranges.extend((p, min(p + page_size, e)) for p in range(s, e, page_size))
+            continue
+        costs = [task_cost.page_cost(profile, doc["parser_id"]) for profile in profiles[s:e]]
+        ranges.extend((s + f, s + t) for f, t in task_cost.split_by_cost(costs))
+    return ranges
+
+
+def _queue_parse_tasks(doc: dict, bucket: str, name: str, priority: int, plan_task_id: str = None):
     parse_task_array = []
 
     if doc["type"] == FileType.PDF.value:
-        file_bin = settings.STORAGE_IMPL.get(bucket, name)
-        do_layout = doc["parser_config"].get("layout_recognize", "DeepDOC")
-        pages = PdfParser.total_page_number(doc["name"], file_bin)
-        if pages is None:
-            pages = 0
-        page_size = doc["parser_config"].get("task_page_size") or 12
-        if doc["parser_id"] == "paper":
-            page_size = doc["parser_config"].get("task_page_size") or 22
-        if doc["parser_id"] in ["one", "knowledge_graph"] or do_layout != "DeepDOC" or doc["parser_config"].get("toc_extraction", False):
-            page_size = 10 ** 9
-        page_ranges = doc["parser_config"].get("pages") or [(1, 10 ** 5)]
-        for s, e in page_ranges:
-            s -= 1
-            s = max(0, s)
-            e = min(e - 1, pages)
-            for p in range(s, e, page_size):
-                task = new_task()
-                task["from_page"] = p
-                task["to_page"] = min(p + page_size, e)
-                parse_task_array.append(task)
+        file_bin = ARTIFACT_CACHE.blob(bucket, name, lambda: settings.STORAGE_IMPL.get(bucket, name), doc.get("size"))
+        for from_page, to_page in _page_ranges(doc, file_bin):
+            task = _new_task(doc)
+            task["from_page"] = from_page
+            task["to_page"] = to_page
+            parse_task_array.append(task)
 
     elif doc["parser_id"] == "table":
-        file_bin = settings.STORAGE_IMPL.get(bucket, name)
+        file_bin = ARTIFACT_CACHE.blob(bucket, name, lambda: settings.STORAGE_IMPL.get(bucket, name), doc.get("size"))
         rn = RAGFlowExcelParser.row_number(doc["name"], file_bin)
-        for i in range(0, rn, 3000):
-            task = new_task()
-            task["from_page"] = i
-            task["to_page"] = min(i + 3000, rn)
+        for from_row, to_row in task_cost.split_evenly(rn, task_cost.rows_per_task()):
+            task = _new_task(doc)
+            task["from_page"] = from_row
+            task["to_page"] = to_row
             parse_task_array.append(task)
     else:
-        parse_task_array.append(new_task())
+        parse_task_array.append(_new_task(doc))
 
     chunking_config = DocumentService.get_chunking_config(doc["id"])
     for task in parse_task_array:
@@ -405,7 +478,7 @@ def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
         task["progress"] = 0.0
         task["priority"] = priority
 
-    prev_tasks = TaskService.get_tasks(doc["id"])
+    prev_tasks = [t for t in TaskService.get_tasks(doc["id"]) or [] if t["id"] != plan_task_id]
     ck_num = 0
     if prev_tasks:
         for task in parse_task_array:
@@ -421,12 +494,14 @@ def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
     DocumentService.update_by_id(doc["id"], {"chunk_num": ck_num})
 
     bulk_insert_into_db(Task, parse_task_array, True)
+    if plan_task_id:
+        TaskService.delete_by_id(plan_task_id)
     DocumentService.begin2parse(doc["id"])
 
     unfinished_task_array = [task for task in parse_task_array if task["progress"] < 1.0]
     for unfinished_task in unfinished_task_array:
-        assert REDIS_CONN.queue_product(
-            settings.get_svr_queue_name(priority), message=unfinished_task
+        assert fair_queue.queue_product(
+            settings.get_svr_queue_name(priority), message=unfinished_task, tenant_id=chunking_config["tenant_id"]
         ), "Can't access Redis. Please check the Redis' status."
 
 
@@ -515,8 +590,8 @@ def queue_dataflow(tenant_id:str, flow_id:str, task_id:str, doc_id:str=CANVAS_DE
     task["dataflow_id"] = flow_id
     task["file"] = file
 
-    if not REDIS_CONN.queue_product(
-            settings.get_svr_queue_name(priority), message=task
+    if not fair_queue.queue_product(
+            settings.get_svr_queue_name(priority), message=task, tenant_id=tenant_id
     ):
         return False, "Can't access Redis. Please check the Redis' status."
 
@@ -13,17 +13,28 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import atexit
+import operator
 import os
 import logging
+import threading
+import time
+from functools import reduce
+
 from langfuse import Langfuse
+from peewee import Case
 from common import settings
 from common.constants import LLMType
 from api.db.db_models import DB, LLMFactories, TenantLLM
 from api.db.services.common_service import CommonService
 from api.db.services.langfuse_service import TenantLangfuseService
+from api.db.services.llm_registry import LLM_REGISTRY
 from api.db.services.user_service import TenantService
 from rag.llm import ChatModel, CvModel, EmbeddingModel, RerankModel, Seq2txtModel, TTSModel
 
+# Seconds between two writes of the accumulated token usage, 0 writes it on every LLM call.
+TOKEN_USAGE_FLUSH_INTERVAL = float(os.environ.get("TOKEN_USAGE_FLUSH_INTERVAL", 5))
+
 
 class LLMFactoriesService(CommonService):
     model = LLMFactories
@@ -85,8 +96,14 @@ class TenantLLMService(CommonService):
         return model_name, None
 
     @classmethod
-    @DB.connection_context()
     def get_model_config(cls, tenant_id, llm_type, llm_name=None):
+        model_config = LLM_REGISTRY.get_or_load("model_config", (tenant_id, str(llm_type), llm_name),
+                                                lambda: cls._load_model_config(tenant_id, llm_type, llm_name))
+        return dict(model_config)
+
+    @classmethod
+    @DB.connection_context()
+    def _load_model_config(cls, tenant_id, llm_type, llm_name=None):
         from api.db.services.llm_service import LLMService
         e, tenant = TenantService.get_by_id(tenant_id)
         if not e:
@@ -128,8 +145,9 @@ class TenantLLMService(CommonService):
 
     @classmethod
     @DB.connection_context()
-    def model_instance(cls, tenant_id, llm_type, llm_name=None, lang="Chinese", **kwargs):
-        model_config = TenantLLMService.get_model_config(tenant_id, llm_type, llm_name)
+    def model_instance(cls, tenant_id, llm_type, llm_name=None, lang="Chinese", model_config=None, **kwargs):
+        if model_config is None:
+            model_config = TenantLLMService.get_model_config(tenant_id, llm_type, llm_name)
         kwargs.update({"provider": model_config["llm_factory"]})
         if llm_type == LLMType.EMBEDDING.value:
             if model_config["llm_factory"] not in EmbeddingModel:
@@ -172,13 +190,14 @@ class TenantLLMService(CommonService):
         return None
 
     @classmethod
-    @DB.connection_context()
     def increase_usage(cls, tenant_id, llm_type, used_tokens, llm_name=None):
-        e, tenant = TenantService.get_by_id(tenant_id)
-        if not e:
-            logging.error(f"Tenant not found: {tenant_id}")
-            return 0
+        # Accumulated in memory and written by TOKEN_USAGE in batches, see TokenUsageAccumulator.
+        # Returns the number of updated rows when written right away, True once queued otherwise:
+        # the flushes then log the usages they can't write.
+        return TOKEN_USAGE.add(tenant_id, llm_type, used_tokens, llm_name)
 
+    @staticmethod
+    def _usage_model_name(tenant, llm_type, llm_name=None):
         llm_map = {
             LLMType.EMBEDDING.value: tenant.embd_id if not llm_name else llm_name,
             LLMType.SPEECH2TEXT.value: tenant.asr_id,
@@ -187,28 +206,54 @@ class TenantLLMService(CommonService):
             LLMType.RERANK.value: tenant.rerank_id if not llm_name else llm_name,
             LLMType.TTS.value: tenant.tts_id if not llm_name else llm_name,
         }
+        return llm_map.get(llm_type)
 
-        mdlnm = llm_map.get(llm_type)
-        if mdlnm is None:
-            logging.error(f"LLM type error: {llm_type}")
+    @classmethod
+    @DB.connection_context()
+    def increase_usage_batch(cls, usages: dict) -> int:
+        """Add used tokens, given as {(tenant_id, llm_type, llm_name): tokens}, and return the number of updated rows.
+
+        Usages of the same model are summed up and every model is updated by the same CASE statement.
+        Models named with and without their factory match overlapping rows, so each kind gets its own statement,
+        both in one transaction: the usages are written entirely or not at all, and can be added again on failure.
+        """
+        tenants = {}
+        deltas = {}
+        for (tenant_id, llm_type, llm_name), used_tokens in usages.items():
+            if tenant_id not in tenants:
+                e, tenant = TenantService.get_by_id(tenant_id)
+                tenants[tenant_id] = tenant if e else None
+            if not tenants[tenant_id]:
+                logging.error(f"Tenant not found: {tenant_id}")
+                continue
+            mdlnm = cls._usage_model_name(tenants[tenant_id], llm_type, llm_name)
+            if mdlnm is None:
+                logging.error(f"LLM type error: {llm_type}")
+                continue
+            mdlnm, llm_factory = TenantLLMService.split_model_name_and_factory(mdlnm)
+            deltas[(tenant_id, mdlnm, llm_factory)] = deltas.get((tenant_id, mdlnm, llm_factory), 0) + used_tokens
+
+        statements = []
+        for with_factory in [True, False]:
+            cases = []
+            for (tenant_id, mdlnm, llm_factory), used_tokens in deltas.items():
+                if bool(llm_factory) != with_factory:
+                    continue
+                cond = (cls.model.tenant_id == tenant_id) & (cls.model.llm_name == mdlnm)
+                if llm_factory:
+                    cond &= (cls.model.llm_factory == llm_factory)
+                cases.append((cond, used_tokens))
+            if cases:
+                statements.append(cls.model.update(used_tokens=cls.model.used_tokens + Case(None, cases, 0))
+                                  .where(reduce(operator.or_, [cond for cond, _ in cases])))
+        if not statements:
             return 0
-
-        llm_name, llm_factory = TenantLLMService.split_model_name_and_factory(mdlnm)
-
         try:
-            num = (
-                cls.model.update(used_tokens=cls.model.used_tokens + used_tokens)
-                .where(cls.model.tenant_id == tenant_id, cls.model.llm_name == llm_name,
-                       cls.model.llm_factory == llm_factory if llm_factory else True)
-                .execute()
-            )
+            with DB.atomic():
+                return sum(statement.execute() for statement in statements)
         except Exception:
-            logging.exception(
-                "TenantLLMService.increase_usage got exception,Failed to update used_tokens for tenant_id=%s, llm_name=%s",
-                tenant_id, llm_name)
-            return 0
-
-        return num
+            logging.exception(f"TenantLLMService.increase_usage_batch failed to update used_tokens of {len(deltas)} models")
+            raise
 
     @classmethod
     @DB.connection_context()
@@ -221,7 +266,40 @@ class TenantLLMService(CommonService):
     @classmethod
     @DB.connection_context()
     def delete_by_tenant_id(cls, tenant_id):
-        return cls.model.delete().where(cls.model.tenant_id == tenant_id).execute()
+        num = cls.model.delete().where(cls.model.tenant_id == tenant_id).execute()
+        LLM_REGISTRY.invalidate()
+        return num
+
+    # Every write to tenant LLM settings drops the resolved configs cached by LLM_REGISTRY.
+    @classmethod
+    def save(cls, **kwargs):
+        res = super().save(**kwargs)
+        LLM_REGISTRY.invalidate()
+        return res
+
+    @classmethod
+    def insert_many(cls, data_list, batch_size=100):
+        res = super().insert_many(data_list, batch_size)
+        LLM_REGISTRY.invalidate()
+        return res
+
+    @classmethod
+    def update_by_id(cls, pid, data):
+        num = super().update_by_id(pid, data)
+        LLM_REGISTRY.invalidate()
+        return num
+
+    @classmethod
+    def filter_update(cls, filters, update_data):
+        num = super().filter_update(filters, update_data)
+        LLM_REGISTRY.invalidate()
+        return num
+
+    @classmethod
+    def filter_delete(cls, filters):
+        num = super().filter_delete(filters)
+        LLM_REGISTRY.invalidate()
+        return num
 
     @staticmethod
     def llm_id2llm_type(llm_id: str) -> str | None:
@@ -244,25 +322,116 @@ class TenantLLMService(CommonService):
         return None
 
 
+class TokenUsageAccumulator:
+    """
+    Sums used tokens per (tenant, llm type, model) in memory instead of writing them on every LLM call.
+    A daemon thread flushes them every TOKEN_USAGE_FLUSH_INTERVAL seconds with TenantLLMService.increase_usage_batch,
+    and they are flushed once more at exit. A failed flush keeps its usages for the next one.
+    """
+
+    def __init__(self, interval=TOKEN_USAGE_FLUSH_INTERVAL):
+        self.interval = interval
+        self._pending = {}
+        self._pending_calls = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self.calls = 0
+        self.flushed_calls = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+
+    def add(self, tenant_id, llm_type, used_tokens, llm_name=None):
+        if self.interval <= 0:
+            # written on every call as before, a failure costs the usage and not the call
+            try:
+                return TenantLLMService.increase_usage_batch({(tenant_id, llm_type, llm_name): used_tokens})
+            except Exception:
+                logging.exception(f"TokenUsageAccumulator failed to update used_tokens of {tenant_id}/{llm_type}/{llm_name}")
+                return 0
+        if not used_tokens:
+            return True
+        key = (tenant_id, llm_type, llm_name)
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + used_tokens
+            self._pending_calls += 1
+            self.calls += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="token_usage_flusher", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+        return True
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._lock:
+                pending, calls = self._pending, self._pending_calls
+                self._pending, self._pending_calls = {}, 0
+            if not pending:
+                return 0
+            try:
+                num = TenantLLMService.increase_usage_batch(pending)
+            except Exception:
+                with self._lock:
+                    for key, used_tokens in pending.items():
+                        self._pending[key] = self._pending.get(key, 0) + used_tokens
+                    self._pending_calls += calls
+                    self.failed_flushes += 1
+                return 0
+            with self._lock:
+                self.flushed_calls += calls
+                self.flushes += 1
+            return num
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logging.exception("TokenUsageAccumulator flush got exception")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "pending": self._pending_calls,
+                "flushes": self.flushes,
+                # each flush is one or two UPDATE statements in place of one per call
+                "coalesced_writes": self.flushed_calls - self.flushes,
+                "failed_flushes": self.failed_flushes,
+            }
+
+
+TOKEN_USAGE = TokenUsageAccumulator()
+
+
 class LLM4Tenant:
     def __init__(self, tenant_id, llm_type, llm_name=None, lang="Chinese", **kwargs):
         self.tenant_id = tenant_id
         self.llm_type = llm_type
         self.llm_name = llm_name
-        self.mdl = TenantLLMService.model_instance(tenant_id, llm_type, llm_name, lang=lang, **kwargs)
-        assert self.mdl, "Can't find model for {}/{}/{}".format(tenant_id, llm_type, llm_name)
         model_config = TenantLLMService.get_model_config(tenant_id, llm_type, llm_name)
+        self.mdl = TenantLLMService.model_instance(tenant_id, llm_type, llm_name, lang=lang, model_config=model_config, **kwargs)
+        assert self.mdl, "Can't find model for {}/{}/{}".format(tenant_id, llm_type, llm_name)
         self.max_length = model_config.get("max_tokens", 8192)
 
         self.is_tools = model_config.get("is_tools", False)
         self.verbose_tool_use = kwargs.get("verbose_tool_use")
 
+        self.langfuse = LLM_REGISTRY.get_or_load("langfuse", (tenant_id,), lambda: self._load_langfuse(tenant_id))
+        if self.langfuse:
+            trace_id = self.langfuse.create_trace_id()
+            self.trace_context = {"trace_id": trace_id}
+
+    @staticmethod
+    def _load_langfuse(tenant_id):
+        # The authenticated client is shared by the bundles of the tenant, each bundle starts its own trace.
         langfuse_keys = TenantLangfuseService.filter_by_tenant(tenant_id=tenant_id)
-        self.langfuse = None
-        if langfuse_keys:
-            langfuse = Langfuse(public_key=langfuse_keys.public_key, secret_key=langfuse_keys.secret_key,
-                                host=langfuse_keys.host)
-            if langfuse.auth_check():
-                self.langfuse = langfuse
-                trace_id = self.langfuse.create_trace_id()
-                self.trace_context = {"trace_id": trace_id}
+        if not langfuse_keys:
+            return None
+        langfuse = Langfuse(public_key=langfuse_keys.public_key, secret_key=langfuse_keys.secret_key,
+                            host=langfuse_keys.host)
+        if langfuse.auth_check():
+            return langfuse
+        return None
@@ -24,6 +24,7 @@ from api.db import UserTenantRole
 from api.db.db_models import DB, UserTenant
 from api.db.db_models import User, Tenant
 from api.db.services.common_service import CommonService
+from api.db.services.llm_registry import LLM_REGISTRY
 from common.misc_utils import get_uuid
 from common.time_utils import current_timestamp, datetime_format
 from common.constants import StatusEnum
@@ -209,6 +210,19 @@ class TenantService(CommonService):
                     .join(UserTenant, on=((cls.model.id == UserTenant.tenant_id) & (UserTenant.user_id == user_id) & (UserTenant.status == StatusEnum.VALID.value) & (UserTenant.role == UserTenantRole.NORMAL)))
                     .where(cls.model.status == StatusEnum.VALID.value).dicts())
 
+    # The default models of a tenant are part of the configs cached by LLM_REGISTRY.
+    @classmethod
+    def update_by_id(cls, pid, data):
+        num = super().update_by_id(pid, data)
+        LLM_REGISTRY.invalidate()
+        return num
+
+    @classmethod
+    def filter_update(cls, filters, update_data):
+        num = super().filter_update(filters, update_data)
+        LLM_REGISTRY.invalidate()
+        return num
+
     @classmethod
     @DB.connection_context()
     def decrease(cls, user_id, num):
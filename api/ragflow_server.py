@@ -34,6 +34,7 @@ import faulthandler
 from api.apps import app, smtp_mail_server
 from api.db.runtime_config import RuntimeConfig
 from api.db.services.document_service import DocumentService
+from api.db.services.tenant_llm_service import TOKEN_USAGE
 from common.file_utils import get_project_base_directory
 from common import settings
 from api.db.db_models import init_database_tables as init_web_db
@@ -70,6 +71,7 @@ def signal_handler(sig, frame):
     shutdown_all_mcp_sessions()
     stop_event.set()
     time.sleep(1)
+    TOKEN_USAGE.flush()
     sys.exit(0)
 
 if __name__ == '__main__':
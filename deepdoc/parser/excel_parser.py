@@ -20,6 +20,7 @@ import pandas as pd
 from openpyxl import Workbook, load_workbook
 
 from rag.nlp import find_codec
+from rag.utils.artifact_cache import ARTIFACT_CACHE
 
 # copied from `/openpyxl/cell/cell.py`
 ILLEGAL_CHARACTERS_RE = re.compile(r"[\000-\010]|[\013-\014]|[\016-\037]")
@@ -27,7 +28,7 @@ ILLEGAL_CHARACTERS_RE = re.compile(r"[\000-\010]|[\013-\014]|[\016-\037]")
 
 class RAGFlowExcelParser:
     @staticmethod
-    def _load_excel_to_workbook(file_like_object):
+    def _load_excel_to_workbook(file_like_object, read_only=False):
         if isinstance(file_like_object, bytes):
             file_like_object = BytesIO(file_like_object)
 
@@ -48,7 +49,7 @@ class RAGFlowExcelParser:
                 raise Exception(f"Failed to parse CSV and convert to Excel Workbook: {e_csv}")
 
         try:
-            return load_workbook(file_like_object, data_only=True)
+            return load_workbook(file_like_object, data_only=True, read_only=read_only)
         except Exception as e:
             logging.info(f"openpyxl load error: {e}, try pandas instead")
             try:
@@ -199,23 +200,27 @@ class RAGFlowExcelParser:
 
     @staticmethod
     def row_number(fnm, binary):
-        if fnm.split(".")[-1].lower().find("xls") >= 0:
-            wb = RAGFlowExcelParser._load_excel_to_workbook(BytesIO(binary))
-            total = 0
-            
-            for sheetname in wb.sheetnames:
-               try:
-                   ws = wb[sheetname]
-                   total += len(list(ws.rows))
-               except Exception as e:
-                   logging.warning(f"Skip sheet '{sheetname}' due to rows access error: {e}")
-                   continue
-            return total
-
-        if fnm.split(".")[-1].lower() in ["csv", "txt"]:
-            encoding = find_codec(binary)
-            txt = binary.decode(encoding, errors="ignore")
-            return len(txt.split("\n"))
+        def count():
+            if fnm.split(".")[-1].lower().find("xls") >= 0:
+                wb = RAGFlowExcelParser._load_excel_to_workbook(BytesIO(binary), read_only=True)
+                total = 0
+
+                for sheetname in wb.sheetnames:
+                    try:
+                        ws = wb[sheetname]
+                        total += sum(1 for _ in ws.iter_rows(values_only=True))
+                    except Exception as e:
+                        logging.warning(f"Skip sheet '{sheetname}' due to rows access error: {e}")
+                        continue
+                wb.close()
+                return total
+
+            if fnm.split(".")[-1].lower() in ["csv", "txt"]:
+                encoding = find_codec(binary)
+                txt = binary.decode(encoding, errors="ignore")
+                return len(txt.split("\n"))
+
+        return ARTIFACT_CACHE.get_or_build(ARTIFACT_CACHE.digest(binary), "rows", count)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,80 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Rendered pages of a PDF, kept compressed once they have been OCRed.
+
+Page images are needed until the very end of a parse: layout and table
+recognition run on them, and crop() cuts chunk images out of them while
+chunks are built. A raw RGB page is about 11MB at the default 216 DPI, so a
+task holding a few hundred of them runs into GBs. Pages are stored as PNG,
+which is lossless, and decoded on access. The last decoded pages are cached,
+since pages are mostly walked in order.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from PIL import Image
+
+# Number of decoded pages kept in memory.
+PDF_PAGE_CACHE = int(os.environ.get("PDF_PAGE_CACHE", 4))
+
+
+class PageImages:
+    def __init__(self, n_pages=0, cache_size=PDF_PAGE_CACHE):
+        self._pages = [None] * n_pages
+        self._cache = OrderedDict()
+        self._cache_size = max(cache_size, 1)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pages)
+
+    def __setitem__(self, i, img):
+        buf = BytesIO()
+        img.save(buf, format="PNG", compress_level=1)
+        with self._lock:
+            self._pages[i] = buf.getvalue()
+            self._cache.pop(i, None)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self._pages)
+        with self._lock:
+            if i in self._cache:
+                self._cache.move_to_end(i)
+                return self._cache[i]
+            data = self._pages[i]
+        if data is None:
+            raise IndexError(f"Page {i} hasn't been rendered.")
+        img = Image.open(BytesIO(data))
+        img.load()
+        with self._lock:
+            self._cache[i] = img
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return img
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def nbytes(self):
+        return sum(len(p) for p in self._pages if p)
@@ -38,16 +38,22 @@ from sklearn.metrics import silhouette_score
 
 from common.file_utils import get_project_base_directory
 from common.misc_utils import pip_install_torch
+from deepdoc.parser.page_images import PageImages
 from deepdoc.vision import OCR, AscendLayoutRecognizer, LayoutRecognizer, Recognizer, TableStructureRecognizer
+from deepdoc.vision.box_index import BoxIndex
 from rag.app.picture import vision_llm_chunk as picture_vision_llm_chunk
 from rag.nlp import rag_tokenizer
 from rag.prompts.generator import vision_llm_describe_prompt
+from rag.utils.artifact_cache import ARTIFACT_CACHE
 from common import settings
 
 LOCK_KEY_pdfplumber = "global_shared_lock_pdfplumber"
 if LOCK_KEY_pdfplumber not in sys.modules:
     sys.modules[LOCK_KEY_pdfplumber] = threading.Lock()
 
+# Number of pages rendered ahead of OCR. Raw pages only live in this window, OCRed ones are kept compressed.
+PDF_PAGE_WINDOW = int(os.environ.get("PDF_PAGE_WINDOW", 4))
+
 
 class RAGFlowPdfParser:
     def __init__(self, **kwargs):
@@ -248,16 +254,17 @@ class RAGFlowPdfParser:
         spans = gather(r".*spanning")
         clmns = sorted([r for r in self.tb_cpns if re.match(r"table column$", r["label"])], key=lambda x: (x["pn"], x["layoutno"], x["x0"]))
         clmns = Recognizer.layouts_cleanup(self.boxes, clmns, 5, 0.5)
+        rows_idx, headers_idx, spans_idx = BoxIndex(rows), BoxIndex(headers), BoxIndex(spans)
         for b in self.boxes:
             if b.get("layout_type", "") != "table":
                 continue
-            ii = Recognizer.find_overlapped_with_threshold(b, rows, thr=0.3)
+            ii = Recognizer.find_overlapped_with_threshold(b, rows, thr=0.3, index=rows_idx)
             if ii is not None:
                 b["R"] = ii
                 b["R_top"] = rows[ii]["top"]
                 b["R_bott"] = rows[ii]["bottom"]
 
-            ii = Recognizer.find_overlapped_with_threshold(b, headers, thr=0.3)
+            ii = Recognizer.find_overlapped_with_threshold(b, headers, thr=0.3, index=headers_idx)
             if ii is not None:
                 b["H_top"] = headers[ii]["top"]
                 b["H_bott"] = headers[ii]["bottom"]
@@ -271,7 +278,7 @@ class RAGFlowPdfParser:
                 b["C_left"] = clmns[ii]["x0"]
                 b["C_right"] = clmns[ii]["x1"]
 
-            ii = Recognizer.find_overlapped_with_threshold(b, spans, thr=0.3)
+            ii = Recognizer.find_overlapped_with_threshold(b, spans, thr=0.3, index=spans_idx)
             if ii is not None:
                 b["H_top"] = spans[ii]["top"]
                 b["H_bott"] = spans[ii]["bottom"]
@@ -281,12 +288,13 @@ class RAGFlowPdfParser:
 
     def __ocr(self, pagenum, img, chars, ZM=3, device_id: int | None = None):
         start = timer()
-        bxs = self.ocr.detect(np.array(img), device_id)
+        img_np = np.array(img)
+        bxs = self.ocr.detect(img_np, device_id)
         logging.info(f"__ocr detecting boxes of a image cost ({timer() - start}s)")
 
         start = timer()
         if not bxs:
-            self.boxes.append([])
+            self.boxes[pagenum - 1] = []
             return
         bxs = [(line[0], line[1][0]) for line in bxs]
         bxs = Recognizer.sort_Y_firstly(
@@ -299,8 +307,9 @@ class RAGFlowPdfParser:
         )
 
         # merge chars in the same rect
+        bxs_idx = BoxIndex(bxs)
         for c in chars:
-            ii = Recognizer.find_overlapped(c, bxs)
+            ii = Recognizer.find_overlapped(c, bxs, index=bxs_idx)
             if ii is None:
                 self.lefted_chars.append(c)
                 continue
@@ -327,7 +336,6 @@ class RAGFlowPdfParser:
         logging.info(f"__ocr sorting {len(chars)} chars cost {timer() - start}s")
         start = timer()
         boxes_to_reg = []
-        img_np = np.array(img)
         for b in bxs:
             if not b["text"]:
                 left, right, top, bott = b["x0"] * ZM, b["x1"] * ZM, b["top"] * ZM, b["bottom"] * ZM
@@ -342,7 +350,7 @@ class RAGFlowPdfParser:
         bxs = [b for b in bxs if b["text"]]
         if self.mean_height[pagenum - 1] == 0:
             self.mean_height[pagenum - 1] = np.median([b["bottom"] - b["top"] for b in bxs])
-        self.boxes.append(bxs)
+        self.boxes[pagenum - 1] = bxs
 
     def _layouts_rec(self, ZM, drop=True):
         assert len(self.page_images) == len(self.boxes)
@@ -1029,15 +1037,78 @@ class RAGFlowPdfParser:
 
     @staticmethod
     def total_page_number(fnm, binary=None):
-        try:
+        def count():
             with sys.modules[LOCK_KEY_pdfplumber]:
                 pdf = pdfplumber.open(fnm) if not binary else pdfplumber.open(BytesIO(binary))
             total_page = len(pdf.pages)
             pdf.close()
             return total_page
+
+        try:
+            if not binary:
+                return count()
+            return ARTIFACT_CACHE.get_or_build(ARTIFACT_CACHE.digest(binary), "pages", count)
         except Exception:
             logging.exception("total_page_number")
 
+    @staticmethod
+    def page_profiles(fnm, binary=None):
+        """
+        What parsing every page costs, read without rendering it: the page size in points,
+        whether it has a text layer and the number of images it draws.
+        """
+        def build():
+            profiles = []
+            with pdf2_read(fnm if not binary else BytesIO(binary)) as pdf:
+                for page in pdf.pages:
+                    res = page.get("/Resources")
+                    res = res.get_object() if res else {}
+                    xobjects = res.get("/XObject")
+                    xobjects = xobjects.get_object() if xobjects else {}
+                    images = sum(1 for x in xobjects.values() if x.get_object().get("/Subtype") == "/Image")
+                    profiles.append({
+                        "width": float(page.mediabox.width),
+                        "height": float(page.mediabox.height),
+                        "text": bool(res.get("/Font")),
+                        "images": images,
+                    })
+            return profiles
+
+        try:
+            if not binary:
+                return build()
+            return ARTIFACT_CACHE.get_or_build(ARTIFACT_CACHE.digest(binary), "page-profiles", build)
+        except Exception:
+            logging.exception("page_profiles")
+
+    def _page_artifacts(self, digest, pn, page):
+        """Chars of a page, and whether they read as English. Built once per content."""
+
+        def build():
+            chars = [c for c in page.dedupe_chars().chars if self._has_color(c)]
+            english = re.search(r"[ a-zA-Z0-9,/¸;:'\[\]\(\)!@#$%^&*\"?<>._-]{30,}", "".join(random.choices([c["text"] for c in chars], k=min(100, len(chars)))))
+            return {"chars": chars, "english": bool(english)}
+
+        return ARTIFACT_CACHE.get_or_build(digest, f"page-{pn}", build) if digest else build()
+
+    def _outlines(self, fnm, digest):
+        def build():
+            outlines = []
+            with pdf2_read(fnm if isinstance(fnm, str) else BytesIO(fnm)) as pdf2:
+                self.pdf = pdf2
+
+                def dfs(arr, depth):
+                    for a in arr:
+                        if isinstance(a, dict):
+                            outlines.append((a["/Title"], depth))
+                            continue
+                        dfs(a, depth + 1)
+
+                dfs(self.pdf.outline, 0)
+            return outlines
+
+        return ARTIFACT_CACHE.get_or_build(digest, "outlines", build) if digest else build()
+
     def __images__(self, fnm, zoomin=3, page_from=0, page_to=299, callback=None):
         self.lefted_chars = []
         self.mean_height = []
@@ -1047,57 +1118,67 @@ class RAGFlowPdfParser:
         self.page_cum_height = [0]
         self.page_layout = []
         self.page_from = page_from
+        self.page_images = PageImages()
+        self.page_chars = []
+        page_english = []
+        pdf = None
+        # Chars and outlines are kept per content, for the other page ranges and re-parses of the file.
+        digest = ARTIFACT_CACHE.digest(fnm) if not isinstance(fnm, str) else None
         start = timer()
         try:
             with sys.modules[LOCK_KEY_pdfplumber]:
-                with pdfplumber.open(fnm) if isinstance(fnm, str) else pdfplumber.open(BytesIO(fnm)) as pdf:
-                    self.pdf = pdf
-                    self.page_images = [p.to_image(resolution=72 * zoomin, antialias=True).annotated for i, p in enumerate(self.pdf.pages[page_from:page_to])]
-
-                    try:
-                        self.page_chars = [[c for c in page.dedupe_chars().chars if self._has_color(c)] for page in self.pdf.pages[page_from:page_to]]
-                    except Exception as e:
-                        logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}: {str(e)}")
-                        self.page_chars = [[] for _ in range(page_to - page_from)]  # If failed to extract, using empty list instead.
-
-                    self.total_page = len(self.pdf.pages)
+                pdf = pdfplumber.open(fnm) if isinstance(fnm, str) else pdfplumber.open(BytesIO(fnm))
+                pages = pdf.pages[page_from:page_to]
+                self.page_images = PageImages(len(pages))
+                try:
+                    artifacts = [self._page_artifacts(digest, page_from + i, page) for i, page in enumerate(pages)]
+                    self.page_chars = [a["chars"] for a in artifacts]
+                    page_english = [a["english"] for a in artifacts]
+                except Exception as e:
+                    logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}: {str(e)}")
+                    self.page_chars = [[] for _ in range(len(pages))]  # If failed to extract, using empty list instead.
+                    page_english = [False] * len(pages)
+
+                self.total_page = len(pdf.pages)
 
         except Exception:
             logging.exception("RAGFlowPdfParser __images__")
+            self.page_images = PageImages()
+            self.page_chars = []
+            page_english = []
         logging.info(f"__images__ dedupe_chars cost {timer() - start}s")
 
         self.outlines = []
         try:
-            with pdf2_read(fnm if isinstance(fnm, str) else BytesIO(fnm)) as pdf:
-                self.pdf = pdf
-
-                outlines = self.pdf.outline
-
-                def dfs(arr, depth):
-                    for a in arr:
-                        if isinstance(a, dict):
-                            self.outlines.append((a["/Title"], depth))
-                            continue
-                        dfs(a, depth + 1)
-
-                dfs(outlines, 0)
-
+            self.outlines = self._outlines(fnm, digest)
         except Exception as e:
             logging.warning(f"Outlines exception: {e}")
 
         if not self.outlines:
             logging.warning("Miss outlines")
 
-        logging.debug("Images converted.")
-        self.is_english = [
-            re.search(r"[ a-zA-Z0-9,/¸;:'\[\]\(\)!@#$%^&*\"?<>._-]{30,}", "".join(random.choices([c["text"] for c in self.page_chars[i]], k=min(100, len(self.page_chars[i])))))
-            for i in range(len(self.page_chars))
-        ]
+        self.is_english = page_english
         if sum([1 if e else 0 for e in self.is_english]) > len(self.page_images) / 2:
             self.is_english = True
         else:
             self.is_english = False
 
+        n_pages = len(self.page_images)
+        self.boxes = [[] for _ in range(n_pages)]
+        self.mean_height = [0] * n_pages
+        self.mean_width = [8] * n_pages
+        self.page_cum_height = [0] * (n_pages + 1)
+        n_workers = max(1, settings.PARALLEL_DEVICES)
+
+        def __render(i):
+            with sys.modules[LOCK_KEY_pdfplumber]:
+                return pdf.pages[page_from + i].to_image(resolution=72 * zoomin, antialias=True).annotated
+
+        def __ocr_page(i, id, img, chars):
+            self.__ocr(i + 1, img, chars, zoomin, id)
+            # From now on the page is only needed for layout, tables and crops.
+            self.page_images[i] = img
+
         async def __img_ocr(i, id, img, chars, limiter):
             j = 0
             while j + 1 < len(chars):
@@ -1112,38 +1193,47 @@ class RAGFlowPdfParser:
 
             if limiter:
                 async with limiter:
-                    await trio.to_thread.run_sync(lambda: self.__ocr(i + 1, img, chars, zoomin, id))
+                    await trio.to_thread.run_sync(lambda: __ocr_page(i, id, img, chars))
             else:
-                self.__ocr(i + 1, img, chars, zoomin, id)
+                await trio.to_thread.run_sync(lambda: __ocr_page(i, id, img, chars))
 
             if callback and i % 6 == 5:
-                callback((i + 1) * 0.6 / len(self.page_images))
+                callback((i + 1) * 0.6 / n_pages)
+
+        def __ocr_preprocess(i, img):
+            chars = self.page_chars[i] if not self.is_english else []
+            self.mean_height[i] = np.median(sorted([c["height"] for c in chars])) if chars else 0
+            self.mean_width[i] = np.median(sorted([c["width"] for c in chars])) if chars else 8
+            self.page_cum_height[i + 1] = img.size[1] / zoomin
+            return chars
+
+        async def __img_ocr_worker(id, receive_channel):
+            limiter = self.parallel_limiter[id] if self.parallel_limiter else None
+            async with receive_channel:
+                async for i, img in receive_channel:
+                    await __img_ocr(i, id, img, __ocr_preprocess(i, img), limiter)
 
         async def __img_ocr_launcher():
-            def __ocr_preprocess():
-                chars = self.page_chars[i] if not self.is_english else []
-                self.mean_height.append(np.median(sorted([c["height"] for c in chars])) if chars else 0)
-                self.mean_width.append(np.median(sorted([c["width"] for c in chars])) if chars else 8)
-                self.page_cum_height.append(img.size[1] / zoomin)
-                return chars
-
-            if self.parallel_limiter:
-                async with trio.open_nursery() as nursery:
-                    for i, img in enumerate(self.page_images):
-                        chars = __ocr_preprocess()
-
-                        nursery.start_soon(__img_ocr, i, i % settings.PARALLEL_DEVICES, img, chars, self.parallel_limiter[i % settings.PARALLEL_DEVICES])
-                        await trio.sleep(0.1)
-            else:
-                for i, img in enumerate(self.page_images):
-                    chars = __ocr_preprocess()
-                    await __img_ocr(i, 0, img, chars, None)
+            # Pages are rendered at most PDF_PAGE_WINDOW ahead of OCR, one OCR worker per device.
+            send_channel, receive_channel = trio.open_memory_channel(PDF_PAGE_WINDOW)
+            async with trio.open_nursery() as nursery:
+                for id in range(n_workers):
+                    nursery.start_soon(__img_ocr_worker, id, receive_channel.clone())
+                receive_channel.close()
+                async with send_channel:
+                    for i in range(n_pages):
+                        img = await trio.to_thread.run_sync(__render, i)
+                        await send_channel.send((i, img))
 
         start = timer()
+        try:
+            if n_pages:
+                trio.run(__img_ocr_launcher)
+        finally:
+            if pdf is not None:
+                pdf.close()
 
-        trio.run(__img_ocr_launcher)
-
-        logging.info(f"__images__ {len(self.page_images)} pages cost {timer() - start}s")
+        logging.info(f"__images__ {n_pages} pages cost {timer() - start}s, page images take {self.page_images.nbytes() / 1024 / 1024:.1f}MB")
 
         if not self.is_english and not any([c for c in self.page_chars]) and self.boxes:
             bxes = [b for bxs in self.boxes for b in bxs]
@@ -0,0 +1,92 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import math
+from collections import defaultdict
+
+import numpy as np
+
+
+class BoxIndex:
+    """
+    Spatial index over a list of boxes (dicts with x0, x1, top and bottom).
+
+    Boxes are bucketed in horizontal bands about as high as a typical box, and their
+    coordinates are held in NumPy arrays to filter large candidate sets at once.
+    `touching(box)` returns the boxes that aren't separated from `box`, i.e. the only ones
+    `Recognizer.overlapped_area` can give a non zero area for, using the same comparisons
+    on the same values.
+    """
+
+    # Candidate sets up to this size are filtered in plain Python, it is cheaper than NumPy for them.
+    SCALAR_LIMIT = 48
+
+    def __init__(self, boxes):
+        self.boxes = boxes
+        n = len(boxes)
+        self.x0 = np.fromiter((b["x0"] for b in boxes), dtype=np.float64, count=n)
+        self.x1 = np.fromiter((b["x1"] for b in boxes), dtype=np.float64, count=n)
+        self.top = np.fromiter((b["top"] for b in boxes), dtype=np.float64, count=n)
+        self.bottom = np.fromiter((b["bottom"] for b in boxes), dtype=np.float64, count=n)
+        heights = self.bottom - self.top
+        heights = heights[np.isfinite(heights) & (heights > 0)]
+        self.band = float(np.median(heights)) if len(heights) else 1.0
+        bands = defaultdict(list)
+        unbanded = []
+        for i, (top, bottom) in enumerate(zip(self.top.tolist(), self.bottom.tolist())):
+            lo, hi = min(top, bottom), max(top, bottom)
+            if not (math.isfinite(lo) and math.isfinite(hi)):
+                unbanded.append(i)
+                continue
+            for k in range(self._band_of(lo), self._band_of(hi) + 1):
+                bands[k].append(i)
+        self._bands = dict(bands)
+        self._unbanded = unbanded
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def _band_of(self, y):
+        return math.floor(y / self.band)
+
+    def touching(self, box, start=0, end=None):
+        """Ascending indices, within [start, end), of the boxes not separated from `box`."""
+        n = len(self.boxes)
+        end = n if end is None else end
+        x0, x1, top, bottom = box["x0"], box["x1"], box["top"], box["bottom"]
+        if math.isfinite(top) and math.isfinite(bottom) and top <= bottom and self._band_of(bottom) - self._band_of(top) < len(self._bands):
+            # one more band on each side, for boxes right on a band edge
+            parts = [self._bands[k] for k in range(self._band_of(top) - 1, self._band_of(bottom) + 2) if k in self._bands]
+            if self._unbanded:
+                parts.append(self._unbanded)
+            if not parts:
+                return []
+            cands = parts[0] if len(parts) == 1 else sorted(set().union(*parts))
+        else:
+            cands = range(n)
+        if len(cands) > self.SCALAR_LIMIT:
+            idx = np.fromiter(cands, dtype=np.int64, count=len(cands))
+            if start or end < n:
+                idx = idx[(idx >= start) & (idx < end)]
+            # float32 coordinates compare with Python floats in float32, leave some slack
+            # here and let the exact comparisons below decide.
+            m = 1e-6 * (max(abs(x0), abs(x1), abs(top), abs(bottom)) + 1)
+            keep = ~((self.x0[idx] > x1 + m) | (self.x1[idx] < x0 - m) | (self.bottom[idx] < top - m) | (self.top[idx] > bottom + m))
+            cands = idx[keep].tolist()
+            start, end = 0, n
+        boxes = self.boxes
+        return [i for i in cands if start <= i < end
+                and not (boxes[i]["x0"] > x1 or boxes[i]["x1"] < x0 or boxes[i]["bottom"] < top or boxes[i]["top"] > bottom)]
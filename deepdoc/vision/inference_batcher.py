@@ -0,0 +1,110 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Pools the inputs that concurrent threads submit to one model.
+
+Documents parsed at the same time by an executor each run their own small
+inference calls: a page rarely has more than a few dozen text lines. An
+InferenceBatcher collects the inputs of all callers and runs them together,
+so the model sees fewer and fuller batches.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+class InferenceBatcher:
+    def __init__(self, fn, max_batch=64, max_wait=0.005, workers=1, name="inference"):
+        """
+        `fn` maps a list of inputs to the list of their results. A run starts when `max_batch`
+        inputs are waiting, or when the oldest one has waited `max_wait` seconds.
+        """
+        self.fn = fn
+        self.max_batch = max(max_batch, 1)
+        self.max_wait = max_wait
+        self.workers = max(workers, 1)
+        self.name = name
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def __call__(self, items):
+        """Results of `items`, in order. Blocks until they have all been run."""
+        if not items:
+            return []
+        futures = [Future() for _ in items]
+        now = time.monotonic()
+        caller = object()
+        with self._cond:
+            self._pending.extend((item, fut, now, caller) for item, fut in zip(items, futures))
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.workers:
+                t = threading.Thread(target=self._loop, name=f"{self.name}-batcher", daemon=True)
+                t.start()
+                self._threads.append(t)
+            self._cond.notify_all()
+        return [fut.result() for fut in futures]
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = self._pending[0][2] + self.max_wait
+            while self._pending and len(self._pending) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                self._cond.wait(timeout)
+            return [self._pending.popleft() for _ in range(min(self.max_batch, len(self._pending)))]
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                self._run(batch)
+            except Exception as e:
+                logging.exception(f"{self.name} batch of {len(batch)} failed")
+                callers = {}
+                for entry in batch:
+                    callers.setdefault(entry[3], []).append(entry)
+                if len(callers) == 1:
+                    self._fail(batch, e)
+                    continue
+                # rerun each caller on its own, so that an input breaking the model
+                # fails its own caller and not the ones it was pooled with
+                for entries in callers.values():
+                    try:
+                        self._run(entries)
+                    except Exception as e:
+                        self._fail(entries, e)
+
+    def _run(self, batch):
+        results = self.fn([item for item, _, _, _ in batch])
+        if len(results) != len(batch):
+            raise ValueError(f"{self.name} returned {len(results)} results for {len(batch)} inputs")
+        for (_, fut, _, _), res in zip(batch, results):
+            fut.set_result(res)
+
+    @staticmethod
+    def _fail(batch, e):
+        for _, fut, _, _ in batch:
+            if not fut.done():
+                fut.set_exception(e)
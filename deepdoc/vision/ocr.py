@@ -16,6 +16,7 @@
 import gc
 import logging
 import copy
+import threading
 import time
 import os
 
@@ -31,9 +32,20 @@ import numpy as np
 import cv2
 import onnxruntime as ort
 
+from .inference_batcher import InferenceBatcher
 from .postprocess import build_post_process
 
+# ONNX Runtime threads of each session. Sessions are shared by every parser of the process.
+OCR_INTRA_OP_NUM_THREADS = int(os.environ.get("OCR_INTRA_OP_NUM_THREADS", 2))
+OCR_INTER_OP_NUM_THREADS = int(os.environ.get("OCR_INTER_OP_NUM_THREADS", 2))
+# Text line crops pooled across the pages being OCRed at the same time, 0 to recognize each page alone.
+OCR_REC_BATCH_SIZE = int(os.environ.get("OCR_REC_BATCH_SIZE", 64))
+OCR_REC_BATCH_WAIT_MS = int(os.environ.get("OCR_REC_BATCH_WAIT_MS", 5))
+OCR_REC_BATCH_WORKERS = int(os.environ.get("OCR_REC_BATCH_WORKERS", 2))
+
 loaded_models = {}
+_load_lock = threading.Lock()
+rec_batchers = {}
 
 def transform(data, ops=None):
     """ transform """
@@ -72,6 +84,12 @@ def load_model(model_dir, nm, device_id: int | None = None):
     model_file_path = os.path.join(model_dir, nm + ".onnx")
     model_cached_tag = model_file_path + str(device_id) if device_id is not None else model_file_path
 
+    # Parsers built at the same time would otherwise each load their own session.
+    with _load_lock:
+        return _load_model(model_file_path, model_cached_tag, device_id)
+
+
+def _load_model(model_file_path, model_cached_tag, device_id):
     global loaded_models
     loaded_model = loaded_models.get(model_cached_tag)
     if loaded_model:
@@ -96,8 +114,8 @@ def load_model(model_dir, nm, device_id: int | None = None):
     options = ort.SessionOptions()
     options.enable_cpu_mem_arena = False
     options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
-    options.intra_op_num_threads = 2
-    options.inter_op_num_threads = 2
+    options.intra_op_num_threads = OCR_INTRA_OP_NUM_THREADS
+    options.inter_op_num_threads = OCR_INTER_OP_NUM_THREADS
 
     # https://github.com/microsoft/onnxruntime/issues/9509#issuecomment-951546580
     # Shrink GPU memory after execution
@@ -142,6 +160,22 @@ class TextRecognizer:
         self.postprocess_op = build_post_process(postprocess_params)
         self.predictor, self.run_options = load_model(model_dir, 'rec', device_id)
         self.input_tensor = self.predictor.get_inputs()[0]
+        self.batcher = None
+        if OCR_REC_BATCH_SIZE > 0:
+            # One batcher per session: crops of all the pages being OCRed are recognized together.
+            key = (os.path.join(model_dir, "rec.onnx"), device_id)
+            with _load_lock:
+                if key not in rec_batchers:
+                    rec_batchers[key] = InferenceBatcher(lambda imgs: self(imgs)[0], OCR_REC_BATCH_SIZE, OCR_REC_BATCH_WAIT_MS / 1000,
+                                                         OCR_REC_BATCH_WORKERS, name="text_recognizer")
+                self.batcher = rec_batchers[key]
+
+    def pooled(self, img_list):
+        """Same as `__call__`, sharing model runs with the other threads recognizing text lines."""
+        if self.batcher is None:
+            return self(img_list)
+        st = time.time()
+        return self.batcher(img_list), time.time() - st
 
     def resize_norm_img(self, img, max_wh_ratio):
         imgC, imgH, imgW = self.rec_image_shape
@@ -696,7 +730,7 @@ class OCR:
     def recognize_batch(self, img_list, device_id: int | None = None):
         if device_id is None:
             device_id = 0
-        rec_res, elapse = self.text_recognizer[device_id](img_list)
+        rec_res, elapse = self.text_recognizer[device_id].pooled(img_list)
         texts = []
         for i in range(len(rec_res)):
             text, score = rec_res[i]
@@ -732,7 +766,7 @@ class OCR:
             img_crop = self.get_rotate_crop_image(ori_im, tmp_box)
             img_crop_list.append(img_crop)
 
-        rec_res, elapse = self.text_recognizer[device_id](img_crop_list)
+        rec_res, elapse = self.text_recognizer[device_id].pooled(img_crop_list)
 
         time_dict['rec'] = elapse
 
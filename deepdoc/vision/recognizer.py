@@ -27,6 +27,7 @@ from .operators import *  # noqa: F403
 from .operators import preprocess
 from . import operators
 from .ocr import load_model
+from .box_index import BoxIndex
 
 class Recognizer:
     def __init__(self, label_list, task_name, model_dir=None):
@@ -76,38 +77,29 @@ class Recognizer:
         # sort using y1 first and then x1
         # sorted(arr, key=lambda r: (r["x0"], r["top"]))
         arr = Recognizer.sort_X_firstly(arr, thr)
-        for i in range(len(arr) - 1):
-            for j in range(i, -1, -1):
-                # restore the order using th
-                if "C" not in arr[j] or "C" not in arr[j + 1]:
-                    continue
-                if arr[j + 1]["C"] < arr[j]["C"] \
-                        or (
-                        arr[j + 1]["C"] == arr[j]["C"]
-                        and arr[j + 1]["top"] < arr[j]["top"]
-                ):
-                    tmp = arr[j]
-                    arr[j] = arr[j + 1]
-                    arr[j + 1] = tmp
-        return arr
+        return Recognizer._sort_runs(arr, "C", lambda r: (r["C"], r["top"]))
 
     @staticmethod
     def sort_R_firstly(arr, thr=0):
         # sort using y1 first and then x1
         # sorted(arr, key=lambda r: (r["top"], r["x0"]))
         arr = Recognizer.sort_Y_firstly(arr, thr)
-        for i in range(len(arr) - 1):
-            for j in range(i, -1, -1):
-                if "R" not in arr[j] or "R" not in arr[j + 1]:
-                    continue
-                if arr[j + 1]["R"] < arr[j]["R"] \
-                        or (
-                        arr[j + 1]["R"] == arr[j]["R"]
-                        and arr[j + 1]["x0"] < arr[j]["x0"]
-                ):
-                    tmp = arr[j]
-                    arr[j] = arr[j + 1]
-                    arr[j + 1] = tmp
+        return Recognizer._sort_runs(arr, "R", lambda r: (r["R"], r["x0"]))
+
+    @staticmethod
+    def _sort_runs(arr, field, key):
+        # restore the order using `field`: boxes without it stay where they are,
+        # each run of boxes in between is sorted on its own, stably.
+        i = 0
+        while i < len(arr):
+            if field not in arr[i]:
+                i += 1
+                continue
+            j = i
+            while j < len(arr) and field in arr[j]:
+                j += 1
+            arr[i:j] = sorted(arr[i:j], key=key)
+            i = j
         return arr
 
     @staticmethod
@@ -139,6 +131,7 @@ class Recognizer:
                         a["bottom"] < b["top"],
                         a["top"] > b["bottom"]])
 
+        index = None
         i = 0
         while i + 1 < len(layouts):
             j = i + 1
@@ -161,12 +154,13 @@ class Recognizer:
                     layouts.pop(i)
                 continue
 
+            if index is None:
+                index = BoxIndex(boxes)
             area_i, area_i_1 = 0, 0
-            for b in boxes:
-                if not not_overlapped(b, layouts[i]):
-                    area_i += Recognizer.overlapped_area(b, layouts[i], False)
-                if not not_overlapped(b, layouts[j]):
-                    area_i_1 += Recognizer.overlapped_area(b, layouts[j], False)
+            for k in index.touching(layouts[i]):
+                area_i += Recognizer.overlapped_area(boxes[k], layouts[i], False)
+            for k in index.touching(layouts[j]):
+                area_i_1 += Recognizer.overlapped_area(boxes[k], layouts[j], False)
 
             if area_i > area_i_1:
                 layouts.pop(j)
@@ -215,7 +209,8 @@ class Recognizer:
         return inputs
 
     @staticmethod
-    def find_overlapped(box, boxes_sorted_by_y, naive=False):
+    def find_overlapped(box, boxes_sorted_by_y, naive=False, index=None):
+        """`index`, a BoxIndex over `boxes_sorted_by_y`, saves scanning them when many boxes are looked up."""
         if not boxes_sorted_by_y:
             return
         bxs = boxes_sorted_by_y
@@ -240,7 +235,8 @@ class Recognizer:
             break
 
         max_overlapped_i, max_overlapped = None, 0
-        for i in range(s, e):
+        # the search above mostly leaves a few boxes to look at, the index pays off on wide ranges
+        for i in (range(s, e) if index is None or e - s <= index.SCALAR_LIMIT else index.touching(box, s, e)):
             ov = Recognizer.overlapped_area(bxs[i], box)
             if ov <= max_overlapped:
                 continue
@@ -264,12 +260,14 @@ class Recognizer:
         return min_i
 
     @staticmethod
-    def find_overlapped_with_threshold(box, boxes, thr=0.3):
+    def find_overlapped_with_threshold(box, boxes, thr=0.3, index=None):
+        """`index`, a BoxIndex over `boxes`, saves scanning them when many boxes are looked up."""
         if not boxes:
             return
         max_overlapped_i, max_overlapped, _max_overlapped = None, thr, 0
         s, e = 0, len(boxes)
-        for i in range(s, e):
+        # boxes apart from `box` overlap it by 0, they can only win when thr <= 0
+        for i in (range(s, e) if index is None or thr <= 0 else index.touching(box)):
             ov = Recognizer.overlapped_area(box, boxes[i])
             _ov = Recognizer.overlapped_area(boxes[i], box)
             if (ov, _ov) < (max_overlapped, _max_overlapped):
@@ -406,6 +404,19 @@ class Recognizer:
             "score": float(scores[i])
         } for i in indices]
 
+    def _stackable(self, inputs):
+        """
+        Whether the preprocessed images can go through the model as one batch: it must take
+        a single image input with a dynamic batch size, and the images must have the same shape.
+        Models with a scale_factor input return the boxes of a batch concatenated, they run per image.
+        """
+        if len(inputs) < 2 or len(self.input_names) != 1 or "scale_factor" in self.input_names:
+            return False
+        if isinstance(self.ort_sess.get_inputs()[0].shape[0], int):
+            return False
+        name = self.input_names[0]
+        return all(ins[name].shape == inputs[0][name].shape for ins in inputs)
+
     def close(self):
         logging.info("Close recognizer.")
         if hasattr(self, "ort_sess"):
@@ -414,20 +425,20 @@ class Recognizer:
 
     def __call__(self, image_list, thr=0.7, batch_size=16):
         res = []
-        images = []
-        for i in range(len(image_list)):
-            if not isinstance(image_list[i], np.ndarray):
-                images.append(np.array(image_list[i]))
-            else:
-                images.append(image_list[i])
-
-        batch_loop_cnt = math.ceil(float(len(images)) / batch_size)
+        batch_loop_cnt = math.ceil(float(len(image_list)) / batch_size)
         for i in range(batch_loop_cnt):
             start_index = i * batch_size
-            end_index = min((i + 1) * batch_size, len(images))
-            batch_image_list = images[start_index:end_index]
+            end_index = min((i + 1) * batch_size, len(image_list))
+            # Pages are turned into arrays a batch at a time, not all up front.
+            batch_image_list = [image_list[j] if isinstance(image_list[j], np.ndarray) else np.array(image_list[j]) for j in range(start_index, end_index)]
             inputs = self.preprocess(batch_image_list)
             logging.debug("preprocess")
+            if self._stackable(inputs):
+                # One run for the whole batch, each image keeps its own slice of the output.
+                name = self.input_names[0]
+                outputs = self.ort_sess.run(None, {name: np.concatenate([ins[name] for ins in inputs])}, self.run_options)[0]
+                res.extend(self.postprocess(outputs[j:j + 1], ins, thr) for j, ins in enumerate(inputs))
+                continue
             for ins in inputs:
                 bb = self.postprocess(self.ort_sess.run(None, {k:v for k,v in ins.items() if k in self.input_names}, self.run_options)[0], ins, thr)
                 res.append(bb)
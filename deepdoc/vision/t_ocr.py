@@ -27,6 +27,8 @@ sys.path.insert(
 from deepdoc.vision.seeit import draw_box
 from deepdoc.vision import OCR, init_in_out
 import argparse
+import threading
+import time
 import numpy as np
 import trio
 
@@ -82,6 +84,30 @@ def main(args):
     print("OCR tasks are all done")
 
 
+def benchmark(args):
+    """CPU throughput of OCR, in pages/second, with `args.docs` documents OCRed at the same time."""
+    ocr = OCR()
+    images, _ = init_in_out(args)
+    pages = [np.array(img) for img in images]
+    batchers = [rec.batcher for rec in ocr.text_recognizer]
+
+    def run(n_docs):
+        threads = [threading.Thread(target=lambda: [ocr(img, 0) for img in pages]) for _ in range(n_docs)]
+        st = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return n_docs * len(pages) / (time.perf_counter() - st)
+
+    run(1)
+    for pooled in [False, True]:
+        for rec, batcher in zip(ocr.text_recognizer, batchers):
+            rec.batcher = batcher if pooled else None
+        for n_docs in sorted({1, args.docs}):
+            print("{:>9}, {} document(s) at a time: {:.2f} pages/s".format("pooled" if pooled else "per page", n_docs, run(n_docs)))
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--inputs',
@@ -89,5 +115,10 @@ if __name__ == "__main__":
                         required=True)
     parser.add_argument('--output_dir', help="Directory where to store the output images. Default: './ocr_outputs'",
                         default="./ocr_outputs")
+    parser.add_argument('--benchmark', help="Measure pages/second instead of writing outputs", action="store_true")
+    parser.add_argument('--docs', help="Documents OCRed at the same time by the benchmark. Default: 4", type=int, default=4)
     args = parser.parse_args()
-    main(args)
+    if args.benchmark:
+        benchmark(args)
+    else:
+        main(args)
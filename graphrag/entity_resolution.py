@@ -17,6 +17,7 @@ import logging
 import itertools
 import os
 import re
+from collections import Counter, defaultdict
 from dataclasses import dataclass
 from typing import Any, Callable
 
@@ -35,6 +36,104 @@ from common.exceptions import TaskCanceledException
 DEFAULT_RECORD_DELIMITER = "##"
 DEFAULT_ENTITY_INDEX_DELIMITER = "<|>"
 DEFAULT_RESOLUTION_RESULT_DELIMITER = "&&"
+# How candidate pairs are generated, one of CANDIDATE_GENERATORS.
+ENTITY_RESOLUTION_CANDIDATES = os.environ.get("ENTITY_RESOLUTION_CANDIDATES", "blocking")
+
+
+def all_pairs_candidates(nodes: list[str], subgraph_nodes: set[str], is_similarity: Callable[[str, str], bool]) -> list[tuple[str, str]]:
+    """Test every pair of `nodes` having at least one node in `subgraph_nodes`."""
+    return [(a, b) for a, b in itertools.combinations(nodes, 2) if (a in subgraph_nodes or b in subgraph_nodes) and is_similarity(a, b)]
+
+
+def _digit_2grams(s):
+    return frozenset(s[i:i + 2] for i in range(len(s) - 1) if any(c.isdigit() for c in s[i:i + 2]))
+
+
+def blocking_candidates(nodes: list[str], subgraph_nodes: set[str], is_similarity: Callable[[str, str], bool]) -> list[tuple[str, str]]:
+    """
+    Same pairs as all_pairs_candidates for EntityResolution.is_similarity, without testing every pair.
+
+    Every pair accepted by the predicate passes these exact filters, so only those are tested:
+      - both names have the same 2-grams containing a digit, nodes are blocked on them;
+      - two English names within edit distance min(len)//2 differ in length by at most min(len)//2 and
+        share at least max(len) - min(len)//2 characters (as multisets), so the len//2 + 1 rarest
+        characters of each name include a common one;
+      - otherwise the character sets overlap by 2, or by 80% of the larger set, so the
+        len - max(2, floor(0.8 * len)) + 1 rarest distinct characters of each name include a common one.
+    Candidates are looked up in inverted indexes of those prefixes (prefix filtering).
+    """
+    pos = {n: i for i, n in enumerate(nodes)}
+    blocks = defaultdict(list)
+    for n in nodes:
+        blocks[_digit_2grams(n)].append(n)
+
+    pairs = []
+    for block in blocks.values():
+        if len(block) < 2 or not any(n in subgraph_nodes for n in block):
+            continue
+        english = {n: is_english(n) for n in block}
+        # Characters numbered by occurrence, e.g. "aba" -> (a, 0), (b, 0), (a, 1), make a multiset a set.
+        multisets = {}
+        for n in block:
+            if not english[n]:
+                continue
+            seen = Counter()
+            multisets[n] = set()
+            for c in n:
+                multisets[n].add((c, seen[c]))
+                seen[c] += 1
+        charsets = {n: set(n) for n in block}
+        m_freq = Counter(t for m in multisets.values() for t in m)
+        c_freq = Counter(c for n in block for c in charsets[n])
+
+        m_index, c_index = defaultdict(list), defaultdict(list)
+        m_prefix, c_prefix = {}, {}
+        for n in block:
+            if english[n]:
+                m_prefix[n] = sorted(multisets[n], key=lambda t: (m_freq[t], t))[:len(n) // 2 + 1]
+                for t in m_prefix[n]:
+                    m_index[t].append(n)
+            size = len(charsets[n])
+            if size < 2:
+                # Can't share 2 characters with anything.
+                c_prefix[n] = []
+                continue
+            c_prefix[n] = sorted(charsets[n], key=lambda c: (c_freq[c], c))[:size - max(2, int(0.8 * size)) + 1]
+            for c in c_prefix[n]:
+                c_index[c].append(n)
+
+        for a in block:
+            if a not in subgraph_nodes:
+                continue
+            cands = set()
+            for t in m_prefix.get(a, []):
+                cands.update(m_index[t])
+            for c in c_prefix[a]:
+                cands.update(c_index[c])
+            for b in cands:
+                # A pair of subgraph nodes is probed from both ends, keep it once.
+                if b == a or (b in subgraph_nodes and pos[b] < pos[a]):
+                    continue
+                if english[a] and english[b]:
+                    short, long = sorted((len(a), len(b)))
+                    if long - short > short // 2 or len(multisets[a] & multisets[b]) < long - short // 2:
+                        continue
+                else:
+                    max_l = max(len(charsets[a]), len(charsets[b]))
+                    common = len(charsets[a] & charsets[b])
+                    if (common <= 1) if max_l < 4 else (common * 1. / max_l < 0.8):
+                        continue
+                x, y = (a, b) if pos[a] < pos[b] else (b, a)
+                if is_similarity(x, y):
+                    pairs.append((x, y))
+    pairs.sort(key=lambda p: (pos[p[0]], pos[p[1]]))
+    return pairs
+
+
+CANDIDATE_GENERATORS = {
+    "all_pairs": all_pairs_candidates,
+    "blocking": blocking_candidates,
+}
 
 
 @dataclass
@@ -56,10 +155,15 @@ class EntityResolution(Extractor):
     def __init__(
             self,
             llm_invoker: CompletionLLM,
+            candidate_generator: Callable | None = None,
     ):
         super().__init__(llm_invoker)
         """Init method definition."""
         self._llm = llm_invoker
+        self._candidate_generator = candidate_generator or CANDIDATE_GENERATORS[ENTITY_RESOLUTION_CANDIDATES]
+        if self._candidate_generator is blocking_candidates and type(self).is_similarity is not EntityResolution.is_similarity:
+            # The blocking filters are derived from the default predicate.
+            self._candidate_generator = all_pairs_candidates
         self._resolution_prompt = ENTITY_RESOLUTION_PROMPT
         self._record_delimiter_key = "record_delimiter"
         self._entity_index_delimiter_key = "entity_index_delimiter"
@@ -95,7 +199,7 @@ class EntityResolution(Extractor):
 
         candidate_resolution = {entity_type: [] for entity_type in entity_types}
         for k, v in node_clusters.items():
-            candidate_resolution[k] = [(a, b) for a, b in itertools.combinations(v, 2) if (a in subgraph_nodes or b in subgraph_nodes) and self.is_similarity(a, b)]
+            candidate_resolution[k] = self._candidate_generator(v, subgraph_nodes, self.is_similarity)
         num_candidates = sum([len(candidates) for _, candidates in candidate_resolution.items()])
         callback(msg=f"Identified {num_candidates} candidate pairs")
         remain_candidates_to_resolve = num_candidates
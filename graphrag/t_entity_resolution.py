@@ -0,0 +1,81 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import os
+import sys
+sys.path.insert(
+    0,
+    os.path.abspath(
+        os.path.join(
+            os.path.dirname(
+                os.path.abspath(__file__)),
+            '../')))
+
+import argparse
+import random
+import time
+
+from graphrag.entity_resolution import EntityResolution, all_pairs_candidates, blocking_candidates
+
+
+def synthetic_entity_names(n_entities=50000, seed=0):
+    """Entity names of a synthetic graph: English and Chinese names, numbered names and misspelled variants."""
+    rnd = random.Random(seed)
+    syllables = ["an", "ber", "co", "del", "ex", "for", "gra", "hal", "in", "jo", "ka", "lin", "mor", "nes",
+                 "ol", "par", "qui", "ros", "sta", "tor", "ul", "ven", "wil", "xen", "yor", "zan"]
+    hanzi = "数据智能科技集团有限公司北京上海研究院大学医院银行中国人民华为阿里巴腾讯网络系统"
+    names = set()
+    while len(names) < n_entities:
+        r = rnd.random()
+        if r < 0.6:
+            name = " ".join("".join(rnd.choice(syllables) for _ in range(rnd.randint(2, 3))).capitalize()
+                            for _ in range(rnd.randint(1, 3)))
+        elif r < 0.85:
+            name = "".join(rnd.choice(hanzi) for _ in range(rnd.randint(3, 8)))
+        else:
+            name = "".join(rnd.choice(syllables) for _ in range(2)).upper() + f"-{rnd.randint(1, 999)}"
+        names.add(name)
+        if rnd.random() < 0.2:
+            # A near duplicate, the kind of pair entity resolution is meant to find.
+            i = rnd.randrange(len(name))
+            names.add(name[:i] + rnd.choice("aeiou") + name[i + 1:])
+    return sorted(names)[:n_entities]
+
+
+def benchmark(n_entities=50000, n_check=3000):
+    """Time candidate pair generation of EntityResolution with blocking, and check it against all pairs on a subset."""
+    er = EntityResolution(None)
+    names = synthetic_entity_names(n_entities)
+    check = names[::max(1, len(names) // n_check)][:n_check]
+    for subgraph in [set(check), set(check[::3])]:
+        assert all_pairs_candidates(check, subgraph, er.is_similarity) == blocking_candidates(check, subgraph, er.is_similarity), \
+            "Blocking doesn't produce the same candidate pairs."
+
+    st = time.perf_counter()
+    all_pairs_candidates(check, set(check), er.is_similarity)
+    all_pairs_estimate = (time.perf_counter() - st) * (len(names) / len(check)) ** 2
+    st = time.perf_counter()
+    pairs = blocking_candidates(names, set(names), er.is_similarity)
+    print(f" all pairs: ~{all_pairs_estimate:.0f}s for {len(names)} entities (extrapolated from {len(check)})")
+    print(f"  blocking: {time.perf_counter() - st:.2f}s for {len(names)} entities, {len(pairs)} candidate pairs")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time candidate pair generation of entity resolution on synthetic entities")
+    parser.add_argument('--entities', help="Entities of the synthetic graph. Default: 50000", type=int, default=50000)
+    parser.add_argument('--check', help="Entities on which blocking is checked against all pairs. Default: 3000", type=int, default=3000)
+    args = parser.parse_args()
+    benchmark(args.entities, args.check)
@@ -7,9 +7,11 @@ Reference:
 """
 
 import dataclasses
+import heapq
 import html
 import json
 import logging
+import math
 import os
 import re
 import time
@@ -18,7 +20,6 @@ from hashlib import md5
 from typing import Any, Callable, Set, Tuple
 
 import networkx as nx
-import numpy as np
 import trio
 import xxhash
 from networkx.readwrite import json_graph
@@ -27,6 +28,7 @@ from common.misc_utils import get_uuid
 from common.connection_utils import timeout
 from rag.nlp import rag_tokenizer, search
 from rag.utils.doc_store_conn import OrderByExpr
+from rag.utils.embedding_cache import EMBED_CACHE
 from rag.utils.redis_conn import REDIS_CONN
 from common import settings
 
@@ -36,6 +38,14 @@ ErrorHandlerFn = Callable[[BaseException | None, str | None, dict | None], None]
 
 chat_limiter = trio.CapacityLimiter(int(os.environ.get("MAX_CONCURRENT_CHATS", 10)))
 
+# A stored graph is split by node name hash into segments of about this many nodes.
+GRAPH_SEGMENT_SIZE = int(os.environ.get("GRAPH_SEGMENT_SIZE", 512))
+# Graph chunks per bulk insert.
+GRAPH_BULK_SIZE = int(os.environ.get("GRAPH_BULK_SIZE", 64))
+# The graph chunk only keeps what the knowledge graph view shows.
+GRAPH_PREVIEW_NODES = 256
+GRAPH_PREVIEW_EDGES = 128
+
 
 @dataclasses.dataclass
 class GraphChange:
@@ -108,26 +118,12 @@ def set_llm_cache(llmnm, txt, v, history, genconf):
     REDIS_CONN.set(k, v.encode("utf-8"), 24 * 3600)
 
 
-def get_embed_cache(llmnm, txt):
-    hasher = xxhash.xxh64()
-    hasher.update(str(llmnm).encode("utf-8"))
-    hasher.update(str(txt).encode("utf-8"))
-
-    k = hasher.hexdigest()
-    bin = REDIS_CONN.get(k)
-    if not bin:
-        return
-    return np.array(json.loads(bin))
-
+def get_embed_cache(llmnm, txt, tenant_id):
+    return EMBED_CACHE.get_many(tenant_id, llmnm, [txt])[0]
 
-def set_embed_cache(llmnm, txt, arr):
-    hasher = xxhash.xxh64()
-    hasher.update(str(llmnm).encode("utf-8"))
-    hasher.update(str(txt).encode("utf-8"))
 
-    k = hasher.hexdigest()
-    arr = json.dumps(arr.tolist() if isinstance(arr, np.ndarray) else arr)
-    REDIS_CONN.set(k, arr.encode("utf-8"), 24 * 3600)
+def set_embed_cache(llmnm, txt, arr, tenant_id):
+    EMBED_CACHE.set_many(tenant_id, llmnm, [txt], [arr])
 
 
 def get_tags_from_cache(kb_ids):
@@ -294,11 +290,16 @@ def chunk_id(chunk):
     return xxhash.xxh64((chunk["content_with_weight"] + chunk["kb_id"]).encode("utf-8")).hexdigest()
 
 
+def graph_record_id(kb_id, kind, *names):
+    """Stable id of a graph record, so that writing a node, an edge or a segment again replaces it."""
+    return xxhash.xxh64("\t".join([kb_id, kind, *names]).encode("utf-8")).hexdigest()
+
+
 async def graph_node_to_chunk(kb_id, embd_mdl, ent_name, meta, chunks):
     global chat_limiter
     enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
     chunk = {
-        "id": get_uuid(),
+        "id": graph_record_id(kb_id, "entity", ent_name),
         "important_kwd": [ent_name],
         "title_tks": rag_tokenizer.tokenize(ent_name),
         "entity_kwd": ent_name,
@@ -311,13 +312,13 @@ async def graph_node_to_chunk(kb_id, embd_mdl, ent_name, meta, chunks):
         "available_int": 0,
     }
     chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(chunk["content_ltks"])
-    ebd = get_embed_cache(embd_mdl.llm_name, ent_name)
+    ebd = get_embed_cache(embd_mdl.llm_name, ent_name, embd_mdl.tenant_id)
     if ebd is None:
         async with chat_limiter:
             with trio.fail_after(3 if enable_timeout_assertion else 30000000):
                 ebd, _ = await trio.to_thread.run_sync(lambda: embd_mdl.encode([ent_name]))
         ebd = ebd[0]
-        set_embed_cache(embd_mdl.llm_name, ent_name, ebd)
+        set_embed_cache(embd_mdl.llm_name, ent_name, ebd, embd_mdl.tenant_id)
     assert ebd is not None
     chunk["q_%d_vec" % len(ebd)] = ebd
     chunks.append(chunk)
@@ -348,7 +349,7 @@ def get_relation(tenant_id, kb_id, from_ent_name, to_ent_name, size=1):
 async def graph_edge_to_chunk(kb_id, embd_mdl, from_ent_name, to_ent_name, meta, chunks):
     enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
     chunk = {
-        "id": get_uuid(),
+        "id": graph_record_id(kb_id, "relation", *sorted([from_ent_name, to_ent_name])),
         "from_entity_kwd": from_ent_name,
         "to_entity_kwd": to_ent_name,
         "knowledge_graph_kwd": "relation",
@@ -362,13 +363,13 @@ async def graph_edge_to_chunk(kb_id, embd_mdl, from_ent_name, to_ent_name, meta,
     }
     chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(chunk["content_ltks"])
     txt = f"{from_ent_name}->{to_ent_name}"
-    ebd = get_embed_cache(embd_mdl.llm_name, txt)
+    ebd = get_embed_cache(embd_mdl.llm_name, txt, embd_mdl.tenant_id)
     if ebd is None:
         async with chat_limiter:
             with trio.fail_after(3 if enable_timeout_assertion else 300000000):
                 ebd, _ = await trio.to_thread.run_sync(lambda: embd_mdl.encode([txt + f": {meta['description']}"]))
         ebd = ebd[0]
-        set_embed_cache(embd_mdl.llm_name, txt, ebd)
+        set_embed_cache(embd_mdl.llm_name, txt, ebd, embd_mdl.tenant_id)
     assert ebd is not None
     chunk["q_%d_vec" % len(ebd)] = ebd
     chunks.append(chunk)
@@ -406,8 +407,19 @@ async def get_graph(tenant_id, kb_id, exclude_rebuild=None):
     if not res.total == 0:
         for id in res.ids:
             try:
-                if res.field[id]["removed_kwd"] == "N":
-                    g = json_graph.node_link_graph(json.loads(res.field[id]["content_with_weight"]), edges="edges")
+                data = json.loads(res.field[id]["content_with_weight"])
+                if "segments" in data:
+                    g = await load_graph_segments(tenant_id, kb_id, data)
+                    if g is None:
+                        # Flag it as a deletion does, so that the next set_graph writes all segments again.
+                        await trio.to_thread.run_sync(settings.docStoreConn.update, {"kb_id": kb_id, "knowledge_graph_kwd": ["graph"]}, {"removed_kwd": "Y"}, search.index_name(tenant_id), kb_id)
+                        return await rebuild_graph(tenant_id, kb_id, exclude_rebuild)
+                    if res.field[id]["removed_kwd"] != "N":
+                        # Some documents were deleted, only their ids were removed from source_id.
+                        prune_graph_sources(g, res.field[id]["source_id"])
+                elif res.field[id]["removed_kwd"] == "N":
+                    # Written before graphs were stored in segments, the chunk holds the whole graph.
+                    g = json_graph.node_link_graph(data, edges="edges")
                     if "source_id" not in g.graph:
                         g.graph["source_id"] = res.field[id]["source_id"]
                 else:
@@ -419,46 +431,178 @@ async def get_graph(tenant_id, kb_id, exclude_rebuild=None):
     return result
 
 
+def graph_segment_count(n_nodes: int) -> int:
+    return 1 << max(0, math.ceil(math.log2(max(1, n_nodes / GRAPH_SEGMENT_SIZE))))
+
+
+def graph_segment_of(node: str, segments: int) -> int:
+    return xxhash.xxh64_intdigest(node.encode("utf-8")) % segments
+
+
+def graph_segments(graph: nx.Graph, segments: int, only: set[int] | None = None) -> dict[int, dict]:
+    """
+    Split `graph` into node-link fragments. A node goes to the segment of its name, an edge to the segment of
+    its smaller end. Only the segments in `only` are built if given.
+    """
+    fragments = {b: {"segment": b, "nodes": [], "edges": []} for b in (range(segments) if only is None else only)}
+    for n, attrs in graph.nodes(data=True):
+        b = graph_segment_of(n, segments)
+        if b in fragments:
+            fragments[b]["nodes"].append({**attrs, "id": n})
+    for f, t, attrs in graph.edges(data=True):
+        b = graph_segment_of(min(f, t), segments)
+        if b in fragments:
+            fragments[b]["edges"].append({**attrs, "source": f, "target": t})
+    return fragments
+
+
+async def load_graph_segments(tenant_id, kb_id, manifest: dict) -> nx.Graph | None:
+    """Assemble the graph described by the graph chunk `manifest` from its segments, None if some are missing."""
+    graph = nx.Graph()
+    graph.graph.update(manifest.get("graph", {}))
+    segments = manifest["segments"]
+    flds = ["content_with_weight"]
+    edges, seen = [], set()
+    bs = 256
+    for i in range(0, segments + bs, bs):
+        es_res = await trio.to_thread.run_sync(
+            lambda: settings.docStoreConn.search(flds, [], {"kb_id": kb_id, "knowledge_graph_kwd": ["graph_segment"]}, [], OrderByExpr(), i, bs, search.index_name(tenant_id), [kb_id])
+        )
+        es_res = settings.docStoreConn.get_fields(es_res, flds)
+        if len(es_res) == 0:
+            break
+        for d in es_res.values():
+            fragment = json.loads(d["content_with_weight"])
+            if fragment["segment"] >= segments or fragment["segment"] in seen:
+                continue
+            seen.add(fragment["segment"])
+            for attrs in fragment["nodes"]:
+                graph.add_node(attrs.pop("id"), **attrs)
+            edges.extend(fragment["edges"])
+    if len(seen) != segments or graph.number_of_nodes() != manifest.get("nodes_count", graph.number_of_nodes()):
+        logging.warning(f"Graph of kb {kb_id} has {len(seen)}/{segments} segments and {graph.number_of_nodes()}/{manifest.get('nodes_count')} nodes, rebuild it.")
+        return None
+    for attrs in edges:
+        f, t = attrs.pop("source"), attrs.pop("target")
+        if graph.has_node(f) and graph.has_node(t):
+            graph.add_edge(f, t, **attrs)
+    # Segments not touched by the last updates keep older degrees.
+    for n, degree in graph.degree:
+        graph.nodes[n]["rank"] = int(degree)
+    return graph
+
+
+def prune_graph_sources(graph: nx.Graph, sources: list[str]):
+    """Keep only the documents in `sources`, dropping the nodes and edges no other document mentions."""
+    keep = set(sources)
+    purged_edges = []
+    for f, t, attrs in graph.edges(data=True):
+        attrs["source_id"] = [s for s in attrs.get("source_id", []) if s in keep]
+        if not attrs["source_id"]:
+            purged_edges.append((f, t))
+    graph.remove_edges_from(purged_edges)
+    purged_nodes = []
+    for n, attrs in graph.nodes(data=True):
+        attrs["source_id"] = [s for s in attrs.get("source_id", []) if s in keep]
+        if not attrs["source_id"]:
+            purged_nodes.append(n)
+    graph.remove_nodes_from(purged_nodes)
+    graph.graph["source_id"] = [s for s in graph.graph.get("source_id", []) if s in keep]
+    for n, degree in graph.degree:
+        graph.nodes[n]["rank"] = int(degree)
+
+
+def graph_preview(graph: nx.Graph) -> dict:
+    """Node-link data of the nodes with the highest pagerank and the heaviest edges between them."""
+    nodes = heapq.nlargest(GRAPH_PREVIEW_NODES, graph.nodes, key=lambda n: graph.nodes[n].get("pagerank", 0))
+    data = nx.node_link_data(graph.subgraph(nodes), edges="edges")
+    data["edges"] = heapq.nlargest(GRAPH_PREVIEW_EDGES, [e for e in data["edges"] if e["source"] != e["target"]], key=lambda e: e.get("weight", 0))
+    return data
+
+
+async def get_graph_manifest(tenant_id, kb_id) -> tuple[dict | None, str]:
+    """The parsed graph chunk and its removed_kwd, (None, "") if there is none or it can't be parsed."""
+    flds = ["content_with_weight", "removed_kwd"]
+    res = await trio.to_thread.run_sync(
+        lambda: settings.docStoreConn.search(flds, [], {"kb_id": kb_id, "knowledge_graph_kwd": ["graph"]}, [], OrderByExpr(), 0, 1, search.index_name(tenant_id), [kb_id])
+    )
+    for d in settings.docStoreConn.get_fields(res, flds).values():
+        try:
+            return json.loads(d["content_with_weight"]), d.get("removed_kwd", "N")
+        except Exception:
+            break
+    return None, ""
+
+
 async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, change: GraphChange, callback):
+    """
+    Persist `graph`, of which only `change` differs from what is stored.
+
+    The graph lives in segment chunks, each holding the nodes of one hash bucket of names and their edges.
+    Only the segments, entities, relations and per document subgraphs touched by `change` are written again.
+    All of them are rewritten if the stored graph is in the former single chunk format, was rebuilt after
+    a document deletion, or outgrew its segment count.
+    """
     global chat_limiter
     start = trio.current_time()
+    idxnm = search.index_name(tenant_id)
 
-    await trio.to_thread.run_sync(settings.docStoreConn.delete, {"knowledge_graph_kwd": ["graph", "subgraph"]}, search.index_name(tenant_id), kb_id)
+    manifest, removed = await get_graph_manifest(tenant_id, kb_id)
+    segments = graph_segment_count(graph.number_of_nodes())
+    full = manifest is None or removed != "N" or "segments" not in manifest or segments >= manifest["segments"] * 4
+    if not full:
+        segments = manifest["segments"]
 
     if change.removed_nodes:
-        await trio.to_thread.run_sync(settings.docStoreConn.delete, {"knowledge_graph_kwd": ["entity"], "entity_kwd": sorted(change.removed_nodes)}, search.index_name(tenant_id), kb_id)
-
-    if change.removed_edges:
-
-        async def del_edges(from_node, to_node):
-            async with chat_limiter:
-                await trio.to_thread.run_sync(
-                    settings.docStoreConn.delete, {"knowledge_graph_kwd": ["relation"], "from_entity_kwd": from_node, "to_entity_kwd": to_node}, search.index_name(tenant_id), kb_id
-                )
+        await trio.to_thread.run_sync(settings.docStoreConn.delete, {"knowledge_graph_kwd": ["entity"], "entity_kwd": sorted(change.removed_nodes)}, idxnm, kb_id)
+
+    # Entities and relations used to be written with random ids, so rewriting one didn't replace it.
+    # Updated entities are deleted by name first, relations are only deleted by their ends when removed.
+    if change.added_updated_nodes:
+        await trio.to_thread.run_sync(settings.docStoreConn.delete, {"knowledge_graph_kwd": ["entity"], "entity_kwd": sorted(change.added_updated_nodes)}, idxnm, kb_id)
+    ends = defaultdict(set)
+    for from_node, to_node in change.removed_edges:
+        ends[from_node].add(to_node)
+        ends[to_node].add(from_node)
+
+    async def del_edges(from_node, to_nodes):
+        async with chat_limiter:
+            await trio.to_thread.run_sync(
+                settings.docStoreConn.delete, {"knowledge_graph_kwd": ["relation"], "from_entity_kwd": from_node, "to_entity_kwd": sorted(to_nodes)}, idxnm, kb_id
+            )
 
-        async with trio.open_nursery() as nursery:
-            for from_node, to_node in change.removed_edges:
-                nursery.start_soon(del_edges, from_node, to_node)
+    async with trio.open_nursery() as nursery:
+        for from_node, to_nodes in ends.items():
+            nursery.start_soon(del_edges, from_node, to_nodes)
 
     now = trio.current_time()
     if callback:
         callback(msg=f"set_graph removed {len(change.removed_nodes)} nodes and {len(change.removed_edges)} edges from index in {now - start:.2f}s.")
     start = now
 
-    chunks = [
-        {
-            "id": get_uuid(),
-            "content_with_weight": json.dumps(nx.node_link_data(graph, edges="edges"), ensure_ascii=False),
-            "knowledge_graph_kwd": "graph",
-            "kb_id": kb_id,
-            "source_id": graph.graph.get("source_id", []),
-            "available_int": 0,
-            "removed_kwd": "N",
-        }
-    ]
+    # Segments and subgraphs holding a changed node or edge.
+    touched_nodes = change.added_updated_nodes | change.removed_nodes | set(ends.keys())
+    for from_node, to_node in change.added_updated_edges:
+        touched_nodes.update([from_node, to_node])
+    touched_segments = None if full else {graph_segment_of(n, segments) for n in touched_nodes}
+    touched_sources = None if full else {s for n in touched_nodes if graph.has_node(n) for s in graph.nodes[n].get("source_id", [])}
+
+    chunks = []
+    for b, fragment in graph_segments(graph, segments, touched_segments).items():
+        chunks.append(
+            {
+                "id": graph_record_id(kb_id, "graph_segment", str(b)),
+                "content_with_weight": json.dumps(fragment, ensure_ascii=False),
+                "knowledge_graph_kwd": "graph_segment",
+                "kb_id": kb_id,
+                "available_int": 0,
+                "removed_kwd": "N",
+            }
+        )
 
     # generate updated subgraphs
-    for source in graph.graph["source_id"]:
+    sources = graph.graph["source_id"] if full else [s for s in graph.graph["source_id"] if s in touched_sources]
+    for source in sources:
         subgraph = graph.subgraph([n for n in graph.nodes if source in graph.nodes[n]["source_id"]]).copy()
         subgraph.graph["source_id"] = [source]
         for n in subgraph.nodes:
@@ -497,16 +641,44 @@ async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, chang
         callback(msg=f"set_graph converted graph change to {len(chunks)} chunks in {now - start:.2f}s.")
     start = now
 
+    if full:
+        await trio.to_thread.run_sync(settings.docStoreConn.delete, {"knowledge_graph_kwd": ["graph_segment", "subgraph"]}, idxnm, kb_id)
+    elif sources:
+        await trio.to_thread.run_sync(settings.docStoreConn.delete, {"knowledge_graph_kwd": ["subgraph"], "source_id": sources}, idxnm, kb_id)
+
     enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
-    es_bulk_size = 4
-    for b in range(0, len(chunks), es_bulk_size):
+    for b in range(0, len(chunks), GRAPH_BULK_SIZE):
         with trio.fail_after(3 if enable_timeout_assertion else 30000000):
-            doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert(chunks[b : b + es_bulk_size], search.index_name(tenant_id), kb_id))
-        if b % 100 == es_bulk_size and callback:
+            doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert(chunks[b : b + GRAPH_BULK_SIZE], idxnm, kb_id))
+        if callback:
             callback(msg=f"Insert chunks: {b}/{len(chunks)}")
         if doc_store_result:
             error_message = f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
             raise Exception(error_message)
+
+    # The graph chunk goes last, so that it never refers to segments not written yet.
+    await trio.to_thread.run_sync(settings.docStoreConn.delete, {"knowledge_graph_kwd": ["graph"]}, idxnm, kb_id)
+    manifest = graph_preview(graph)
+    manifest.update({"graph": graph.graph, "segments": segments, "nodes_count": graph.number_of_nodes(), "edges_count": graph.number_of_edges()})
+    doc_store_result = await trio.to_thread.run_sync(
+        lambda: settings.docStoreConn.insert(
+            [
+                {
+                    "id": graph_record_id(kb_id, "graph"),
+                    "content_with_weight": json.dumps(manifest, ensure_ascii=False),
+                    "knowledge_graph_kwd": "graph",
+                    "kb_id": kb_id,
+                    "source_id": graph.graph.get("source_id", []),
+                    "available_int": 0,
+                    "removed_kwd": "N",
+                }
+            ],
+            idxnm,
+            kb_id,
+        )
+    )
+    if doc_store_result:
+        raise Exception(f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!")
     now = trio.current_time()
     if callback:
         callback(msg=f"set_graph added/updated {len(change.added_updated_nodes)} nodes and {len(change.added_updated_edges)} edges from index in {now - start:.2f}s.")
@@ -20,7 +20,7 @@ import re
 
 from common.constants import ParserType
 from io import BytesIO
-from rag.nlp import rag_tokenizer, tokenize, tokenize_table, bullets_category, title_frequency, tokenize_chunks, docx_question_level, attach_media_context
+from rag.nlp import rag_tokenizer, tokenize_docs, tokenize_table, bullets_category, title_frequency, tokenize_chunks, docx_question_level, attach_media_context
 from common.token_utils import num_tokens_from_string
 from deepdoc.parser import PdfParser, DocxParser
 from deepdoc.parser.figure_parser import vision_figure_parser_pdf_wrapper,vision_figure_parser_docx_wrapper
@@ -322,13 +322,15 @@ def chunk(filename, binary=None, from_page=0, to_page=100000,
                                     from_page=0, to_page=10000, callback=callback)
         tbls=vision_figure_parser_docx_wrapper(sections=ti_list,tbls=tbls,callback=callback,**kwargs)
         res = tokenize_table(tbls, doc, eng)
+        ds = []
         for text, image in ti_list:
             d = copy.deepcopy(doc)
             if image:
                 d['image'] = image
                 d["doc_type_kwd"] = "image"
-            tokenize(d, text, eng)
-            res.append(d)
+            ds.append(d)
+        tokenize_docs(ds, [text for text, _ in ti_list], eng)
+        res.extend(ds)
         table_ctx = max(0, int(parser_config.get("table_context_size", 0) or 0))
         image_ctx = max(0, int(parser_config.get("image_context_size", 0) or 0))
         if table_ctx or image_ctx:
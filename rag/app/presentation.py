@@ -20,7 +20,7 @@ from io import BytesIO
 
 from PIL import Image
 
-from rag.nlp import tokenize, is_english
+from rag.nlp import tokenize_docs, is_english
 from rag.nlp import rag_tokenizer
 from deepdoc.parser import PdfParser, PptParser, PlainParser
 from PyPDF2 import PdfReader as pdf2_read
@@ -109,7 +109,7 @@ def chunk(filename, binary=None, from_page=0, to_page=100000,
         "title_tks": rag_tokenizer.tokenize(re.sub(r"\.[a-zA-Z]+$", "", filename))
     }
     doc["title_sm_tks"] = rag_tokenizer.fine_grained_tokenize(doc["title_tks"])
-    res = []
+    res, txts = [], []
     if re.search(r"\.pptx?$", filename, re.IGNORECASE):
         ppt_parser = Ppt()
         for pn, (txt, img) in enumerate(ppt_parser(
@@ -121,8 +121,9 @@ def chunk(filename, binary=None, from_page=0, to_page=100000,
             d["page_num_int"] = [pn + 1]
             d["top_int"] = [0]
             d["position_int"] = [(pn + 1, 0, img.size[0], 0, img.size[1])]
-            tokenize(d, txt, eng)
             res.append(d)
+            txts.append(txt)
+        tokenize_docs(res, txts, eng)
         return res
     elif re.search(r"\.pdf$", filename, re.IGNORECASE):
         layout_recognizer = parser_config.get("layout_recognize", "DeepDOC")
@@ -162,8 +163,9 @@ def chunk(filename, binary=None, from_page=0, to_page=100000,
             d["page_num_int"] = [pn + 1]
             d["top_int"] = [0]
             d["position_int"] = [(pn + 1, 0, img.size[0] if img else 0, 0, img.size[1] if img else 0)]
-            tokenize(d, txt, eng)
             res.append(d)
+            txts.append(txt)
+        tokenize_docs(res, txts, eng)
         return res
 
     raise NotImplementedError(
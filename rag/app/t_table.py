@@ -0,0 +1,80 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import os
+import sys
+sys.path.insert(
+    0,
+    os.path.abspath(
+        os.path.join(
+            os.path.dirname(
+                os.path.abspath(__file__)),
+            '../../')))
+
+import argparse
+import subprocess
+import tempfile
+
+from openpyxl import Workbook
+
+from common.file_utils import get_project_base_directory
+
+
+_TABLE_TASK = """
+import resource, sys, time
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+st = time.perf_counter()
+path, from_page, to_page = sys.argv[2], int(sys.argv[3]), int(sys.argv[4])
+if sys.argv[1] == "full":
+    # What a task paid before streaming: the whole workbook in memory.
+    from openpyxl import load_workbook
+    wb = load_workbook(path, data_only=True)
+    rows = [r for ws in wb for r in ws.iter_rows(values_only=True)][from_page + 1:to_page + 1]
+else:
+    from rag.app.table import Excel
+    with open(path, "rb") as f:
+        rows = Excel()(path, f.read(), from_page=from_page, to_page=to_page, callback=lambda *a, **k: None)
+print(time.perf_counter() - st, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before)
+"""
+
+
+def benchmark(n_rows=200000, task_rows=3000):
+    """Peak RSS and time of table parsing tasks at several offsets of a large xlsx, fully loaded and streamed."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "table.xlsx")
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("data")
+        ws.append(["id/编号", "name", "city", "amount", "ratio", "created", "active", "comment"])
+        for i in range(n_rows):
+            ws.append([i, f"name {i % 5000}", ["Beijing", "Shanghai", "Paris", "Berlin"][i % 4], i * 7 % 10000,
+                       (i % 1000) / 1000, f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}", ["yes", "no"][i % 2],
+                       f"row {i} of a large table"])
+        wb.save(path)
+        print(f"{n_rows} rows, {os.path.getsize(path) / 1024 / 1024:.1f} MB")
+        for from_page in [0, n_rows // 2, n_rows - task_rows]:
+            for mode in ["full", "stream"]:
+                out = subprocess.run([sys.executable, "-c", _TABLE_TASK, mode, path, str(from_page), str(from_page + task_rows)],
+                                     check=True, capture_output=True, text=True, cwd=get_project_base_directory())
+                elapsed, rss = out.stdout.split()[-2:]
+                print(f"rows {from_page}~{from_page + task_rows} {mode:>6}: {float(elapsed):.2f} s, RSS +{int(rss) / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Peak RSS and time of table parsing tasks on a large xlsx, fully loaded and streamed")
+    parser.add_argument('--rows', help="Rows of the synthetic xlsx. Default: 200000", type=int, default=200000)
+    parser.add_argument('--task_rows', help="Rows parsed by one task. Default: 3000", type=int, default=3000)
+    args = parser.parse_args()
+    benchmark(args.rows, args.task_rows)
@@ -15,84 +15,170 @@
 #
 
 import copy
+import itertools
 import logging
 import re
 from io import BytesIO
 from xpinyin import Pinyin
-import numpy as np
 import pandas as pd
 from collections import Counter
 
-# from openpyxl import load_workbook, Workbook
+import openpyxl
+from openpyxl.utils.cell import column_index_from_string, range_boundaries
+from openpyxl.worksheet._read_only import ReadOnlyWorksheet
 from dateutil.parser import parse as datetime_parse
 
 from api.db.services.knowledgebase_service import KnowledgebaseService
 from deepdoc.parser.utils import get_text
-from rag.nlp import rag_tokenizer, tokenize
+from rag.nlp import rag_tokenizer, tokenize_docs
 from deepdoc.parser import ExcelParser
 
 
+_MERGE_CELL_RE = re.compile(rb"<(?:\w+:)?mergeCell\b[^>]*?\bref=\"([A-Z0-9:$]+)\"")
+_CELL_COLUMN_RE = re.compile(rb"<(?:\w+:)?c\b[^>]*?\br=\"\$?([A-Z]+)\$?[0-9]+\"")
+
+
+class _MergedCells:
+    """Merged ranges of a sheet, resolved while its rows are read in order."""
+
+    def __init__(self, ranges):
+        # (min_row, min_col, max_row, max_col), ordered by first row.
+        self.ranges = sorted(ranges)
+        self._next = 0
+        # Ranges covering the current row, with the value of their top-left cell.
+        self._active = {}
+
+    def advance(self, row_num, values):
+        """Move to row `row_num`, whose cell values are `values`."""
+        if self._active:
+            self._active = {rng: v for rng, v in self._active.items() if rng[2] >= row_num}
+        while self._next < len(self.ranges) and self.ranges[self._next][0] <= row_num:
+            rng = self.ranges[self._next]
+            self._next += 1
+            if rng[2] >= row_num:
+                self._active[rng] = values[rng[1] - 1] if rng[0] == row_num and rng[1] <= len(values) else None
+
+    def value(self, col):
+        """Value of the merged range covering column `col` of the current row, None if there is none."""
+        for (_, min_col, _, max_col), v in self._active.items():
+            if min_col <= col <= max_col:
+                return v
+        return None
+
+    def head_value(self, head, row, col):
+        """Same as `value`, for a cell of the first rows `head`."""
+        for min_row, min_col, max_row, max_col in self.ranges:
+            if min_row > row:
+                break
+            if row <= max_row and min_col <= col <= max_col:
+                anchor = head[min_row - 1]
+                return anchor[min_col - 1] if min_col <= len(anchor) else None
+        return None
+
+
 class Excel(ExcelParser):
     def __call__(self, fnm, binary=None, from_page=0, to_page=10000000000, callback=None):
-        if not binary:
-            wb = Excel._load_excel_to_workbook(fnm)
-        else:
-            wb = Excel._load_excel_to_workbook(BytesIO(binary))
-        total = 0
-        for sheetname in wb.sheetnames:
-            total += len(list(wb[sheetname].rows))
+        # Sheets are streamed: only the rows of [from_page, to_page) are kept.
+        wb = Excel._load_excel_to_workbook(fnm if not binary else BytesIO(binary), read_only=True)
+        if not all(Excel._has_raw_xml(ws) for ws in wb.worksheets):
+            logging.error(f"openpyxl {openpyxl.__version__} doesn't expose the xml of read-only sheets, which table parsing "
+                          "needs for merged cells: the whole workbook is loaded instead. Check the openpyxl pin of pyproject.toml.")
+            wb.close()
+            wb = Excel._load_excel_to_workbook(fnm if not binary else BytesIO(binary))
         res, fails, done = [], [], 0
         rn = 0
-        for sheetname in wb.sheetnames:
-            ws = wb[sheetname]
-            try:
-                rows = list(ws.rows)
-            except Exception as e:
-                logging.warning(f"Skip sheet '{sheetname}' due to rows access error: {e}")
-                continue
-            if not rows:
-                continue
-            headers, header_rows = self._parse_headers(ws, rows)
-            if not headers:
-                continue
-            data = []
-            for i, r in enumerate(rows[header_rows:]):
-                rn += 1
-                if rn - 1 < from_page:
-                    continue
-                if rn - 1 >= to_page:
+        try:
+            for sheetname in wb.sheetnames:
+                if rn > to_page:
                     break
-                row_data = self._extract_row_data(ws, r, header_rows + i, len(headers))
-                if row_data is None:
-                    fails.append(str(i))
+                ws = wb[sheetname]
+                try:
+                    ranges, max_col = self._sheet_layout(ws)
+                    merged = _MergedCells(ranges)
+                    rows = ws.iter_rows(max_col=max_col, values_only=True)
+                    head = list(itertools.islice(rows, 5))
+                    if not head:
+                        continue
+                    headers, header_rows = self._parse_headers(head, merged)
+                    if not headers:
+                        continue
+                    data = []
+                    for row_num, r in enumerate(itertools.chain(head, rows), 1):
+                        merged.advance(row_num, r)
+                        if row_num <= header_rows:
+                            continue
+                        rn += 1
+                        if rn - 1 < from_page:
+                            continue
+                        if rn - 1 >= to_page:
+                            break
+                        row_data = self._extract_row_data(r, merged, len(headers))
+                        if row_data is None:
+                            fails.append(str(row_num - header_rows - 1))
+                            continue
+                        if self._is_empty_row(row_data):
+                            continue
+                        data.append(row_data)
+                        done += 1
+                except Exception as e:
+                    logging.warning(f"Skip sheet '{sheetname}' due to rows access error: {e}")
                     continue
-                if self._is_empty_row(row_data):
+                if len(data) == 0:
                     continue
-                data.append(row_data)
-                done += 1
-            if len(data) == 0:
-                continue
-            df = pd.DataFrame(data, columns=headers)
-            res.append(df)
+                df = pd.DataFrame(data, columns=headers)
+                res.append(df)
+        finally:
+            wb.close()
         callback(0.3, ("Extract records: {}~{}".format(from_page + 1, min(to_page, from_page + rn)) + (f"{len(fails)} failure, line: %s..." % (",".join(fails[:3])) if fails else "")))
         return res
 
-    def _parse_headers(self, ws, rows):
-        if len(rows) == 0:
+    @staticmethod
+    def _has_raw_xml(ws):
+        # Private attributes of openpyxl 3.1 read-only sheets.
+        if not isinstance(ws, ReadOnlyWorksheet):
+            return True
+        return hasattr(getattr(ws.parent, "_archive", None), "open") and isinstance(getattr(ws, "_worksheet_path", None), str)
+
+    @staticmethod
+    def _sheet_layout(ws):
+        """Merged ranges of `ws`, and its width when rows wouldn't be padded to the same one."""
+        if not isinstance(ws, ReadOnlyWorksheet):
+            return [(r.min_row, r.min_col, r.max_row, r.max_col) for r in ws.merged_cells.ranges], None
+        # Read-only sheets don't load merged cells, and size rows with the declared dimension.
+        # Both are scanned from the raw xml, which is much cheaper than parsing it.
+        ranges, max_col = [], None if ws.max_column else 0
+        tail = b""
+        with ws.parent._archive.open(ws._worksheet_path) as src:
+            while True:
+                block = src.read(1 << 20)
+                buf = tail + block
+                # Scan up to the last complete tag, the rest goes with the next block.
+                cut = buf.rfind(b">") + 1 if block else len(buf)
+                buf, tail = buf[:cut], buf[cut:]
+                for m in _MERGE_CELL_RE.finditer(buf):
+                    c0, r0, c1, r1 = range_boundaries(m.group(1).decode())
+                    ranges.append((r0, c0, r1, c1))
+                if max_col is not None:
+                    cols = {m.group(1) for m in _CELL_COLUMN_RE.finditer(buf)}
+                    if cols:
+                        max_col = max(max_col, column_index_from_string(max(cols, key=lambda c: (len(c), c)).decode()))
+                if not block:
+                    break
+        return ranges, max_col or None
+
+    def _parse_headers(self, head, merged):
+        if len(head) == 0:
             return [], 0
-        has_complex_structure = self._has_complex_header_structure(ws, rows)
+        has_complex_structure = self._has_complex_header_structure(merged)
         if has_complex_structure:
-            return self._parse_multi_level_headers(ws, rows)
+            return self._parse_multi_level_headers(head, merged)
         else:
-            return self._parse_simple_headers(rows)
+            return self._parse_simple_headers(head)
 
-    def _has_complex_header_structure(self, ws, rows):
-        if len(rows) < 1:
-            return False
-        merged_ranges = list(ws.merged_cells.ranges)
+    def _has_complex_header_structure(self, merged):
         # 检查前两行是否涉及合并单元格
-        for rng in merged_ranges:
-            if rng.min_row <= 2:  # 只要合并区域涉及第1或第2行
+        for rng in merged.ranges:
+            if rng[0] <= 2:  # 只要合并区域涉及第1或第2行
                 return True
         return False
 
@@ -100,10 +186,10 @@ class Excel(ExcelParser):
         header_like_cells = 0
         data_like_cells = 0
         non_empty_cells = 0
-        for cell in row:
-            if cell.value is not None:
+        for value in row:
+            if value is not None:
                 non_empty_cells += 1
-                val = str(cell.value).strip()
+                val = str(value).strip()
                 if self._looks_like_header(val):
                     header_like_cells += 1
                 elif self._looks_like_data(val):
@@ -112,22 +198,13 @@ class Excel(ExcelParser):
             return False
         return header_like_cells >= data_like_cells
 
-    def _parse_simple_headers(self, rows):
-        if not rows:
+    def _parse_simple_headers(self, head):
+        if not head:
             return [], 0
-        header_row = rows[0]
-        headers = []
-        for cell in header_row:
-            if cell.value is not None:
-                header_value = str(cell.value).strip()
-                if header_value:
-                    headers.append(header_value)
-            else:
-                pass
         final_headers = []
-        for i, cell in enumerate(header_row):
-            if cell.value is not None:
-                header_value = str(cell.value).strip()
+        for i, value in enumerate(head[0]):
+            if value is not None:
+                header_value = str(value).strip()
                 if header_value:
                     final_headers.append(header_value)
                 else:
@@ -136,22 +213,22 @@ class Excel(ExcelParser):
                 final_headers.append(f"Column_{i + 1}")
         return final_headers, 1
 
-    def _parse_multi_level_headers(self, ws, rows):
-        if len(rows) < 2:
+    def _parse_multi_level_headers(self, head, merged):
+        if len(head) < 2:
             return [], 0
-        header_rows = self._detect_header_rows(rows)
+        header_rows = self._detect_header_rows(head)
         if header_rows == 1:
-            return self._parse_simple_headers(rows)
+            return self._parse_simple_headers(head)
         else:
-            return self._build_hierarchical_headers(ws, rows, header_rows), header_rows
+            return self._build_hierarchical_headers(head, merged, header_rows), header_rows
 
-    def _detect_header_rows(self, rows):
-        if len(rows) < 2:
+    def _detect_header_rows(self, head):
+        if len(head) < 2:
             return 1
         header_rows = 1
-        max_check_rows = min(5, len(rows))
+        max_check_rows = min(5, len(head))
         for i in range(1, max_check_rows):
-            row = rows[i]
+            row = head[i]
             if self._row_looks_like_header(row):
                 header_rows = i + 1
             else:
@@ -178,16 +255,15 @@ class Excel(ExcelParser):
             return True
         return False
 
-    def _build_hierarchical_headers(self, ws, rows, header_rows):
+    def _build_hierarchical_headers(self, head, merged, header_rows):
         headers = []
-        max_col = max(len(row) for row in rows[:header_rows]) if header_rows > 0 else 0
-        merged_ranges = list(ws.merged_cells.ranges)
+        max_col = max(len(row) for row in head[:header_rows]) if header_rows > 0 else 0
         for col_idx in range(max_col):
             header_parts = []
             for row_idx in range(header_rows):
-                if col_idx < len(rows[row_idx]):
-                    cell_value = rows[row_idx][col_idx].value
-                    merged_value = self._get_merged_cell_value(ws, row_idx + 1, col_idx + 1, merged_ranges)
+                if col_idx < len(head[row_idx]):
+                    cell_value = head[row_idx][col_idx]
+                    merged_value = merged.head_value(head, row_idx + 1, col_idx + 1)
                     if merged_value is not None:
                         cell_value = merged_value
                     if cell_value is not None:
@@ -211,39 +287,15 @@ class Excel(ExcelParser):
             return False
         return True
 
-    def _get_merged_cell_value(self, ws, row, col, merged_ranges):
-        for merged_range in merged_ranges:
-            if merged_range.min_row <= row <= merged_range.max_row and merged_range.min_col <= col <= merged_range.max_col:
-                return ws.cell(merged_range.min_row, merged_range.min_col).value
-        return None
-
-    def _extract_row_data(self, ws, row, absolute_row_idx, expected_cols):
+    def _extract_row_data(self, row, merged, expected_cols):
         row_data = []
-        merged_ranges = list(ws.merged_cells.ranges)
-        actual_row_num = absolute_row_idx + 1
         for col_idx in range(expected_cols):
-            cell_value = None
-            actual_col_num = col_idx + 1
-            try:
-                cell_value = ws.cell(row=actual_row_num, column=actual_col_num).value
-            except ValueError:
-                if col_idx < len(row):
-                    cell_value = row[col_idx].value
+            cell_value = row[col_idx] if col_idx < len(row) else None
             if cell_value is None:
-                merged_value = self._get_merged_cell_value(ws, actual_row_num, actual_col_num, merged_ranges)
-                if merged_value is not None:
-                    cell_value = merged_value
-                else:
-                    cell_value = self._get_inherited_value(ws, actual_row_num, actual_col_num, merged_ranges)
+                cell_value = merged.value(col_idx + 1)
             row_data.append(cell_value)
         return row_data
 
-    def _get_inherited_value(self, ws, row, col, merged_ranges):
-        for merged_range in merged_ranges:
-            if merged_range.min_row <= row <= merged_range.max_row and merged_range.min_col <= col <= merged_range.max_col:
-                return ws.cell(merged_range.min_row, merged_range.min_col).value
-        return None
-
     def _is_empty_row(self, row_data):
         for val in row_data:
             if val is not None and str(val).strip() != "":
@@ -265,45 +317,70 @@ def trans_bool(s):
         return "no"
 
 
+def _value_type(s):
+    if re.match(r"[+-]?[0-9]+$", s.replace("%%", "")) and not s.replace("%%", "").startswith("0"):
+        # Integers overflowing int64 make the whole column float.
+        return "bigint" if int(s) > 2**63 - 1 else "int"
+    elif re.match(r"[+-]?[0-9.]{,19}$", s.replace("%%", "")) and not s.replace("%%", "").startswith("0"):
+        return "float"
+    elif re.match(r"(true|yes|是|\*|✓|✔|☑|✅|√|false|no|否|⍻|×)$", s, flags=re.IGNORECASE):
+        return "bool"
+    elif trans_datatime(s):
+        return "datetime"
+    return "text"
+
+
 def column_data_type(arr):
     arr = list(arr)
     counts = {"int": 0, "float": 0, "text": 0, "datetime": 0, "bool": 0}
     trans = {t: f for f, t in [(int, "int"), (float, "float"), (trans_datatime, "datetime"), (trans_bool, "bool"), (str, "text")]}
     float_flag = False
+    # Columns repeat their values a lot, each distinct one is typed and converted once.
+    types = {}
     for a in arr:
         if a is None:
             continue
-        if re.match(r"[+-]?[0-9]+$", str(a).replace("%%", "")) and not str(a).replace("%%", "").startswith("0"):
-            counts["int"] += 1
-            if int(str(a)) > 2**63 - 1:
-                float_flag = True
-                break
-        elif re.match(r"[+-]?[0-9.]{,19}$", str(a).replace("%%", "")) and not str(a).replace("%%", "").startswith("0"):
-            counts["float"] += 1
-        elif re.match(r"(true|yes|是|\*|✓|✔|☑|✅|√|false|no|否|⍻|×)$", str(a), flags=re.IGNORECASE):
-            counts["bool"] += 1
-        elif trans_datatime(str(a)):
-            counts["datetime"] += 1
-        else:
-            counts["text"] += 1
+        s = str(a)
+        if s not in types:
+            types[s] = _value_type(s)
+        if types[s] == "bigint":
+            float_flag = True
+            break
+        counts[types[s]] += 1
     if float_flag:
         ty = "float"
     else:
         counts = sorted(counts.items(), key=lambda x: x[1] * -1)
         ty = counts[0][0]
+    converted = {}
     for i in range(len(arr)):
         if arr[i] is None:
             continue
-        try:
-            arr[i] = trans[ty](str(arr[i]))
-        except Exception:
-            arr[i] = None
+        s = str(arr[i])
+        if s not in converted:
+            try:
+                converted[s] = trans[ty](s)
+            except Exception:
+                converted[s] = None
+        arr[i] = converted[s]
     # if ty == "text":
     #    if len(arr) > 128 and uni / len(arr) < 0.1:
     #        ty = "keyword"
     return arr, ty
 
 
+def _lines(txt):
+    """Lines of `txt` as `txt.split("\n")` would give them, without building the list."""
+    start = 0
+    while True:
+        end = txt.find("\n", start)
+        if end < 0:
+            yield txt[start:]
+            return
+        yield txt[start:end]
+        start = end + 1
+
+
 def chunk(filename, binary=None, from_page=0, to_page=10000000000, lang="Chinese", callback=None, **kwargs):
     """
     Excel and csv(txt) format files are supported.
@@ -326,11 +403,11 @@ def chunk(filename, binary=None, from_page=0, to_page=10000000000, lang="Chinese
     elif re.search(r"\.(txt|csv)$", filename, re.IGNORECASE):
         callback(0.1, "Start to parse.")
         txt = get_text(filename, binary)
-        lines = txt.split("\n")
+        lines = _lines(txt)
         fails = []
-        headers = lines[0].split(kwargs.get("delimiter", "\t"))
+        headers = next(lines).split(kwargs.get("delimiter", "\t"))
         rows = []
-        for i, line in enumerate(lines[1:]):
+        for i, line in enumerate(lines):
             if i < from_page:
                 continue
             if i >= to_page:
@@ -341,9 +418,9 @@ def chunk(filename, binary=None, from_page=0, to_page=10000000000, lang="Chinese
                 continue
             rows.append(row)
 
-        callback(0.3, ("Extract records: {}~{}".format(from_page, min(len(lines), to_page)) + (f"{len(fails)} failure, line: %s..." % (",".join(fails[:3])) if fails else "")))
+        callback(0.3, ("Extract records: {}~{}".format(from_page, min(txt.count("\n") + 1, to_page)) + (f"{len(fails)} failure, line: %s..." % (",".join(fails[:3])) if fails else "")))
 
-        dfs = [pd.DataFrame(np.array(rows), columns=headers)]
+        dfs = [pd.DataFrame(rows, columns=headers, dtype=str)]
 
     else:
         raise NotImplementedError("file type not supported yet(excel, text, csv supported)")
@@ -374,23 +451,31 @@ def chunk(filename, binary=None, from_page=0, to_page=10000000000, lang="Chinese
         clmns_map = [(py_clmns[i].lower() + fieds_map[clmn_tys[i]], str(clmns[i]).replace("_", " ")) for i in range(len(clmns))]
 
         eng = lang.lower() == "english"  # is_english(txts)
-        for ii, row in df.iterrows():
-            d = {"docnm_kwd": filename, "title_tks": rag_tokenizer.tokenize(re.sub(r"\.[a-zA-Z]+$", "", filename))}
+        title_tks = rag_tokenizer.tokenize(re.sub(r"\.[a-zA-Z]+$", "", filename))
+        ds, row_txts = [], []
+        columns = [df[c].tolist() for c in clmns]
+        # Text cells are tokenized a column at a time.
+        tokenized = [rag_tokenizer.tokenize_batch([v if isinstance(v, str) else "" for v in col]) if clmn_tys[j] == "text" else None for j, col in enumerate(columns)]
+        for ii in range(len(df)):
+            d = {"docnm_kwd": filename, "title_tks": title_tks}
             row_txt = []
             for j in range(len(clmns)):
-                if row[clmns[j]] is None:
+                v = columns[j][ii]
+                if v is None:
                     continue
-                if not str(row[clmns[j]]):
+                if not str(v):
                     continue
-                if not isinstance(row[clmns[j]], pd.Series) and pd.isna(row[clmns[j]]):
+                if pd.isna(v):
                     continue
                 fld = clmns_map[j][0]
-                d[fld] = row[clmns[j]] if clmn_tys[j] != "text" else rag_tokenizer.tokenize(row[clmns[j]])
-                row_txt.append("{}:{}".format(clmns[j], row[clmns[j]]))
+                d[fld] = v if clmn_tys[j] != "text" else tokenized[j][ii]
+                row_txt.append("{}:{}".format(clmns[j], v))
             if not row_txt:
                 continue
-            tokenize(d, "; ".join(row_txt), eng)
-            res.append(d)
+            ds.append(d)
+            row_txts.append("; ".join(row_txt))
+        tokenize_docs(ds, row_txts, eng)
+        res.extend(ds)
 
         KnowledgebaseService.update_parser_config(kwargs["kb_id"], {"field_map": {k: v for k, v in clmns_map}})
     callback(0.35, "")
@@ -56,6 +56,58 @@ class ProcessBase(ComponentBase):
         self.set_output("_elapsed_time", time.perf_counter() - self.output("_created_time"))
         return self.output()
 
+    def chunk_wise(self, upstream_id: str) -> bool:
+        """
+        Whether the component transforms each of the chunks output by `upstream_id` on its own,
+        whatever the other chunks. The pipeline may then stream it the chunks in batches.
+        """
+        return False
+
+    async def invoke_batch(self, **kwargs):
+        await self._invoke(**kwargs)
+
+    def merge_outputs(self, outputs: list[dict[str, Any]]) -> dict[str, Any]:
+        """The output of all the chunks at once, out of the outputs of their batches."""
+        merged = dict(outputs[-1])
+        merged["chunks"] = [ck for o in outputs for ck in o.get("chunks") or []]
+        return merged
+
+    async def invoke_stream(self, receive: trio.MemoryReceiveChannel, send: trio.MemorySendChannel):
+        """
+        `invoke` over every batch of chunks received, sending its output for the batch downstream.
+        The output is left as `invoke` would have set it on all the chunks at once.
+        """
+        created_time = time.perf_counter()
+        outputs = []
+        async with receive, send:
+            try:
+                with trio.fail_after(self._param.timeout):
+                    async for kwargs in receive:
+                        for k, v in kwargs.items():
+                            self.set_output(k, v)
+                        await self.invoke_batch(**kwargs)
+                        if self.error():
+                            break
+                        outputs.append(self.output())
+                        await send.send(outputs[-1])
+                    else:
+                        self.callback(1, "Done")
+            except trio.BrokenResourceError:
+                # a downstream component failed and reports it
+                pass
+            except Exception as e:
+                if self.get_exception_default_value():
+                    self.set_exception_default_value()
+                else:
+                    self.set_output("_ERROR", str(e))
+                logging.exception(e)
+                self.callback(-1, str(e))
+        if outputs and not self.error():
+            for k, v in self.merge_outputs(outputs).items():
+                self.set_output(k, v)
+        self.set_output("_created_time", created_time)
+        self.set_output("_elapsed_time", time.perf_counter() - created_time)
+
     @timeout(int(os.environ.get("COMPONENT_EXEC_TIMEOUT", 10 * 60)))
     async def _invoke(self, **kwargs):
         raise NotImplementedError()
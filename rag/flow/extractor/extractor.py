@@ -12,11 +12,22 @@
 #  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
+import logging
+import os
 import random
 from copy import deepcopy
+
+import trio
+import xxhash
+
 from agent.component.llm import LLMParam, LLM
+from graphrag.utils import chat_limiter, get_llm_cache, set_llm_cache
 from rag.flow.base import ProcessBase, ProcessParamBase
 
+# Attempts of a chunk after its first one, waiting EXTRACTOR_RETRY_BACKOFF seconds, then twice as long, and so on.
+EXTRACTOR_RETRIES = int(os.environ.get("EXTRACTOR_RETRIES", 2))
+EXTRACTOR_RETRY_BACKOFF = float(os.environ.get("EXTRACTOR_RETRY_BACKOFF", 1.0))
+
 
 class ExtractorParam(ProcessParamBase, LLMParam):
     def __init__(self):
@@ -30,6 +41,51 @@ class ExtractorParam(ProcessParamBase, LLMParam):
 
 class Extractor(ProcessBase, LLM):
     component_name = "Extractor"
+    # The batch of chunks to generate on, in place of the chunks input, when streamed by the pipeline.
+    _stream_chunks = None
+
+    def chunk_wise(self, upstream_id: str) -> bool:
+        # Generates on the chunks of the upstream one by one, and on no other list.
+        inputs = self.get_input_elements()
+        key = f"{upstream_id}@chunks"
+        return key in inputs and not any(isinstance(v["value"], list) for k, v in inputs.items() if k != key)
+
+    async def invoke_batch(self, **kwargs):
+        self._stream_chunks = kwargs["chunks"]
+        try:
+            await self._invoke(**kwargs)
+        finally:
+            self._stream_chunks = None
+
+    async def _generate_cached(self, msg: list[dict]) -> str:
+        # The rendered messages hold the prompt template filled with the chunk. Images are part of the key by digest.
+        gen_conf = self._param.gen_conf()
+        if self.imgs:
+            gen_conf = {**gen_conf, "images": xxhash.xxh64("\n".join(self.imgs).encode("utf-8")).hexdigest()}
+        cached = get_llm_cache(self.chat_mdl.llm_name, msg[0]["content"], msg[1:], gen_conf)
+        if cached:
+            return cached
+        for attempt in range(EXTRACTOR_RETRIES + 1):
+            try:
+                async with chat_limiter:
+                    ans = await trio.to_thread.run_sync(self._generate, msg)
+                if ans.find("**ERROR**") < 0:
+                    set_llm_cache(self.chat_mdl.llm_name, msg[0]["content"], ans, msg[1:], gen_conf)
+                    return ans
+                error = ans
+            except Exception as e:
+                if attempt == EXTRACTOR_RETRIES:
+                    raise
+                error = str(e)
+            if attempt == EXTRACTOR_RETRIES:
+                return ans
+            logging.warning(f"Extractor got error, retry {attempt + 1}/{EXTRACTOR_RETRIES}: {error}")
+            await trio.sleep(EXTRACTOR_RETRY_BACKOFF * 2 ** attempt)
+
+    def _messages(self, args):
+        msg, sys_prompt = self._sys_prompt_and_msg([], args)
+        msg.insert(0, {"role": "system", "content": sys_prompt})
+        return msg
 
     async def _invoke(self, **kwargs):
         self.set_output("output_format", "chunks")
@@ -41,23 +97,23 @@ class Extractor(ProcessBase, LLM):
         for k, v in inputs.items():
             args[k] = v["value"]
             if isinstance(args[k], list):
-                chunks = deepcopy(args[k])
+                chunks = deepcopy(args[k] if self._stream_chunks is None else self._stream_chunks)
                 chunks_key = k
 
         if chunks:
-            prog = 0
-            for i, ck in enumerate(chunks):
-                args[chunks_key] = ck["text"]
-                msg, sys_prompt = self._sys_prompt_and_msg([], args)
-                msg.insert(0, {"role": "system", "content": sys_prompt})
-                ck[self._param.field_name] = self._generate(msg)
-                prog += 1./len(chunks)
-                if i % (len(chunks)//100+1) == 1:
-                    self.callback(prog, f"{i+1} / {len(chunks)}")
-            self.set_output("chunks", chunks)
-        else:
-            msg, sys_prompt = self._sys_prompt_and_msg([], args)
-            msg.insert(0, {"role": "system", "content": sys_prompt})
-            self.set_output("chunks", [{self._param.field_name: self._generate(msg)}])
+            done = 0
 
+            async def extract(ck):
+                nonlocal done
+                ck[self._param.field_name] = await self._generate_cached(self._messages({**args, chunks_key: ck["text"]}))
+                done += 1
+                if done % (len(chunks)//100+1) == 1:
+                    self.callback(done / len(chunks), f"{done} / {len(chunks)}")
 
+            # Chunks are generated concurrently, each one writes its own answer so the order is kept.
+            async with trio.open_nursery() as nursery:
+                for ck in chunks:
+                    nursery.start_soon(extract, ck)
+            self.set_output("chunks", chunks)
+        else:
+            self.set_output("chunks", [{self._param.field_name: await self._generate_cached(self._messages(args))}])
@@ -16,6 +16,7 @@
 import datetime
 import json
 import logging
+import os
 import random
 from timeit import default_timer as timer
 import trio
@@ -24,12 +25,19 @@ from api.db.services.document_service import DocumentService
 from api.db.services.task_service import has_canceled, TaskService, CANVAS_DEBUG_DOC_ID
 from rag.utils.redis_conn import REDIS_CONN
 
+# Streams the chunks through consecutive chunk-wise components, in batches of PIPELINE_STREAM_BATCH chunks,
+# at most PIPELINE_STREAM_BUFFER of them waiting between two components. 0 runs every component on all the chunks.
+PIPELINE_STREAMING = int(os.environ.get("PIPELINE_STREAMING", 0))
+PIPELINE_STREAM_BATCH = int(os.environ.get("PIPELINE_STREAM_BATCH", 64))
+PIPELINE_STREAM_BUFFER = int(os.environ.get("PIPELINE_STREAM_BUFFER", 2))
+
 
 class Pipeline(Graph):
-    def __init__(self, dsl: str|dict, tenant_id=None, doc_id=None, task_id=None, flow_id=None):
+    def __init__(self, dsl: str|dict, tenant_id=None, doc_id=None, task_id=None, flow_id=None, streaming=None):
         if isinstance(dsl, dict):
             dsl = json.dumps(dsl, ensure_ascii=False)
         super().__init__(dsl, tenant_id, task_id)
+        self._streaming = bool(PIPELINE_STREAMING if streaming is None else streaming)
         if doc_id == CANVAS_DEBUG_DOC_ID:
             doc_id = None
         self._doc_id = doc_id
@@ -113,6 +121,53 @@ class Pipeline(Graph):
             logging.exception(e)
         return []
 
+    def _stream_stages(self, upstream, cpn_obj) -> list:
+        """
+        The consecutive chunk-wise components from `cpn_obj` on, to stream the chunks output by `upstream`.
+        A single one gains nothing over running it on all the chunks.
+        """
+        chunks = upstream.output("chunks")
+        if upstream.output("output_format") != "chunks" or not chunks or not isinstance(chunks, list):
+            return []
+        stages = []
+        while cpn_obj.chunk_wise(upstream._id):
+            stages.append(cpn_obj)
+            downstream = cpn_obj.get_downstream()
+            if len(downstream) != 1:
+                break
+            upstream, cpn_obj = cpn_obj, self.get_component_obj(downstream[0])
+        return stages if len(stages) > 1 else []
+
+    async def _stream(self, upstream, stages: list):
+        """
+        Runs the stages at once, passing them the chunks of `upstream` in batches through bounded channels.
+        A stage waits on its downstream when the channel is full, so the batches in memory are bounded and
+        the chunks come out of the last stage while the first one is still working on later ones.
+        """
+        head = upstream.output()
+        chunks = head["chunks"]
+
+        async def produce(send):
+            async with send:
+                for i in range(0, len(chunks), PIPELINE_STREAM_BATCH):
+                    try:
+                        await send.send({**head, "chunks": chunks[i : i + PIPELINE_STREAM_BATCH]})
+                    except trio.BrokenResourceError:
+                        return
+
+        async def drain(receive):
+            async with receive:
+                async for _ in receive:
+                    pass
+
+        async with trio.open_nursery() as nursery:
+            send, receive = trio.open_memory_channel(PIPELINE_STREAM_BUFFER)
+            nursery.start_soon(produce, send)
+            for cpn_obj in stages:
+                send, next_receive = trio.open_memory_channel(PIPELINE_STREAM_BUFFER)
+                nursery.start_soon(cpn_obj.invoke_stream, receive, send)
+                receive = next_receive
+            nursery.start_soon(drain, receive)
 
     async def run(self, **kwargs):
         log_key = f"{self._flow_id}-{self.task_id}-logs"
@@ -144,23 +199,32 @@ class Pipeline(Graph):
             last_cpn = self.get_component_obj(self.path[idx - 1])
             cpn_obj = self.get_component_obj(self.path[idx])
 
-            async def invoke():
-                nonlocal last_cpn, cpn_obj
-                await cpn_obj.invoke(**last_cpn.output())
-                #if inspect.iscoroutinefunction(cpn_obj.invoke):
-                #    await cpn_obj.invoke(**last_cpn.output())
-                #else:
-                #    cpn_obj.invoke(**last_cpn.output())
-
-            async with trio.open_nursery() as nursery:
-                nursery.start_soon(invoke)
-
-            if cpn_obj.error():
-                self.error = "[ERROR]" + cpn_obj.error()
-                self.callback(cpn_obj._id, -1, self.error)
-                break
-            idx += 1
-            self.path.extend(cpn_obj.get_downstream())
+            stages = []
+            if self._streaming and idx == len(self.path) - 1:
+                stages = self._stream_stages(last_cpn, cpn_obj)
+            if stages:
+                await self._stream(last_cpn, stages)
+            else:
+                stages = [cpn_obj]
+
+                async def invoke():
+                    nonlocal last_cpn, cpn_obj
+                    await cpn_obj.invoke(**last_cpn.output())
+                    #if inspect.iscoroutinefunction(cpn_obj.invoke):
+                    #    await cpn_obj.invoke(**last_cpn.output())
+                    #else:
+                    #    cpn_obj.invoke(**last_cpn.output())
+
+                async with trio.open_nursery() as nursery:
+                    nursery.start_soon(invoke)
+
+            for cpn_obj in stages:
+                if cpn_obj.error():
+                    self.error = "[ERROR]" + cpn_obj.error()
+                    self.callback(cpn_obj._id, -1, self.error)
+                    break
+                idx += 1
+                self.path.extend(cpn_obj.get_downstream())
 
         self.callback("END", 1 if not self.error else -1, json.dumps(self.get_component_obj(self.path[-1]).output(), ensure_ascii=False))
 
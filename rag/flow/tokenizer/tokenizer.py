@@ -49,6 +49,24 @@ class TokenizerParam(ProcessParamBase):
 
 class Tokenizer(ProcessBase):
     component_name = "Tokenizer"
+    # The embeddings of the titles, kept over the batches of chunks when streamed by the pipeline.
+    _title_vectors = None
+
+    def chunk_wise(self, upstream_id: str) -> bool:
+        return True
+
+    async def invoke_stream(self, receive, send):
+        self._title_vectors = {}
+        try:
+            await super().invoke_stream(receive, send)
+        finally:
+            self._title_vectors = None
+
+    def merge_outputs(self, outputs):
+        merged = super().merge_outputs(outputs)
+        if "embedding_token_consumption" in merged:
+            merged["embedding_token_consumption"] = sum(o.get("embedding_token_consumption") or 0 for o in outputs)
+        return merged
 
     async def _embedding(self, name, chunks):
         parts = sum(["full_text" in self._param.search_method, "embedding" in self._param.search_method])
@@ -72,9 +90,12 @@ class Tokenizer(ProcessBase):
                 elif isinstance(f, list):
                     txt += "\n".join(f)
             texts.append(re.sub(r"</?(table|td|caption|tr|th)( [^<>]{0,12})?>", " ", txt))
-        vts, c = embedding_model.encode([name])
-        token_count += c
-        tts = np.concatenate([vts[0] for _ in range(len(texts))], axis=0)
+        title_vectors = self._title_vectors if self._title_vectors is not None else {}
+        if name not in title_vectors:
+            vts, c = embedding_model.encode([name])
+            token_count += c
+            title_vectors[name] = vts[0]
+        tts = np.concatenate([title_vectors[name] for _ in range(len(texts))], axis=0)
 
         @timeout(60)
         def batch_encode(txts):
@@ -34,6 +34,7 @@ from strenum import StrEnum
 from zhipuai import ZhipuAI
 
 from rag.llm import FACTORY_DEFAULT_BASE_URL, LITELLM_PROVIDER_PREFIX, SupportedLiteLLMProvider
+from rag.llm.client_pool import shared_client
 from rag.nlp import is_chinese, is_english
 from common.token_utils import num_tokens_from_string, total_token_count_from_response
 
@@ -67,7 +68,7 @@ LENGTH_NOTIFICATION_EN = "...\nThe answer is truncated by your chosen LLM due to
 class Base(ABC):
     def __init__(self, key, model_name, base_url, **kwargs):
         timeout = int(os.environ.get("LM_TIMEOUT_SECONDS", 600))
-        self.client = OpenAI(api_key=key, base_url=base_url, timeout=timeout)
+        self.client = shared_client(OpenAI, api_key=key, base_url=base_url, timeout=timeout)
         self.model_name = model_name
         # Configure retry parameters
         self.max_retries = kwargs.get("max_retries", int(os.environ.get("LLM_MAX_RETRIES", 5)))
@@ -555,7 +556,7 @@ class AzureChat(Base):
         api_key = json.loads(key).get("api_key", "")
         api_version = json.loads(key).get("api_version", "2024-02-01")
         super().__init__(key, model_name, base_url, **kwargs)
-        self.client = AzureOpenAI(api_key=api_key, azure_endpoint=base_url, api_version=api_version)
+        self.client = shared_client(AzureOpenAI, api_key=api_key, azure_endpoint=base_url, api_version=api_version)
         self.model_name = model_name
 
     @property
@@ -711,7 +712,7 @@ class LocalAIChat(Base):
         if not base_url:
             raise ValueError("Local llm url cannot be None")
         base_url = urljoin(base_url, "v1")
-        self.client = OpenAI(api_key="empty", base_url=base_url)
+        self.client = shared_client(OpenAI, api_key="empty", base_url=base_url)
         self.model_name = model_name.split("___")[0]
 
 
@@ -919,7 +920,7 @@ class LmStudioChat(Base):
             raise ValueError("Local llm url cannot be None")
         base_url = urljoin(base_url, "v1")
         super().__init__(key, model_name, base_url, **kwargs)
-        self.client = OpenAI(api_key="lm-studio", base_url=base_url)
+        self.client = shared_client(OpenAI, api_key="lm-studio", base_url=base_url)
         self.model_name = model_name
 
 
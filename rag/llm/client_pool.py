@@ -0,0 +1,56 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Process-wide pool of provider SDK clients.
+
+A model wrapper is built for every LLMBundle, i.e. several times per request.
+Its SDK client owns an HTTP connection pool, so building a fresh one per
+wrapper throws away keep-alive connections and pays TLS handshakes again.
+Clients are thread safe and carry no per-request state, so wrappers with the
+same client class and arguments (api key, base url, timeout...) share one.
+"""
+
+import os
+import threading
+
+from cachetools import LRUCache
+
+PROVIDER_CLIENT_POOL_SIZE = int(os.environ.get("PROVIDER_CLIENT_POOL_SIZE", 256))
+
+_clients = LRUCache(maxsize=PROVIDER_CLIENT_POOL_SIZE)
+_lock = threading.Lock()
+
+
+def shared_client(client_cls, **kwargs):
+    """Return the pooled `client_cls(**kwargs)`, building it on first use. Unhashable arguments bypass the pool."""
+    try:
+        key = (client_cls, tuple(sorted(kwargs.items())))
+        hash(key)
+    except TypeError:
+        return client_cls(**kwargs)
+    with _lock:
+        client = _clients.get(key)
+    if client is not None:
+        return client
+    client = client_cls(**kwargs)
+    with _lock:
+        # Keep the first one built if two threads raced, the other is dropped with its idle pool.
+        return _clients.setdefault(key, client)
+
+
+def clear_clients():
+    with _lock:
+        _clients.clear()
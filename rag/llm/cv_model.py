@@ -34,6 +34,7 @@ from zhipuai import ZhipuAI
 from common.token_utils import num_tokens_from_string, total_token_count_from_response
 from rag.nlp import is_english
 from rag.prompts.generator import vision_llm_describe_prompt
+from rag.llm.client_pool import shared_client
 
 
 class Base(ABC):
@@ -190,7 +191,7 @@ class GptV4(Base):
         if not base_url:
             base_url = "https://api.openai.com/v1"
         self.api_key = key
-        self.client = OpenAI(api_key=key, base_url=base_url)
+        self.client = shared_client(OpenAI, api_key=key, base_url=base_url)
         self.model_name = model_name
         self.lang = lang
         super().__init__(**kwargs)
@@ -220,7 +221,7 @@ class AzureGptV4(GptV4):
     def __init__(self, key, model_name, lang="Chinese", **kwargs):
         api_key = json.loads(key).get("api_key", "")
         api_version = json.loads(key).get("api_version", "2024-02-01")
-        self.client = AzureOpenAI(api_key=api_key, azure_endpoint=kwargs["base_url"], api_version=api_version)
+        self.client = shared_client(AzureOpenAI, api_key=api_key, azure_endpoint=kwargs["base_url"], api_version=api_version)
         self.model_name = model_name
         self.lang = lang
         Base.__init__(self, **kwargs)
@@ -411,7 +412,7 @@ class StepFunCV(GptV4):
     def __init__(self, key, model_name="step-1v-8k", lang="Chinese", base_url="https://api.stepfun.com/v1", **kwargs):
         if not base_url:
             base_url = "https://api.stepfun.com/v1"
-        self.client = OpenAI(api_key=key, base_url=base_url)
+        self.client = shared_client(OpenAI, api_key=key, base_url=base_url)
         self.model_name = model_name
         self.lang = lang
         Base.__init__(self, **kwargs)
@@ -424,7 +425,7 @@ class VolcEngineCV(GptV4):
         if not base_url:
             base_url = "https://ark.cn-beijing.volces.com/api/v3"
         ark_api_key = json.loads(key).get("ark_api_key", "")
-        self.client = OpenAI(api_key=ark_api_key, base_url=base_url)
+        self.client = shared_client(OpenAI, api_key=ark_api_key, base_url=base_url)
         self.model_name = json.loads(key).get("ep_id", "") + json.loads(key).get("endpoint_id", "")
         self.lang = lang
         Base.__init__(self, **kwargs)
@@ -437,7 +438,7 @@ class LmStudioCV(GptV4):
         if not base_url:
             raise ValueError("Local llm url cannot be None")
         base_url = urljoin(base_url, "v1")
-        self.client = OpenAI(api_key="lm-studio", base_url=base_url)
+        self.client = shared_client(OpenAI, api_key="lm-studio", base_url=base_url)
         self.model_name = model_name
         self.lang = lang
         Base.__init__(self, **kwargs)
@@ -450,7 +451,7 @@ class OpenAI_APICV(GptV4):
         if not base_url:
             raise ValueError("url cannot be None")
         base_url = urljoin(base_url, "v1")
-        self.client = OpenAI(api_key=key, base_url=base_url)
+        self.client = shared_client(OpenAI, api_key=key, base_url=base_url)
         self.model_name = model_name.split("___")[0]
         self.lang = lang
         Base.__init__(self, **kwargs)
@@ -490,7 +491,7 @@ class OpenRouterCV(GptV4):
         if not base_url:
             base_url = "https://openrouter.ai/api/v1"
         api_key = json.loads(key).get("api_key", "")
-        self.client = OpenAI(api_key=api_key, base_url=base_url)
+        self.client = shared_client(OpenAI, api_key=api_key, base_url=base_url)
         self.model_name = model_name
         self.lang = lang
         Base.__init__(self, **kwargs)
@@ -521,7 +522,7 @@ class LocalAICV(GptV4):
         if not base_url:
             raise ValueError("Local cv model url cannot be None")
         base_url = urljoin(base_url, "v1")
-        self.client = OpenAI(api_key="empty", base_url=base_url)
+        self.client = shared_client(OpenAI, api_key="empty", base_url=base_url)
         self.model_name = model_name.split("___")[0]
         self.lang = lang
         Base.__init__(self, **kwargs)
@@ -532,7 +533,7 @@ class XinferenceCV(GptV4):
 
     def __init__(self, key, model_name="", lang="Chinese", base_url="", **kwargs):
         base_url = urljoin(base_url, "v1")
-        self.client = OpenAI(api_key=key, base_url=base_url)
+        self.client = shared_client(OpenAI, api_key=key, base_url=base_url)
         self.model_name = model_name
         self.lang = lang
         Base.__init__(self, **kwargs)
@@ -545,7 +546,7 @@ class GPUStackCV(GptV4):
         if not base_url:
             raise ValueError("Local llm url cannot be None")
         base_url = urljoin(base_url, "v1")
-        self.client = OpenAI(api_key=key, base_url=base_url)
+        self.client = shared_client(OpenAI, api_key=key, base_url=base_url)
         self.model_name = model_name
         self.lang = lang
         Base.__init__(self, **kwargs)
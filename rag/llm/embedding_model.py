@@ -30,6 +30,8 @@ from zhipuai import ZhipuAI
 from common.log_utils import log_exception
 from common.token_utils import num_tokens_from_string, truncate
 from common import settings
+from rag.utils.embedding_batcher import encode_batches_sync
+from rag.llm.client_pool import shared_client
 import logging
 import base64
 
@@ -84,16 +86,7 @@ class BuiltinEmbed(Base):
     def encode(self, texts: list):
         batch_size = 16
         # TEI is able to auto truncate inputs according to https://github.com/huggingface/text-embeddings-inference.
-        token_count = 0
-        ress = None
-        for i in range(0, len(texts), batch_size):
-            embeddings, token_count_delta = self._model.encode(texts[i : i + batch_size])
-            token_count += token_count_delta
-            if ress is None:
-                ress = embeddings
-            else:
-                ress = np.concatenate((ress, embeddings), axis=0)
-        return ress, token_count
+        return encode_batches_sync(texts, self._model.encode, batch_size)
 
     def encode_queries(self, text: str):
         return self._model.encode_queries(text)
@@ -105,7 +98,7 @@ class OpenAIEmbed(Base):
     def __init__(self, key, model_name="text-embedding-ada-002", base_url="https://api.openai.com/v1"):
         if not base_url:
             base_url = "https://api.openai.com/v1"
-        self.client = OpenAI(api_key=key, base_url=base_url)
+        self.client = shared_client(OpenAI, api_key=key, base_url=base_url)
         self.model_name = model_name
 
     def encode(self, texts: list):
@@ -135,7 +128,7 @@ class LocalAIEmbed(Base):
         if not base_url:
             raise ValueError("Local embedding model url cannot be None")
         base_url = urljoin(base_url, "v1")
-        self.client = OpenAI(api_key="empty", base_url=base_url)
+        self.client = shared_client(OpenAI, api_key="empty", base_url=base_url)
         self.model_name = model_name.split("___")[0]
 
     def encode(self, texts: list):
@@ -163,7 +156,7 @@ class AzureEmbed(OpenAIEmbed):
 
         api_key = json.loads(key).get("api_key", "")
         api_version = json.loads(key).get("api_version", "2024-02-01")
-        self.client = AzureOpenAI(api_key=api_key, azure_endpoint=kwargs["base_url"], api_version=api_version)
+        self.client = shared_client(AzureOpenAI, api_key=api_key, azure_endpoint=kwargs["base_url"], api_version=api_version)
         self.model_name = model_name
 
 
@@ -300,7 +293,7 @@ class XinferenceEmbed(Base):
 
     def __init__(self, key, model_name="", base_url=""):
         base_url = urljoin(base_url, "v1")
-        self.client = OpenAI(api_key=key, base_url=base_url)
+        self.client = shared_client(OpenAI, api_key=key, base_url=base_url)
         self.model_name = model_name
 
     def encode(self, texts: list):
@@ -608,7 +601,7 @@ class LmStudioEmbed(LocalAIEmbed):
         if not base_url:
             raise ValueError("Local llm url cannot be None")
         base_url = urljoin(base_url, "v1")
-        self.client = OpenAI(api_key="lm-studio", base_url=base_url)
+        self.client = shared_client(OpenAI, api_key="lm-studio", base_url=base_url)
         self.model_name = model_name
 
 
@@ -619,7 +612,7 @@ class OpenAI_APIEmbed(OpenAIEmbed):
         if not base_url:
             raise ValueError("url cannot be None")
         base_url = urljoin(base_url, "v1")
-        self.client = OpenAI(api_key=key, base_url=base_url)
+        self.client = shared_client(OpenAI, api_key=key, base_url=base_url)
         self.model_name = model_name.split("___")[0]
 
 
@@ -877,7 +870,7 @@ class GPUStackEmbed(OpenAIEmbed):
             raise ValueError("url cannot be None")
         base_url = urljoin(base_url, "v1")
 
-        self.client = OpenAI(api_key=key, base_url=base_url)
+        self.client = shared_client(OpenAI, api_key=key, base_url=base_url)
         self.model_name = model_name
 
 
@@ -271,8 +271,19 @@ def tokenize(d, txt, eng):
     d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
 
 
+def tokenize_docs(ds, txts, eng):
+    """Same as `tokenize` for every (d, txt) pair, in one batched pass over the tokenizer."""
+    ts = [re.sub(r"</?(table|td|caption|tr|th)( [^<>]{0,12})?>", " ", txt) for txt in txts]
+    ltks = rag_tokenizer.tokenize_batch(ts)
+    sm_ltks = rag_tokenizer.fine_grained_tokenize_batch(ltks)
+    for d, txt, lt, sm in zip(ds, txts, ltks, sm_ltks):
+        d["content_with_weight"] = txt
+        d["content_ltks"] = lt
+        d["content_sm_ltks"] = sm
+
+
 def tokenize_chunks(chunks, doc, eng, pdf_parser=None, child_delimiters_pattern=None):
-    res = []
+    res, txts = [], []
     # wrap up as es documents
     for ii, ck in enumerate(chunks):
         if len(ck.strip()) == 0:
@@ -292,18 +303,18 @@ def tokenize_chunks(chunks, doc, eng, pdf_parser=None, child_delimiters_pattern=
         if child_delimiters_pattern:
             d["mom_with_weight"] = ck
             for txt in re.split(r"(%s)" % child_delimiters_pattern, ck, flags=re.DOTALL):
-                dd = copy.deepcopy(d)
-                tokenize(dd, txt, eng)
-                res.append(dd)
+                res.append(copy.deepcopy(d))
+                txts.append(txt)
             continue
 
-        tokenize(d, ck, eng)
         res.append(d)
+        txts.append(ck)
+    tokenize_docs(res, txts, eng)
     return res
 
 
 def tokenize_chunks_with_images(chunks, doc, eng, images, child_delimiters_pattern=None):
-    res = []
+    res, txts = [], []
     # wrap up as es documents
     for ii, (ck, image) in enumerate(zip(chunks, images)):
         if len(ck.strip()) == 0:
@@ -315,25 +326,24 @@ def tokenize_chunks_with_images(chunks, doc, eng, images, child_delimiters_patte
         if child_delimiters_pattern:
             d["mom_with_weight"] = ck
             for txt in re.split(r"(%s)" % child_delimiters_pattern, ck, flags=re.DOTALL):
-                dd = copy.deepcopy(d)
-                tokenize(dd, txt, eng)
-                res.append(dd)
+                res.append(copy.deepcopy(d))
+                txts.append(txt)
             continue
-        tokenize(d, ck, eng)
         res.append(d)
+        txts.append(ck)
+    tokenize_docs(res, txts, eng)
     return res
 
 
 def tokenize_table(tbls, doc, eng, batch_size=10):
-    res = []
+    res, txts = [], []
     # add tables
     for (img, rows), poss in tbls:
         if not rows:
             continue
         if isinstance(rows, str):
             d = copy.deepcopy(doc)
-            tokenize(d, rows, eng)
-            d["content_with_weight"] = rows
+            txts.append(rows)
             d["doc_type_kwd"] = "table"
             if img:
                 d["image"] = img
@@ -345,14 +355,14 @@ def tokenize_table(tbls, doc, eng, batch_size=10):
         de = "; " if eng else "； "
         for i in range(0, len(rows), batch_size):
             d = copy.deepcopy(doc)
-            r = de.join(rows[i:i + batch_size])
-            tokenize(d, r, eng)
+            txts.append(de.join(rows[i:i + batch_size]))
             d["doc_type_kwd"] = "table"
             if img:
                 d["image"] = img
                 d["doc_type_kwd"] = "image"
             add_positions(d, poss)
             res.append(d)
+    tokenize_docs(res, txts, eng)
     return res
 
 
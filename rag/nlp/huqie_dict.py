@@ -0,0 +1,258 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Compiled, memory-mapped segmentation dictionary for RagTokenizer.
+
+The file holds every word (lower case), every word reversed behind a "DD"
+marker, and every character-boundary prefix of both. All of them live in an
+open-addressing hash table over flat arrays. A lookup, a membership test or a
+prefix test is one hash probe. The file is mapped read-only, so processes
+on a host share it through the page cache instead of each holding a trie.
+
+Build it once with:
+
+    python rag/nlp/huqie_dict.py [<huqie.txt or huqie.txt.trie> [<output>]]
+"""
+
+import json
+import logging
+import math
+import mmap
+import os
+import sys
+
+import numpy as np
+import xxhash
+
+MAGIC = b"HUQIEDC1"
+DENOMINATOR = 1000000
+# Flags of an entry; an entry without flags is only a prefix of longer keys.
+FLAG_WORD = 1
+FLAG_REVERSED = 2
+_ALIGN = 8
+
+
+def _hash(kb: bytes) -> int:
+    return xxhash.xxh64_intdigest(kb)
+
+
+class HuqieDict:
+    """
+    Read-only dictionary with the subset of the datrie.Trie interface used by RagTokenizer.
+    Keys are plain lower case words, and "DD" + reversed word for suffix tests.
+    Words added at runtime, e.g. from a user dictionary, are kept in a small in-memory overlay.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a compiled huqie dictionary.")
+        hlen = int.from_bytes(self._mm[len(MAGIC):len(MAGIC) + 4], "little")
+        header = json.loads(self._mm[len(MAGIC) + 4:len(MAGIC) + 4 + hlen].decode("utf-8"))
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError(f"{path} was built for a {header['byteorder']} endian host.")
+        mv = memoryview(self._mm)
+        sections = header["sections"]
+
+        def section(name, fmt):
+            start, size = sections[name]
+            return mv[start:start + size].cast(fmt)
+
+        self._offsets = section("offsets", "I")
+        self._freqs = section("freqs", "h")
+        self._tag_ids = section("tags", "H")
+        self._flags = section("flags", "B")
+        self._slots = section("slots", "I")
+        self._blob = sections["blob"][0]
+        self._mask = len(self._slots) - 1
+        self._tags = header["tags"]
+        self.size = header["entries"]
+        self._extra = {}
+        self._extra_prefixes = set()
+
+    def _find(self, key: str) -> int:
+        kb = key.encode("utf-8")
+        slots, offsets, mm, blob, mask = self._slots, self._offsets, self._mm, self._blob, self._mask
+        h = _hash(kb) & mask
+        while True:
+            e = slots[h]
+            if not e:
+                return -1
+            e -= 1
+            if mm[blob + offsets[e]:blob + offsets[e + 1]] == kb:
+                return e
+            h = (h + 1) & mask
+
+    def __contains__(self, key: str) -> bool:
+        if key in self._extra:
+            return True
+        e = self._find(key)
+        return e >= 0 and self._flags[e] != 0
+
+    def __getitem__(self, key: str):
+        if key in self._extra:
+            return self._extra[key]
+        e = self._find(key)
+        if e < 0 or not self._flags[e]:
+            raise KeyError(key)
+        if not self._flags[e] & FLAG_WORD:
+            return 1
+        return self._freqs[e], self._tags[self._tag_ids[e]]
+
+    def __setitem__(self, key: str, value):
+        self._extra[key] = value
+        for i in range(1, len(key) + 1):
+            self._extra_prefixes.add(key[:i])
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def has_keys_with_prefix(self, prefix: str) -> bool:
+        """Whether some key starts with `prefix`. Only prefixes ending on a character boundary are indexed."""
+        return prefix in self._extra_prefixes or self._find(prefix) >= 0
+
+    def close(self):
+        self._mm.close()
+
+
+def _aligned(n: int) -> int:
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def build(words: dict[str, tuple[int, str]], path: str):
+    """
+    Write the compiled dictionary of `words`, a mapping from a lower case word to (log frequency, tag),
+    to `path`. The file is written aside and renamed, so readers never see a partial file.
+    """
+    index = {}
+    keys, freqs, tag_ids, flags = [], [], [], []
+    tags = {}
+
+    def entry(k):
+        if k not in index:
+            index[k] = len(keys)
+            keys.append(k.encode("utf-8"))
+            freqs.append(0)
+            tag_ids.append(0)
+            flags.append(0)
+        return index[k]
+
+    for w, (F, tg) in words.items():
+        for i in range(1, len(w) + 1):
+            entry(w[:i])
+        e = index[w]
+        flags[e] |= FLAG_WORD
+        freqs[e] = F
+        tag_ids[e] = tags.setdefault(tg, len(tags))
+        r = "DD" + w[::-1]
+        for i in range(1, len(r) + 1):
+            entry(r[:i])
+        flags[index[r]] |= FLAG_REVERSED
+    assert len(tags) < 65536, "Too many distinct tags."
+
+    n = len(keys)
+    offsets = np.zeros(n + 1, dtype=np.uint32)
+    offsets[1:] = np.cumsum([len(k) for k in keys])
+    slots = np.zeros(1 << max(4, math.ceil(math.log2(max(n, 1) * 2))), dtype=np.uint32)
+    mask = len(slots) - 1
+    for e, kb in enumerate(keys):
+        h = _hash(kb) & mask
+        while slots[h]:
+            h = (h + 1) & mask
+        slots[h] = e + 1
+
+    arrays = [
+        ("offsets", offsets.tobytes()),
+        ("freqs", np.asarray(freqs, dtype=np.int16).tobytes()),
+        ("tags", np.asarray(tag_ids, dtype=np.uint16).tobytes()),
+        ("flags", np.asarray(flags, dtype=np.uint8).tobytes()),
+        ("slots", slots.tobytes()),
+        ("blob", b"".join(keys)),
+    ]
+    header = {"entries": n, "byteorder": sys.byteorder, "tags": [t for t, _ in sorted(tags.items(), key=lambda x: x[1])],
+              "sections": {}}
+    # The header holds the section offsets, which depend on the header length: reserve room for them first.
+    hlen = len(json.dumps(header).encode("utf-8")) + 64 * len(arrays) + 64
+    pos = _aligned(len(MAGIC) + 4 + hlen)
+    for name, data in arrays:
+        header["sections"][name] = [pos, len(data)]
+        pos = _aligned(pos + len(data))
+    hbin = json.dumps(header).encode("utf-8")
+    assert len(hbin) <= hlen
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(hbin).to_bytes(4, "little"))
+        f.write(hbin)
+        for name, data in arrays:
+            f.seek(header["sections"][name][0])
+            f.write(data)
+    os.replace(tmp, path)
+    logging.info(f"[HUQIE]:Compiled {len(words)} words into {n} entries at {path}")
+
+
+def words_from_text(fnm: str) -> dict[str, tuple[int, str]]:
+    """Read a `word frequency tag` dictionary file, keeping the highest frequency of a repeated word."""
+    words = {}
+    with open(fnm, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\r\n").split()
+            if len(line) < 3:
+                continue
+            w = line[0].lower()
+            F = int(math.log(float(line[1]) / DENOMINATOR) + 0.5)
+            if w not in words or words[w][0] < F:
+                words[w] = (F, line[2])
+    return words
+
+
+def words_from_trie(trie) -> dict[str, tuple[int, str]]:
+    """Recover the words of a datrie built by RagTokenizer, whose keys are escaped UTF-8 byte strings."""
+    words = {}
+    for k, v in trie.items():
+        if k.startswith("DD") or not isinstance(v, tuple):
+            continue
+        w = k.encode("latin-1").decode("unicode_escape").encode("latin-1").decode("utf-8")
+        words[w] = (int(v[0]), v[1])
+    return words
+
+
+def default_path(dict_prefix: str) -> str:
+    return dict_prefix + ".txt.dict"
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+    from common.file_utils import get_project_base_directory
+
+    prefix = os.path.join(get_project_base_directory(), "rag/res", "huqie")
+    src = sys.argv[1] if len(sys.argv) > 1 else (prefix + ".txt" if os.path.exists(prefix + ".txt") else prefix + ".txt.trie")
+    dst = sys.argv[2] if len(sys.argv) > 2 else default_path(prefix)
+    if src.endswith(".trie"):
+        import datrie
+
+        src_words = words_from_trie(datrie.Trie.load(src))
+    else:
+        src_words = words_from_text(src)
+    build(src_words, dst)
+    print(f"{len(src_words)} words compiled into {dst} ({os.path.getsize(dst) / 1024 / 1024:.1f} MB)")
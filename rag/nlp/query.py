@@ -19,6 +19,8 @@ import json
 import re
 from collections import defaultdict
 
+import numpy as np
+
 from rag.utils.doc_store_conn import MatchTextExpr
 from rag.nlp import rag_tokenizer, term_weight, synonym
 
@@ -218,28 +220,48 @@ class FulltextQueryer:
         return None, keywords
 
     def hybrid_similarity(self, avec, bvecs, atks, btkss, tkweight=0.3, vtweight=0.7):
-        from sklearn.metrics.pairwise import cosine_similarity
-        import numpy as np
-
-        sims = cosine_similarity([avec], bvecs)
+        sims = self.vector_similarity(avec, bvecs)
         tksim = self.token_similarity(atks, btkss)
-        if np.sum(sims[0]) == 0:
-            return np.array(tksim), tksim, sims[0]
-        return np.array(sims[0]) * vtweight + np.array(tksim) * tkweight, tksim, sims[0]
+        if np.sum(sims) == 0:
+            return np.array(tksim), tksim, sims
+        return sims * vtweight + np.array(tksim) * tkweight, tksim, sims
+
+    @staticmethod
+    def vector_similarity(avec, bvecs):
+        """Cosine similarity between one vector and each row of `bvecs`, zero vectors score 0."""
+        avec = np.asarray(avec, dtype=np.float32).reshape(-1)
+        bvecs = np.asarray(bvecs, dtype=np.float32)
+        if bvecs.ndim == 1:
+            bvecs = bvecs.reshape(1, -1)
+        anorm = np.linalg.norm(avec)
+        bnorms = np.linalg.norm(bvecs, axis=1)
+        dots = bvecs @ avec
+        denom = anorm * bnorms
+        return np.divide(dots, denom, out=np.zeros_like(dots), where=denom > 0).astype(np.float64)
 
     def token_similarity(self, atks, btkss):
-        def to_dict(tks):
+        if isinstance(atks, str):
+            atks = atks.split()
+        qtwt = defaultdict(int)
+        for t, c in self.tw.weights(atks, preprocess=False):
+            qtwt[t] += c
+        if not btkss:
+            return []
+        # Only the presence of query terms in a chunk matters to `similarity`, so a sparse
+        # chunk x query-term incidence matrix times the query weights gives all scores at once.
+        vocab = {t: i for i, t in enumerate(qtwt.keys())}
+        qw = np.array(list(qtwt.values()), dtype=np.float64)
+        rows, cols = [], []
+        for r, tks in enumerate(btkss):
             if isinstance(tks, str):
                 tks = tks.split()
-            d = defaultdict(int)
-            wts = self.tw.weights(tks, preprocess=False)
-            for i, (t, c) in enumerate(wts):
-                d[t] += c
-            return d
-
-        atks = to_dict(atks)
-        btkss = [to_dict(tks) for tks in btkss]
-        return [self.similarity(atks, btks) for btks in btkss]
+            for t in set(tks):
+                c = vocab.get(t)
+                if c is not None:
+                    rows.append(r)
+                    cols.append(c)
+        s = np.bincount(np.array(rows, dtype=np.int64), weights=qw[np.array(cols, dtype=np.int64)], minlength=len(btkss))
+        return ((s + 1e-9) / (np.sum(qw) + 1e-9)).tolist()
 
     def similarity(self, qtwt, dtwt):
         if isinstance(dtwt, type("")):
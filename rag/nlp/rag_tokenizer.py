@@ -17,25 +17,49 @@
 import logging
 import copy
 import datrie
+import fcntl
 import math
 import os
 import re
 import string
 import sys
+from functools import lru_cache
 from hanziconv import HanziConv
 from nltk import word_tokenize
 from nltk.stem import PorterStemmer, WordNetLemmatizer
 from common.file_utils import get_project_base_directory
 from common import settings
+from rag.nlp import huqie_dict
+from rag.nlp.huqie_dict import HuqieDict
+
+# Entries kept by each memo of the tokenizer: English words, Chinese segments and fine-grained tokens.
+TOKENIZER_CACHE_SIZE = int(os.environ.get("TOKENIZER_CACHE_SIZE", 65536))
+# Whole lines up to this length are memoized as well, e.g. titles, keywords and query terms.
+TOKENIZER_MEMO_LINE_LEN = int(os.environ.get("TOKENIZER_MEMO_LINE_LEN", 256))
+# Compile the loaded trie into rag/res/huqie.txt.dict on first start, see rag/nlp/huqie_dict.py.
+HUQIE_COMPILE = int(os.environ.get("HUQIE_COMPILE", "0"))
+
+# Full-width ASCII variants and the ideographic space map to their half-width counterparts.
+Q2B_TABLE = {c: c - 0xFEE0 for c in range(0xFF00, 0xFF5F)}
+Q2B_TABLE[0x3000] = 0x0020
 
 
 class RagTokenizer:
     def key_(self, line):
+        if self._plain_keys:
+            return line.lower()
         return str(line.lower().encode("utf-8"))[2:-1]
 
     def rkey_(self, line):
+        if self._plain_keys:
+            return "DD" + line[::-1].lower()
         return str(("DD" + (line[::-1].lower())).encode("utf-8"))[2:-1]
 
+    def _set_trie(self, trie):
+        # A datrie only takes printable keys, so its keys are escaped UTF-8; the compiled dictionary takes plain text.
+        self.trie_ = trie
+        self._plain_keys = isinstance(trie, HuqieDict)
+
     def _load_dict(self, fnm):
         logging.info(f"[HUQIE]:Build trie from {fnm}")
         try:
@@ -52,10 +76,11 @@ class RagTokenizer:
                     self.trie_[self.key_(line[0])] = (F, line[2])
                 self.trie_[self.rkey_(line[0])] = 1
 
-            dict_file_cache = fnm + ".trie"
-            logging.info(f"[HUQIE]:Build trie cache to {dict_file_cache}")
-            self.trie_.save(dict_file_cache)
             of.close()
+            if isinstance(self.trie_, datrie.Trie):
+                dict_file_cache = fnm + ".trie"
+                logging.info(f"[HUQIE]:Build trie cache to {dict_file_cache}")
+                self.trie_.save(dict_file_cache)
         except Exception:
             logging.exception(f"[HUQIE]:Build trie {fnm} failed")
 
@@ -68,51 +93,87 @@ class RagTokenizer:
         self.lemmatizer = WordNetLemmatizer()
 
         self.SPLIT_CHAR = r"([ ,\.<>/?;:'\[\]\\`!@#$%^&*\(\)\{\}\|_+=《》，。？、；‘’：“”【】~！￥%……（）——-]+|[a-zA-Z0-9,\.-]+)"
+        self._init_cache()
+
+        # prefer the compiled dictionary, which is mapped instead of loaded
+        dict_file_name = huqie_dict.default_path(self.DIR_)
+        if os.path.exists(dict_file_name):
+            try:
+                self._set_trie(HuqieDict(dict_file_name))
+                return
+            except Exception:
+                logging.exception(f"[HUQIE]:Fail to open compiled dictionary {dict_file_name}, fall back to the trie file")
 
         trie_file_name = self.DIR_ + ".txt.trie"
         # check if trie file existence
         if os.path.exists(trie_file_name):
             try:
                 # load trie from file
-                self.trie_ = datrie.Trie.load(trie_file_name)
+                self._set_trie(datrie.Trie.load(trie_file_name))
+                self._compile_dict(dict_file_name)
                 return
             except Exception:
                 # fail to load trie from file, build default trie
                 logging.exception(f"[HUQIE]:Fail to load trie file {trie_file_name}, build the default trie file")
-                self.trie_ = datrie.Trie(string.printable)
+                self._set_trie(datrie.Trie(string.printable))
         else:
             # file not exist, build default trie
             logging.info(f"[HUQIE]:Trie file {trie_file_name} not found, build the default trie file")
-            self.trie_ = datrie.Trie(string.printable)
+            self._set_trie(datrie.Trie(string.printable))
 
         # load data from dict file and save to trie file
         self._load_dict(self.DIR_ + ".txt")
+        self._compile_dict(dict_file_name)
+
+    def _compile_dict(self, dict_file_name):
+        """Compile the loaded trie once for the next start, if HUQIE_COMPILE is on. Only one process does it."""
+        if not HUQIE_COMPILE or not isinstance(self.trie_, datrie.Trie) or not len(self.trie_):
+            return
+        # The lock goes away with its holder, so a compiling process that dies doesn't block the next ones.
+        # The lock file is left in place: removing it would let two processes lock different files.
+        try:
+            lock_file = open(dict_file_name + ".lock", "a")
+        except OSError:
+            logging.exception(f"[HUQIE]:Fail to open the lock of {dict_file_name}")
+            return
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return
+        try:
+            # another process may have compiled it between our check and the lock
+            if not os.path.exists(dict_file_name):
+                huqie_dict.build(huqie_dict.words_from_trie(self.trie_), dict_file_name)
+        except Exception:
+            logging.exception(f"[HUQIE]:Fail to compile dictionary {dict_file_name}")
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+    def _init_cache(self):
+        # Bounded memos, dropped whenever the dictionary changes.
+        self._tokenize_memo = lru_cache(maxsize=TOKENIZER_CACHE_SIZE)(self._tokenize)
+        self._english_word = lru_cache(maxsize=TOKENIZER_CACHE_SIZE)(self._english_word_)
+        self._zh_segment = lru_cache(maxsize=TOKENIZER_CACHE_SIZE)(self._zh_segment_)
+        self._fine_grained_token = lru_cache(maxsize=TOKENIZER_CACHE_SIZE)(self._fine_grained_token_)
 
     def load_user_dict(self, fnm):
+        self._init_cache()
         try:
-            self.trie_ = datrie.Trie.load(fnm + ".trie")
+            self._set_trie(datrie.Trie.load(fnm + ".trie"))
             return
         except Exception:
-            self.trie_ = datrie.Trie(string.printable)
+            self._set_trie(datrie.Trie(string.printable))
         self._load_dict(fnm)
 
     def add_user_dict(self, fnm):
+        self._init_cache()
         self._load_dict(fnm)
 
     def _strQ2B(self, ustring):
         """Convert full-width characters to half-width characters"""
-        rstring = ""
-        for uchar in ustring:
-            inside_code = ord(uchar)
-            if inside_code == 0x3000:
-                inside_code = 0x0020
-            else:
-                inside_code -= 0xFEE0
-            if inside_code < 0x0020 or inside_code > 0x7E:  # After the conversion, if it's not a half-width character, return the original character.
-                rstring += uchar
-            else:
-                rstring += chr(inside_code)
-        return rstring
+        return ustring.translate(Q2B_TABLE)
 
     def _tradi2simp(self, line):
         return HanziConv.toSimplified(line)
@@ -293,8 +354,11 @@ class RagTokenizer:
 
         return self.score_(res[::-1])
 
+    def _english_word_(self, t):
+        return self.stemmer.stem(self.lemmatizer.lemmatize(t))
+
     def english_normalize_(self, tks):
-        return [self.stemmer.stem(self.lemmatizer.lemmatize(t)) if re.match(r"[a-zA-Z_-]+$", t) else t for t in tks]
+        return [self._english_word(t) if re.match(r"[a-zA-Z_-]+$", t) else t for t in tks]
 
     def _split_by_lang(self, line):
         txt_lang_pairs = []
@@ -319,9 +383,63 @@ class RagTokenizer:
             txt_lang_pairs.append((a[s:e], zh))
         return txt_lang_pairs
 
-    def tokenize(self, line: str) -> str:
-        if settings.DOC_ENGINE_INFINITY:
-            return line
+    def _zh_segment_(self, L):
+        res = []
+        # use maxforward for the first time
+        tks, s = self._max_forward(L)
+        tks1, s1 = self._max_backward(L)
+        if self.DEBUG:
+            logging.debug("[FW] {} {}".format(tks, s))
+            logging.debug("[BW] {} {}".format(tks1, s1))
+
+        i, j, _i, _j = 0, 0, 0, 0
+        same = 0
+        while i + same < len(tks1) and j + same < len(tks) and tks1[i + same] == tks[j + same]:
+            same += 1
+        if same > 0:
+            res.append(" ".join(tks[j : j + same]))
+        _i = i + same
+        _j = j + same
+        j = _j + 1
+        i = _i + 1
+
+        while i < len(tks1) and j < len(tks):
+            tk1, tk = "".join(tks1[_i:i]), "".join(tks[_j:j])
+            if tk1 != tk:
+                if len(tk1) > len(tk):
+                    j += 1
+                else:
+                    i += 1
+                continue
+
+            if tks1[i] != tks[j]:
+                i += 1
+                j += 1
+                continue
+            # backward tokens from_i to i are different from forward tokens from _j to j.
+            tkslist = []
+            self.dfs_("".join(tks[_j:j]), 0, [], tkslist)
+            res.append(" ".join(self._sort_tokens(tkslist)[0][0]))
+
+            same = 1
+            while i + same < len(tks1) and j + same < len(tks) and tks1[i + same] == tks[j + same]:
+                same += 1
+            res.append(" ".join(tks[j : j + same]))
+            _i = i + same
+            _j = j + same
+            j = _j + 1
+            i = _i + 1
+
+        if _i < len(tks1):
+            assert _j < len(tks)
+            assert "".join(tks1[_i:]) == "".join(tks[_j:])
+            tkslist = []
+            self.dfs_("".join(tks[_j:]), 0, [], tkslist)
+            res.append(" ".join(self._sort_tokens(tkslist)[0][0]))
+
+        return tuple(res)
+
+    def _tokenize(self, line):
         line = re.sub(r"\W+", " ", line)
         line = self._strQ2B(line).lower()
         line = self._tradi2simp(line)
@@ -330,67 +448,61 @@ class RagTokenizer:
         res = []
         for L, lang in arr:
             if not lang:
-                res.extend([self.stemmer.stem(self.lemmatizer.lemmatize(t)) for t in word_tokenize(L)])
+                res.extend([self._english_word(t) for t in word_tokenize(L)])
                 continue
             if len(L) < 2 or re.match(r"[a-z\.-]+$", L) or re.match(r"[0-9\.-]+$", L):
                 res.append(L)
                 continue
+            res.extend(self._zh_segment(L))
 
-            # use maxforward for the first time
-            tks, s = self._max_forward(L)
-            tks1, s1 = self._max_backward(L)
-            if self.DEBUG:
-                logging.debug("[FW] {} {}".format(tks, s))
-                logging.debug("[BW] {} {}".format(tks1, s1))
-
-            i, j, _i, _j = 0, 0, 0, 0
-            same = 0
-            while i + same < len(tks1) and j + same < len(tks) and tks1[i + same] == tks[j + same]:
-                same += 1
-            if same > 0:
-                res.append(" ".join(tks[j : j + same]))
-            _i = i + same
-            _j = j + same
-            j = _j + 1
-            i = _i + 1
-
-            while i < len(tks1) and j < len(tks):
-                tk1, tk = "".join(tks1[_i:i]), "".join(tks[_j:j])
-                if tk1 != tk:
-                    if len(tk1) > len(tk):
-                        j += 1
-                    else:
-                        i += 1
-                    continue
+        res = self.merge_(" ".join(res))
+        logging.debug("[TKS] {}".format(res))
+        return res
 
-                if tks1[i] != tks[j]:
-                    i += 1
-                    j += 1
-                    continue
-                # backward tokens from_i to i are different from forward tokens from _j to j.
-                tkslist = []
-                self.dfs_("".join(tks[_j:j]), 0, [], tkslist)
-                res.append(" ".join(self._sort_tokens(tkslist)[0][0]))
-
-                same = 1
-                while i + same < len(tks1) and j + same < len(tks) and tks1[i + same] == tks[j + same]:
-                    same += 1
-                res.append(" ".join(tks[j : j + same]))
-                _i = i + same
-                _j = j + same
-                j = _j + 1
-                i = _i + 1
-
-            if _i < len(tks1):
-                assert _j < len(tks)
-                assert "".join(tks1[_i:]) == "".join(tks[_j:])
-                tkslist = []
-                self.dfs_("".join(tks[_j:]), 0, [], tkslist)
-                res.append(" ".join(self._sort_tokens(tkslist)[0][0]))
-
-        res = " ".join(res)
-        logging.debug("[TKS] {}".format(self.merge_(res)))
-        return self.merge_(res)
+    def tokenize(self, line: str) -> str:
+        if settings.DOC_ENGINE_INFINITY:
+            return line
+        if len(line) <= TOKENIZER_MEMO_LINE_LEN:
+            return self._tokenize_memo(line)
+        return self._tokenize(line)
+
+    def tokenize_batch(self, lines: list[str]) -> list[str]:
+        """
+        Tokenize the chunks of a whole document in one pass. Repeated lines are tokenized once,
+        and all lines share the word, segment and line memos.
+        """
+        if settings.DOC_ENGINE_INFINITY:
+            return list(lines)
+        done = {}
+        for line in lines:
+            if line not in done:
+                done[line] = self.tokenize(line)
+        return [done[line] for line in lines]
+
+    def _fine_grained_token_(self, tk):
+        if len(tk) < 3 or re.match(r"[0-9,\.-]+$", tk):
+            return tk
+        tkslist = []
+        if len(tk) > 10:
+            tkslist.append(tk)
+        else:
+            self.dfs_(tk, 0, [], tkslist)
+        if len(tkslist) < 2:
+            return tk
+        stk = self._sort_tokens(tkslist)[1][0]
+        if len(stk) == len(tk):
+            stk = tk
+        else:
+            if re.match(r"[a-z\.-]+$", tk):
+                for t in stk:
+                    if len(t) < 3:
+                        stk = tk
+                        break
+                else:
+                    stk = " ".join(stk)
+            else:
+                stk = " ".join(stk)
+        return stk
 
     def fine_grained_tokenize(self, tks: str) -> str:
         if settings.DOC_ENGINE_INFINITY:
@@ -403,37 +515,19 @@ class RagTokenizer:
                 res.extend(tk.split("/"))
             return " ".join(res)
 
-        res = []
-        for tk in tks:
-            if len(tk) < 3 or re.match(r"[0-9,\.-]+$", tk):
-                res.append(tk)
-                continue
-            tkslist = []
-            if len(tk) > 10:
-                tkslist.append(tk)
-            else:
-                self.dfs_(tk, 0, [], tkslist)
-            if len(tkslist) < 2:
-                res.append(tk)
-                continue
-            stk = self._sort_tokens(tkslist)[1][0]
-            if len(stk) == len(tk):
-                stk = tk
-            else:
-                if re.match(r"[a-z\.-]+$", tk):
-                    for t in stk:
-                        if len(t) < 3:
-                            stk = tk
-                            break
-                    else:
-                        stk = " ".join(stk)
-                else:
-                    stk = " ".join(stk)
-
-            res.append(stk)
-
+        res = [self._fine_grained_token(tk) for tk in tks]
         return " ".join(self.english_normalize_(res))
 
+    def fine_grained_tokenize_batch(self, tks_list: list[str]) -> list[str]:
+        """Fine-grained counterpart of `tokenize_batch`, taking the output of `tokenize`."""
+        if settings.DOC_ENGINE_INFINITY:
+            return list(tks_list)
+        done = {}
+        for tks in tks_list:
+            if tks not in done:
+                done[tks] = self.fine_grained_tokenize(tks)
+        return [done[tks] for tks in tks_list]
+
 
 def is_chinese(s):
     if s >= "\u4e00" and s <= "\u9fa5":
@@ -468,6 +562,8 @@ def naive_qie(txt):
 tokenizer = RagTokenizer()
 tokenize = tokenizer.tokenize
 fine_grained_tokenize = tokenizer.fine_grained_tokenize
+tokenize_batch = tokenizer.tokenize_batch
+fine_grained_tokenize_batch = tokenizer.fine_grained_tokenize_batch
 tag = tokenizer.tag
 freq = tokenizer.freq
 load_user_dict = tokenizer.load_user_dict
@@ -13,6 +13,7 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import ast
 import json
 import logging
 import re
@@ -50,11 +51,18 @@ class Dealer:
         group_docs: list[list] | None = None
 
     def get_vector(self, txt, emb_mdl, topk=10, similarity=0.1):
-        qv, _ = emb_mdl.encode_queries(txt)
-        shape = np.array(qv).shape
-        if len(shape) > 1:
-            raise Exception(
-                f"Dealer.get_vector returned array's shape {shape} doesn't match expectation(exact one dimension).")
+        # imported here: rag.utils.redis_conn imports common.settings, which imports this module
+        from rag.utils.retrieval_cache import QUERY_EMBED_CACHE
+
+        tenant_id, llm_name = getattr(emb_mdl, "tenant_id", ""), getattr(emb_mdl, "llm_name", None)
+        qv = QUERY_EMBED_CACHE.get_many(tenant_id, llm_name, [txt])[0]
+        if qv is None:
+            qv, _ = emb_mdl.encode_queries(txt)
+            shape = np.array(qv).shape
+            if len(shape) > 1:
+                raise Exception(
+                    f"Dealer.get_vector returned array's shape {shape} doesn't match expectation(exact one dimension).")
+            QUERY_EMBED_CACHE.set_many(tenant_id, llm_name, [txt], [qv])
         embedding_data = [get_float(v) for v in qv]
         vector_column_name = f"q_{len(embedding_data)}_vec"
         return MatchDenseExpr(vector_column_name, embedding_data, 'float', 'cosine', topk, {"similarity": similarity})
@@ -168,6 +176,21 @@ class Dealer:
             keywords=keywords
         )
 
+    @staticmethod
+    def decode_vectors(vectors: list, vector_size: int) -> np.ndarray:
+        """Decode chunk vectors (lists or tab separated strings) into one contiguous float32 matrix."""
+        mtx = np.zeros((len(vectors), vector_size), dtype=np.float32)
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                continue
+            if isinstance(vector, str):
+                try:
+                    vector = np.array(vector.split("\t"), dtype=np.float32)
+                except ValueError:
+                    vector = [get_float(v) for v in vector.split("\t")]
+            mtx[i] = vector
+        return mtx
+
     @staticmethod
     def trans2floats(txt):
         return [get_float(t) for t in txt.split("\t")]
@@ -261,32 +284,57 @@ class Dealer:
 
         return res, seted
 
+    @staticmethod
+    def parse_tag_features(v) -> dict:
+        """Tag features as a dict, whether the doc store returns a map, JSON or a legacy repr string."""
+        if not v:
+            return {}
+        if isinstance(v, dict):
+            return v
+        if isinstance(v, str):
+            try:
+                return json.loads(v)
+            except ValueError:
+                pass
+            try:
+                v = ast.literal_eval(v)
+                return v if isinstance(v, dict) else {}
+            except (ValueError, SyntaxError):
+                logging.warning(f"Dealer.parse_tag_features can't parse {v[:64]}")
+        return {}
+
     def _rank_feature_scores(self, query_rfea, search_res):
         ## For rank feature(tag_fea) scores.
-        rank_fea = []
-        pageranks = []
-        for chunk_id in search_res.ids:
-            pageranks.append(search_res.field[chunk_id].get(PAGERANK_FLD, 0))
-        pageranks = np.array(pageranks, dtype=float)
+        pageranks = np.array([search_res.field[i].get(PAGERANK_FLD, 0) for i in search_res.ids], dtype=float)
 
         if not query_rfea:
-            return np.array([0 for _ in range(len(search_res.ids))]) + pageranks
+            return np.zeros(len(search_res.ids)) + pageranks
 
         q_denor = np.sqrt(np.sum([s*s for t,s in query_rfea.items() if t != PAGERANK_FLD]))
-        for i in search_res.ids:
-            nor, denor = 0, 0
-            if not search_res.field[i].get(TAG_FLD):
-                rank_fea.append(0)
+        # Scatter all candidates' tag features over the query tag vocabulary once.
+        vocab = {t: j for j, t in enumerate(query_rfea.keys())}
+        q_vec = np.array(list(query_rfea.values()), dtype=float)
+        rows, cols, vals = [], [], []
+        denor = np.zeros(len(search_res.ids))
+        for r, i in enumerate(search_res.ids):
+            feas = self.parse_tag_features(search_res.field[i].get(TAG_FLD))
+            if not feas:
                 continue
-            for t, sc in eval(search_res.field[i].get(TAG_FLD, "{}")).items():
-                if t in query_rfea:
-                    nor += query_rfea[t] * sc
-                denor += sc * sc
-            if denor == 0:
-                rank_fea.append(0)
-            else:
-                rank_fea.append(nor/np.sqrt(denor)/q_denor)
-        return np.array(rank_fea)*10. + pageranks
+            scores = np.array(list(feas.values()), dtype=float)
+            denor[r] = np.sum(scores * scores)
+            for t, sc in zip(feas.keys(), scores):
+                j = vocab.get(t)
+                if j is not None:
+                    rows.append(r)
+                    cols.append(j)
+                    vals.append(sc)
+        nor = np.bincount(np.array(rows, dtype=np.int64),
+                          weights=q_vec[np.array(cols, dtype=np.int64)] * np.array(vals, dtype=float),
+                          minlength=len(search_res.ids))
+        rank_fea = np.zeros(len(search_res.ids))
+        mask = denor != 0
+        rank_fea[mask] = nor[mask] / np.sqrt(denor[mask]) / q_denor
+        return rank_fea*10. + pageranks
 
     def rerank(self, sres, query, tkweight=0.3,
                vtweight=0.7, cfield="content_ltks",
@@ -295,15 +343,9 @@ class Dealer:
         _, keywords = self.qryr.question(query)
         vector_size = len(sres.query_vector)
         vector_column = f"q_{vector_size}_vec"
-        zero_vector = [0.0] * vector_size
-        ins_embd = []
-        for chunk_id in sres.ids:
-            vector = sres.field[chunk_id].get(vector_column, zero_vector)
-            if isinstance(vector, str):
-                vector = [get_float(v) for v in vector.split("\t")]
-            ins_embd.append(vector)
-        if not ins_embd:
+        if not sres.ids:
             return [], [], []
+        ins_embd = self.decode_vectors([sres.field[chunk_id].get(vector_column) for chunk_id in sres.ids], vector_size)
 
         for i in sres.ids:
             if isinstance(sres.field[i].get("important_kwd", []), str):
@@ -373,9 +415,44 @@ class Dealer:
         highlight=False,
         rank_feature: dict | None = {PAGERANK_FLD: 10},
     ):
-        ranks = {"total": 0, "chunks": [], "doc_aggs": {}}
         if not question:
-            return ranks
+            return {"total": 0, "chunks": [], "doc_aggs": {}}
+
+        from rag.utils.redis_conn import REDIS_CONN
+        from rag.utils.retrieval_cache import RETRIEVAL_CACHE
+
+        cache_key = None
+        if RETRIEVAL_CACHE.enabled and REDIS_CONN.is_alive():
+            cache_key = RETRIEVAL_CACHE.key(
+                kb_ids,
+                tenant_ids=tenant_ids,
+                question=question,
+                doc_ids=doc_ids,
+                page=page,
+                page_size=page_size,
+                similarity_threshold=similarity_threshold,
+                vector_similarity_weight=vector_similarity_weight,
+                top=top,
+                aggs=aggs,
+                highlight=highlight,
+                rank_feature=rank_feature,
+                embd_mdl=getattr(embd_mdl, "llm_name", None),
+                rerank_mdl=getattr(rerank_mdl, "llm_name", None),
+            )
+        if cache_key:
+            ranks = RETRIEVAL_CACHE.get(cache_key)
+            if ranks is not None:
+                return ranks
+
+        ranks = self._retrieval(question, embd_mdl, tenant_ids, kb_ids, page, page_size, similarity_threshold,
+                                vector_similarity_weight, top, doc_ids, aggs, rerank_mdl, highlight, rank_feature)
+        if cache_key:
+            RETRIEVAL_CACHE.set(cache_key, ranks)
+        return ranks
+
+    def _retrieval(self, question, embd_mdl, tenant_ids, kb_ids, page, page_size, similarity_threshold,
+                   vector_similarity_weight, top, doc_ids, aggs, rerank_mdl, highlight, rank_feature):
+        ranks = {"total": 0, "chunks": [], "doc_aggs": {}}
 
         # Ensure RERANK_LIMIT is multiple of page_size
         RERANK_LIMIT = math.ceil(64 / page_size) * page_size if page_size > 1 else 1
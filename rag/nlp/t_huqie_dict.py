@@ -0,0 +1,97 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import os
+import sys
+sys.path.insert(
+    0,
+    os.path.abspath(
+        os.path.join(
+            os.path.dirname(
+                os.path.abspath(__file__)),
+            '../../')))
+
+import argparse
+import random
+import subprocess
+import time
+
+import datrie
+
+# rag.nlp can only be imported once common.settings is
+from common import settings  # noqa: F401
+from common.file_utils import get_project_base_directory
+from rag.nlp import huqie_dict
+
+
+_HUQIE_LOAD = """
+import resource, sys, time
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+st = time.perf_counter()
+if sys.argv[1] == "trie":
+    import datrie
+    d = datrie.Trie.load(sys.argv[2])
+else:
+    # Load the module by path: importing the rag.nlp package would build a tokenizer.
+    import importlib.util
+    spec = importlib.util.spec_from_file_location("huqie_dict", "rag/nlp/huqie_dict.py")
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    d = mod.HuqieDict(sys.argv[2])
+print(time.perf_counter() - st, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before)
+"""
+
+
+def benchmark(trie_path="", dict_path="", n_lookups=200000):
+    """Compare start-up time, RSS and lookup throughput of the datrie and the compiled huqie dictionary."""
+    prefix = os.path.join(get_project_base_directory(), "rag/res", "huqie")
+    trie_path = trie_path or prefix + ".txt.trie"
+    dict_path = dict_path or huqie_dict.default_path(prefix)
+    trie = datrie.Trie.load(trie_path)
+    if not os.path.exists(dict_path):
+        st = time.perf_counter()
+        huqie_dict.build(huqie_dict.words_from_trie(trie), dict_path)
+        print(f"compiled {dict_path} in {time.perf_counter() - st:.1f} s")
+
+    # Each load runs in a fresh interpreter so it pays the full cost and its RSS growth is its own.
+    for name, path in [("trie", trie_path), ("compiled", dict_path)]:
+        out = subprocess.run([sys.executable, "-c", _HUQIE_LOAD, name, path], check=True, capture_output=True, text=True,
+                             cwd=get_project_base_directory())
+        elapsed, rss = out.stdout.split()[-2:]
+        print(f"{name:>10}: load {float(elapsed) * 1000:.1f} ms, RSS +{int(rss) / 1024:.1f} MB, file {os.path.getsize(path) / 1024 / 1024:.1f} MB")
+
+    words = list(huqie_dict.words_from_trie(trie).keys())
+    sample = [random.choice(words) for _ in range(n_lookups)]
+    prefixes = [w[:max(1, len(w) - 1)] for w in sample]
+    escaped = [str(w.encode("utf-8"))[2:-1] for w in sample]
+    escaped_prefixes = [str(w.encode("utf-8"))[2:-1] for w in prefixes]
+    compiled = huqie_dict.HuqieDict(dict_path)
+    for name, d, keys, pfx in [("trie", trie, escaped, escaped_prefixes), ("compiled", compiled, sample, prefixes)]:
+        st = time.perf_counter()
+        for k, p in zip(keys, pfx):
+            if k in d:
+                d[k]
+            d.has_keys_with_prefix(p)
+        print(f"{name:>10}: {n_lookups / (time.perf_counter() - st):.0f} lookups/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the datrie and the compiled huqie dictionary")
+    parser.add_argument('--trie', help="Path of the datrie. Default: rag/res/huqie.txt.trie", default="")
+    parser.add_argument('--dict', help="Path of the compiled dictionary, built from the datrie if missing. Default: next to the datrie", default="")
+    parser.add_argument('--lookups', help="Lookups timed. Default: 200000", type=int, default=200000)
+    args = parser.parse_args()
+    benchmark(args.trie, args.dict, args.lookups)
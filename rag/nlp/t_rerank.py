@@ -0,0 +1,86 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import os
+import sys
+sys.path.insert(
+    0,
+    os.path.abspath(
+        os.path.join(
+            os.path.dirname(
+                os.path.abspath(__file__)),
+            '../../')))
+
+import argparse
+import random
+import time
+from collections import defaultdict
+
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+
+# rag.nlp can only be imported once common.settings is
+from common import settings  # noqa: F401
+from common.float_utils import get_float
+from rag.nlp import search
+from rag.nlp.query import FulltextQueryer
+
+
+def benchmark(n_chunks=64, dim=1024, repeat=50):
+    """Compare the list based rerank scoring with the NumPy-native one on synthetic chunks."""
+    qryr = FulltextQueryer()
+    words = ["retrieval", "augmented", "generation", "document", "vector", "index", "chunk", "query",
+             "rerank", "token", "similarity", "embedding", "knowledge", "graph", "table", "layout"]
+    rng = np.random.default_rng(0)
+    query_vector = rng.standard_normal(dim).tolist()
+    raw_vectors = ["\t".join(str(v) for v in rng.standard_normal(dim)) for _ in range(n_chunks)]
+    keywords = random.sample(words, 5)
+    ins_tw = [[random.choice(words) for _ in range(128)] for _ in range(n_chunks)]
+
+    def legacy():
+        ins_embd = [[get_float(v) for v in vector.split("\t")] for vector in raw_vectors]
+        sims = cosine_similarity([query_vector], ins_embd)
+
+        def to_dict(tks):
+            d = defaultdict(int)
+            for t, c in qryr.tw.weights(tks, preprocess=False):
+                d[t] += c
+            return d
+
+        atks = to_dict(keywords)
+        tksim = [qryr.similarity(atks, to_dict(tks)) for tks in ins_tw]
+        return np.array(sims[0]) * 0.7 + np.array(tksim) * 0.3
+
+    def vectorized():
+        ins_embd = search.Dealer.decode_vectors(raw_vectors, dim)
+        sim, _, _ = qryr.hybrid_similarity(query_vector, ins_embd, keywords, ins_tw, 0.3, 0.7)
+        return sim
+
+    assert np.allclose(legacy(), vectorized(), atol=1e-5), "Vectorized rerank doesn't match the legacy one."
+    for name, fn in [("legacy", legacy), ("vectorized", vectorized)]:
+        st = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        print(f"{name:>10}: {(time.perf_counter() - st) / repeat * 1000:.2f} ms per rerank of {n_chunks}x{dim}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the rerank scoring of Dealer.rerank on synthetic chunks")
+    parser.add_argument('--chunks', help="Chunks reranked at once. Default: 64", type=int, default=64)
+    parser.add_argument('--dim', help="Dimension of the chunk vectors. Default: 1024", type=int, default=1024)
+    parser.add_argument('--repeat', help="Reranks timed. Default: 50", type=int, default=50)
+    args = parser.parse_args()
+    benchmark(args.chunks, args.dim, args.repeat)
@@ -14,11 +14,14 @@
 #  limitations under the License.
 #
 import logging
+import math
+import os
 import re
 
 import numpy as np
 import trio
 import umap
+from joblib import Parallel, delayed
 from sklearn.mixture import GaussianMixture
 
 from api.db.services.task_service import has_canceled
@@ -33,6 +36,23 @@ from graphrag.utils import (
     set_llm_cache,
 )
 
+# "exhaustive" fits a mixture for every cluster count, "fast" searches the counts coarse to fine.
+RAPTOR_CLUSTER_SEARCH = os.environ.get("RAPTOR_CLUSTER_SEARCH", "exhaustive")
+# Processes fitting candidate mixtures of the fast search, for layers of at least RAPTOR_PARALLEL_MIN_SIZE chunks.
+RAPTOR_CLUSTER_JOBS = int(os.environ.get("RAPTOR_CLUSTER_JOBS", min(4, os.cpu_count() or 1)))
+RAPTOR_PARALLEL_MIN_SIZE = int(os.environ.get("RAPTOR_PARALLEL_MIN_SIZE", 2000))
+# The fast search scores candidates on a sample of this size, and UMAP of larger layers is fitted on a sample.
+RAPTOR_BIC_SAMPLE_SIZE = int(os.environ.get("RAPTOR_BIC_SAMPLE_SIZE", 5000))
+RAPTOR_UMAP_SAMPLE_SIZE = int(os.environ.get("RAPTOR_UMAP_SAMPLE_SIZE", 20000))
+# Incremental updates fall back to a full rebuild when this share of the leaves is new.
+RAPTOR_INCREMENTAL_MAX_NEW_RATIO = float(os.environ.get("RAPTOR_INCREMENTAL_MAX_NEW_RATIO", 0.3))
+
+
+def _fit_bic(embeddings: np.ndarray, n: int, random_state: int) -> float:
+    gm = GaussianMixture(n_components=n, random_state=random_state)
+    gm.fit(embeddings)
+    return gm.bic(embeddings)
+
 
 class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
     def __init__(
@@ -44,8 +64,10 @@ class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
         max_token=512,
         threshold=0.1,
         max_errors=3,
+        cluster_search=RAPTOR_CLUSTER_SEARCH,
     ):
         self._max_cluster = max_cluster
+        self._cluster_search = cluster_search
         self._llm_model = llm_model
         self._embd_model = embd_model
         self._threshold = threshold
@@ -53,6 +75,8 @@ class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
         self._max_token = max_token
         self._max_errors = max(1, max_errors)
         self._error_count = 0
+        # index of every summary in the returned chunks -> indexes of the chunks it summarizes
+        self.members = {}
 
     @timeout(60 * 20)
     async def _chat(self, system, history, gen_conf):
@@ -79,115 +103,191 @@ class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
 
     @timeout(20)
     async def _embedding_encode(self, txt):
-        response = await trio.to_thread.run_sync(lambda: get_embed_cache(self._embd_model.llm_name, txt))
+        response = await trio.to_thread.run_sync(lambda: get_embed_cache(self._embd_model.llm_name, txt, self._embd_model.tenant_id))
         if response is not None:
             return response
         embds, _ = await trio.to_thread.run_sync(lambda: self._embd_model.encode([txt]))
         if len(embds) < 1 or len(embds[0]) < 1:
             raise Exception("Embedding error: ")
         embds = embds[0]
-        await trio.to_thread.run_sync(lambda: set_embed_cache(self._embd_model.llm_name, txt, embds))
+        await trio.to_thread.run_sync(lambda: set_embed_cache(self._embd_model.llm_name, txt, embds, self._embd_model.tenant_id))
         return embds
 
+    def _check_canceled(self, task_id, stage):
+        if task_id and has_canceled(task_id):
+            logging.info(f"Task {task_id} cancelled during {stage}.")
+            raise TaskCanceledException(f"Task {task_id} was cancelled")
+
     def _get_optimal_clusters(self, embeddings: np.ndarray, random_state: int, task_id: str = ""):
+        if self._cluster_search == "fast":
+            return self._search_optimal_clusters(embeddings, random_state, task_id)
         max_clusters = min(self._max_cluster, len(embeddings))
-        n_clusters = np.arange(1, max_clusters)
+        n_clusters = list(range(1, max_clusters))
         bics = []
         for n in n_clusters:
-            if task_id:
-                if has_canceled(task_id):
-                    logging.info(f"Task {task_id} cancelled during get optimal clusters.")
-                    raise TaskCanceledException(f"Task {task_id} was cancelled")
-
-            gm = GaussianMixture(n_components=n, random_state=random_state)
-            gm.fit(embeddings)
-            bics.append(gm.bic(embeddings))
+            self._check_canceled(task_id, "get optimal clusters")
+            bics.append(_fit_bic(embeddings, n, random_state))
         optimal_clusters = n_clusters[np.argmin(bics)]
         return optimal_clusters
 
+    def _search_optimal_clusters(self, embeddings: np.ndarray, random_state: int, task_id: str = ""):
+        """
+        Coarse to fine search of the cluster count with the lowest BIC over the same range as the exhaustive one.
+        A grid of about sqrt(range) counts is scored first, then every count around the best of them.
+        Candidates are scored on a sample of large layers, and fitted in parallel processes.
+        """
+        max_clusters = min(self._max_cluster, len(embeddings))
+        if max_clusters <= 2:
+            return 1
+        if len(embeddings) > RAPTOR_BIC_SAMPLE_SIZE:
+            rng = np.random.default_rng(random_state)
+            embeddings = embeddings[rng.choice(len(embeddings), RAPTOR_BIC_SAMPLE_SIZE, replace=False)]
+        jobs = RAPTOR_CLUSTER_JOBS if len(embeddings) >= RAPTOR_PARALLEL_MIN_SIZE else 1
+        bics = {}
+
+        def score(candidates):
+            candidates = [n for n in candidates if n not in bics]
+            self._check_canceled(task_id, "get optimal clusters")
+            if jobs > 1 and len(candidates) > 1:
+                res = Parallel(n_jobs=min(jobs, len(candidates)))(delayed(_fit_bic)(embeddings, n, random_state) for n in candidates)
+            else:
+                res = [_fit_bic(embeddings, n, random_state) for n in candidates]
+            bics.update(zip(candidates, res))
+
+        step = max(1, int(math.sqrt(max_clusters - 1)))
+        score(list(range(1, max_clusters, step)) + [max_clusters - 1])
+        best = min(bics, key=bics.get)
+        score(range(max(1, best - step + 1), min(max_clusters, best + step)))
+        return min(bics, key=bics.get)
+
+    def _reduce(self, embeddings: list, random_state: int) -> np.ndarray:
+        n_neighbors = int((len(embeddings) - 1) ** 0.8)
+        reducer = umap.UMAP(
+            n_neighbors=max(2, n_neighbors),
+            n_components=min(12, len(embeddings) - 2),
+            metric="cosine",
+        )
+        if self._cluster_search != "fast" or len(embeddings) <= RAPTOR_UMAP_SAMPLE_SIZE:
+            return reducer.fit_transform(embeddings)
+        # Fit the projection on a sample of a large layer and project the rest with it.
+        embeddings = np.asarray(embeddings)
+        rng = np.random.default_rng(random_state)
+        sample = rng.choice(len(embeddings), RAPTOR_UMAP_SAMPLE_SIZE, replace=False)
+        reducer.n_neighbors = max(2, int((RAPTOR_UMAP_SAMPLE_SIZE - 1) ** 0.8))
+        reducer.fit(embeddings[sample])
+        return reducer.transform(embeddings)
+
+    @timeout(60 * 20)
+    async def _summarize(self, chunks: list, ck_idx: list[int], callback=None, task_id: str = ""):
+        self._check_canceled(task_id, "RAPTOR summarization")
+
+        texts = [chunks[i][0] for i in ck_idx]
+        len_per_chunk = int((self._llm_model.max_length - self._max_token) / len(texts))
+        cluster_content = "\n".join([truncate(t, max(1, len_per_chunk)) for t in texts])
+        try:
+            async with chat_limiter:
+                self._check_canceled(task_id, "RAPTOR LLM call")
+
+                cnt = await self._chat(
+                    "You're a helpful assistant.",
+                    [
+                        {
+                            "role": "user",
+                            "content": self._prompt.format(cluster_content=cluster_content),
+                        }
+                    ],
+                    {"max_tokens": max(self._max_token, 512)},  # fix issue:  #10235
+                )
+                cnt = re.sub(
+                    "(······\n由于长度的原因，回答被截断了，要继续吗？|For the content length reason, it stopped, continue?)",
+                    "",
+                    cnt,
+                )
+                logging.debug(f"SUM: {cnt}")
+
+                self._check_canceled(task_id, "RAPTOR embedding")
+
+                embds = await self._embedding_encode(cnt)
+                chunks.append((cnt, embds))
+                self.members[len(chunks) - 1] = list(ck_idx)
+        except TaskCanceledException:
+            raise
+        except Exception as exc:
+            self._error_count += 1
+            warn_msg = f"[RAPTOR] Skip cluster ({len(ck_idx)} chunks) due to error: {exc}"
+            logging.warning(warn_msg)
+            if callback:
+                callback(msg=warn_msg)
+            if self._error_count >= self._max_errors:
+                raise RuntimeError(f"RAPTOR aborted after {self._error_count} errors. Last error: {exc}") from exc
+
     async def __call__(self, chunks, random_state, callback=None, task_id: str = ""):
         if len(chunks) <= 1:
             return []
         chunks = [(s, a) for s, a in chunks if s and a is not None and len(a) > 0]
-        layers = [(0, len(chunks))]
-        start, end = 0, len(chunks)
+        self.members = {}
+        return await self._build(chunks, 0, len(chunks), random_state, callback, task_id)
 
-        @timeout(60 * 20)
-        async def summarize(ck_idx: list[int]):
-            nonlocal chunks
+    async def update(self, leaves, clusters, random_state, callback=None, task_id: str = ""):
+        """
+        Incrementally update a tree built before.
 
-            if task_id:
-                if has_canceled(task_id):
-                    logging.info(f"Task {task_id} cancelled during RAPTOR summarization.")
-                    raise TaskCanceledException(f"Task {task_id} was cancelled")
+        `leaves` are all the (text, embedding) chunks now, and `clusters` the bottom layer summaries of the tree
+        as (text, embedding, indexes of their leaves), where None stands for a leaf which is gone.
+        New leaves join the cluster with the closest centroid, and only the clusters which got or lost leaves
+        are summarized again. The upper layers are rebuilt from the bottom layer, their unchanged clusters
+        are answered by the LLM cache.
+        Return the chunks like __call__, or None if the tree has to be rebuilt from scratch.
+        """
+        self.members = {}
+        members = [[i for i in idx if i is not None] for _, _, idx in clusters]
+        # clusters which lost leaves since the last build
+        touched = set([c for c, (_, _, idx) in enumerate(clusters) if len(members[c]) != len(idx)])
+        clustered = set([i for idx in members for i in idx])
+        new_leaves = [i for i in range(len(leaves)) if i not in clustered]
+        if not clusters or len(new_leaves) > RAPTOR_INCREMENTAL_MAX_NEW_RATIO * len(leaves):
+            return None
 
-            texts = [chunks[i][0] for i in ck_idx]
-            len_per_chunk = int((self._llm_model.max_length - self._max_token) / len(texts))
-            cluster_content = "\n".join([truncate(t, max(1, len_per_chunk)) for t in texts])
-            try:
-                async with chat_limiter:
-                    if task_id and has_canceled(task_id):
-                        logging.info(f"Task {task_id} cancelled before RAPTOR LLM call.")
-                        raise TaskCanceledException(f"Task {task_id} was cancelled")
-
-                    cnt = await self._chat(
-                        "You're a helpful assistant.",
-                        [
-                            {
-                                "role": "user",
-                                "content": self._prompt.format(cluster_content=cluster_content),
-                            }
-                        ],
-                        {"max_tokens": max(self._max_token, 512)},  # fix issue:  #10235
-                    )
-                    cnt = re.sub(
-                        "(······\n由于长度的原因，回答被截断了，要继续吗？|For the content length reason, it stopped, continue?)",
-                        "",
-                        cnt,
-                    )
-                    logging.debug(f"SUM: {cnt}")
-
-                    if task_id and has_canceled(task_id):
-                        logging.info(f"Task {task_id} cancelled before RAPTOR embedding.")
-                        raise TaskCanceledException(f"Task {task_id} was cancelled")
-
-                    embds = await self._embedding_encode(cnt)
-                    chunks.append((cnt, embds))
-            except TaskCanceledException:
-                raise
-            except Exception as exc:
-                self._error_count += 1
-                warn_msg = f"[RAPTOR] Skip cluster ({len(ck_idx)} chunks) due to error: {exc}"
-                logging.warning(warn_msg)
-                if callback:
-                    callback(msg=warn_msg)
-                if self._error_count >= self._max_errors:
-                    raise RuntimeError(f"RAPTOR aborted after {self._error_count} errors. Last error: {exc}") from exc
+        vectors = np.asarray([e for _, e in leaves], dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        if new_leaves:
+            centroids = np.asarray([vectors[idx].mean(axis=0) if idx else np.zeros(vectors.shape[1]) for idx in members])
+            sims = vectors[new_leaves] @ centroids.T
+            sims[:, [c for c, idx in enumerate(members) if not idx]] = -np.inf
+            for i, c in zip(new_leaves, np.argmax(sims, axis=1)):
+                members[c].append(i)
+                touched.add(int(c))
+
+        chunks = list(leaves)
+        for c, (text, embd, _) in enumerate(clusters):
+            if c not in touched and members[c]:
+                chunks.append((text, embd))
+                self.members[len(chunks) - 1] = members[c]
+        async with trio.open_nursery() as nursery:
+            for c in sorted(touched):
+                if members[c]:
+                    nursery.start_soon(self._summarize, chunks, members[c], callback, task_id)
+        if callback:
+            callback(msg="Update the bottom layer: {} new chunks, {} of {} clusters summarized again".format(
+                len(new_leaves), len(touched), len(clusters)))
+        return await self._build(chunks, len(leaves), len(chunks), random_state, callback, task_id)
 
+    async def _build(self, chunks, start, end, random_state, callback=None, task_id: str = ""):
         labels = []
         while end - start > 1:
-            if task_id:
-                if has_canceled(task_id):
-                    logging.info(f"Task {task_id} cancelled during RAPTOR layer processing.")
-                    raise TaskCanceledException(f"Task {task_id} was cancelled")
+            self._check_canceled(task_id, "RAPTOR layer processing")
 
             embeddings = [embd for _, embd in chunks[start:end]]
             if len(embeddings) == 2:
-                await summarize([start, start + 1])
+                await self._summarize(chunks, [start, start + 1], callback, task_id)
                 if callback:
                     callback(msg="Cluster one layer: {} -> {}".format(end - start, len(chunks) - end))
                 labels.extend([0, 0])
-                layers.append((end, len(chunks)))
                 start = end
                 end = len(chunks)
                 continue
 
-            n_neighbors = int((len(embeddings) - 1) ** 0.8)
-            reduced_embeddings = umap.UMAP(
-                n_neighbors=max(2, n_neighbors),
-                n_components=min(12, len(embeddings) - 2),
-                metric="cosine",
-            ).fit_transform(embeddings)
+            reduced_embeddings = self._reduce(embeddings, random_state)
             n_clusters = self._get_optimal_clusters(reduced_embeddings, random_state, task_id=task_id)
             if n_clusters == 1:
                 lbls = [0 for _ in range(len(reduced_embeddings))]
@@ -203,15 +303,12 @@ class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
                     ck_idx = [i + start for i in range(len(lbls)) if lbls[i] == c]
                     assert len(ck_idx) > 0
 
-                    if task_id and has_canceled(task_id):
-                        logging.info(f"Task {task_id} cancelled before RAPTOR cluster processing.")
-                        raise TaskCanceledException(f"Task {task_id} was cancelled")
+                    self._check_canceled(task_id, "RAPTOR cluster processing")
 
-                    nursery.start_soon(summarize, ck_idx)
+                    nursery.start_soon(self._summarize, chunks, ck_idx, callback, task_id)
 
             assert len(chunks) - end == n_clusters, "{} vs. {}".format(len(chunks) - end, n_clusters)
             labels.extend(lbls)
-            layers.append((end, len(chunks)))
             if callback:
                 callback(msg="Cluster one layer: {} -> {}".format(end - start, len(chunks) - end))
             start = end
@@ -15,11 +15,10 @@
 #
 import logging
 import time
-import traceback
 
 from api.db.db_models import close_connection
 from api.db.services.task_service import TaskService
-from rag.utils.redis_conn import REDIS_CONN
+from rag.utils.artifact_cache import ARTIFACT_CACHE
 from common import settings
 
 
@@ -39,18 +38,13 @@ def main():
     logging.info(f"TASKS: {len(locations)}")
     for kb_id, loc in locations:
         try:
-            if REDIS_CONN.is_alive():
-                try:
-                    key = "{}/{}".format(kb_id, loc)
-                    if REDIS_CONN.exist(key):
-                        continue
-                    file_bin = settings.STORAGE_IMPL.get(kb_id, loc)
-                    REDIS_CONN.transaction(key, file_bin, 12 * 60)
-                    logging.info("CACHE: {}".format(loc))
-                except Exception as e:
-                    traceback.print_stack(e)
-        except Exception as e:
-            traceback.print_stack(e)
+            # Staged once per content, the page/row range tasks of the document read it from the spill directory.
+            if ARTIFACT_CACHE.staged(kb_id, loc):
+                continue
+            ARTIFACT_CACHE.stage(kb_id, loc, settings.STORAGE_IMPL.get(kb_id, loc))
+            logging.info("CACHE: {}".format(loc))
+        except Exception:
+            logging.exception(f"Fail to stage {kb_id}/{loc}")
 
 
 if __name__ == "__main__":
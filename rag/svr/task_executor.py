@@ -53,16 +53,21 @@ from peewee import DoesNotExist
 from common.constants import LLMType, ParserType, PipelineTaskType
 from api.db.services.document_service import DocumentService
 from api.db.services.llm_service import LLMBundle
-from api.db.services.task_service import TaskService, has_canceled, CANVAS_DEBUG_DOC_ID, GRAPH_RAPTOR_FAKE_DOC_ID
+from api.db.services.tenant_llm_service import TOKEN_USAGE
+from api.db.services.task_service import TaskService, has_canceled, plan_tasks, CANVAS_DEBUG_DOC_ID, GRAPH_RAPTOR_FAKE_DOC_ID
 from api.db.services.file2document_service import File2DocumentService
 from common.versions import get_ragflow_version
 from api.db.db_models import close_connection
 from rag.app import laws, paper, presentation, manual, qa, table, book, resume, picture, naive, one, audio, \
     email, tag
 from rag.nlp import search, rag_tokenizer, add_positions
-from rag.raptor import RecursiveAbstractiveProcessing4TreeOrganizedRetrieval as Raptor
+from rag.raptor import RecursiveAbstractiveProcessing4TreeOrganizedRetrieval as Raptor, RAPTOR_CLUSTER_SEARCH
 from common.token_utils import num_tokens_from_string, truncate
+from rag.utils.artifact_cache import ARTIFACT_CACHE
 from rag.utils.redis_conn import REDIS_CONN, RedisDistributedLock
+from rag.utils.embedding_cache import EMBED_CACHE
+from rag.utils.fair_queue import AsyncTaskConsumer, BatchedAcker, FairScheduler, queue_stats
+from rag.utils.embedding_batcher import EMBEDDING_MAX_IN_FLIGHT, EmbeddingMatrix, encode_batches, pack_batches
 from graphrag.utils import chat_limiter
 from common.signal_utils import start_tracemalloc_and_snapshot, stop_tracemalloc
 from common.exceptions import TaskCanceledException
@@ -101,6 +106,9 @@ UNACKED_ITERATOR = None
 
 CONSUMER_NO = "0" if len(sys.argv) < 2 else sys.argv[1]
 CONSUMER_NAME = "task_executor_" + CONSUMER_NO
+TASK_ACKER = BatchedAcker()
+TASK_SCHEDULER = FairScheduler(settings.get_svr_queue_names(), SVR_CONSUMER_GROUP_NAME, CONSUMER_NAME, acker=TASK_ACKER)
+TASK_CONSUMER = AsyncTaskConsumer(TASK_SCHEDULER)
 BOOT_AT = datetime.now().astimezone().isoformat(timespec="milliseconds")
 PENDING_TASKS = 0
 LAG_TASKS = 0
@@ -112,9 +120,13 @@ CURRENT_TASKS = {}
 MAX_CONCURRENT_TASKS = int(os.environ.get('MAX_CONCURRENT_TASKS', "5"))
 MAX_CONCURRENT_CHUNK_BUILDERS = int(os.environ.get('MAX_CONCURRENT_CHUNK_BUILDERS', "1"))
 MAX_CONCURRENT_MINIO = int(os.environ.get('MAX_CONCURRENT_MINIO', '10'))
+# Bulk requests kept in flight per insert_es call, and the seconds between two cancellation checks while indexing.
+DOC_BULK_CONCURRENCY = int(os.environ.get('DOC_BULK_CONCURRENCY', '4'))
+DOC_BULK_CANCEL_CHECK_INTERVAL = float(os.environ.get('DOC_BULK_CANCEL_CHECK_INTERVAL', '2'))
 task_limiter = trio.Semaphore(MAX_CONCURRENT_TASKS)
 chunk_limiter = trio.CapacityLimiter(MAX_CONCURRENT_CHUNK_BUILDERS)
-embed_limiter = trio.CapacityLimiter(MAX_CONCURRENT_CHUNK_BUILDERS)
+# Embedding calls in flight at once over all the tasks, each one holds it for a batch.
+embed_limiter = trio.CapacityLimiter(EMBEDDING_MAX_IN_FLIGHT)
 minio_limiter = trio.CapacityLimiter(MAX_CONCURRENT_MINIO)
 kg_limiter = trio.CapacityLimiter(2)
 WORKER_HEARTBEAT_TIMEOUT = int(os.environ.get('WORKER_HEARTBEAT_TIMEOUT', '120'))
@@ -125,6 +137,8 @@ def signal_handler(sig, frame):
     logging.info("Received interrupt signal, shutting down...")
     stop_event.set()
     time.sleep(1)
+    TASK_ACKER.flush()
+    TOKEN_USAGE.flush()
     sys.exit(0)
 
 
@@ -164,19 +178,18 @@ async def collect():
     global CONSUMER_NAME, DONE_TASKS, FAILED_TASKS
     global UNACKED_ITERATOR
 
-    svr_queue_names = settings.get_svr_queue_names()
     try:
         if not UNACKED_ITERATOR:
-            UNACKED_ITERATOR = REDIS_CONN.get_unacked_iterator(svr_queue_names, SVR_CONSUMER_GROUP_NAME, CONSUMER_NAME)
+            UNACKED_ITERATOR = REDIS_CONN.get_unacked_iterator(TASK_SCHEDULER.streams(), SVR_CONSUMER_GROUP_NAME, CONSUMER_NAME)
         try:
             redis_msg = next(UNACKED_ITERATOR)
         except StopIteration:
-            for svr_queue_name in svr_queue_names:
-                redis_msg = REDIS_CONN.queue_consumer(svr_queue_name, SVR_CONSUMER_GROUP_NAME, CONSUMER_NAME)
-                if redis_msg:
-                    break
+            # Tenants take turns, one uploading a lot doesn't hold back the others.
+            # Waits for a task to be queued, off the trio loop.
+            redis_msg = await TASK_CONSUMER.get()
     except Exception:
         logging.exception("collect got exception")
+        await trio.sleep(5)
         return None, None
 
     if not redis_msg:
@@ -216,8 +229,9 @@ async def collect():
     return redis_msg, task
 
 
-async def get_storage_binary(bucket, name):
-    return await trio.to_thread.run_sync(lambda: settings.STORAGE_IMPL.get(bucket, name))
+async def get_storage_binary(bucket, name, size=None):
+    # The page/row range tasks of a document share one staged copy of it.
+    return await trio.to_thread.run_sync(lambda: ARTIFACT_CACHE.blob(bucket, name, lambda: settings.STORAGE_IMPL.get(bucket, name), size))
 
 
 @timeout(60*80, 1)
@@ -231,7 +245,7 @@ async def build_chunks(task, progress_callback):
     try:
         st = timer()
         bucket, name = File2DocumentService.get_storage_address(doc_id=task["doc_id"])
-        binary = await get_storage_binary(bucket, name)
+        binary = await get_storage_binary(bucket, name, task["size"])
         logging.info("From minio({}) {}/{}".format(timer() - st, task["location"], task["name"]))
     except TimeoutError:
         progress_callback(-1, "Internal server error: Fetch file from minio timeout. Could you try it again.")
@@ -422,6 +436,36 @@ def init_kb(row, vector_size: int):
     return settings.docStoreConn.createIdx(idxnm, row.get("kb_id", ""), vector_size)
 
 
+async def cached_encode(mdl, texts, batch_encode, on_batch=None):
+    """
+    Encode texts through the embedding cache, only the missed ones are sent to the model.
+    `batch_encode` takes a list of texts and returns (vectors, token_count). Misses are packed
+    by token count, and every batch is encoded holding `embed_limiter`, so the batches of concurrent
+    tasks interleave and EMBEDDING_MAX_IN_FLIGHT of them at most are in flight at the provider.
+    """
+    max_length = mdl.max_length - 10
+    tenant_id, llm_name = getattr(mdl, "tenant_id", ""), getattr(mdl, "llm_name", "")
+    cached = await trio.to_thread.run_sync(lambda: EMBED_CACHE.get_many(tenant_id, llm_name, texts, max_length))
+    matrix = EmbeddingMatrix(len(texts))
+    hit = [i for i, v in enumerate(cached) if v is not None]
+    if hit:
+        matrix.put(hit, [cached[i] for i in hit])
+    missed = [i for i, v in enumerate(cached) if v is None]
+    batches = pack_batches(texts, settings.EMBEDDING_BATCH_SIZE, indices=missed)
+
+    async def batch_done(txts, vts, done, total):
+        await trio.to_thread.run_sync(lambda: EMBED_CACHE.set_many(tenant_id, llm_name, txts, vts, max_length))
+        if on_batch:
+            on_batch(done - 1, total)
+
+    tk_count = 0
+    if batches:
+        tk_count = await encode_batches(texts, batches, batch_encode, matrix, on_batch=batch_done, limiter=embed_limiter)
+    if texts:
+        logging.info("Embedding cache hit {}/{} texts of {}".format(len(hit), len(texts), llm_name))
+    return matrix.result(), tk_count
+
+
 async def embedding(docs, mdl, parser_config=None, callback=None):
     if parser_config is None:
         parser_config = {}
@@ -447,17 +491,9 @@ async def embedding(docs, mdl, parser_config=None, callback=None):
         nonlocal mdl
         return mdl.encode([truncate(c, mdl.max_length-10) for c in txts])
 
-    cnts_ = np.array([])
-    for i in range(0, len(cnts), settings.EMBEDDING_BATCH_SIZE):
-        async with embed_limiter:
-            vts, c = await trio.to_thread.run_sync(lambda: batch_encode(cnts[i: i + settings.EMBEDDING_BATCH_SIZE]))
-        if len(cnts_) == 0:
-            cnts_ = vts
-        else:
-            cnts_ = np.concatenate((cnts_, vts), axis=0)
-        tk_count += c
-        callback(prog=0.7 + 0.2 * (i + 1) / len(cnts), msg="")
-    cnts = cnts_
+    cnts, c = await cached_encode(mdl, cnts, batch_encode,
+                                  lambda i, total: callback(prog=0.7 + 0.2 * (i + 1) / total, msg=""))
+    tk_count += c
     filename_embd_weight = parser_config.get("filename_embd_weight", 0.1) # due to the db support none value
     if not filename_embd_weight:
         filename_embd_weight = 0.1
@@ -527,21 +563,13 @@ async def run_dataflow(task: dict):
             def batch_encode(txts):
                 nonlocal embedding_model
                 return embedding_model.encode([truncate(c, embedding_model.max_length - 10) for c in txts])
-            vects = np.array([])
             texts = [o.get("questions", o.get("summary", o["text"])) for o in chunks]
-            delta = 0.20/(len(texts)//settings.EMBEDDING_BATCH_SIZE+1)
-            prog = 0.8
-            for i in range(0, len(texts), settings.EMBEDDING_BATCH_SIZE):
-                async with embed_limiter:
-                    vts, c = await trio.to_thread.run_sync(lambda: batch_encode(texts[i : i + settings.EMBEDDING_BATCH_SIZE]))
-                if len(vects) == 0:
-                    vects = vts
-                else:
-                    vects = np.concatenate((vects, vts), axis=0)
-                embedding_token_consumption += c
-                prog += delta
-                if i % (len(texts)//settings.EMBEDDING_BATCH_SIZE/100+1) == 1:
-                    set_progress(task_id, prog=prog, msg=f"{i+1} / {len(texts)//settings.EMBEDDING_BATCH_SIZE}")
+
+            def on_batch(i, total):
+                if i % (total//100+1) == 0:
+                    set_progress(task_id, prog=0.8 + 0.2 * (i + 1) / total, msg=f"{i+1} / {total}")
+            vects, c = await cached_encode(embedding_model, texts, batch_encode, on_batch)
+            embedding_token_consumption += c
 
             assert len(vects) == len(chunks)
             for i, ck in enumerate(chunks):
@@ -645,14 +673,15 @@ async def run_raptor_for_kb(row, kb_parser_config, chat_mdl, embd_mdl, vector_si
 
     raptor_config = kb_parser_config.get("raptor", {})
     vctr_nm = "q_%d_vec"%vector_size
+    # Only summarize what changed since the last run: new documents in file scope, touched clusters in dataset scope.
+    incremental = raptor_config.get("incremental", False)
 
     res = []
     tk_count = 0
     max_errors = int(os.environ.get("RAPTOR_MAX_ERRORS", 3))
 
-    async def generate(chunks, did):
-        nonlocal tk_count, res
-        raptor = Raptor(
+    def new_raptor():
+        return Raptor(
             raptor_config.get("max_cluster", 64),
             chat_mdl,
             embd_mdl,
@@ -660,9 +689,26 @@ async def run_raptor_for_kb(row, kb_parser_config, chat_mdl, embd_mdl, vector_si
             raptor_config["max_token"],
             raptor_config["threshold"],
             max_errors=max_errors,
+            cluster_search=raptor_config.get("cluster_search", RAPTOR_CLUSTER_SEARCH),
         )
-        original_length = len(chunks)
-        chunks = await raptor(chunks, kb_parser_config["raptor"]["random_seed"], callback, row["id"])
+
+    def load_chunks(doc_id):
+        chunks, ids, is_raptor = [], [], False
+        for d in settings.retriever.chunk_list(doc_id, row["tenant_id"], [str(row["kb_id"])],
+                                             fields=["content_with_weight", vctr_nm, "raptor_kwd"],
+                                             sort_by_position=True):
+            if not d.get("content_with_weight") or not d.get(vctr_nm):
+                continue
+            is_raptor = is_raptor or bool(d.get("raptor_kwd"))
+            chunks.append((d["content_with_weight"], np.array(d[vctr_nm])))
+            ids.append(d["id"])
+        return chunks, ids, is_raptor
+
+    def summary_id(content):
+        return xxhash.xxh64((content + str(fake_doc_id)).encode("utf-8")).hexdigest()
+
+    def collect(raptor, chunks, leaf_ids, did):
+        nonlocal tk_count
         doc = {
             "doc_id": did,
             "kb_id": [str(row["kb_id"])],
@@ -673,36 +719,78 @@ async def run_raptor_for_kb(row, kb_parser_config, chat_mdl, embd_mdl, vector_si
         if row["pagerank"]:
             doc[PAGERANK_FLD] = int(row["pagerank"])
 
-        for content, vctr in chunks[original_length:]:
+        ids = list(leaf_ids) + [summary_id(content) for content, _ in chunks[len(leaf_ids):]]
+        for i, (content, vctr) in enumerate(chunks[len(leaf_ids):], start=len(leaf_ids)):
             d = copy.deepcopy(doc)
-            d["id"] = xxhash.xxh64((content + str(fake_doc_id)).encode("utf-8")).hexdigest()
+            d["id"] = ids[i]
             d["create_time"] = str(datetime.now()).replace("T", " ")[:19]
             d["create_timestamp_flt"] = datetime.now().timestamp()
             d[vctr_nm] = vctr.tolist()
             d["content_with_weight"] = content
             d["content_ltks"] = rag_tokenizer.tokenize(content)
             d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
+            # the summarized chunks, which an incremental run uses to find the clusters touched by new chunks
+            d["source_id"] = [ids[j] for j in raptor.members.get(i, [])]
             res.append(d)
             tk_count += num_tokens_from_string(content)
 
+    async def generate(chunks, leaf_ids, did):
+        raptor = new_raptor()
+        chunks = await raptor(chunks, raptor_config["random_seed"], callback, row["id"])
+        collect(raptor, chunks, leaf_ids, did)
+
+    async def update(chunks, leaf_ids):
+        """Update the dataset scope tree, return False if it has to be rebuilt."""
+        summaries = settings.retriever.chunk_list(fake_doc_id, row["tenant_id"], [str(row["kb_id"])],
+                                                  max_count=100000, fields=["content_with_weight", vctr_nm, "source_id"])
+        summary_ids = set([d["id"] for d in summaries])
+        leaf_index = {id: i for i, id in enumerate(leaf_ids)}
+        clusters = []
+        for d in summaries:
+            source_ids = d.get("source_id") or []
+            if not source_ids:
+                # built before members were recorded
+                return False
+            if any([id in summary_ids for id in source_ids]):
+                continue
+            clusters.append((d["content_with_weight"], np.array(d[vctr_nm]), [leaf_index.get(id) for id in source_ids]))
+        raptor = new_raptor()
+        chunks = await raptor.update(chunks, clusters, raptor_config["random_seed"], callback, row["id"])
+        if chunks is None:
+            return False
+        collect(raptor, chunks, leaf_ids, fake_doc_id)
+        return True
+
+    def drop_stale_summaries():
+        """Drop the summaries the new tree doesn't have any more."""
+        new_ids = set([d["id"] for d in res])
+        stale_ids = [d["id"] for d in settings.retriever.chunk_list(fake_doc_id, row["tenant_id"], [str(row["kb_id"])],
+                                                                    max_count=100000, fields=["content_with_weight"])
+                     if d["id"] not in new_ids]
+        if stale_ids:
+            settings.docStoreConn.delete({"id": stale_ids}, search.index_name(row["tenant_id"]), row["kb_id"])
+
     if raptor_config.get("scope", "file") == "file":
         for x, doc_id in enumerate(doc_ids):
-            chunks = []
-            for d in settings.retriever.chunk_list(doc_id, row["tenant_id"], [str(row["kb_id"])],
-                                                 fields=["content_with_weight", vctr_nm],
-                                                 sort_by_position=True):
-                chunks.append((d["content_with_weight"], np.array(d[vctr_nm])))
-            await generate(chunks, doc_id)
+            chunks, leaf_ids, has_raptor = load_chunks(doc_id)
+            if incremental and has_raptor:
+                callback(msg=f"Skip document {doc_id} which has been summarized.")
+            else:
+                await generate(chunks, leaf_ids, doc_id)
             callback(prog=(x+1.)/len(doc_ids))
     else:
-        chunks = []
+        chunks, leaf_ids = [], []
         for doc_id in doc_ids:
-            for d in settings.retriever.chunk_list(doc_id, row["tenant_id"], [str(row["kb_id"])],
-                                                 fields=["content_with_weight", vctr_nm],
-                                                 sort_by_position=True):
-                chunks.append((d["content_with_weight"], np.array(d[vctr_nm])))
+            doc_chunks, doc_leaf_ids, _ = load_chunks(doc_id)
+            chunks.extend(doc_chunks)
+            leaf_ids.extend(doc_leaf_ids)
 
-        await generate(chunks, fake_doc_id)
+        if not incremental or not await update(chunks, leaf_ids):
+            if incremental:
+                callback(msg="Rebuild the RAPTOR tree of the dataset.")
+            await generate(chunks, leaf_ids, fake_doc_id)
+        if incremental:
+            await trio.to_thread.run_sync(drop_stale_summaries)
 
     return res, tk_count
 
@@ -716,7 +804,7 @@ async def delete_image(kb_id, chunk_id):
         raise
 
 
-async def insert_es(task_id, task_tenant_id, task_dataset_id, chunks, progress_callback):
+async def insert_es(task_id, task_tenant_id, task_dataset_id, chunks, progress_callback, append_chunk_ids=False):
     mothers = []
     mother_ids = set([])
     for ck in chunks:
@@ -728,47 +816,67 @@ async def insert_es(task_id, task_tenant_id, task_dataset_id, chunks, progress_c
             continue
         mother_ids.add(id)
         ck["mom_id"] = id
-        mom_ck = copy.deepcopy(ck)
+        mom_ck = {fld: ck[fld] for fld in ["doc_id", "kb_id"] if fld in ck}
         mom_ck["id"] = id
         mom_ck["content_with_weight"] = mom
         mom_ck["available_int"] = 0
-        flds = list(mom_ck.keys())
-        for fld in flds:
-            if fld not in ["id", "content_with_weight", "doc_id", "kb_id", "available_int"]:
-                del mom_ck[fld]
         mothers.append(mom_ck)
 
-    for b in range(0, len(mothers), settings.DOC_BULK_SIZE):
-        await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert(mothers[b:b + settings.DOC_BULK_SIZE], search.index_name(task_tenant_id), task_dataset_id))
-        task_canceled = has_canceled(task_id)
-        if task_canceled:
-            progress_callback(-1, msg="Task has been canceled.")
-            return False
+    # Record the chunk ids ahead of indexing: a crashed or re-run task can always clean up what it may have written.
+    chunk_ids = [chunk["id"] for chunk in chunks]
+    try:
+        if append_chunk_ids:
+            TaskService.append_chunk_ids(task_id, chunk_ids)
+        else:
+            TaskService.update_chunk_ids(task_id, " ".join(chunk_ids))
+    except DoesNotExist:
+        logging.warning(f"insert_es update_chunk_ids failed since task {task_id} is unknown.")
+        progress_callback(-1, msg=f"Chunk updates failed since task {task_id} is unknown.")
+        return False
+
+    index_name = search.index_name(task_tenant_id)
+    batches = [mothers[b:b + settings.DOC_BULK_SIZE] for b in range(0, len(mothers), settings.DOC_BULK_SIZE)]
+    batches += [chunks[b:b + settings.DOC_BULK_SIZE] for b in range(0, len(chunks), settings.DOC_BULK_SIZE)]
+    state = {"inserted": 0, "error": None, "canceled": False, "checked_at": timer()}
+
+    async def bulk_worker(receive_channel, cancel_scope):
+        async with receive_channel:
+            async for batch in receive_channel:
+                doc_store_result = await trio.to_thread.run_sync(settings.docStoreConn.insert, batch, index_name, task_dataset_id)
+                if doc_store_result:
+                    state["error"] = doc_store_result
+                    cancel_scope.cancel()
+                    return
+                state["inserted"] += len(batch)
+                if timer() - state["checked_at"] < DOC_BULK_CANCEL_CHECK_INTERVAL:
+                    continue
+                state["checked_at"] = timer()
+                if has_canceled(task_id):
+                    state["canceled"] = True
+                    cancel_scope.cancel()
+                    return
+                progress_callback(prog=0.8 + 0.1 * state["inserted"] / (len(mothers) + len(chunks)), msg="")
 
-    for b in range(0, len(chunks), settings.DOC_BULK_SIZE):
-        doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert(chunks[b:b + settings.DOC_BULK_SIZE], search.index_name(task_tenant_id), task_dataset_id))
-        task_canceled = has_canceled(task_id)
-        if task_canceled:
-            progress_callback(-1, msg="Task has been canceled.")
-            return False
-        if b % 128 == 0:
-            progress_callback(prog=0.8 + 0.1 * (b + 1) / len(chunks), msg="")
-        if doc_store_result:
-            error_message = f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
-            progress_callback(-1, msg=error_message)
-            raise Exception(error_message)
-        chunk_ids = [chunk["id"] for chunk in chunks[:b + settings.DOC_BULK_SIZE]]
-        chunk_ids_str = " ".join(chunk_ids)
-        try:
-            TaskService.update_chunk_ids(task_id, chunk_ids_str)
-        except DoesNotExist:
-            logging.warning(f"do_handle_task update_chunk_ids failed since task {task_id} is unknown.")
-            doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({"id": chunk_ids}, search.index_name(task_tenant_id), task_dataset_id))
-            async with trio.open_nursery() as nursery:
-                for chunk_id in chunk_ids:
-                    nursery.start_soon(delete_image, task_dataset_id, chunk_id)
-            progress_callback(-1, msg=f"Chunk updates failed since task {task_id} is unknown.")
-            return False
+    async with trio.open_nursery() as nursery:
+        send_channel, receive_channel = trio.open_memory_channel(0)
+        async with receive_channel:
+            for _ in range(min(DOC_BULK_CONCURRENCY, len(batches))):
+                nursery.start_soon(bulk_worker, receive_channel.clone(), nursery.cancel_scope)
+        async with send_channel:
+            try:
+                for batch in batches:
+                    await send_channel.send(batch)
+            except trio.BrokenResourceError:
+                # every worker stopped on an error or a cancellation
+                pass
+
+    if state["error"]:
+        error_message = f"Insert chunk error: {state['error']}, please check log file and Elasticsearch/Infinity status!"
+        progress_callback(-1, msg=error_message)
+        raise Exception(error_message)
+    if state["canceled"] or has_canceled(task_id):
+        progress_callback(-1, msg="Task has been canceled.")
+        return False
     return True
 
 
@@ -780,6 +888,12 @@ async def do_handle_task(task):
         await run_dataflow(task)
         return
 
+    if task_type == "plan":
+        # Counts the pages or rows and queues the range tasks, the file stays staged here for them.
+        if not has_canceled(task["id"]):
+            await trio.to_thread.run_sync(plan_tasks, task)
+        return
+
     task_id = task["id"]
     task_from_page = task["from_page"]
     task_to_page = task["to_page"]
@@ -962,7 +1076,7 @@ async def do_handle_task(task):
     if toc_thread:
         d = toc_thread.result()
         if d:
-            e = await insert_es(task_id, task_tenant_id, task_dataset_id, [d], progress_callback)
+            e = await insert_es(task_id, task_tenant_id, task_dataset_id, [d], progress_callback, append_chunk_ids=True)
             if not e:
                 return
             DocumentService.increment_chunk_num(task_doc_id, task_dataset_id, 0, 1, 0)
@@ -980,16 +1094,17 @@ async def handle_task():
     global DONE_TASKS, FAILED_TASKS
     redis_msg, task = await collect()
     if not task:
-        await trio.sleep(5)
         return
 
     task_type = task["task_type"]
     pipeline_task_type = TASK_TYPE_TO_PIPELINE_TASK_TYPE.get(task_type, PipelineTaskType.PARSE) or PipelineTaskType.PARSE
 
+    planned = False
     try:
         logging.info(f"handle_task begin for task {json.dumps(task)}")
         CURRENT_TASKS[task["id"]] = copy.deepcopy(task)
         await do_handle_task(task)
+        planned = task_type == "plan"
         DONE_TASKS += 1
         CURRENT_TASKS.pop(task["id"], None)
         logging.info(f"handle_task done for task {json.dumps(task)}")
@@ -1009,7 +1124,8 @@ async def handle_task():
         task_document_ids = []
         if task_type in ["graphrag", "raptor", "mindmap"]:
             task_document_ids = task["doc_ids"]
-        if not task.get("dataflow_id", ""):
+        # a planned document is recorded by the tasks it was split into
+        if not task.get("dataflow_id", "") and not planned:
             PipelineOperationLogService.record_pipeline_operation(document_id=task["doc_id"], pipeline_id="", task_type=pipeline_task_type, fake_document_ids=task_document_ids)
 
     redis_msg.ack()
@@ -1033,10 +1149,9 @@ async def report_status():
     while True:
         try:
             now = datetime.now()
-            group_info = REDIS_CONN.queue_info(settings.get_svr_queue_name(0), SVR_CONSUMER_GROUP_NAME)
-            if group_info is not None:
-                PENDING_TASKS = int(group_info.get("pending", 0))
-                LAG_TASKS = int(group_info.get("lag", 0))
+            group_info = queue_stats(settings.get_svr_queue_name(0), SVR_CONSUMER_GROUP_NAME)
+            PENDING_TASKS = group_info["pending"]
+            LAG_TASKS = group_info["lag"]
 
             pid = os.getpid()
             ip_address = await get_server_ip()
@@ -1052,6 +1167,8 @@ async def report_status():
                 "done": DONE_TASKS,
                 "failed": FAILED_TASKS,
                 "current": current,
+                "embedding_cache": EMBED_CACHE.stats(),
+                "token_usage": TOKEN_USAGE.stats(),
             })
             REDIS_CONN.zadd(CONSUMER_NAME, heartbeat, now.timestamp())
             logging.info(f"{CONSUMER_NAME} reported heartbeat: {heartbeat}")
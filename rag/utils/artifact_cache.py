@@ -0,0 +1,241 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Parse-once artifacts of documents.
+
+A PDF or a spreadsheet is split into page or row ranges, and every range task
+used to fetch the whole file and open it again. Files are staged in a spill
+directory under the hash of their content, next to the cheap artifacts every
+range needs: page count, outlines, the chars of each page... The spill
+directory can be local or shared by several hosts, its size is bounded and the
+least recently used files are evicted first. Which content a storage location
+holds is kept in Redis, so the API server, the prefetcher and the executors
+all find what another one has staged. Whatever writes or removes the content
+of a location forgets its reference.
+
+Artifacts are stored as JSON: a shared spill directory is only ever read as
+data, never as code to run.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+
+import xxhash
+
+from rag.utils.redis_conn import REDIS_CONN
+
+ARTIFACT_CACHE_ENABLED = int(os.environ.get("ARTIFACT_CACHE_ENABLED", "1"))
+ARTIFACT_CACHE_DIR = os.environ.get("ARTIFACT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "ragflow_artifacts"))
+# Upper bound of the spill directory.
+ARTIFACT_CACHE_SIZE = int(os.environ.get("ARTIFACT_CACHE_SIZE_MB", 4096)) * 1024 * 1024
+# How long a storage location is trusted to map to the content staged for it.
+ARTIFACT_REF_TTL = int(os.environ.get("ARTIFACT_REF_TTL", 3600))
+
+# Not json.dumps, which api.utils.api_utils patches to take sets and other types JSON doesn't have.
+_JSON_ENCODER = json.JSONEncoder(ensure_ascii=False)
+
+
+class ArtifactCache:
+    def __init__(self, root=ARTIFACT_CACHE_DIR, max_bytes=ARTIFACT_CACHE_SIZE, ref_ttl=ARTIFACT_REF_TTL, enabled=ARTIFACT_CACHE_ENABLED):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ref_ttl = ref_ttl
+        self.enabled = bool(enabled)
+        self._lock = threading.Lock()
+        # Bytes written since the size of the directory was last checked, None before the first check.
+        self._written = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(binary) -> str:
+        return xxhash.xxh3_128_hexdigest(binary)
+
+    def _path(self, digest, name):
+        return os.path.join(self.root, digest[:2], digest, name)
+
+    @staticmethod
+    def _ref_key(bucket, name) -> str:
+        return f"artifact_ref:{bucket}/{name}"
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _read(self, path):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def _write(self, path, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        with self._lock:
+            check = self._written is None or self._written + len(data) >= self.max_bytes // 10
+            self._written = 0 if check else self._written + len(data)
+        if check:
+            self.evict()
+
+    def evict(self):
+        """Removes the least recently used files until the directory fits in max_bytes."""
+        files = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for fnm in filenames:
+                path = os.path.join(dirpath, fnm)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in files)
+        if total <= self.max_bytes:
+            return
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                continue
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+        logging.info(f"ArtifactCache evicted down to {total / 1024 / 1024:.1f}MB")
+
+    def staged(self, bucket, name) -> bool:
+        if not self.enabled or not REDIS_CONN.is_alive():
+            return False
+        ref = REDIS_CONN.get(self._ref_key(bucket, name))
+        return bool(ref) and os.path.exists(self._path(str(ref).partition(":")[0], "blob"))
+
+    def stage(self, bucket, name, binary) -> str:
+        """Stages the content of a storage location, returns its digest."""
+        digest = self.digest(binary)
+        if not self.enabled:
+            return digest
+        try:
+            path = self._path(digest, "blob")
+            if not os.path.exists(path):
+                self._write(path, binary)
+            REDIS_CONN.set(self._ref_key(bucket, name), f"{digest}:{len(binary)}", self.ref_ttl)
+        except Exception:
+            logging.exception(f"ArtifactCache can't stage {bucket}/{name}")
+        return digest
+
+    def forget(self, bucket, name):
+        """Drops what is known of a storage location, whose content is about to change or be gone."""
+        if not self.enabled:
+            return
+        try:
+            REDIS_CONN.delete(self._ref_key(bucket, name))
+        except Exception:
+            logging.exception(f"ArtifactCache can't forget {bucket}/{name}")
+
+    def blob(self, bucket, name, fetch, size=None) -> bytes:
+        """
+        Content of a storage location. It comes from the spill directory if it has been
+        staged, else `fetch()` gets it and it's staged. `size`, when known, guards against
+        a location whose content has been replaced.
+        """
+        if self.enabled:
+            ref = REDIS_CONN.get(self._ref_key(bucket, name)) if REDIS_CONN.is_alive() else None
+            if ref:
+                digest, _, n = str(ref).partition(":")
+                data = self._read(self._path(digest, "blob")) if not size or str(size) == n else None
+                if data is not None and len(data) == int(n):
+                    self._count(True)
+                    return data
+        binary = fetch()
+        self._count(False)
+        self.stage(bucket, name, binary)
+        return binary
+
+    def get(self, digest, name):
+        if not self.enabled or not digest:
+            return None
+        data = self._read(self._path(digest, name + ".json"))
+        if data is None:
+            self._count(False)
+            return None
+        try:
+            obj = json.loads(data)
+        except Exception:
+            logging.warning(f"ArtifactCache got a corrupted {name} of {digest}, ignore it.")
+            return None
+        self._count(True)
+        return obj
+
+    def put(self, digest, name, obj):
+        """Stores `obj` as JSON: tuples read back as lists, and what JSON can't hold isn't stored."""
+        if not self.enabled or not digest:
+            return
+        try:
+            data = _JSON_ENCODER.encode(obj).encode("utf-8")
+        except (TypeError, ValueError) as e:
+            logging.warning(f"ArtifactCache can't store {name} of {digest} as JSON: {e}")
+            return
+        try:
+            self._write(self._path(digest, name + ".json"), data)
+        except Exception:
+            logging.exception(f"ArtifactCache can't store {name} of {digest}")
+
+    def get_or_build(self, digest, name, build):
+        """The artifact `name` of the content `digest`, built by `build()` the first time."""
+        obj = self.get(digest, name)
+        if obj is None:
+            obj = build()
+            if obj is not None:
+                self.put(digest, name, obj)
+        return obj
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+ARTIFACT_CACHE = ArtifactCache()
+
@@ -14,6 +14,9 @@
 #  limitations under the License.
 #
 
+import functools
+import inspect
+import logging
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 import numpy as np
@@ -22,6 +25,9 @@ DEFAULT_MATCH_VECTOR_TOPN = 10
 DEFAULT_MATCH_SPARSE_TOPN = 10
 VEC = list | np.ndarray
 
+# Writes after which the cached retrievals of the knowledge base written are stale.
+WRITE_METHODS = ("deleteIdx", "insert", "update", "delete")
+
 
 @dataclass
 class SparseVector:
@@ -141,11 +147,43 @@ class OrderByExpr(ABC):
     def fields(self):
         return self.fields
 
+def _invalidating_retrievals(method):
+    """Bumps the generation of the knowledge base written once `method` is done, see rag/utils/retrieval_cache.py."""
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            arguments = signature.bind_partial(self, *args, **kwargs).arguments
+            kb_ids = arguments.get("knowledgebaseId")
+            if not kb_ids and method.__name__ == "insert" and args:
+                kb_ids = [row.get("kb_id") for row in args[0] if isinstance(row.get("kb_id"), str)]
+            if kb_ids:
+                try:
+                    from rag.utils.retrieval_cache import bump_kb_generation
+                    bump_kb_generation(kb_ids)
+                except Exception as e:
+                    logging.warning(f"Fail to invalidate the retrieval cache of {kb_ids}: {e}")
+
+    wrapper.invalidates_retrievals = True
+    return wrapper
+
+
 class DocStoreConnection(ABC):
     """
     Database operations
     """
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Every engine drops the cached retrievals of the knowledge bases it writes, whatever the caller.
+        for name in WRITE_METHODS:
+            method = cls.__dict__.get(name)
+            if callable(method) and not getattr(method, "invalidates_retrievals", False):
+                setattr(cls, name, _invalidating_retrievals(method))
+
     @abstractmethod
     def dbType(self) -> str:
         """
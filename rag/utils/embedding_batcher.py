@@ -0,0 +1,131 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Batched embedding engine.
+
+Texts are packed into batches by token count, several batches are kept in
+flight and the vectors are written in place into one preallocated float32
+matrix, so the result keeps the input order without any concatenation.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import trio
+
+from common.token_utils import num_tokens_from_string
+
+EMBEDDING_BATCH_TOKENS = int(os.environ.get("EMBEDDING_BATCH_TOKENS", 8192))
+EMBEDDING_MAX_IN_FLIGHT = int(os.environ.get("EMBEDDING_MAX_IN_FLIGHT", 4))
+
+
+def pack_batches(texts: list[str], max_items: int, max_tokens: int = EMBEDDING_BATCH_TOKENS, indices: list[int] | None = None) -> list[list[int]]:
+    """
+    Group text positions into batches of at most `max_items` texts and about `max_tokens` tokens.
+    A text longer than `max_tokens` goes into a batch of its own.
+    """
+    if indices is None:
+        indices = list(range(len(texts)))
+    batches, cur, cur_tks = [], [], 0
+    for i in indices:
+        n = num_tokens_from_string(texts[i])
+        if cur and (len(cur) >= max_items or cur_tks + n > max_tokens):
+            batches.append(cur)
+            cur, cur_tks = [], 0
+        cur.append(i)
+        cur_tks += n
+    if cur:
+        batches.append(cur)
+    return batches
+
+
+class EmbeddingMatrix:
+    """Row-addressable float32 buffer, allocated once the vector dimension is known."""
+
+    def __init__(self, rows: int):
+        self.rows = rows
+        self.data = None
+
+    def put(self, idx: list[int], vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        assert len(idx) == len(vectors), f"Embedding returns {len(vectors)} vectors for {len(idx)} texts."
+        if self.data is None:
+            self.data = np.empty((self.rows, vectors.shape[1]), dtype=np.float32)
+        self.data[idx] = vectors
+
+    def result(self) -> np.ndarray:
+        if self.data is None:
+            return np.array([], dtype=np.float32)
+        return self.data
+
+
+async def encode_batches(texts: list[str], batches: list[list[int]], encode_fn, matrix: EmbeddingMatrix,
+                         max_in_flight: int = EMBEDDING_MAX_IN_FLIGHT, on_batch=None, limiter=None) -> int:
+    """
+    Run `encode_fn(list[str]) -> (vectors, token_count)` over the batches with up to `max_in_flight`
+    calls running concurrently in worker threads. A batch also holds `limiter`, when given, while
+    being encoded: callers sharing it queue `max_in_flight` batches at most, so they interleave.
+    `on_batch(batch_texts, vectors, done, total)` is called after each batch has been written into
+    `matrix`. Returns the consumed token count.
+    """
+    tk_count = 0
+    done = 0
+    in_flight = trio.Semaphore(max(1, max_in_flight))
+
+    async def _run(idx):
+        nonlocal tk_count, done
+        txts = [texts[i] for i in idx]
+        async with in_flight:
+            if limiter is None:
+                vts, c = await trio.to_thread.run_sync(lambda: encode_fn(txts))
+            else:
+                async with limiter:
+                    vts, c = await trio.to_thread.run_sync(lambda: encode_fn(txts))
+        matrix.put(idx, vts)
+        tk_count += c
+        done += 1
+        if on_batch:
+            await on_batch(txts, vts, done, len(batches))
+
+    async with trio.open_nursery() as nursery:
+        for idx in batches:
+            nursery.start_soon(_run, idx)
+    return tk_count
+
+
+def encode_batches_sync(texts: list[str], encode_fn, max_items: int, max_tokens: int = EMBEDDING_BATCH_TOKENS,
+                        max_in_flight: int = EMBEDDING_MAX_IN_FLIGHT):
+    """Thread pool counterpart of `encode_batches` for synchronous callers. Returns (matrix, token_count)."""
+    matrix = EmbeddingMatrix(len(texts))
+    batches = pack_batches(texts, max_items, max_tokens)
+    tk_count = 0
+    if len(batches) <= 1 or max_in_flight <= 1:
+        for idx in batches:
+            vts, c = encode_fn([texts[i] for i in idx])
+            matrix.put(idx, vts)
+            tk_count += c
+        return matrix.result(), tk_count
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        futures = [(idx, executor.submit(encode_fn, [texts[i] for i in idx])) for idx in batches]
+        for idx, fut in futures:
+            vts, c = fut.result()
+            matrix.put(idx, vts)
+            tk_count += c
+    return matrix.result(), tk_count
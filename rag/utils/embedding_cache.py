@@ -0,0 +1,148 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Content-addressed embedding cache.
+
+Vectors are stored in Redis as base64 encoded float32 buffers, keyed by
+(tenant, model name, truncation length, text). Re-parsing a document only
+sends the chunks whose text changed to the embedding provider.
+"""
+
+import base64
+import logging
+import math
+import os
+import threading
+import time
+
+import numpy as np
+import xxhash
+
+from rag.utils.redis_conn import REDIS_CONN
+
+EMBEDDING_CACHE_ENABLED = int(os.environ.get("EMBEDDING_CACHE_ENABLED", "1"))
+EMBEDDING_CACHE_TTL = int(os.environ.get("EMBEDDING_CACHE_TTL", 7 * 24 * 3600))
+# Upper bound of cached bytes per tenant, 0 means unlimited.
+EMBEDDING_CACHE_TENANT_LIMIT = int(os.environ.get("EMBEDDING_CACHE_TENANT_LIMIT_MB", 512)) * 1024 * 1024
+# The bytes cached by a tenant are counted per slot of this many seconds their entries expire in.
+EMBEDDING_CACHE_SIZE_SLOT = 3600
+
+
+class EmbeddingCache:
+    def __init__(self, prefix="embd_cache", ttl=EMBEDDING_CACHE_TTL, tenant_limit=EMBEDDING_CACHE_TENANT_LIMIT, enabled=EMBEDDING_CACHE_ENABLED):
+        self.prefix = prefix
+        self.ttl = ttl
+        self.tenant_limit = tenant_limit
+        self.enabled = bool(enabled)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+
+    def key(self, tenant_id, llm_name, txt, max_length=0) -> str:
+        hasher = xxhash.xxh64()
+        hasher.update(str(llm_name).encode("utf-8"))
+        hasher.update(str(max_length).encode("utf-8"))
+        hasher.update(str(txt).encode("utf-8", "surrogatepass"))
+        return f"{self.prefix}:{tenant_id}:{hasher.hexdigest()}"
+
+    def _size_key(self, tenant_id) -> str:
+        return f"{self.prefix}_size:{tenant_id}"
+
+    @staticmethod
+    def _dumps(vec) -> str:
+        return base64.b64encode(np.asarray(vec, dtype=np.float32).tobytes()).decode("ascii")
+
+    @staticmethod
+    def _loads(s: str) -> np.ndarray:
+        return np.frombuffer(base64.b64decode(s), dtype=np.float32)
+
+    def _count(self, hits, misses, rejected=0):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.rejected += rejected
+
+    def get_many(self, tenant_id, llm_name, texts: list[str], max_length=0) -> list[np.ndarray | None]:
+        if not self.enabled or not llm_name or not texts or not REDIS_CONN.is_alive():
+            return [None] * len(texts)
+        keys = [self.key(tenant_id, llm_name, t, max_length) for t in texts]
+        res = []
+        for v in REDIS_CONN.mget(keys):
+            if not v:
+                res.append(None)
+                continue
+            try:
+                res.append(self._loads(v))
+            except Exception:
+                logging.warning("EmbeddingCache got a corrupted entry, ignore it.")
+                res.append(None)
+        hits = len([v for v in res if v is not None])
+        self._count(hits, len(res) - hits)
+        return res
+
+    def set_many(self, tenant_id, llm_name, texts: list[str], vectors, max_length=0) -> bool:
+        if not self.enabled or not llm_name or not texts or not REDIS_CONN.is_alive():
+            return False
+        mapping = {}
+        for t, v in zip(texts, vectors):
+            mapping[self.key(tenant_id, llm_name, t, max_length)] = self._dumps(v)
+        size = sum([len(k) + len(v) for k, v in mapping.items()])
+        if self.tenant_limit > 0 and not self._reserve(tenant_id, size):
+            self._count(0, 0, len(mapping))
+            logging.debug(f"EmbeddingCache of tenant {tenant_id} is full, skip {len(mapping)} entries.")
+            return False
+        return REDIS_CONN.mset(mapping, self.ttl)
+
+    def _reserve(self, tenant_id, size: int) -> bool:
+        """
+        Accounts `size` bytes to the tenant unless it would go over its limit. The bytes live in a hash
+        field per slot their entries expire in, and the slots past are dropped: expired entries free
+        their room, and rejected writes leave the accounting as it was.
+        """
+        key = self._size_key(tenant_id)
+        now = time.time()
+        try:
+            slots = REDIS_CONN.REDIS.hgetall(key)
+            expired = [slot for slot in slots if int(slot) <= now]
+            used = sum(int(v) for slot, v in slots.items() if int(slot) > now)
+            if used + size > self.tenant_limit:
+                if expired:
+                    REDIS_CONN.REDIS.hdel(key, *expired)
+                return False
+            slot = math.ceil((now + self.ttl) / EMBEDDING_CACHE_SIZE_SLOT) * EMBEDDING_CACHE_SIZE_SLOT
+            pipeline = REDIS_CONN.REDIS.pipeline(transaction=True)
+            if expired:
+                pipeline.hdel(key, *expired)
+            pipeline.hincrby(key, str(slot), size)
+            pipeline.expire(key, self.ttl + EMBEDDING_CACHE_SIZE_SLOT)
+            pipeline.execute()
+        except Exception as e:
+            logging.warning(f"EmbeddingCache fails to account the size of tenant {tenant_id}: {e}")
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "rejected": self.rejected,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+EMBED_CACHE = EmbeddingCache()
@@ -294,7 +294,8 @@ class ESConnection(DocStoreConnection):
         for d in documents:
             assert "_id" not in d
             assert "id" in d
-            d_copy = copy.deepcopy(d)
+            # The bulk body is serialized right away, a shallow copy is enough to leave the caller's dict intact.
+            d_copy = dict(d)
             d_copy["kb_id"] = knowledgebaseId
             meta_id = d_copy.pop("id", "")
             operations.append(
@@ -497,6 +498,9 @@ class ESConnection(DocStoreConnection):
                 if isinstance(v, list):
                     m[n] = v
                     continue
+                if n.endswith("_feas") and isinstance(v, dict):
+                    m[n] = v
+                    continue
                 if n == "available_int" and isinstance(v, (int, float)):
                     m[n] = v
                     continue
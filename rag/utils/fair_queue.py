@@ -0,0 +1,407 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Tenant-fair scheduling over the task queues.
+
+A task queue is a Redis stream per priority, so one tenant queuing 50k pages
+used to hold back every task queued after it. Tasks are now queued in a
+sub-stream per tenant, `<queue>@<tenant_id>`, and the tenants having tasks are
+registered in the sorted set `<queue>@tenants`. Executors read at most a few
+messages of each tenant at once and pick among them by deficit round robin:
+every tenant gets `TASK_QUEUE_QUANTUM * weight` tasks per round, the weights
+being read from the hash `<queue>@weights` (1 by default). A tenant having
+`TENANT_MAX_INFLIGHT` tasks running on all executors waits for one of them to
+end. The queue itself is still read as the tenant "", for tasks queued
+without a tenant.
+
+Executors consume through `AsyncTaskConsumer`: reads run off the trio loop,
+wait on the streams when there is nothing to run instead of polling them, and
+fetch what the idle task slots need in one round trip. Acks are buffered by
+`BatchedAcker` and sent along with the next read.
+"""
+
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+
+import trio
+
+from rag.utils.redis_conn import REDIS_CONN, RedisMsg
+
+FAIR_TASK_QUEUE = int(os.environ.get("FAIR_TASK_QUEUE", "1"))
+TASK_QUEUE_QUANTUM = float(os.environ.get("TASK_QUEUE_QUANTUM", 1))
+# Tasks of a tenant running at once over all executors, 0 means unlimited.
+TENANT_MAX_INFLIGHT = int(os.environ.get("TENANT_MAX_INFLIGHT", 0))
+# A running task not acked after this long, because its executor died, doesn't count anymore.
+TENANT_INFLIGHT_TTL = int(os.environ.get("TENANT_INFLIGHT_TTL", 3 * 3600))
+# Tenants which haven't queued anything for this long aren't read anymore.
+TENANT_IDLE_TTL = int(os.environ.get("TENANT_IDLE_TTL", 7 * 24 * 3600))
+# Messages an executor reads at once, at least as many as its idle task slots. The ones
+# beyond are held by the executor until a slot frees.
+TASK_PREFETCH = int(os.environ.get("TASK_PREFETCH", 1))
+# How long an idle executor waits on the queues in one read.
+TASK_QUEUE_BLOCK_MS = int(os.environ.get("TASK_QUEUE_BLOCK_MS", 2000))
+# Acks go with the next read, or once this many are buffered or the oldest is this many seconds old.
+TASK_ACK_BATCH = int(os.environ.get("TASK_ACK_BATCH", 16))
+TASK_ACK_INTERVAL = float(os.environ.get("TASK_ACK_INTERVAL", 1.0))
+
+
+def tenant_stream(queue, tenant_id) -> str:
+    return f"{queue}@{tenant_id}" if tenant_id else queue
+
+
+def tenants_key(queue) -> str:
+    return f"{queue}@tenants"
+
+
+def weights_key(queue) -> str:
+    return f"{queue}@weights"
+
+
+def inflight_key(tenant_id) -> str:
+    return f"task_inflight@{tenant_id}"
+
+
+def queue_product(queue, message, tenant_id=None, client=None) -> bool:
+    """Queues a task message in the sub-stream of its tenant."""
+    if not FAIR_TASK_QUEUE or not tenant_id:
+        return REDIS_CONN.queue_product(queue, message)
+    for _ in range(3):
+        try:
+            pipe = (client or REDIS_CONN.REDIS).pipeline(transaction=True)
+            pipe.xadd(tenant_stream(queue, tenant_id), {"message": json.dumps(message)})
+            pipe.zadd(tenants_key(queue), {tenant_id: time.time()})
+            pipe.execute()
+            return True
+        except Exception as e:
+            logging.exception(f"fair_queue.queue_product {queue}@{tenant_id} got exception: {e}")
+    return False
+
+
+def queue_stats(queue, group_name, client=None) -> dict:
+    """Pending and lag of `queue`, summed over its tenant sub-streams."""
+    client = client or REDIS_CONN.REDIS
+    stats = {"pending": 0, "lag": 0}
+    try:
+        tenants = [""] + list(client.zrangebyscore(tenants_key(queue), time.time() - TENANT_IDLE_TTL, "+inf"))
+    except Exception as e:
+        logging.warning(f"fair_queue.queue_stats {queue} got exception: {e}")
+        tenants = [""]
+    for t in tenants:
+        try:
+            groups = client.xinfo_groups(tenant_stream(queue, t))
+        except Exception:
+            continue
+        for g in groups:
+            if g["name"] == group_name:
+                stats["pending"] += int(g.get("pending", 0) or 0)
+                stats["lag"] += int(g.get("lag", 0) or 0)
+    return stats
+
+
+class BatchedAcker:
+    """
+    Stands in for the Redis client of the messages it acks: the XACKs are buffered, and
+    sent one per stream with the next read of the scheduler, or by `xack` once
+    `batch_size` are buffered or the oldest is `interval` seconds old.
+    """
+
+    def __init__(self, client=None, batch_size=TASK_ACK_BATCH, interval=TASK_ACK_INTERVAL):
+        self._client = client
+        self.batch_size = batch_size
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._count = 0
+        self._since = None
+
+    @property
+    def client(self):
+        return self._client or REDIS_CONN.REDIS
+
+    def xack(self, stream, group_name, msg_id):
+        with self._lock:
+            self._pending.setdefault((stream, group_name), []).append(msg_id)
+            self._count += 1
+            if self._since is None:
+                self._since = time.time()
+            due = self._count >= self.batch_size or time.time() - self._since >= self.interval
+        if due:
+            self.flush()
+        return 1
+
+    def take(self) -> dict:
+        """The buffered acks, {(stream, group_name): [msg_id]}, to be sent by the caller."""
+        with self._lock:
+            pending, self._pending, self._count, self._since = self._pending, {}, 0, None
+        return pending
+
+    def restore(self, pending: dict):
+        """Buffers again acks taken but which couldn't be sent."""
+        with self._lock:
+            for k, ids in pending.items():
+                self._pending.setdefault(k, []).extend(ids)
+                self._count += len(ids)
+            if self._since is None:
+                self._since = time.time()
+
+    @staticmethod
+    def queue(pipe, pending: dict):
+        for (stream, group_name), ids in pending.items():
+            pipe.xack(stream, group_name, *ids)
+
+    def flush(self):
+        pending = self.take()
+        if not pending:
+            return
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            self.queue(pipe, pending)
+            pipe.execute()
+        except Exception as e:
+            logging.warning(f"BatchedAcker.flush got exception: {e}")
+            self.restore(pending)
+
+
+class _QueueState:
+    def __init__(self):
+        self.order = [""]
+        self.pos = 0
+        self.deficit = {"": 0.0}
+        self.buf = {"": deque()}
+        self.weights = {}
+
+
+class FairScheduler:
+    def __init__(self, queues, group_name, consumer_name, client=None, quantum=TASK_QUEUE_QUANTUM,
+                 max_inflight=TENANT_MAX_INFLIGHT, prefetch=1, refresh_interval=1.0, acker=None):
+        """
+        `queues` are read in the given order, a queue only when the ones before it have nothing
+        to run. `prefetch` is the number of messages read ahead per tenant, they are pending on
+        this consumer until picked. The messages are acked through `acker` if given, a
+        `BatchedAcker` whose buffered acks are sent along with the reads.
+        """
+        self.queues = list(queues)
+        self.group_name = group_name
+        self.consumer_name = consumer_name
+        self._client = client
+        self.quantum = quantum
+        self.max_inflight = max_inflight
+        self.prefetch = max(prefetch, 1)
+        self.refresh_interval = refresh_interval
+        self.acker = acker
+        self._state = {q: _QueueState() for q in self.queues}
+        self._grouped = set()
+        self._refreshed_at = 0
+
+    @property
+    def client(self):
+        return self._client or REDIS_CONN.REDIS
+
+    def streams(self) -> list[str]:
+        """Every stream read, the tenant sub-streams included."""
+        self._refresh(force=True)
+        return [tenant_stream(q, t) for q in self.queues for t in self._state[q].order]
+
+    def _refresh(self, force=False):
+        now = time.time()
+        if not force and now - self._refreshed_at < self.refresh_interval:
+            return
+        self._refreshed_at = now
+        for q in self.queues:
+            st = self._state[q]
+            try:
+                tenants = self.client.zrangebyscore(tenants_key(q), now - TENANT_IDLE_TTL, "+inf")
+                st.weights = {t: float(w) for t, w in (self.client.hgetall(weights_key(q)) or {}).items()}
+            except Exception:
+                logging.exception(f"FairScheduler can't read the tenants of {q}")
+                continue
+            active = set([""] + list(tenants))
+            # keep the round robin order, new tenants join at the end
+            order = [t for t in st.order if t in active or st.buf[t]]
+            order += [t for t in tenants if t not in st.buf]
+            for t in order:
+                st.buf.setdefault(t, deque())
+                st.deficit.setdefault(t, 0.0)
+            for t in set(st.buf) - set(order):
+                del st.buf[t]
+                del st.deficit[t]
+            cur = st.order[st.pos % len(st.order)]
+            st.order = order
+            st.pos = order.index(cur) if cur in order else 0
+
+    def _ensure_groups(self, streams):
+        for s in streams:
+            if s in self._grouped:
+                continue
+            try:
+                self.client.xgroup_create(s, self.group_name, id="0", mkstream=True)
+            except Exception as e:
+                if "busygroup" not in str(e).lower():
+                    raise
+            self._grouped.add(s)
+
+    def _fill(self, queues, want=1, block_ms=None) -> int | None:
+        """
+        Reads ahead the tenants of `queues` with nothing buffered, in one round trip which also
+        sends the buffered acks. Waits up to `block_ms` for a message to be queued if given.
+        The number of messages read, None if there is no tenant to read.
+        """
+        streams = {tenant_stream(q, t): (q, t) for q in queues for t in self._state[q].order if not self._state[q].buf[t]}
+        if not streams:
+            return None
+        self._ensure_groups(streams)
+        args = {
+            "groupname": self.group_name,
+            "consumername": self.consumer_name,
+            "streams": {s: ">" for s in streams},
+            "count": max(self.prefetch, math.ceil(want / len(streams))),
+            "block": block_ms or None,
+        }
+        acks = self.acker.take() if self.acker else {}
+        try:
+            if acks:
+                pipe = self.client.pipeline(transaction=False)
+                BatchedAcker.queue(pipe, acks)
+                pipe.xreadgroup(**args)
+                messages = pipe.execute()[-1]
+            else:
+                messages = self.client.xreadgroup(**args)
+        except Exception as e:
+            if acks:
+                self.acker.restore(acks)
+            if "nogroup" in str(e).lower():
+                self._grouped.difference_update(streams)
+            raise
+        n = 0
+        for stream, elements in messages or []:
+            q, t = streams[stream]
+            for msg_id, payload in elements:
+                if payload is None:
+                    continue
+                self._state[q].buf[t].append(RedisMsg(self.acker or self.client, stream, self.group_name, msg_id, payload,
+                                                      on_ack=self._release if t else None))
+                n += 1
+        return n
+
+    def _weight(self, st, t):
+        return max(st.weights.get(t, 1.0), 0.0)
+
+    def _capped(self, t) -> bool:
+        if not t or self.max_inflight <= 0:
+            return False
+        key = inflight_key(t)
+        self.client.zremrangebyscore(key, "-inf", time.time() - TENANT_INFLIGHT_TTL)
+        return self.client.zcard(key) >= self.max_inflight
+
+    def _release(self, msg: RedisMsg):
+        if self.max_inflight <= 0:
+            return
+        t = msg.get_queue_name().split("@", 1)[-1]
+        try:
+            self.client.zrem(inflight_key(t), msg.get_msg_id())
+        except Exception:
+            logging.exception(f"FairScheduler can't release {msg.get_msg_id()} of {t}")
+
+    def _pick(self, q):
+        st = self._state[q]
+        n = len(st.order)
+        quanta = [self.quantum * self._weight(st, t) for t in st.order]
+        quanta = [x for x in quanta if x > 0]
+        if not quanta:
+            return None
+        # enough visits for the tenant of the smallest weight to earn one task
+        for _ in range(n * math.ceil(1 / min(quanta)) + 1):
+            t = st.order[st.pos % n]
+            if st.buf[t] and st.deficit[t] >= 1 and not self._capped(t):
+                st.deficit[t] -= 1
+                msg = st.buf[t].popleft()
+                if t and self.max_inflight > 0:
+                    self.client.zadd(inflight_key(t), {msg.get_msg_id(): time.time()})
+                return msg
+            st.pos = (st.pos + 1) % n
+            t = st.order[st.pos]
+            if not st.buf[t]:
+                # an empty tenant doesn't save up for later
+                st.deficit[t] = 0.0
+            elif not self._capped(t):
+                st.deficit[t] += self.quantum * self._weight(st, t)
+        return None
+
+    def _take(self, q, n, picked):
+        got = self._fill([q], n - len(picked))
+        while len(picked) < n:
+            msg = self._pick(q)
+            if msg:
+                picked.append(msg)
+                continue
+            if not got:
+                break
+            got = self._fill([q], n - len(picked))
+
+    def next_batch(self, n, block_ms=None) -> list[RedisMsg]:
+        """
+        Up to `n` task messages to run. If there is nothing to run now, waits up to `block_ms`
+        for a task to be queued.
+        """
+        self._refresh()
+        picked = []
+        for q in self.queues:
+            self._take(q, n, picked)
+        if not picked and block_ms:
+            if self._fill(self.queues, n, block_ms) is None:
+                # every tenant having tasks is at its cap
+                time.sleep(block_ms / 1000)
+            for q in self.queues:
+                self._take(q, n, picked)
+        return picked
+
+    def next(self) -> RedisMsg | None:
+        """The next task message to run, None if there is nothing to run now."""
+        picked = self.next_batch(1)
+        return picked[0] if picked else None
+
+
+class AsyncTaskConsumer:
+    """
+    Hands the messages of a `FairScheduler` to the tasks of a trio loop. A read runs in a
+    worker thread, fetching at once what the waiting tasks need, at least `prefetch`
+    messages, and waits up to `block_ms` on the queues when they are empty.
+    """
+
+    def __init__(self, scheduler: FairScheduler, prefetch=TASK_PREFETCH, block_ms=TASK_QUEUE_BLOCK_MS):
+        self.scheduler = scheduler
+        self.prefetch = max(prefetch, 1)
+        self.block_ms = max(block_ms, 1)
+        self._buf = deque()
+        self._waiting = 0
+        self._lock = trio.Lock()
+
+    async def get(self) -> RedisMsg | None:
+        """The next task message to run, None if nothing was queued within `block_ms`."""
+        self._waiting += 1
+        try:
+            async with self._lock:
+                if not self._buf:
+                    n = max(self.prefetch, self._waiting)
+                    self._buf.extend(await trio.to_thread.run_sync(self.scheduler.next_batch, n, self.block_ms))
+                return self._buf.popleft() if self._buf else None
+        finally:
+            self._waiting -= 1
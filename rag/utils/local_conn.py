@@ -0,0 +1,925 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Embedded document store for single-box deployments, CI and benchmarks.
+
+Every index is a directory with an append-only JSON lines log of chunk writes
+and one raw float32 file per vector column, memory mapped at search time.
+Compaction writes the vector files of a new generation next to the current
+ones and only then swaps the log, so a crash leaves either store whole.
+A process replays the tail of the log before serving each request, so the API
+server and the task executors share one store through file locks.
+
+Full-text search is BM25 over the whitespace tokenized `*_tks`/`*_ltks` fields
+plus exact matching over keyword fields. Dense search is an exact cosine scan
+over the chunks left after filtering.
+"""
+
+import copy
+import fcntl
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+
+from common import settings
+from common.constants import PAGERANK_FLD, TAG_FLD
+from common.decorator import singleton
+from common.file_utils import get_project_base_directory
+from common.float_utils import get_float
+from rag.nlp import is_english
+from rag.utils.doc_store_conn import DocStoreConnection, MatchExpr, OrderByExpr, MatchTextExpr, MatchDenseExpr, \
+    FusionExpr
+
+logger = logging.getLogger('ragflow.local_conn')
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# The log is rewritten once it holds this many records and more than twice the live chunks.
+COMPACT_MIN_RECORDS = int(os.environ.get("LOCAL_DOC_STORE_COMPACT_MIN", 10000))
+VECTOR_SCAN_BLOCK = 65536
+# Elasticsearch returns 10 hits when no size is given.
+DEFAULT_SEARCH_SIZE = 10
+
+TEXT_FIELD = re.compile(r"^.*_l?tks$")
+KEYWORD_FIELD = re.compile(r"^(.*_(kwd|id|ids|uid|uids)|uid)$")
+VECTOR_FIELD = re.compile(r"^.*_([0-9]+)_vec$")
+INDEX_NAME = re.compile(r"^[\w.-]+$")
+
+_QUERY_TOKEN = re.compile(r'"(?:\\.|[^"\\])*"|[()]|\^[0-9]*\.?[0-9]+|~[0-9]*|(?:\\.|[^\s()"^~\\])+')
+
+
+def _unescape(s: str) -> str:
+    return re.sub(r"\\(.)", r"\1", s)
+
+
+def parse_query(text: str) -> list[list[tuple[tuple[str, ...], float]]]:
+    """
+    Parse the query_string syntax produced by FulltextQueryer into its top-level clauses.
+    Every clause is a list of (terms, boost) leaves, a leaf with several terms being a phrase.
+    Phrase slops are ignored.
+    """
+    tokens = _QUERY_TOKEN.findall(text or "")
+    pos = 0
+
+    def group():
+        nonlocal pos
+        clauses = []
+        while pos < len(tokens):
+            tk = tokens[pos]
+            pos += 1
+            if tk == ")":
+                break
+            if tk in ("OR", "AND", "||", "&&") or tk[0] in "^~":
+                continue
+            if tk == "(":
+                leaves = [leaf for c in group() for leaf in c]
+            elif tk[0] == '"':
+                leaves = [(tuple(_unescape(tk[1:-1]).split()), 1.0)]
+            else:
+                leaves = [((_unescape(tk),), 1.0)]
+            boost = 1.0
+            while pos < len(tokens) and tokens[pos][0] in "^~":
+                if tokens[pos][0] == "^":
+                    boost *= float(tokens[pos][1:])
+                pos += 1
+            leaves = [(terms, w * boost) for terms, w in leaves if terms]
+            if leaves:
+                clauses.append(leaves)
+        return clauses
+
+    clauses = []
+    while pos < len(tokens):
+        clauses.extend(group())
+    return clauses
+
+
+def _json_default(o):
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, np.generic):
+        return o.item()
+    if isinstance(o, (set, tuple)):
+        return list(o)
+    return str(o)
+
+
+def _value_in(v, values: set[str]) -> bool:
+    if v is None:
+        return False
+    if isinstance(v, list):
+        return any(str(x) in values for x in v)
+    return str(v) in values
+
+
+def _available(doc: dict, v: int) -> bool:
+    a = doc.get("available_int")
+    unavailable = a is not None and get_float(a) < 1
+    return unavailable if v == 0 else not unavailable
+
+
+class LocalIndex:
+    """One index: the chunks in memory, their vectors on disk and the inverted index over both."""
+
+    def __init__(self, root: str, name: str):
+        assert INDEX_NAME.match(name), f"Invalid index name: {name}"
+        self.name = name
+        self.dir = os.path.join(root, name)
+        self.log_path = os.path.join(self.dir, "docs.jsonl")
+        # The lock file lives outside of the index directory so that dropping the index keeps it.
+        self._lock_file = open(os.path.join(root, f".{name}.lock"), "a+")
+        self._mutex = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.docs = {}
+        self.seq = {}
+        self.vec_rows = defaultdict(dict)  # vector column -> {chunk id: row}
+        self.postings = defaultdict(lambda: defaultdict(dict))  # field -> term -> {chunk id: term frequency}
+        self.doc_len = defaultdict(dict)  # text field -> {chunk id: token count}
+        self.total_len = defaultdict(int)
+        self.records = 0
+        self._next_seq = 0
+        # Generation of the vector files, bumped by compactions. Logs of generation 0 have no "gen" record.
+        self.gen = 0
+        self._offset = 0
+        self._inode = None
+        self._matrices = {}
+
+    @contextmanager
+    def locked(self, exclusive=False):
+        with self._mutex:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                self._refresh()
+                yield self
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.log_path)
+
+    def create(self):
+        os.makedirs(self.dir, exist_ok=True)
+        open(self.log_path, "a").close()
+
+    def drop(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+        self._reset()
+
+    """
+    Log replay
+    """
+
+    def _refresh(self):
+        try:
+            st = os.stat(self.log_path)
+        except FileNotFoundError:
+            if self._inode is not None:
+                self._reset()
+            return
+        if st.st_ino != self._inode or st.st_size < self._offset:
+            # Dropped, re-created or compacted by someone else.
+            self._reset()
+            self._inode = st.st_ino
+        if st.st_size == self._offset:
+            return
+        with open(self.log_path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read(st.st_size - self._offset)
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            if line.strip():
+                self._apply(json.loads(line))
+        self._offset += end
+
+    def _apply(self, rec: dict):
+        self.records += 1
+        if rec["op"] == "gen":
+            self.gen = rec["gen"]
+            return
+        chunk_id = rec["id"]
+        if chunk_id in self.docs:
+            self._unindex(chunk_id)
+        if rec["op"] == "del":
+            self.seq.pop(chunk_id, None)
+            return
+        self.docs[chunk_id] = rec["doc"]
+        if chunk_id not in self.seq:
+            self.seq[chunk_id] = self._next_seq
+            self._next_seq += 1
+        for col, row in rec.get("vec", {}).items():
+            self.vec_rows[col][chunk_id] = row
+        self._index(chunk_id)
+
+    @staticmethod
+    def _terms(doc: dict):
+        for fld, v in doc.items():
+            if v is None:
+                continue
+            if TEXT_FIELD.match(fld):
+                yield fld, Counter(str(v).split()), True
+            elif KEYWORD_FIELD.match(fld):
+                yield fld, Counter([str(x) for x in (v if isinstance(v, list) else [v])]), False
+
+    def _index(self, chunk_id: str):
+        for fld, tf, is_text in self._terms(self.docs[chunk_id]):
+            postings = self.postings[fld]
+            for t, c in tf.items():
+                postings[t][chunk_id] = c
+            if is_text:
+                n = sum(tf.values())
+                self.doc_len[fld][chunk_id] = n
+                self.total_len[fld] += n
+
+    def _unindex(self, chunk_id: str):
+        doc = self.docs.pop(chunk_id)
+        for rows in self.vec_rows.values():
+            rows.pop(chunk_id, None)
+        for fld, tf, is_text in self._terms(doc):
+            postings = self.postings[fld]
+            for t in tf.keys():
+                p = postings.get(t)
+                if p is None:
+                    continue
+                p.pop(chunk_id, None)
+                if not p:
+                    del postings[t]
+            if is_text:
+                self.total_len[fld] -= self.doc_len[fld].pop(chunk_id, 0)
+
+    """
+    Writes, the exclusive lock must be held
+    """
+
+    def _write(self, records: list[dict]):
+        if not records:
+            return
+        os.makedirs(self.dir, exist_ok=True)
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            for rec in records:
+                f.write(json.dumps(rec, ensure_ascii=False, default=_json_default) + "\n")
+        self._refresh()
+        if self.records >= COMPACT_MIN_RECORDS and self.records > 2 * len(self.docs):
+            try:
+                self._compact()
+            except Exception:
+                # The records are written, the log only stays longer than it needs to be.
+                logger.exception(f"LocalIndex {self.name} compaction failed.")
+
+    def _vector_path(self, col: str, gen: int | None = None) -> str:
+        gen = self.gen if gen is None else gen
+        return os.path.join(self.dir, f"{col}.f32" if not gen else f"{col}.{gen}.f32")
+
+    def _append_vectors(self, col: str, vectors: list) -> int:
+        dim = int(VECTOR_FIELD.match(col).group(1))
+        arr = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), dim)
+        os.makedirs(self.dir, exist_ok=True)
+        with open(self._vector_path(col), "ab") as f:
+            f.seek(0, os.SEEK_END)
+            start = f.tell() // (dim * 4)
+            f.write(arr.tobytes())
+        return start
+
+    def put(self, items: list[tuple[str, dict]], keep_vectors=False) -> list[str]:
+        """
+        Write whole chunks, replacing the stored ones with their vectors. With `keep_vectors`,
+        as for updates, vector columns left out of a chunk keep their stored vectors.
+        """
+        errors = []
+        records = []
+        vectors = defaultdict(list)
+        for chunk_id, doc in items:
+            rec = {"op": "put", "id": chunk_id, "doc": {}, "vec": {}}
+            if keep_vectors:
+                rec["vec"] = {col: rows[chunk_id] for col, rows in self.vec_rows.items() if chunk_id in rows}
+            pending = []
+            for k, v in doc.items():
+                m = VECTOR_FIELD.match(k)
+                if not m or v is None or isinstance(v, str):
+                    rec["doc"][k] = v
+                    continue
+                if len(v) != int(m.group(1)):
+                    errors.append(f"{chunk_id}:{k} expects {m.group(1)} dimensions, got {len(v)}")
+                    rec = None
+                    break
+                pending.append((k, v))
+            if rec is None:
+                continue
+            for k, v in pending:
+                vectors[k].append((rec, v))
+            records.append(rec)
+        for col, pairs in vectors.items():
+            row = self._append_vectors(col, [v for _, v in pairs])
+            for n, (rec, _) in enumerate(pairs):
+                rec["vec"][col] = row + n
+        self._write(records)
+        return errors
+
+    def remove(self, chunk_ids: list[str]):
+        self._write([{"op": "del", "id": chunk_id} for chunk_id in chunk_ids if chunk_id in self.docs])
+
+    def _compact(self):
+        # The vector files of the new generation never overwrite the ones the current log refers to:
+        # until the new log replaces it, a crash leaves the store as it was.
+        gen = self.gen + 1
+        new_rows = {}
+        for col, rows in self.vec_rows.items():
+            dim = int(VECTOR_FIELD.match(col).group(1))
+            matrix = self._matrix(col, dim)
+            ids = list(rows.keys())
+            with open(self._vector_path(col, gen), "wb") as f:
+                for b in range(0, len(ids), VECTOR_SCAN_BLOCK):
+                    f.write(np.asarray(matrix[[rows[i] for i in ids[b:b + VECTOR_SCAN_BLOCK]]]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            new_rows[col] = {chunk_id: n for n, chunk_id in enumerate(ids)}
+        with open(self.log_path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(json.dumps({"op": "gen", "gen": gen}) + "\n")
+            for chunk_id in sorted(self.docs.keys(), key=lambda i: self.seq[i]):
+                rec = {"op": "put", "id": chunk_id, "doc": self.docs[chunk_id],
+                       "vec": {col: rows[chunk_id] for col, rows in new_rows.items() if chunk_id in rows}}
+                f.write(json.dumps(rec, ensure_ascii=False, default=_json_default) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.log_path + ".tmp", self.log_path)
+        logger.info(f"LocalIndex {self.name} compacted {self.records} records into {len(self.docs)} chunks.")
+        self._reset()
+        self._refresh()
+        self._remove_stale_vectors()
+
+    def _remove_stale_vectors(self):
+        """Vector files of former generations, or left by a compaction that didn't finish."""
+        live = {os.path.basename(self._vector_path(col)) for col in self.vec_rows.keys()}
+        for fnm in os.listdir(self.dir):
+            if fnm.endswith(".f32") and fnm not in live:
+                try:
+                    os.unlink(os.path.join(self.dir, fnm))
+                except OSError:
+                    pass
+
+    """
+    Reads, the shared lock must be held
+    """
+
+    def _matrix(self, col: str, dim: int):
+        path = self._vector_path(col)
+        rows = os.path.getsize(path) // (dim * 4) if os.path.exists(path) else 0
+        matrix = self._matrices.get(col)
+        if matrix is None or len(matrix) < rows:
+            if rows:
+                matrix = np.memmap(path, dtype=np.float32, mode="r", shape=(rows, dim))
+            else:
+                matrix = np.zeros((0, dim), dtype=np.float32)
+            self._matrices[col] = matrix
+        return matrix
+
+    def vector(self, col: str, chunk_id: str) -> list[float] | None:
+        row = self.vec_rows.get(col, {}).get(chunk_id)
+        if row is None:
+            return None
+        dim = int(VECTOR_FIELD.match(col).group(1))
+        return self._matrix(col, dim)[row].tolist()
+
+    def select(self, condition: dict, skip_empty=True) -> list[str]:
+        """Ids of the chunks matching the filter conditions, in insertion order."""
+        ids = None
+        checks = []
+        for k, v in condition.items():
+            if k == "available_int" and isinstance(v, int):
+                checks.append(lambda d, v=v: _available(d, v))
+                continue
+            if not v and skip_empty:
+                continue
+            if k == "exists":
+                checks.append(lambda d, f=v: d.get(f) is not None)
+                continue
+            if k == "must_not":
+                if isinstance(v, dict) and "exists" in v:
+                    checks.append(lambda d, f=v["exists"]: d.get(f) is None)
+                continue
+            if not isinstance(v, (list, str, int, float)):
+                raise Exception(
+                    f"Condition `{str(k)}={str(v)}` value type is {str(type(v))}, expected to be int, str or list.")
+            values = v if isinstance(v, list) else [v]
+            if k == "id":
+                matched = {str(x) for x in values if str(x) in self.docs}
+            elif KEYWORD_FIELD.match(k):
+                postings = self.postings.get(k, {})
+                matched = set()
+                for x in values:
+                    matched.update(postings.get(str(x), {}).keys())
+            else:
+                checks.append(lambda d, k=k, values={str(x) for x in values}: _value_in(d.get(k), values))
+                continue
+            ids = matched if ids is None else ids & matched
+
+        if ids is None:
+            ids = self.docs.keys()
+        else:
+            ids = sorted(ids, key=lambda i: self.seq[i])
+        if not checks:
+            return list(ids)
+        return [i for i in ids if all(c(self.docs[i]) for c in checks)]
+
+    def _leaf_scores(self, fld: str, terms: tuple[str, ...], candidates: set[str]) -> dict[str, float]:
+        postings = self.postings.get(fld)
+        if not postings:
+            return {}
+        if not TEXT_FIELD.match(fld):
+            # Keyword fields match the whole value, like a boolean similarity.
+            return {i: 1.0 for i in postings.get(" ".join(terms), {}) if i in candidates}
+        lists = [postings.get(t) for t in terms]
+        if not all(lists):
+            return {}
+        lens = self.doc_len[fld]
+        n_docs = len(lens)
+        avg_len = self.total_len[fld] / max(n_docs, 1)
+        idfs = [math.log(1 + (n_docs - len(p) + 0.5) / (len(p) + 0.5)) for p in lists]
+        shortest = min(lists, key=len)
+        base = shortest if len(shortest) <= len(candidates) else candidates
+        res = {}
+        for i in base:
+            if i not in candidates or not all(i in p for p in lists):
+                continue
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lens[i] / avg_len)
+            res[i] = sum([idf * p[i] * (BM25_K1 + 1) / (p[i] + norm) for idf, p in zip(idfs, lists)])
+        return res
+
+    def text_scores(self, clauses, fields: list[str], min_should_match: float, candidates: list[str]) -> dict[str, float]:
+        """
+        BM25 scores of the candidates matching at least `min_should_match` of the top-level clauses.
+        Each leaf takes its best field, like the best_fields type of query_string.
+        """
+        candidates = set(candidates)
+        fields = [(f.split("^")[0], get_float(f.split("^")[1]) if "^" in f else 1.0) for f in fields]
+        scores, matched = defaultdict(float), defaultdict(int)
+        for clause in clauses:
+            clause_scores = defaultdict(float)
+            for terms, boost in clause:
+                best = {}
+                for fld, fld_boost in fields:
+                    for i, s in self._leaf_scores(fld, terms, candidates).items():
+                        if s * fld_boost > best.get(i, 0):
+                            best[i] = s * fld_boost
+                for i, s in best.items():
+                    clause_scores[i] += s * boost
+            for i, s in clause_scores.items():
+                scores[i] += s
+                matched[i] += 1
+        need = max(1, int(len(clauses) * min_should_match))
+        return {i: s for i, s in scores.items() if matched[i] >= need}
+
+    def vector_scores(self, col: str, query, candidates: list[str]) -> dict[str, float]:
+        """Cosine similarity between `query` and the stored vectors of the candidates."""
+        m = VECTOR_FIELD.match(col)
+        rows = self.vec_rows.get(col)
+        if not m or not rows:
+            return {}
+        dim = int(m.group(1))
+        q = np.asarray(query, dtype=np.float32).reshape(-1)
+        if len(q) != dim:
+            raise Exception(f"Query vector has {len(q)} dimensions while {col} has {dim}.")
+        q = q / (np.linalg.norm(q) or 1.0)
+        ids = [i for i in candidates if i in rows]
+        idx = np.fromiter((rows[i] for i in ids), dtype=np.int64, count=len(ids))
+        matrix = self._matrix(col, dim)
+        sims = np.empty(len(ids), dtype=np.float32)
+        for b in range(0, len(ids), VECTOR_SCAN_BLOCK):
+            block = np.asarray(matrix[idx[b:b + VECTOR_SCAN_BLOCK]])
+            norms = np.linalg.norm(block, axis=1)
+            norms[norms == 0] = 1.0
+            sims[b:b + VECTOR_SCAN_BLOCK] = block @ q / norms
+        return dict(zip(ids, sims.tolist()))
+
+
+class LocalDocStore(DocStoreConnection):
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+        self._indices = {}
+        self._lock = threading.Lock()
+
+    def _index(self, indexName: str) -> LocalIndex:
+        with self._lock:
+            if indexName not in self._indices:
+                self._indices[indexName] = LocalIndex(self.root, indexName)
+            return self._indices[indexName]
+
+    """
+    Database operations
+    """
+
+    def dbType(self) -> str:
+        return "local"
+
+    def health(self) -> dict:
+        indices = [n for n in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, n))]
+        return {"type": "local", "status": "green", "path": self.root, "indices": len(indices)}
+
+    """
+    Table operations
+    """
+
+    def createIdx(self, indexName: str, knowledgebaseId: str, vectorSize: int):
+        idx = self._index(indexName)
+        with idx.locked(exclusive=True):
+            idx.create()
+        return True
+
+    def deleteIdx(self, indexName: str, knowledgebaseId: str):
+        if len(knowledgebaseId) > 0:
+            # The index need to be alive after any kb deletion since all kb under this tenant are in one index.
+            return
+        idx = self._index(indexName)
+        with idx.locked(exclusive=True):
+            idx.drop()
+
+    def indexExist(self, indexName: str, knowledgebaseId: str = None) -> bool:
+        return self._index(indexName).exists()
+
+    """
+    CRUD operations
+    """
+
+    def search(
+            self, selectFields: list[str],
+            highlightFields: list[str],
+            condition: dict,
+            matchExprs: list[MatchExpr],
+            orderBy: OrderByExpr,
+            offset: int,
+            limit: int,
+            indexNames: str | list[str],
+            knowledgebaseIds: list[str],
+            aggFields: list[str] = [],
+            rank_feature: dict | None = None
+    ):
+        if isinstance(indexNames, str):
+            indexNames = indexNames.split(",")
+        assert isinstance(indexNames, list) and len(indexNames) > 0
+        assert "_id" not in condition
+        condition["kb_id"] = knowledgebaseIds
+
+        text_expr, dense_expr = None, None
+        vector_similarity_weight = 0.5
+        for m in matchExprs:
+            if isinstance(m, MatchTextExpr):
+                text_expr = m
+            elif isinstance(m, MatchDenseExpr):
+                dense_expr = m
+            elif isinstance(m, FusionExpr) and m.method == "weighted_sum" and "weights" in m.fusion_params:
+                vector_similarity_weight = get_float(m.fusion_params["weights"].split(",")[1])
+
+        clauses, min_should_match = [], 0.0
+        if text_expr:
+            clauses = parse_query(text_expr.matching_text)
+            min_should_match = text_expr.extra_options.get("minimum_should_match", 0.0)
+            if isinstance(min_should_match, str):
+                min_should_match = get_float(min_should_match.rstrip("%")) / 100.0
+
+        # (index, chunk id, chunk, text score, vector similarity)
+        hits = []
+        for indexName in indexNames:
+            idx = self._index(indexName)
+            if not idx.exists():
+                continue
+            with idx.locked():
+                candidates = idx.select(condition)
+                text_scores, sims = {}, {}
+                if text_expr:
+                    text_scores = idx.text_scores(clauses, text_expr.fields, min_should_match, candidates)
+                if dense_expr:
+                    sims = idx.vector_scores(dense_expr.vector_column_name, dense_expr.embedding_data, candidates)
+                if not text_expr and not dense_expr:
+                    matched = candidates
+                else:
+                    matched = set(text_scores.keys())
+                    if dense_expr:
+                        similarity = dense_expr.extra_options.get("similarity", 0.0)
+                        knn = sorted([(s, i) for i, s in sims.items() if s >= similarity], reverse=True)
+                        matched.update([i for _, i in knn[:dense_expr.topn]])
+                    matched = sorted(matched, key=lambda i: idx.seq[i])
+                for i in matched:
+                    hits.append((idx, i, idx.docs[i], text_scores.get(i), sims.get(i)))
+
+        max_text_score = max([h[3] for h in hits if h[3]] or [0.0])
+        scored = []
+        for idx, chunk_id, doc, text_score, sim in hits:
+            if text_expr and dense_expr:
+                score = (1.0 - vector_similarity_weight) * (text_score or 0.0) / (max_text_score or 1.0) \
+                        + vector_similarity_weight * (sim or 0.0)
+            elif text_expr:
+                score = text_score
+            elif dense_expr:
+                score = (1.0 + sim) / 2.0
+            else:
+                score = 0.0
+            if matchExprs and rank_feature:
+                score += self._rank_feature_score(doc, rank_feature)
+            scored.append((idx, chunk_id, doc, score))
+
+        if orderBy and orderBy.fields:
+            # Stable sorts from the last key to the first, chunks missing a key go last.
+            for field, order in reversed(orderBy.fields):
+                present = [h for h in scored if h[2].get(field) is not None]
+                missing = [h for h in scored if h[2].get(field) is None]
+                present.sort(key=lambda h: self._sort_value(field, h[2][field]), reverse=(order == 1))
+                scored = present + missing
+        elif matchExprs:
+            scored.sort(key=lambda h: h[3], reverse=True)
+
+        aggregations = {}
+        for fld in aggFields:
+            counter = Counter()
+            for _, _, doc, _ in scored:
+                v = doc.get(fld)
+                if v is None:
+                    continue
+                counter.update([str(x) for x in v] if isinstance(v, list) else [str(v)])
+            aggregations[f"aggs_{fld}"] = {"buckets": [{"key": k, "doc_count": n} for k, n in counter.most_common()]}
+
+        total = len(scored)
+        page = scored[offset:offset + limit] if limit > 0 else scored[:DEFAULT_SEARCH_SIZE]
+        terms = {t for clause in clauses for leaf_terms, _ in clause for t in leaf_terms}
+        vector_fields = [f for f in selectFields or [] if VECTOR_FIELD.match(f)]
+        res_hits = []
+        for idx, chunk_id, doc, score in page:
+            source = copy.deepcopy(doc)
+            if vector_fields:
+                with idx.locked():
+                    for f in vector_fields:
+                        v = idx.vector(f, chunk_id)
+                        if v is not None:
+                            source[f] = v
+            hit = {"_index": idx.name, "_id": chunk_id, "_score": score, "_source": source}
+            highlight = self._highlight(source, highlightFields, terms)
+            if highlight:
+                hit["highlight"] = highlight
+            res_hits.append(hit)
+        res = {"timed_out": False, "hits": {"total": {"value": total}, "hits": res_hits}}
+        if aggregations:
+            res["aggregations"] = aggregations
+        logger.debug(f"LocalDocStore.search {str(indexNames)} total: {total}")
+        return res
+
+    @staticmethod
+    def _rank_feature_score(doc: dict, rank_feature: dict) -> float:
+        score = 0.0
+        tags = doc.get(TAG_FLD)
+        if not isinstance(tags, dict):
+            tags = {}
+        for fld, sc in rank_feature.items():
+            v = doc.get(PAGERANK_FLD) if fld == PAGERANK_FLD else tags.get(fld)
+            if v:
+                score += sc * max(get_float(v), 0.0)
+        return score
+
+    @staticmethod
+    def _sort_value(field: str, v):
+        if isinstance(v, list):
+            nums = [get_float(x) for x in v]
+            return sum(nums) / len(nums) if nums else float("-inf")
+        if field.endswith("_int") or field.endswith("_flt") or field.endswith("_long") or isinstance(v, (int, float)):
+            return get_float(v)
+        return str(v)
+
+    @staticmethod
+    def _highlight(source: dict, highlightFields: list[str], terms: set[str]) -> dict:
+        highlight = {}
+        if not terms:
+            return highlight
+        for fld in highlightFields or []:
+            txt = source.get(fld)
+            if not isinstance(txt, str):
+                continue
+            tks = txt.split()
+            if not any(t in terms for t in tks):
+                continue
+            highlight[fld] = [" ".join([f"<em>{t}</em>" if t in terms else t for t in tks])]
+        return highlight
+
+    def get(self, chunkId: str, indexName: str, knowledgebaseIds: list[str]) -> dict | None:
+        idx = self._index(indexName)
+        if not idx.exists():
+            return None
+        with idx.locked():
+            doc = idx.docs.get(chunkId)
+            if doc is None:
+                return None
+            chunk = copy.deepcopy(doc)
+            for col in list(idx.vec_rows.keys()):
+                v = idx.vector(col, chunkId)
+                if v is not None:
+                    chunk[col] = v
+        chunk["id"] = chunkId
+        return chunk
+
+    def insert(self, documents: list[dict], indexName: str, knowledgebaseId: str = None) -> list[str]:
+        items = []
+        for d in documents:
+            assert "_id" not in d
+            assert "id" in d
+            doc = {k: v for k, v in d.items() if k != "id"}
+            doc["kb_id"] = knowledgebaseId
+            items.append((d["id"], doc))
+        idx = self._index(indexName)
+        try:
+            with idx.locked(exclusive=True):
+                if not idx.exists():
+                    idx.create()
+                return idx.put(items)
+        except Exception as e:
+            logger.exception(f"LocalDocStore.insert {indexName} got exception")
+            return [str(e)]
+
+    def update(self, condition: dict, newValue: dict, indexName: str, knowledgebaseId: str) -> bool:
+        doc = dict(newValue)
+        doc.pop("id", None)
+        condition["kb_id"] = knowledgebaseId
+        idx = self._index(indexName)
+        try:
+            with idx.locked(exclusive=True):
+                if "id" in condition and isinstance(condition["id"], str):
+                    # update specific single document
+                    chunk_id = condition["id"]
+                    if chunk_id not in idx.docs:
+                        logger.warning(f"LocalDocStore.update(index={indexName}, id={chunk_id}) chunk not found.")
+                        return False
+                    chunk = copy.deepcopy(idx.docs[chunk_id])
+                    chunk.update(doc)
+                    idx.put([(chunk_id, chunk)], keep_vectors=True)
+                    return True
+
+                # update unspecific maybe-multiple documents
+                items = []
+                for chunk_id in idx.select({k: v for k, v in condition.items() if isinstance(k, str)}):
+                    items.append((chunk_id, self._apply_update(copy.deepcopy(idx.docs[chunk_id]), newValue)))
+                idx.put(items, keep_vectors=True)
+                return True
+        except Exception as e:
+            logger.error(f"LocalDocStore.update got exception: {str(e)}")
+        return False
+
+    @staticmethod
+    def _apply_update(chunk: dict, newValue: dict) -> dict:
+        for k, v in newValue.items():
+            if k == "remove":
+                if isinstance(v, str):
+                    chunk.pop(v, None)
+                if isinstance(v, dict):
+                    for kk, vv in v.items():
+                        if isinstance(chunk.get(kk), list) and vv in chunk[kk]:
+                            chunk[kk].remove(vv)
+                continue
+            if k == "add":
+                if isinstance(v, dict):
+                    for kk, vv in v.items():
+                        chunk.setdefault(kk, [])
+                        if not isinstance(chunk[kk], list):
+                            chunk[kk] = [chunk[kk]]
+                        chunk[kk].append(vv.strip())
+                continue
+            if (not isinstance(k, str) or not v) and k != "available_int":
+                continue
+            if k == "id":
+                continue
+            if not isinstance(v, (str, int, float, list)):
+                raise Exception(
+                    f"newValue `{str(k)}={str(v)}` value type is {str(type(v))}, expected to be int, str.")
+            chunk[k] = v
+        return chunk
+
+    def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
+        assert "_id" not in condition
+        condition["kb_id"] = knowledgebaseId
+        idx = self._index(indexName)
+        if not idx.exists():
+            return 0
+        with idx.locked(exclusive=True):
+            if "id" in condition:
+                chunk_ids = condition["id"]
+                if not isinstance(chunk_ids, list):
+                    chunk_ids = [chunk_ids]
+                if not chunk_ids:  # when chunk_ids is empty, delete all of the knowledgebase
+                    chunk_ids = idx.select({"kb_id": knowledgebaseId}, skip_empty=False)
+                else:
+                    chunk_ids = [i for i in chunk_ids if i in idx.docs]
+            else:
+                chunk_ids = idx.select(condition, skip_empty=False)
+            idx.remove(chunk_ids)
+        logger.debug(f"LocalDocStore.delete {indexName} removed {len(chunk_ids)} chunks.")
+        return len(chunk_ids)
+
+    """
+    Helper functions for search result
+    """
+
+    def get_total(self, res):
+        if isinstance(res["hits"]["total"], type({})):
+            return res["hits"]["total"]["value"]
+        return res["hits"]["total"]
+
+    def get_chunk_ids(self, res):
+        return [d["_id"] for d in res["hits"]["hits"]]
+
+    def __getSource(self, res):
+        rr = []
+        for d in res["hits"]["hits"]:
+            d["_source"]["id"] = d["_id"]
+            d["_source"]["_score"] = d["_score"]
+            rr.append(d["_source"])
+        return rr
+
+    def get_fields(self, res, fields: list[str]) -> dict[str, dict]:
+        res_fields = {}
+        if not fields:
+            return {}
+        for d in self.__getSource(res):
+            m = {n: d.get(n) for n in fields if d.get(n) is not None}
+            for n, v in m.items():
+                if isinstance(v, list):
+                    m[n] = v
+                    continue
+                if n.endswith("_feas") and isinstance(v, dict):
+                    m[n] = v
+                    continue
+                if n == "available_int" and isinstance(v, (int, float)):
+                    m[n] = v
+                    continue
+                if not isinstance(v, str):
+                    m[n] = str(m[n])
+
+            if m:
+                res_fields[d["id"]] = m
+        return res_fields
+
+    def get_highlight(self, res, keywords: list[str], fieldnm: str):
+        ans = {}
+        for d in res["hits"]["hits"]:
+            hlts = d.get("highlight")
+            if not hlts:
+                continue
+            txt = "...".join([a for a in list(hlts.items())[0][1]])
+            if not is_english(txt.split()):
+                ans[d["_id"]] = txt
+                continue
+
+            txt = d["_source"][fieldnm]
+            txt = re.sub(r"[\r\n]", " ", txt, flags=re.IGNORECASE | re.MULTILINE)
+            txts = []
+            for t in re.split(r"[.?!;\n]", txt):
+                for w in keywords:
+                    t = re.sub(r"(^|[ .?/'\"\(\)!,:;-])(%s)([ .?/'\"\(\)!,:;-])" % re.escape(w), r"\1<em>\2</em>\3", t,
+                               flags=re.IGNORECASE | re.MULTILINE)
+                if not re.search(r"<em>[^<>]+</em>", t, flags=re.IGNORECASE | re.MULTILINE):
+                    continue
+                txts.append(t)
+            ans[d["_id"]] = "...".join(txts) if txts else "...".join([a for a in list(hlts.items())[0][1]])
+
+        return ans
+
+    def get_aggregation(self, res, fieldnm: str):
+        agg_field = "aggs_" + fieldnm
+        if "aggregations" not in res or agg_field not in res["aggregations"]:
+            return list()
+        bkts = res["aggregations"][agg_field]["buckets"]
+        return [(b["key"], b["doc_count"]) for b in bkts]
+
+    """
+    SQL
+    """
+
+    def sql(self, sql: str, fetch_size: int, format: str):
+        logger.warning("LocalDocStore does not support SQL retrieval.")
+        return None
+
+
+@singleton
+class LocalConnection(LocalDocStore):
+    def __init__(self):
+        path = settings.LOCAL.get("path", os.path.join("data", "local_doc_store"))
+        if not os.path.isabs(path):
+            path = os.path.join(get_project_base_directory(), path)
+        logger.info(f"Use the local doc store at {path} as the doc engine.")
+        super().__init__(path)
@@ -291,7 +291,7 @@ class OSConnection(DocStoreConnection):
         for d in documents:
             assert "_id" not in d
             assert "id" in d
-            d_copy = copy.deepcopy(d)
+            d_copy = dict(d)
             meta_id = d_copy.pop("id", "")
             operations.append(
                 {"index": {"_index": indexName, "_id": meta_id}})
@@ -481,6 +481,9 @@ class OSConnection(DocStoreConnection):
                 if isinstance(v, list):
                     m[n] = v
                     continue
+                if n.endswith("_feas") and isinstance(v, dict):
+                    m[n] = v
+                    continue
                 if not isinstance(v, str):
                     m[n] = str(m[n])
                 # if n.find("tks") > 0:
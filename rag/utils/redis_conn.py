@@ -34,16 +34,19 @@ except Exception:
         REDIS = {}
 
 class RedisMsg:
-    def __init__(self, consumer, queue_name, group_name, msg_id, message):
+    def __init__(self, consumer, queue_name, group_name, msg_id, message, on_ack=None):
         self.__consumer = consumer
         self.__queue_name = queue_name
         self.__group_name = group_name
         self.__msg_id = msg_id
         self.__message = json.loads(message["message"])
+        self.__on_ack = on_ack
 
     def ack(self):
         try:
             self.__consumer.xack(self.__queue_name, self.__group_name, self.__msg_id)
+            if self.__on_ack:
+                self.__on_ack(self)
             return True
         except Exception as e:
             logging.warning("[EXCEPTION]ack" + str(self.__queue_name) + "||" + str(e))
@@ -55,6 +58,9 @@ class RedisMsg:
     def get_msg_id(self):
         return self.__msg_id
 
+    def get_queue_name(self):
+        return self.__queue_name
+
 
 @singleton
 class RedisDB:
@@ -71,6 +77,8 @@ class RedisDB:
     def __init__(self):
         self.REDIS = None
         self.config = REDIS
+        # (queue, group) known to exist, so that consuming doesn't probe the groups every time
+        self._groups = set()
         self.__open__()
 
     def register_scripts(self) -> None:
@@ -159,6 +167,44 @@ class RedisDB:
             self.__open__()
         return False
 
+    def mget(self, keys: list[str]) -> list:
+        if not self.REDIS or not keys:
+            return [None] * len(keys)
+        try:
+            return self.REDIS.mget(keys)
+        except Exception as e:
+            logging.warning("RedisDB.mget " + str(keys[:3]) + " got exception: " + str(e))
+            self.__open__()
+        return [None] * len(keys)
+
+    def mset(self, mapping: dict, exp=3600):
+        """Set several keys with the same expiration in one round trip."""
+        if not mapping:
+            return True
+        try:
+            pipeline = self.REDIS.pipeline(transaction=False)
+            for k, v in mapping.items():
+                pipeline.set(k, v, exp)
+            pipeline.execute()
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.mset " + str(list(mapping.keys())[:3]) + " got exception: " + str(e))
+            self.__open__()
+        return False
+
+    def incrby(self, key: str, amount: int, exp=None):
+        try:
+            pipeline = self.REDIS.pipeline(transaction=True)
+            pipeline.incrby(key, amount)
+            if exp:
+                pipeline.expire(key, exp)
+            res = pipeline.execute()
+            return int(res[0])
+        except Exception as e:
+            logging.warning("RedisDB.incrby " + str(key) + " got exception: " + str(e))
+            self.__open__()
+        return None
+
     def sadd(self, key: str, member: str):
         try:
             self.REDIS.sadd(key, member)
@@ -252,23 +298,21 @@ class RedisDB:
                 self.__open__()
         return False
 
+    def _ensure_group(self, queue_name, group_name):
+        if (queue_name, group_name) in self._groups:
+            return
+        try:
+            self.REDIS.xgroup_create(queue_name, group_name, id="0", mkstream=True)
+        except redis.exceptions.ResponseError as e:
+            if "busygroup" not in str(e).lower():
+                raise
+        self._groups.add((queue_name, group_name))
+
     def queue_consumer(self, queue_name, group_name, consumer_name, msg_id=b">") -> RedisMsg:
         """https://redis.io/docs/latest/commands/xreadgroup/"""
         for _ in range(3):
             try:
-
-                try:
-                    group_info = self.REDIS.xinfo_groups(queue_name)
-                    if not any(gi["name"] == group_name for gi in group_info):
-                        self.REDIS.xgroup_create(queue_name, group_name, id="0", mkstream=True)
-                except redis.exceptions.ResponseError as e:
-                    if "no such key" in str(e).lower():
-                        self.REDIS.xgroup_create(queue_name, group_name, id="0", mkstream=True)
-                    elif "busygroup" in str(e).lower():
-                        logging.warning("Group already exists, continue.")
-                        pass
-                    else:
-                        raise
+                self._ensure_group(queue_name, group_name)
 
                 args = {
                     "groupname": group_name,
@@ -287,6 +331,8 @@ class RedisDB:
                 res = RedisMsg(self.REDIS, queue_name, group_name, msg_id, payload)
                 return res
             except Exception as e:
+                # the group may be gone with the stream, create it again on retry
+                self._groups.discard((queue_name, group_name))
                 if str(e) == 'no such key':
                     pass
                 else:
@@ -0,0 +1,121 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Two-level cache in front of Dealer.retrieval.
+
+Level 1 keeps query vectors keyed by (embedding model, question).
+Level 2 keeps ranked retrieval results. Their keys embed the generation
+counter of every knowledge base involved, so bumping a generation after
+chunks are inserted, updated or deleted makes older results unreachable.
+Every DocStoreConnection bumps the generation of the knowledge base it writes,
+see `DocStoreConnection.__init_subclass__`.
+"""
+
+import json
+import logging
+import os
+import threading
+
+import xxhash
+
+from rag.utils.embedding_cache import EmbeddingCache
+from rag.utils.redis_conn import REDIS_CONN
+
+RETRIEVAL_CACHE_ENABLED = int(os.environ.get("RETRIEVAL_CACHE_ENABLED", "1"))
+RETRIEVAL_CACHE_TTL = int(os.environ.get("RETRIEVAL_CACHE_TTL", 300))
+QUERY_EMBEDDING_CACHE_TTL = int(os.environ.get("QUERY_EMBEDDING_CACHE_TTL", 24 * 3600))
+# Writes become searchable at the next index refresh (every second, see conf/mapping.json). Results of a knowledge base
+# written less than this many seconds ago aren't cached, or one computed before the refresh would outlive it.
+RETRIEVAL_CACHE_WRITE_SETTLE = int(os.environ.get("RETRIEVAL_CACHE_WRITE_SETTLE", 2))
+
+QUERY_EMBED_CACHE = EmbeddingCache(prefix="qry_embd_cache", ttl=QUERY_EMBEDDING_CACHE_TTL, enabled=RETRIEVAL_CACHE_ENABLED)
+
+
+def _generation_key(kb_id) -> str:
+    return f"kb_generation:{kb_id}"
+
+
+def _written_key(kb_id) -> str:
+    return f"kb_written:{kb_id}"
+
+
+def bump_kb_generation(kb_ids):
+    """Invalidate the cached retrieval results of the given knowledge bases."""
+    if isinstance(kb_ids, str):
+        kb_ids = [kb_ids]
+    for kb_id in set(kb_ids or []):
+        REDIS_CONN.incrby(_generation_key(kb_id), 1)
+        if RETRIEVAL_CACHE_WRITE_SETTLE > 0:
+            REDIS_CONN.set(_written_key(kb_id), "1", RETRIEVAL_CACHE_WRITE_SETTLE)
+
+
+class RetrievalCache:
+    PREFIX = "retrieval_cache"
+
+    def __init__(self, ttl=RETRIEVAL_CACHE_TTL, enabled=RETRIEVAL_CACHE_ENABLED):
+        self.ttl = ttl
+        self.enabled = bool(enabled)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, kb_ids: list[str], **conditions) -> str | None:
+        """Key of the results of `conditions` over `kb_ids`, None if one of them was written too recently to cache them."""
+        kb_ids = sorted(set(kb_ids or []))
+        values = REDIS_CONN.mget([_generation_key(kb_id) for kb_id in kb_ids] + [_written_key(kb_id) for kb_id in kb_ids])
+        generations, written = values[:len(kb_ids)], values[len(kb_ids):]
+        if any(written):
+            return None
+        hasher = xxhash.xxh64()
+        hasher.update(json.dumps(list(zip(kb_ids, [g or "0" for g in generations]))).encode("utf-8"))
+        hasher.update(json.dumps(conditions, sort_keys=True, default=str, ensure_ascii=False).encode("utf-8"))
+        return f"{self.PREFIX}:{hasher.hexdigest()}"
+
+    def get(self, key: str) -> dict | None:
+        bin = REDIS_CONN.get(key)
+        with self._lock:
+            if bin:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not bin:
+            return None
+        try:
+            return json.loads(bin)
+        except Exception:
+            logging.warning(f"RetrievalCache got a corrupted entry {key}, ignore it.")
+        return None
+
+    def set(self, key: str, ranks: dict) -> bool:
+        try:
+            bin = json.dumps(ranks, ensure_ascii=False)
+        except (TypeError, ValueError):
+            logging.debug("RetrievalCache skips a result which is not JSON serializable.")
+            return False
+        return REDIS_CONN.set(key, bin, self.ttl)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "query_embedding": QUERY_EMBED_CACHE.stats(),
+            }
+
+
+RETRIEVAL_CACHE = RetrievalCache()
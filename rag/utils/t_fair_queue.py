@@ -0,0 +1,307 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import os
+import sys
+sys.path.insert(
+    0,
+    os.path.abspath(
+        os.path.join(
+            os.path.dirname(
+                os.path.abspath(__file__)),
+            '../../')))
+
+import argparse
+import json
+import random
+import socketserver
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+import trio
+import valkey
+
+from rag.utils.fair_queue import AsyncTaskConsumer, BatchedAcker, FairScheduler
+from rag.utils.redis_conn import RedisMsg
+
+
+class _RespStandIn:
+    """An in-memory server speaking the Redis protocol, with the stream, sorted set and hash commands of the task queues."""
+
+    def __init__(self):
+        self.streams = defaultdict(list)
+        self.groups = defaultdict(dict)
+        self.zsets = defaultdict(dict)
+        self.hashes = defaultdict(dict)
+        self.seq = 0
+        self.cond = threading.Condition()
+        stand_in = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            # as Redis does
+            disable_nagle_algorithm = True
+
+            def handle(self):
+                queued = None
+                while True:
+                    cmd = stand_in._read(self.rfile)
+                    if cmd is None:
+                        return
+                    name = cmd[0].upper()
+                    if name == "MULTI":
+                        queued, reply = [], "+OK"
+                    elif name == "EXEC":
+                        reply = [stand_in._call(c) for c in queued]
+                        queued = None
+                    elif queued is not None:
+                        queued.append(cmd)
+                        reply = "+QUEUED"
+                    else:
+                        reply = stand_in._call(cmd)
+                    self.wfile.write(stand_in._encode(reply))
+                    self.wfile.flush()
+
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @staticmethod
+    def _read(rfile):
+        line = rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            n = int(rfile.readline()[1:])
+            args.append(rfile.read(n + 2)[:-2].decode())
+        return args
+
+    @classmethod
+    def _encode(cls, v):
+        if v is None:
+            return b"$-1\r\n"
+        if isinstance(v, Exception):
+            return f"-{v}\r\n".encode()
+        if isinstance(v, bool) or isinstance(v, int):
+            return f":{int(v)}\r\n".encode()
+        if isinstance(v, str) and v[:1] == "+":
+            return f"{v}\r\n".encode()
+        if isinstance(v, (list, tuple)):
+            return f"*{len(v)}\r\n".encode() + b"".join(cls._encode(x) for x in v)
+        v = str(v).encode()
+        return b"$%d\r\n%s\r\n" % (len(v), v)
+
+    def _call(self, cmd):
+        with self.cond:
+            try:
+                return getattr(self, "_" + cmd[0].lower(), self._ok)(*cmd[1:])
+            except Exception as e:
+                return e
+
+    @staticmethod
+    def _score(v):
+        return float(v.replace("inf", "Infinity").lstrip("("))
+
+    def _ok(self, *args):
+        return "+OK"
+
+    def _ping(self, *args):
+        return "+PONG"
+
+    def _flushall(self, *args):
+        for d in [self.streams, self.groups, self.zsets, self.hashes]:
+            d.clear()
+        return "+OK"
+
+    def _xadd(self, key, msg_id, *fields):
+        self.seq += 1
+        msg_id = f"{int(time.time() * 1000)}-{self.seq}"
+        self.streams[key].append((msg_id, list(fields)))
+        self.cond.notify_all()
+        return msg_id
+
+    def _xgroup(self, sub, key, group, msg_id="0", *args):
+        if group in self.groups[key]:
+            raise Exception("BUSYGROUP Consumer Group name already exists")
+        self.groups[key][group] = {"last": len(self.streams[key]) if msg_id == "$" else 0, "pending": {}, "consumers": set()}
+        return "+OK"
+
+    def _xreadgroup(self, *args):
+        args = list(args)
+        group, consumer = args[1], args[2]
+        count = int(args[args.index("COUNT") + 1]) if "COUNT" in args else None
+        block = int(args[args.index("BLOCK") + 1]) if "BLOCK" in args else None
+        rest = args[args.index("STREAMS") + 1:]
+        keys = rest[:len(rest) // 2]
+        for k in keys:
+            if group not in self.groups[k]:
+                raise Exception("NOGROUP No such key or consumer group")
+        deadline = None if not block else time.time() + block / 1000
+        while True:
+            res = []
+            for k in keys:
+                g = self.groups[k][group]
+                g["consumers"].add(consumer)
+                elements = self.streams[k][g["last"]:g["last"] + (count or len(self.streams[k]))]
+                g["last"] += len(elements)
+                for msg_id, _ in elements:
+                    g["pending"][msg_id] = consumer
+                if elements:
+                    res.append([k, [[msg_id, fields] for msg_id, fields in elements]])
+            if res or block is None:
+                return res or None
+            if deadline and time.time() >= deadline:
+                return None
+            self.cond.wait(None if not deadline else deadline - time.time())
+
+    def _xack(self, key, group, *msg_ids):
+        g = self.groups[key].get(group, {"pending": {}})
+        return sum(g["pending"].pop(i, None) is not None for i in msg_ids)
+
+    def _xinfo(self, sub, key):
+        if key not in self.streams and key not in self.groups:
+            raise Exception("ERR no such key")
+        return [["name", name, "consumers", len(g["consumers"]), "pending", len(g["pending"]),
+                 "last-delivered-id", self.streams[key][g["last"] - 1][0] if g["last"] else "0-0",
+                 "entries-read", g["last"], "lag", len(self.streams[key]) - g["last"]]
+                for name, g in self.groups[key].items()]
+
+    def _zadd(self, key, *args):
+        pairs = [a for a in args if a.upper() not in ("NX", "XX", "GT", "LT", "CH")]
+        new = 0
+        for score, member in zip(pairs[::2], pairs[1::2]):
+            new += member not in self.zsets[key]
+            self.zsets[key][member] = float(score)
+        return new
+
+    def _zrangebyscore(self, key, lo, hi, *args):
+        return [m for m, s in sorted(self.zsets[key].items(), key=lambda x: x[1]) if self._score(lo) <= s <= self._score(hi)]
+
+    def _zremrangebyscore(self, key, lo, hi):
+        members = self._zrangebyscore(key, lo, hi)
+        for m in members:
+            del self.zsets[key][m]
+        return len(members)
+
+    def _zrem(self, key, *members):
+        return sum(self.zsets[key].pop(m, None) is not None for m in members)
+
+    def _zcard(self, key):
+        return len(self.zsets[key])
+
+    def _hgetall(self, key):
+        return [x for kv in self.hashes[key].items() for x in kv]
+
+
+def _probing_consume(client, queue_name, group_name, consumer_name):
+    """Consuming as `RedisDB.queue_consumer` did: probing the groups, then reading one message."""
+    if not any(gi["name"] == group_name for gi in client.xinfo_groups(queue_name)):
+        client.xgroup_create(queue_name, group_name, id="0", mkstream=True)
+    messages = client.xreadgroup(group_name, consumer_name, {queue_name: ">"}, count=1, block=5)
+    if not messages:
+        return None
+    msg_id, payload = messages[0][1][0]
+    return RedisMsg(client, queue_name, group_name, msg_id, payload)
+
+
+def benchmark(n_tasks=3000, n_arrivals=300, slots=5):
+    """Dequeue rate and pickup latency of the executor task slots, on an in-process Redis protocol stand-in."""
+    stand_in = _RespStandIn()
+    client = valkey.StrictRedis(host="127.0.0.1", port=stand_in.port, decode_responses=True)
+    queue, group = "bench_queue", "bench_group"
+
+    def probing():
+        client.xgroup_create(queue, group, id="0", mkstream=True)
+
+        async def get():
+            msg = _probing_consume(client, queue, group, "c0")
+            if not msg:
+                await trio.sleep(5)
+            return msg
+        return get
+
+    def polling():
+        scheduler = FairScheduler([queue], group, "c0", client=client)
+
+        async def get():
+            msg = scheduler.next()
+            if not msg:
+                await trio.sleep(5)
+            return msg
+        return get
+
+    def waiting(prefetch):
+        def make():
+            scheduler = FairScheduler([queue], group, "c0", client=client, acker=BatchedAcker(client))
+            return AsyncTaskConsumer(scheduler, prefetch=prefetch).get
+        return make
+
+    def run(get, n):
+        latencies = []
+
+        async def slot(done):
+            while len(latencies) < n:
+                msg = await get()
+                if not msg:
+                    continue
+                latencies.append(time.time() - msg.get_message()["ts"])
+                msg.ack()
+            done.cancel()
+
+        async def main():
+            async with trio.open_nursery() as nursery:
+                for _ in range(slots):
+                    nursery.start_soon(slot, nursery.cancel_scope)
+
+        trio.run(main)
+        return latencies
+
+    def produce(n, interval=0.0):
+        rng = random.Random(0)
+        for i in range(n):
+            if interval:
+                time.sleep(rng.expovariate(1 / interval))
+            client.xadd(queue, {"message": json.dumps({"id": i, "ts": time.time()})})
+
+    modes = [("xinfo_groups probe, 1 per read, 5s idle sleep", probing), ("scheduler polled, 5s idle sleep", polling),
+             ("async consumer, prefetch 1", waiting(1)), ("async consumer, prefetch 8", waiting(8))]
+    print(f"{slots} task slots, {n_tasks} queued tasks, then {n_arrivals} tasks arriving every 20 ms on average")
+    for name, make in modes:
+        client.flushall()
+        get = make()
+        produce(n_tasks)
+        st = time.perf_counter()
+        run(get, n_tasks)
+        rate = n_tasks / (time.perf_counter() - st)
+        producer = threading.Thread(target=produce, args=(n_arrivals, 0.02))
+        producer.start()
+        latencies = np.array(run(get, n_arrivals)) * 1000
+        producer.join()
+        print(f"{name:>48}: {rate:8.0f} tasks/s, pickup latency p50 {np.percentile(latencies, 50):7.1f} ms, "
+              f"p99 {np.percentile(latencies, 99):7.1f} ms")
+    stand_in.server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dequeue rate and pickup latency of the executor task slots")
+    parser.add_argument('--tasks', help="Tasks queued before the slots start. Default: 3000", type=int, default=3000)
+    parser.add_argument('--arrivals', help="Tasks then arriving every 20 ms on average. Default: 300", type=int, default=300)
+    parser.add_argument('--slots', help="Task slots of the executor. Default: 5", type=int, default=5)
+    args = parser.parse_args()
+    benchmark(args.tasks, args.arrivals, args.slots)
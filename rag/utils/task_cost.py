@@ -0,0 +1,102 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Sizing the page and row range tasks of a document by their expected run time.
+
+PDFs used to be cut every 12 pages (22 for papers) and tables every 3000 rows,
+whatever they hold. A scanned page goes through OCR and costs several times a
+page having a text layer, so scans made long running tasks while small text
+PDFs were cut in tasks shorter than their setup. The cost of every page is now
+estimated from signals read without rendering it: text layer, images and size,
+weighted per parser, and the pages are cut in consecutive ranges of even cost,
+about `TASK_TARGET_SECONDS` each.
+"""
+
+import bisect
+import math
+import os
+
+# Wall clock seconds a parsing task is sized to, 0 cuts documents in fixed sizes as before.
+TASK_TARGET_SECONDS = float(os.environ.get("TASK_TARGET_SECONDS", 60))
+
+# Rough seconds per A4 page on a CPU executor: rendering, layout and table structure, plus
+# the OCR of pages without a text layer, plus the cropping of every image drawn.
+PAGE_SECONDS = 1.5
+OCR_PAGE_SECONDS = 4.0
+IMAGE_SECONDS = 0.2
+MAX_IMAGES = 20
+A4_AREA = 595 * 842
+# Pages of these parsers cost less or more than the general ones, after the former fixed sizes.
+PARSER_WEIGHTS = {"paper": 12 / 22}
+ROW_SECONDS = 0.02
+
+LEGACY_PAGE_SIZE = 12
+LEGACY_PAPER_PAGE_SIZE = 22
+LEGACY_TABLE_ROWS = 3000
+
+
+def page_cost(profile: dict | None, parser_id: str = "naive") -> float:
+    """Expected seconds to parse a page out of its profile, see `PdfParser.page_profiles`."""
+    weight = PARSER_WEIGHTS.get(parser_id, 1.0)
+    if not profile:
+        return weight * PAGE_SECONDS
+    area = (profile.get("width") or 0) * (profile.get("height") or 0)
+    scale = min(max(area / A4_AREA, 0.25), 4.0) if area > 0 else 1.0
+    seconds = PAGE_SECONDS + (0 if profile.get("text") else OCR_PAGE_SECONDS)
+    seconds += IMAGE_SECONDS * min(profile.get("images", 0), MAX_IMAGES)
+    return weight * scale * seconds
+
+
+def split_by_cost(costs: list[float], target: float | int = TASK_TARGET_SECONDS) -> list[tuple[int, int]]:
+    """
+    Cuts [0, len(costs)) in the fewest consecutive ranges costing about `target` at most,
+    of costs as even as the pages allow.
+    """
+    n = len(costs)
+    if n == 0:
+        return []
+    prefix = [0.0]
+    for c in costs:
+        prefix.append(prefix[-1] + c)
+    total = prefix[-1]
+    k = min(n, max(1, math.ceil(total / target))) if target > 0 else 1
+    cuts = [0]
+    for i in range(1, k):
+        goal = total * i / k
+        j = bisect.bisect_left(prefix, goal, lo=cuts[-1] + 1, hi=n)
+        # the page boundary nearest to the even share
+        if j - 1 > cuts[-1] and goal - prefix[j - 1] < prefix[j] - goal:
+            j -= 1
+        if j >= n - (k - 1 - i):
+            j = n - (k - i)
+        cuts.append(j)
+    cuts.append(n)
+    return [(s, e) for s, e in zip(cuts, cuts[1:]) if s < e]
+
+
+def split_evenly(n: int, size: int) -> list[tuple[int, int]]:
+    """Cuts [0, n) in the fewest ranges of `size` at most, of sizes differing by one at most."""
+    if n <= 0:
+        return []
+    k = math.ceil(n / max(size, 1))
+    bounds = [n * i // k for i in range(k + 1)]
+    return list(zip(bounds, bounds[1:]))
+
+
+def rows_per_task(target: float | int = TASK_TARGET_SECONDS) -> int:
+    if target <= 0:
+        return LEGACY_TABLE_ROWS
+    return max(1, round(target / ROW_SECONDS))
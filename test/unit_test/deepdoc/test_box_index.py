@@ -0,0 +1,66 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import json
+import os
+
+import pytest
+
+from deepdoc.vision.box_index import BoxIndex
+from deepdoc.vision.recognizer import Recognizer
+
+# Boxes and the results the box lookups gave before they were indexed.
+FIXTURES = json.load(open(os.path.join(os.path.dirname(__file__), "fixtures", "box_overlap.json")))
+
+
+class TestBoxIndex:
+
+    def test_touching(self):
+        """Test that the index returns exactly the boxes not separated from the query"""
+        case = FIXTURES["find_overlapped"][0]
+        index = BoxIndex(case["boxes"])
+        for q in case["queries"]:
+            expected = [i for i, b in enumerate(case["boxes"]) if not (b["x0"] > q["x1"] or b["x1"] < q["x0"] or b["bottom"] < q["top"] or b["top"] > q["bottom"])]
+            assert index.touching(q) == expected
+            assert index.touching(q, 10, 30) == [i for i in expected if 10 <= i < 30]
+
+    def test_empty(self):
+        assert BoxIndex([]).touching({"x0": 0, "x1": 1, "top": 0, "bottom": 1}) == []
+
+    @pytest.mark.parametrize("case", FIXTURES["find_overlapped"])
+    def test_find_overlapped(self, case):
+        index = BoxIndex(case["boxes"])
+        for q, expected, expected_naive in zip(case["queries"], case["expected"], case["expected_naive"]):
+            assert Recognizer.find_overlapped(q, case["boxes"], index=index) == expected
+            assert Recognizer.find_overlapped(q, case["boxes"], naive=True, index=index) == expected_naive
+            assert Recognizer.find_overlapped(q, case["boxes"]) == expected
+
+    @pytest.mark.parametrize("case", FIXTURES["find_overlapped_with_threshold"])
+    def test_find_overlapped_with_threshold(self, case):
+        index = BoxIndex(case["boxes"])
+        for thr, expected in case["expected"].items():
+            assert [Recognizer.find_overlapped_with_threshold(q, case["boxes"], float(thr), index=index) for q in case["queries"]] == expected
+
+    @pytest.mark.parametrize("case", FIXTURES["layouts_cleanup"])
+    def test_layouts_cleanup(self, case):
+        layouts = Recognizer.layouts_cleanup(case["boxes"], [dict(lt) for lt in case["layouts"]], case["far"], case["thr"])
+        assert [lt["id"] for lt in layouts] == case["expected"]
+
+    @pytest.mark.parametrize("fn", ["sort_C_firstly", "sort_R_firstly"])
+    def test_sort_firstly(self, fn):
+        for case in FIXTURES[fn]:
+            arr = getattr(Recognizer, fn)([dict(b) for b in case["boxes"]], case["thr"])
+            assert [b["id"] for b in arr] == case["expected"]
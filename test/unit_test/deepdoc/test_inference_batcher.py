@@ -0,0 +1,92 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import threading
+import time
+
+import pytest
+
+from deepdoc.vision.inference_batcher import InferenceBatcher
+
+
+class TestInferenceBatcher:
+
+    def test_results_in_order(self):
+        """Test that each caller gets the results of its own inputs, in order"""
+        batcher = InferenceBatcher(lambda xs: [x * 2 for x in xs], max_batch=8, max_wait=0.01)
+        assert batcher(list(range(20))) == [x * 2 for x in range(20)]
+        assert batcher([]) == []
+
+    def test_pools_concurrent_callers(self):
+        """Test that inputs of concurrent callers share runs"""
+        sizes = []
+
+        def run(xs):
+            sizes.append(len(xs))
+            time.sleep(0.01)
+            return [-x for x in xs]
+
+        batcher = InferenceBatcher(run, max_batch=64, max_wait=0.05)
+        results = {}
+
+        def caller(k):
+            results[k] = batcher([k * 100 + i for i in range(4)])
+
+        threads = [threading.Thread(target=caller, args=(k,)) for k in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert results == {k: [-(k * 100 + i) for i in range(4)] for k in range(8)}
+        assert sum(sizes) == 32
+        assert max(sizes) > 4
+
+    def test_errors_reach_callers(self):
+        """Test that a failing run raises in the callers of its inputs, and later runs still work"""
+        def run(xs):
+            if "bad" in xs:
+                raise RuntimeError("model failed")
+            return xs
+
+        batcher = InferenceBatcher(run, max_batch=4, max_wait=0)
+        with pytest.raises(RuntimeError):
+            batcher(["bad"])
+        assert batcher(["ok"]) == ["ok"]
+
+    def test_errors_stay_with_their_caller(self):
+        """Test that a pooled run failing on one caller's input does not fail the other callers"""
+        def run(xs):
+            time.sleep(0.01)
+            if "bad" in xs:
+                raise ValueError("bad")
+            return [x * 2 for x in xs]
+
+        batcher = InferenceBatcher(run, max_batch=64, max_wait=0.05)
+        results, errors = {}, {}
+
+        def caller(k, items):
+            try:
+                results[k] = batcher(items)
+            except ValueError as e:
+                errors[k] = e
+
+        threads = [threading.Thread(target=caller, args=(0, [1, 2, 3])), threading.Thread(target=caller, args=(1, ["bad"]))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert results == {0: [2, 4, 6]}
+        assert list(errors) == [1]
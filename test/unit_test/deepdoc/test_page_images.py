@@ -0,0 +1,60 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from deepdoc.parser.page_images import PageImages
+
+
+def page(seed, size=(120, 160)):
+    rnd = np.random.default_rng(seed)
+    return Image.fromarray(rnd.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8))
+
+
+class TestPageImages:
+
+    def test_lossless(self):
+        """Test that pages come back pixel for pixel"""
+        pages = [page(i) for i in range(3)]
+        store = PageImages(3)
+        for i, img in enumerate(pages):
+            store[i] = img
+        assert len(store) == 3
+        for img, stored in zip(pages, store):
+            assert stored.size == img.size
+            assert np.array_equal(np.array(stored), np.array(img))
+        assert np.array_equal(np.array(store[-1]), np.array(pages[-1]))
+        assert [np.array(p).sum() for p in store[1:]] == [np.array(p).sum() for p in pages[1:]]
+
+    def test_bounded_cache(self):
+        """Test that only the last decoded pages stay cached"""
+        store = PageImages(5, cache_size=2)
+        for i in range(5):
+            store[i] = page(i, size=(10 + i, 20))
+        for i in range(5):
+            assert store[i].size == (10 + i, 20)
+        assert list(store._cache.keys()) == [3, 4]
+        assert store[4] is store[4]
+
+    def test_missing_page(self):
+        """Test that a page which was never stored can't be read"""
+        store = PageImages(2)
+        store[0] = page(0)
+        with pytest.raises(IndexError):
+            store[1]
+        assert not PageImages()
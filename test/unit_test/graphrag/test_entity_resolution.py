@@ -0,0 +1,60 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import random
+
+import pytest
+
+from graphrag.entity_resolution import EntityResolution, all_pairs_candidates, blocking_candidates
+
+
+@pytest.fixture(scope="module")
+def er():
+    return EntityResolution(None)
+
+
+def random_names(alphabet, n, seed):
+    rnd = random.Random(seed)
+    return sorted({"".join(rnd.choice(alphabet) for _ in range(rnd.randint(1, 9))) for _ in range(n)})
+
+
+class TestBlockingCandidates:
+
+    @pytest.mark.parametrize("alphabet", ["abcde", "ab1 ", "abcdefgh2-", "数据智能科技a1"])
+    def test_same_pairs_as_all_pairs(self, er, alphabet):
+        """Test that blocking finds exactly the pairs, in the order, of testing every pair"""
+        names = random_names(alphabet, 300, seed=len(alphabet))
+        for subgraph in [set(names), set(names[::4]), set()]:
+            expected = all_pairs_candidates(names, subgraph, er.is_similarity)
+            assert blocking_candidates(names, subgraph, er.is_similarity) == expected
+
+    def test_known_pairs(self, er):
+        """Test misspellings, numbered names and Chinese names"""
+        names = sorted(["Microsoft", "Microsfot", "Apple", "Model 3", "Model 4", "北京大学", "北京大学医学部", "清华大学"])
+        pairs = blocking_candidates(names, set(names), er.is_similarity)
+        assert ("Microsfot", "Microsoft") in pairs
+        assert ("Model 3", "Model 4") not in pairs
+        assert pairs == all_pairs_candidates(names, set(names), er.is_similarity)
+
+    def test_custom_predicate_falls_back_to_all_pairs(self):
+        """Test that a subclass overriding the predicate doesn't use filters derived from the default one"""
+
+        class Resolution(EntityResolution):
+            def is_similarity(self, a, b):
+                return a[0] == b[0]
+
+        assert Resolution(None)._candidate_generator is all_pairs_candidates
+        assert EntityResolution(None, candidate_generator=all_pairs_candidates)._candidate_generator is all_pairs_candidates
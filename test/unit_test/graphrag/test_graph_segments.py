@@ -0,0 +1,182 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import json
+from types import SimpleNamespace
+
+import networkx as nx
+import pytest
+import trio
+
+from common import settings
+from graphrag import utils
+from graphrag.utils import GraphChange, get_graph, get_graph_manifest, graph_segment_count, graph_segment_of, set_graph
+from rag.nlp import search
+from rag.utils import retrieval_cache
+from rag.utils.doc_store_conn import OrderByExpr
+from rag.utils.local_conn import LocalDocStore
+
+TENANT = "tenant"
+KB = "kb1"
+INDEX = search.index_name(TENANT)
+DOCS = ["d0", "d1"]
+N_NODES = 40
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    s = LocalDocStore(str(tmp_path))
+    s.createIdx(INDEX, KB, 4)
+    monkeypatch.setattr(retrieval_cache, "bump_kb_generation", lambda kb_ids: None)
+    monkeypatch.setattr(settings, "docStoreConn", s, raising=False)
+    monkeypatch.setattr(settings, "retriever", search.Dealer(s), raising=False)
+    monkeypatch.setattr(utils, "GRAPH_SEGMENT_SIZE", 4)
+    monkeypatch.setattr(utils, "get_embed_cache", lambda llmnm, txt, tenant_id: [0.1, 0.2, 0.3, 0.4])
+    return s
+
+
+def make_graph():
+    """Entities of two documents, each linked to the next entity of its document."""
+    graph = nx.Graph(source_id=list(DOCS))
+    for i in range(N_NODES):
+        graph.add_node(f"entity {i}", entity_type="thing", description=f"entity number {i}", source_id=[DOCS[i % 2]])
+    for i in range(N_NODES - 2):
+        graph.add_edge(f"entity {i}", f"entity {i + 2}", description=f"{i} before {i + 2}", keywords=["before"], weight=1, source_id=[DOCS[i % 2]])
+    for n, degree in graph.degree:
+        graph.nodes[n]["rank"] = degree
+    return graph
+
+
+def everything(graph):
+    return GraphChange(added_updated_nodes=set(graph.nodes), added_updated_edges=set(graph.edges))
+
+
+def write(graph, change):
+    trio.run(set_graph, TENANT, KB, SimpleNamespace(llm_name="embd", tenant_id=TENANT), graph, change, None)
+
+
+def read():
+    return trio.run(get_graph, TENANT, KB)
+
+
+def rows(store, kind):
+    flds = ["content_with_weight", "source_id", "removed_kwd"]
+    res = store.search(flds, [], {"kb_id": KB, "knowledge_graph_kwd": [kind]}, [], OrderByExpr(), 0, 10000, INDEX, [KB])
+    return list(store.get_fields(res, flds).values())
+
+
+def assert_same(graph, expected):
+    assert dict(graph.nodes(data=True)) == dict(expected.nodes(data=True))
+    assert {frozenset((f, t)): attrs for f, t, attrs in graph.edges(data=True)} == {frozenset((f, t)): attrs for f, t, attrs in expected.edges(data=True)}
+    assert graph.graph["source_id"] == expected.graph["source_id"]
+
+
+class TestGraphSegments:
+
+    def test_round_trip(self, store):
+        """Test that a graph written in segments reads back the same"""
+        graph = make_graph()
+        write(graph, everything(graph))
+        segments = graph_segment_count(N_NODES)
+        assert segments > 1
+        assert sorted(json.loads(r["content_with_weight"])["segment"] for r in rows(store, "graph_segment")) == list(range(segments))
+        assert sorted(r["source_id"][0] for r in rows(store, "subgraph")) == DOCS
+        assert_same(read(), graph)
+
+    def test_incremental_rewrite(self, store, monkeypatch):
+        """Test that updating one entity rewrites its segment and its document's subgraph only"""
+        graph = make_graph()
+        write(graph, everything(graph))
+        inserted = []
+        insert = store.insert
+
+        def recording_insert(documents, indexName, knowledgebaseId=None):
+            inserted.extend(documents)
+            return insert(documents, indexName, knowledgebaseId)
+
+        monkeypatch.setattr(store, "insert", recording_insert)
+        graph.nodes["entity 3"]["description"] = "updated"
+        write(graph, GraphChange(added_updated_nodes={"entity 3"}))
+
+        written = {}
+        for d in inserted:
+            written.setdefault(d["knowledge_graph_kwd"], []).append(d)
+        segments = graph_segment_count(N_NODES)
+        assert [json.loads(d["content_with_weight"])["segment"] for d in written["graph_segment"]] == [graph_segment_of("entity 3", segments)]
+        assert [d["source_id"] for d in written["subgraph"]] == [["d1"]]
+        assert [d["entity_kwd"] for d in written["entity"]] == ["entity 3"]
+        assert "relation" not in written
+        assert sorted(r["source_id"][0] for r in rows(store, "subgraph")) == DOCS
+        assert_same(read(), graph)
+
+    def test_prune_after_document_deletion(self, store):
+        """Test that the graph read after a document deletion drops what only that document mentions"""
+        graph = make_graph()
+        write(graph, everything(graph))
+        # What DocumentService.remove_document does to the graph records of a deleted document.
+        store.update({"kb_id": KB, "knowledge_graph_kwd": ["entity", "relation", "graph", "subgraph", "community_report"], "source_id": "d1"},
+                     {"remove": {"source_id": "d1"}}, INDEX, KB)
+        store.update({"kb_id": KB, "knowledge_graph_kwd": ["graph"]}, {"removed_kwd": "Y"}, INDEX, KB)
+
+        expected = graph.subgraph([n for n in graph.nodes if graph.nodes[n]["source_id"] == ["d0"]]).copy()
+        expected.graph["source_id"] = ["d0"]
+        for n, degree in expected.degree:
+            expected.nodes[n]["rank"] = degree
+        pruned = read()
+        assert_same(pruned, expected)
+
+        # The next write is a full one, and clears the deletion flag.
+        write(pruned, GraphChange())
+        assert [r["removed_kwd"] for r in rows(store, "graph")] == ["N"]
+        assert_same(read(), expected)
+
+    def test_missing_segment_rebuilds(self, store, monkeypatch):
+        """Test that a graph with a lost segment is rebuilt from the subgraphs and flagged for a full rewrite"""
+        graph = make_graph()
+        write(graph, everything(graph))
+        flds = ["content_with_weight"]
+        res = store.search(flds, [], {"kb_id": KB, "knowledge_graph_kwd": ["graph_segment"]}, [], OrderByExpr(), 0, 1, INDEX, [KB])
+        assert store.delete({"id": list(store.get_fields(res, flds).keys())}, INDEX, KB) == 1
+
+        rebuilt = []
+        rebuild_graph = utils.rebuild_graph
+
+        async def recording_rebuild(tenant_id, kb_id, exclude_rebuild=None):
+            rebuilt.append(kb_id)
+            return await rebuild_graph(tenant_id, kb_id, exclude_rebuild)
+
+        monkeypatch.setattr(utils, "rebuild_graph", recording_rebuild)
+        g = read()
+        assert rebuilt == [KB]
+        assert set(g.nodes) == set(graph.nodes)
+        assert set(map(frozenset, g.edges)) == set(map(frozenset, graph.edges))
+        assert g.graph["source_id"] == DOCS
+        manifest, removed = trio.run(get_graph_manifest, TENANT, KB)
+        assert removed == "Y"
+
+    def test_legacy_single_chunk(self, store):
+        """Test that a graph stored in one chunk, as before segments, is read and then rewritten in segments"""
+        graph = make_graph()
+        store.insert([{"id": "legacy", "content_with_weight": json.dumps(nx.node_link_data(graph, edges="edges")), "knowledge_graph_kwd": "graph",
+                       "kb_id": KB, "source_id": list(DOCS), "available_int": 0, "removed_kwd": "N"}], INDEX, KB)
+        assert_same(read(), graph)
+
+        write(graph, GraphChange())
+        manifest, removed = trio.run(get_graph_manifest, TENANT, KB)
+        assert manifest["segments"] == graph_segment_count(N_NODES)
+        assert len(rows(store, "graph_segment")) == manifest["segments"]
+        assert len(rows(store, "graph")) == 1
+        assert_same(read(), graph)
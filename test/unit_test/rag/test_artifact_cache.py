@@ -0,0 +1,116 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import os
+
+import pytest
+
+from rag.utils import artifact_cache
+from rag.utils.artifact_cache import ArtifactCache
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def is_alive(self):
+        return True
+
+    def get(self, k):
+        return self.data.get(k)
+
+    def set(self, k, v, exp=3600):
+        self.data[k] = v
+        return True
+
+    def delete(self, k):
+        self.data.pop(k, None)
+        return True
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(artifact_cache, "REDIS_CONN", FakeRedis())
+    return ArtifactCache(root=str(tmp_path), max_bytes=1024 * 1024)
+
+
+class TestArtifactCache:
+
+    def test_blob_fetched_once(self, cache):
+        """Test that the range tasks of a document fetch it from storage once"""
+        fetched = []
+
+        def fetch():
+            fetched.append(1)
+            return b"%PDF-1.4 content"
+
+        for _ in range(3):
+            assert cache.blob("kb", "doc.pdf", fetch, size=16) == b"%PDF-1.4 content"
+        assert len(fetched) == 1
+        assert cache.staged("kb", "doc.pdf")
+        assert not cache.staged("kb", "other.pdf")
+
+    def test_blob_replaced(self, cache):
+        """Test that a location whose size changed is fetched again"""
+        cache.blob("kb", "doc.pdf", lambda: b"old", size=3)
+        assert cache.blob("kb", "doc.pdf", lambda: b"newer", size=5) == b"newer"
+        assert cache.blob("kb", "doc.pdf", lambda: b"unexpected", size=5) == b"newer"
+
+    def test_blob_forgotten(self, cache):
+        """Test that a location written again with content of the same size is fetched again once forgotten"""
+        cache.blob("kb", "doc.pdf", lambda: b"old", size=3)
+        cache.forget("kb", "doc.pdf")
+        assert not cache.staged("kb", "doc.pdf")
+        assert cache.blob("kb", "doc.pdf", lambda: b"new", size=3) == b"new"
+
+    def test_artifacts_built_once(self, cache):
+        digest = cache.digest(b"content")
+        built = []
+
+        def build():
+            built.append(1)
+            return {"chars": [{"text": "a"}], "english": True}
+
+        assert cache.get_or_build(digest, "page-0", build) == {"chars": [{"text": "a"}], "english": True}
+        assert cache.get_or_build(digest, "page-0", build) == {"chars": [{"text": "a"}], "english": True}
+        assert len(built) == 1
+        assert cache.get(cache.digest(b"other"), "page-0") is None
+
+    def test_artifacts_are_json(self, cache):
+        """Test that artifacts are stored as JSON, and that what JSON can't hold is built every time"""
+        digest = cache.digest(b"content")
+        cache.put(digest, "outlines", [("Title", 0), ("Section", 1)])
+        assert cache.get(digest, "outlines") == [["Title", 0], ["Section", 1]]
+        files = [f for _, _, fs in os.walk(cache.root) for f in fs]
+        assert files == ["outlines.json"]
+        assert cache.get_or_build(digest, "page-0", lambda: {"chars": {1, 2}}) == {"chars": {1, 2}}
+        assert cache.get(digest, "page-0") is None
+
+    def test_size_bounded(self, cache):
+        """Test that the least recently used files are evicted first"""
+        for i in range(12):
+            cache.put(f"{i:02d}" * 8, "page-0", os.urandom(100 * 1024).hex())
+        cache.evict()
+        total = sum(os.path.getsize(os.path.join(d, f)) for d, _, fs in os.walk(cache.root) for f in fs)
+        assert total <= cache.max_bytes
+        assert cache.get(f"{11:02d}" * 8, "page-0") is not None
+        assert cache.get(f"{0:02d}" * 8, "page-0") is None
+
+    def test_disabled(self, tmp_path):
+        cache = ArtifactCache(root=str(tmp_path), enabled=False)
+        assert cache.get_or_build("d" * 32, "pages", lambda: 3) == 3
+        assert cache.get("d" * 32, "pages") is None
+        assert os.listdir(tmp_path) == []
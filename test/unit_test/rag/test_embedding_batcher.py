@@ -0,0 +1,111 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import random
+import threading
+import time
+
+import numpy as np
+import trio
+
+from rag.utils.embedding_batcher import EmbeddingMatrix, encode_batches, encode_batches_sync, pack_batches
+
+
+def fake_encode(txts):
+    """Encode each text as [len(text), first char code] after a random delay"""
+    time.sleep(random.random() / 100)
+    return np.array([[len(t), ord(t[0])] for t in txts], dtype=np.float64), len(txts)
+
+
+class TestPackBatches:
+
+    def test_item_limit(self):
+        """Test that batches never exceed the item limit"""
+        batches = pack_batches(["hello"] * 10, max_items=3, max_tokens=1000)
+        assert [len(b) for b in batches] == [3, 3, 3, 1]
+        assert [i for b in batches for i in b] == list(range(10))
+
+    def test_token_limit(self):
+        """Test that batches are cut by token count"""
+        batches = pack_batches(["hello world"] * 6, max_items=100, max_tokens=4)
+        assert [len(b) for b in batches] == [2, 2, 2]
+
+    def test_oversized_text(self):
+        """Test that a text longer than the token budget goes alone"""
+        batches = pack_batches(["hi", "hello " * 50, "hi"], max_items=100, max_tokens=10)
+        assert batches == [[0], [1], [2]]
+
+    def test_indices_subset(self):
+        """Test packing only a subset of positions"""
+        batches = pack_batches(["a", "b", "c", "d"], max_items=2, indices=[1, 3])
+        assert batches == [[1, 3]]
+
+
+class TestEncodeBatches:
+
+    def test_ordered_reassembly(self):
+        """Test that concurrent batches land in the right rows"""
+        texts = [chr(ord("a") + i % 26) * (i + 1) for i in range(50)]
+        matrix = EmbeddingMatrix(len(texts))
+        batches = pack_batches(texts, max_items=4)
+        tokens = trio.run(encode_batches, texts, batches, fake_encode, matrix, 8)
+        expected, _ = fake_encode(texts)
+        assert tokens == len(texts)
+        assert matrix.result().dtype == np.float32
+        assert np.array_equal(matrix.result(), expected.astype(np.float32))
+
+    def test_shared_limiter(self):
+        """Test that tasks sharing a limiter interleave their batches, with the limiter's total in flight"""
+        lock, running, peak, order = threading.Lock(), [0], [0], []
+
+        def encode(txts):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+                order.append(txts[0][0])
+            time.sleep(0.005)
+            with lock:
+                running[0] -= 1
+            return fake_encode(txts)
+
+        big, small = ["a" * (i + 1) for i in range(40)], ["b" * (i + 1) for i in range(4)]
+
+        async def run():
+            limiter = trio.CapacityLimiter(2)
+            async with trio.open_nursery() as nursery:
+                for texts in (big, small):
+                    nursery.start_soon(lambda t=texts: encode_batches(t, pack_batches(t, max_items=2), encode,
+                                                                      EmbeddingMatrix(len(t)), 2, limiter=limiter))
+                    await trio.sleep(0.001)
+
+        trio.run(run)
+        assert peak[0] == 2
+        # the small task doesn't wait for all the batches of the big one
+        assert order.index("b") <= 4
+
+    def test_sync_engine(self):
+        """Test the thread pool engine returns the same as a single call"""
+        texts = ["x" * (i + 1) for i in range(37)]
+        res, tokens = encode_batches_sync(texts, fake_encode, max_items=5, max_in_flight=4)
+        expected, _ = fake_encode(texts)
+        assert tokens == len(texts)
+        assert np.array_equal(res, expected.astype(np.float32))
+
+    def test_empty(self):
+        """Test encoding nothing"""
+        res, tokens = encode_batches_sync([], fake_encode, max_items=5)
+        assert tokens == 0
+        assert len(res) == 0
@@ -0,0 +1,118 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import numpy as np
+import pytest
+
+from rag.utils import embedding_cache
+from rag.utils.embedding_cache import EmbeddingCache
+
+HOUR = 3600
+
+
+class FakeRedis:
+    """Strings and hashes expiring on a fake clock."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.kv = {}
+        self.hashes = {}
+        self.REDIS = self
+
+    def is_alive(self):
+        return True
+
+    def _live(self, key):
+        value, expiry = self.kv.get(key, (None, 0))
+        return value if expiry > self.clock[0] else None
+
+    def mget(self, keys):
+        return [self._live(k) for k in keys]
+
+    def mset(self, mapping, exp=3600):
+        for k, v in mapping.items():
+            self.kv[k] = (v, self.clock[0] + exp)
+        return True
+
+    def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    def hdel(self, key, *fields):
+        for f in fields:
+            self.hashes.get(key, {}).pop(f, None)
+
+    def hincrby(self, key, field, amount):
+        h = self.hashes.setdefault(key, {})
+        h[field] = str(int(h.get(field, 0)) + amount)
+
+    def expire(self, key, seconds):
+        pass
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def execute(self):
+        return []
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(embedding_cache.time, "time", lambda: now[0])
+    monkeypatch.setattr(embedding_cache, "REDIS_CONN", FakeRedis(now))
+    return now
+
+
+def vectors(n):
+    return [np.full(8, i, dtype=np.float32) for i in range(n)]
+
+
+def texts(prefix, n):
+    return [f"{prefix} {i}" for i in range(n)]
+
+
+class TestEmbeddingCache:
+
+    def test_round_trip(self, clock):
+        cache = EmbeddingCache(ttl=HOUR, tenant_limit=0)
+        assert cache.set_many("t1", "bge", texts("a", 3), vectors(3))
+        got = cache.get_many("t1", "bge", texts("a", 3) + ["b"])
+        assert all(np.array_equal(g, v) for g, v in zip(got, vectors(3))) and got[3] is None
+        assert cache.get_many("t2", "bge", texts("a", 1)) == [None]
+
+    def test_limit_frees_on_expiry(self, clock):
+        """Test that a tenant at its limit caches again once its entries expire, while writing all along"""
+        cache = EmbeddingCache(ttl=2 * HOUR)
+        batch = sum(len(cache.key("t1", "bge", t)) + len(cache._dumps(v)) for t, v in zip(texts("a", 10), vectors(10)))
+        cache.tenant_limit = 3 * batch
+        assert cache.set_many("t1", "bge", texts("a", 10), vectors(10))
+        assert cache.set_many("t1", "bge", texts("b", 10), vectors(10))
+        accepted = []
+        for i in range(6):
+            clock[0] += HOUR / 2
+            accepted.append(cache.set_many("t1", "bge", texts(f"c{i}", 10), vectors(10)))
+        # full until the first entries expired, and the rejected writes did not hold their room
+        assert accepted == [True, False, False, False, True, True]
+        clock[0] += 2 * HOUR
+        assert cache.set_many("t1", "bge", texts("d", 10), vectors(10))
+        assert cache.set_many("t2", "bge", texts("a", 10), vectors(10))
+
+    def test_rejected_writes_not_counted(self, clock):
+        cache = EmbeddingCache(ttl=HOUR, tenant_limit=1)
+        for _ in range(100):
+            assert not cache.set_many("t1", "bge", texts("a", 10), vectors(10))
+        assert embedding_cache.REDIS_CONN.hgetall(cache._size_key("t1")) == {}
+        assert cache.stats()["rejected"] == 1000
@@ -0,0 +1,160 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import threading
+import time
+from collections import Counter
+
+import pytest
+import trio
+
+from rag.flow.extractor import extractor
+from rag.flow.extractor.extractor import Extractor, ExtractorParam
+
+
+class FakeChatModel:
+    """Answers after `delay` seconds, recording the calls per chunk and how many ran at once."""
+
+    llm_name = "fake@Fake"
+
+    def __init__(self, delay=0.01, failures=None, errors=None):
+        self.delay = delay
+        self.failures = Counter(failures or {})
+        self.errors = Counter(errors or {})
+        self.calls = Counter()
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def chat(self, system, history, gen_conf, **kwargs):
+        text = history[-1]["content"]
+        with self._lock:
+            self.calls[text] += 1
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            fail = self.failures[text] > 0
+            self.failures[text] -= 1
+            error = self.errors[text] > 0
+            self.errors[text] -= 1
+        try:
+            time.sleep(self.delay)
+            if error:
+                return "**ERROR**: rate limited"
+            if fail:
+                raise ConnectionError("connection reset")
+            return f"{system}: {text[::-1]}"
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+@pytest.fixture
+def llm_cache(monkeypatch):
+    cache = {}
+    monkeypatch.setattr(extractor, "get_llm_cache", lambda llm, txt, history, conf: cache.get(str((llm, txt, history, conf))))
+    monkeypatch.setattr(extractor, "set_llm_cache", lambda llm, txt, v, history, conf: cache.__setitem__(str((llm, txt, history, conf)), v))
+    monkeypatch.setattr(extractor, "chat_limiter", trio.CapacityLimiter(4))
+    monkeypatch.setattr(extractor, "EXTRACTOR_RETRY_BACKOFF", 0)
+    return cache
+
+
+class UpstreamCanvas:
+    """The canvas of an extractor which generates on the chunks output of the component Up:0."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def get_component_name(self, cpn_id):
+        return cpn_id.split(":")[0]
+
+    def get_variable_value(self, exp):
+        return self.chunks if exp == "Up:0@chunks" else None
+
+
+def make_extractor(chat_mdl, chunks):
+    param = ExtractorParam()
+    param.field_name = "summary"
+    param.sys_prompt = "Summarize"
+    param.prompts = [{"role": "user", "content": "{Up:0@chunks}"}]
+    cpn = Extractor.__new__(Extractor)
+    cpn._param = param
+    cpn._canvas = UpstreamCanvas(chunks)
+    cpn._id = "Extractor:0"
+    cpn.callback = lambda *args, **kwargs: None
+    cpn.chat_mdl = chat_mdl
+    cpn.imgs = []
+    return cpn
+
+
+def run(cpn):
+    trio.run(cpn._invoke)
+    return cpn.output("chunks")
+
+
+CHUNKS = [{"text": f"chunk {i}"} for i in range(40)]
+
+
+class TestExtractor:
+
+    def test_concurrent_in_order(self, llm_cache):
+        chat_mdl = FakeChatModel()
+        out = run(make_extractor(chat_mdl, CHUNKS))
+        assert [c["summary"] for c in out] == [f"Summarize: {c['text'][::-1]}" for c in CHUNKS]
+        assert [c["text"] for c in out] == [c["text"] for c in CHUNKS]
+        assert 1 < chat_mdl.max_running <= 4
+        assert set(chat_mdl.calls.values()) == {1}
+
+    def test_cached(self, llm_cache):
+        """Test that a chunk is generated once for a model, prompt and generation config"""
+        chat_mdl = FakeChatModel()
+        first = run(make_extractor(chat_mdl, CHUNKS))
+        assert run(make_extractor(chat_mdl, CHUNKS + [{"text": "new"}]))[:-1] == first
+        assert sum(chat_mdl.calls.values()) == len(CHUNKS) + 1
+        cpn = make_extractor(chat_mdl, CHUNKS[:1])
+        cpn._param.sys_prompt = "Translate"
+        assert run(cpn)[0]["summary"] == "Translate: 0 knuhc"
+
+    def test_cached_per_images(self, llm_cache):
+        """Test that the same chunk with other images is generated again"""
+        chat_mdl = FakeChatModel()
+        for imgs in [[], ["data:image/png;base64,AAAA"], ["data:image/png;base64,BBBB"], ["data:image/png;base64,AAAA"]]:
+            cpn = make_extractor(chat_mdl, CHUNKS[:2])
+            cpn.imgs = imgs
+            run(cpn)
+        assert chat_mdl.calls == {"chunk 0": 3, "chunk 1": 3}
+
+    def test_retried_in_order(self, llm_cache):
+        chat_mdl = FakeChatModel(failures={"chunk 3": 2, "chunk 7": 1})
+        out = run(make_extractor(chat_mdl, CHUNKS))
+        assert [c["summary"] for c in out] == [f"Summarize: {c['text'][::-1]}" for c in CHUNKS]
+        assert chat_mdl.calls["chunk 3"] == 3 and chat_mdl.calls["chunk 7"] == 2
+
+    def test_error_answers(self, llm_cache):
+        """Test that error answers are retried, and not cached when retries are exhausted"""
+        chat_mdl = FakeChatModel(errors={"chunk 2": 1, "chunk 5": extractor.EXTRACTOR_RETRIES + 1})
+        out = run(make_extractor(chat_mdl, CHUNKS[:8]))
+        assert out[2]["summary"] == "Summarize: 2 knuhc"
+        assert out[5]["summary"].startswith("**ERROR**")
+        assert run(make_extractor(chat_mdl, CHUNKS[:8]))[5]["summary"] == "Summarize: 5 knuhc"
+        assert chat_mdl.calls["chunk 5"] == extractor.EXTRACTOR_RETRIES + 2
+
+    def test_retries_exhausted(self, llm_cache):
+        chat_mdl = FakeChatModel(failures={"chunk 1": extractor.EXTRACTOR_RETRIES + 1})
+        with pytest.raises(Exception) as e:
+            run(make_extractor(chat_mdl, CHUNKS[:3]))
+        # raised alone, or grouped by the nursery with strict exception groups
+        assert e.errisinstance(ConnectionError) or e.group_contains(ConnectionError)
+        assert chat_mdl.calls["chunk 1"] == extractor.EXTRACTOR_RETRIES + 1
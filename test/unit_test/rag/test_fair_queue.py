@@ -0,0 +1,249 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+from collections import Counter, defaultdict
+
+import pytest
+import trio
+
+from rag.utils import fair_queue
+from rag.utils.fair_queue import AsyncTaskConsumer, BatchedAcker, FairScheduler, queue_product, queue_stats
+
+QUEUE = "svr_queue"
+GROUP = "svr_group"
+
+
+def _score(v):
+    return float(v.replace("inf", "Infinity")) if isinstance(v, str) else v
+
+
+class FakeRedis:
+    """The stream, sorted set and hash commands the scheduler uses, in memory."""
+
+    def __init__(self):
+        self.streams = defaultdict(list)
+        self.groups = defaultdict(dict)
+        self.zsets = defaultdict(dict)
+        self.hashes = defaultdict(dict)
+        self.seq = 0
+        self.calls = Counter()
+
+    def pipeline(self, transaction=True):
+        redis = self
+
+        class Pipeline:
+            def __init__(self):
+                self.ops = []
+
+            def __getattr__(self, name):
+                return lambda *args, **kwargs: self.ops.append((name, args, kwargs))
+
+            def execute(self):
+                return [getattr(redis, name)(*args, **kwargs) for name, args, kwargs in self.ops]
+
+        return Pipeline()
+
+    def xadd(self, stream, fields):
+        self.calls["xadd"] += 1
+        self.seq += 1
+        msg_id = f"0-{self.seq}"
+        self.streams[stream].append((msg_id, dict(fields)))
+        return msg_id
+
+    def xgroup_create(self, stream, group, id="0", mkstream=False):
+        self.calls["xgroup_create"] += 1
+        if group in self.groups[stream]:
+            raise Exception("BUSYGROUP Consumer Group name already exists")
+        self.groups[stream][group] = {"last": 0, "pending": {}}
+
+    def xreadgroup(self, groupname, consumername, streams, count=None, block=None):
+        self.calls["xreadgroup"] += 1
+        res = []
+        for stream in streams:
+            if groupname not in self.groups[stream]:
+                raise Exception("NOGROUP No such key or consumer group")
+            g = self.groups[stream][groupname]
+            elements = self.streams[stream][g["last"]:g["last"] + (count or len(self.streams[stream]))]
+            g["last"] += len(elements)
+            for msg_id, _ in elements:
+                g["pending"][msg_id] = consumername
+            if elements:
+                res.append([stream, elements])
+        return res
+
+    def xack(self, stream, group, *msg_ids):
+        self.calls["xack"] += 1
+        return sum(self.groups[stream][group]["pending"].pop(msg_id, None) is not None for msg_id in msg_ids)
+
+    def xinfo_groups(self, stream):
+        return [{"name": name, "pending": len(g["pending"]), "lag": len(self.streams[stream]) - g["last"]} for name, g in self.groups[stream].items()]
+
+    def zadd(self, key, mapping):
+        self.zsets[key].update(mapping)
+
+    def zrangebyscore(self, key, lo, hi):
+        return [m for m, s in sorted(self.zsets[key].items(), key=lambda x: x[1]) if _score(lo) <= s <= _score(hi)]
+
+    def zremrangebyscore(self, key, lo, hi):
+        for m in self.zrangebyscore(key, lo, hi):
+            del self.zsets[key][m]
+
+    def zrem(self, key, member):
+        self.zsets[key].pop(member, None)
+
+    def zcard(self, key):
+        return len(self.zsets[key])
+
+    def hgetall(self, key):
+        return dict(self.hashes[key])
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    monkeypatch.setattr(fair_queue, "FAIR_TASK_QUEUE", 1)
+    return FakeRedis()
+
+
+def produce(redis, tenant, n, start=0):
+    for i in range(start, start + n):
+        assert queue_product(QUEUE, {"id": f"{tenant}-{i}"}, tenant_id=tenant, client=redis)
+
+
+def tenant(msg):
+    return msg.get_message()["id"].split("-")[0]
+
+
+def drain(scheduler, n=None):
+    picked = []
+    while n is None or len(picked) < n:
+        msg = scheduler.next()
+        if not msg:
+            break
+        msg.ack()
+        picked.append(tenant(msg))
+    return picked
+
+
+class TestFairScheduler:
+
+    def test_no_starvation(self, redis):
+        """Test that a tenant queuing a lot doesn't hold back the tasks queued after"""
+        produce(redis, "big", 500)
+        produce(redis, "small1", 5)
+        produce(redis, "small2", 5)
+        scheduler = FairScheduler([QUEUE], GROUP, "c1", client=redis, refresh_interval=0)
+        picked = drain(scheduler, 15)
+        assert Counter(picked) == {"big": 5, "small1": 5, "small2": 5}
+        rest = drain(scheduler)
+        assert len(rest) == 495 and set(rest) == {"big"}
+
+    def test_weights(self, redis):
+        produce(redis, "a", 300)
+        produce(redis, "b", 300)
+        redis.hashes[f"{QUEUE}@weights"] = {"a": "3", "b": "1"}
+        scheduler = FairScheduler([QUEUE], GROUP, "c1", client=redis, refresh_interval=0)
+        assert Counter(drain(scheduler, 200)) == {"a": 150, "b": 50}
+
+    def test_inflight_cap(self, redis):
+        """Test that a tenant at its cap waits while others run"""
+        produce(redis, "a", 10)
+        produce(redis, "b", 10)
+        scheduler = FairScheduler([QUEUE], GROUP, "c1", client=redis, max_inflight=2, refresh_interval=0)
+        running = [scheduler.next() for _ in range(4)]
+        assert Counter(tenant(m) for m in running) == {"a": 2, "b": 2}
+        assert scheduler.next() is None
+        next(m for m in running if tenant(m) == "b").ack()
+        assert tenant(scheduler.next()) == "b"
+        assert scheduler.next() is None
+
+    def test_priority_and_legacy_queue(self, redis):
+        """Test that the high priority queue goes first, and messages queued without a tenant are read"""
+        high = QUEUE + "_1"
+        assert queue_product(high, {"id": "h-0"}, tenant_id="a", client=redis)
+        redis.xadd(QUEUE, {"message": '{"id": "legacy-0"}'})
+        produce(redis, "a", 2)
+        scheduler = FairScheduler([high, QUEUE], GROUP, "c1", client=redis, refresh_interval=0)
+        picked = drain(scheduler)
+        assert picked[0] == "h" and sorted(picked[1:]) == ["a", "a", "legacy"]
+        assert set(scheduler.streams()) == {high, f"{high}@a", QUEUE, f"{QUEUE}@a"}
+
+    def test_shared_by_executors(self, redis):
+        """Test that several executors run every task once, at the pace of a single one"""
+        for t in range(8):
+            produce(redis, f"t{t}", 50)
+        executors = [FairScheduler([QUEUE], GROUP, f"c{i}", client=redis, refresh_interval=0) for i in range(3)]
+        picked, rounds = [], 0
+        while True:
+            rounds += 1
+            msgs = [e.next() for e in executors]
+            if not any(msgs):
+                break
+            if len(picked) == 0:
+                # each executor holds the first task of every tenant
+                assert queue_stats(QUEUE, GROUP, client=redis) == {"pending": 3 * 8, "lag": 400 - 3 * 8}
+            for m in msgs:
+                if m:
+                    picked.append(m.get_message()["id"])
+                    m.ack()
+        assert len(picked) == 400 and len(set(picked)) == 400
+        assert queue_stats(QUEUE, GROUP, client=redis) == {"pending": 0, "lag": 0}
+        # groups are created once per stream, one read per pick serves all the tenants
+        assert redis.calls["xgroup_create"] <= 3 * 9
+        assert redis.calls["xreadgroup"] <= 3 * rounds
+
+    def test_batched_acks(self, redis):
+        """Test that acks are sent along with the reads, one XACK per stream"""
+        produce(redis, "a", 20)
+        produce(redis, "b", 20)
+        acker = BatchedAcker(redis, batch_size=100, interval=3600)
+        scheduler = FairScheduler([QUEUE], GROUP, "c1", client=redis, refresh_interval=0, acker=acker)
+        picked = []
+        while True:
+            msgs = scheduler.next_batch(4)
+            if not msgs:
+                break
+            for m in msgs:
+                picked.append(m.get_message()["id"])
+                assert m.ack()
+            # buffered until the next read
+            assert queue_stats(QUEUE, GROUP, client=redis)["pending"] >= len(msgs)
+        assert len(set(picked)) == 40
+        assert queue_stats(QUEUE, GROUP, client=redis) == {"pending": 0, "lag": 0}
+        assert redis.calls["xack"] <= 2 * redis.calls["xreadgroup"]
+
+    def test_async_consumer(self, redis):
+        """Test that the tasks waiting for a message are served by one read"""
+        produce(redis, "a", 3)
+        produce(redis, "b", 3)
+        scheduler = FairScheduler([QUEUE], GROUP, "c1", client=redis, refresh_interval=0)
+        consumer = AsyncTaskConsumer(scheduler, prefetch=1, block_ms=10)
+        got = []
+
+        async def worker():
+            msg = await consumer.get()
+            got.append(msg and tenant(msg))
+
+        async def run():
+            async with trio.open_nursery() as nursery:
+                for _ in range(4):
+                    nursery.start_soon(worker)
+
+        trio.run(run)
+        assert Counter(got) == {"a": 2, "b": 2}
+        assert redis.calls["xreadgroup"] == 1
+        got.clear()
+        trio.run(run)
+        assert Counter(got) == {"a": 1, "b": 1, None: 2}
@@ -0,0 +1,162 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import os
+
+import pytest
+
+from rag.utils import local_conn
+from rag.utils.doc_store_conn import FusionExpr, MatchDenseExpr, MatchTextExpr, OrderByExpr
+from rag.utils.local_conn import LocalDocStore, parse_query
+
+INDEX = "ragflow_tenant"
+KB = "kb1"
+
+
+def chunk(i, content, vec, **kw):
+    d = {"id": f"c{i}", "doc_id": f"d{i % 2}", "docnm_kwd": f"doc{i % 2}.txt", "content_ltks": content,
+         "content_with_weight": content, "q_4_vec": vec, "available_int": 1, "page_num_int": [i], "top_int": [0]}
+    d.update(kw)
+    return d
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = LocalDocStore(str(tmp_path))
+    s.createIdx(INDEX, KB, 4)
+    assert s.insert([
+        chunk(0, "the quick brown fox", [1, 0, 0, 0]),
+        chunk(1, "a lazy brown dog", [0, 1, 0, 0]),
+        chunk(2, "fox and dog are friends", [0.7, 0.7, 0, 0]),
+        chunk(3, "nothing to see here", [0, 0, 1, 0], available_int=0),
+    ], INDEX, KB) == []
+    return s
+
+
+def search(store, match_exprs, condition=None, order_by=None, agg_fields=None, limit=10):
+    return store.search(["content_with_weight", "q_4_vec"], ["content_ltks"], condition or {}, match_exprs,
+                        order_by or OrderByExpr(), 0, limit, INDEX, [KB], agg_fields or [])
+
+
+class TestParseQuery:
+
+    def test_boosts_and_phrases(self):
+        """Test that group boosts multiply into their leaves"""
+        clauses = parse_query('(fox^0.5 "red fox"^0.2) "brown fox"^2')
+        assert clauses == [[(("fox",), 0.5), (("red", "fox"), 0.2)], [(("brown", "fox"), 2.0)]]
+
+    def test_nested_or(self):
+        """Test the OR groups built for Chinese questions"""
+        clauses = parse_query("((a)^0.6 OR (b c)^0.4)^5 OR (d)")
+        assert clauses == [[(("a",), 3.0), (("b",), 2.0), (("c",), 2.0)], [(("d",), 1.0)]]
+
+
+class TestLocalDocStore:
+
+    def test_filters(self, store):
+        """Test available_int, keyword and kb filters"""
+        res = search(store, [], {"available_int": 1})
+        assert store.get_total(res) == 3
+        res = search(store, [], {"doc_id": "d1"})
+        assert store.get_chunk_ids(res) == ["c1", "c3"]
+        res = store.search([], [], {}, [], OrderByExpr(), 0, 10, INDEX, ["other_kb"])
+        assert store.get_total(res) == 0
+
+    def test_bm25(self, store):
+        """Test that rarer and repeated terms rank first"""
+        res = search(store, [MatchTextExpr(["content_ltks"], "fox^1 brown^1", 100)])
+        assert set(store.get_chunk_ids(res)) == {"c0", "c1", "c2"}
+        assert store.get_chunk_ids(res)[0] == "c0"
+        assert store.get_highlight(res, ["fox"], "content_with_weight")["c0"]
+
+    def test_minimum_should_match(self, store):
+        """Test that chunks matching too few clauses are dropped"""
+        expr = MatchTextExpr(["content_ltks"], "(fox) OR (brown) OR (quick)", 100, {"minimum_should_match": 0.7})
+        assert store.get_chunk_ids(search(store, [expr])) == ["c0"]
+
+    def test_dense_and_fusion(self, store):
+        """Test cosine search and weighted fusion"""
+        dense = MatchDenseExpr("q_4_vec", [0, 1, 0, 0], "float", "cosine", 2, {"similarity": 0.5})
+        res = search(store, [dense])
+        assert store.get_chunk_ids(res) == ["c1", "c2"]
+        fields = store.get_fields(res, ["q_4_vec"])
+        assert fields["c1"]["q_4_vec"] == [0.0, 1.0, 0.0, 0.0]
+
+        text = MatchTextExpr(["content_ltks"], "fox", 100)
+        fusion = FusionExpr("weighted_sum", 10, {"weights": "0.5,0.5"})
+        res = search(store, [text, dense, fusion])
+        assert set(store.get_chunk_ids(res)) == {"c0", "c1", "c2"}
+        assert store.get_chunk_ids(res)[0] == "c2"
+
+    def test_order_and_aggregation(self, store):
+        """Test sorting on list values and terms aggregation"""
+        res = search(store, [], order_by=OrderByExpr().desc("page_num_int"), agg_fields=["docnm_kwd"])
+        assert store.get_chunk_ids(res) == ["c3", "c2", "c1", "c0"]
+        assert sorted(store.get_aggregation(res, "docnm_kwd")) == [("doc0.txt", 2), ("doc1.txt", 2)]
+
+    def test_update_and_delete(self, store, tmp_path):
+        """Test single and conditional updates, deletes and a second process view"""
+        assert store.update({"id": "c0"}, {"content_ltks": "slow red fox", "q_4_vec": [0, 0, 0, 1]}, INDEX, KB)
+        chunk0 = store.get("c0", INDEX, [KB])
+        assert chunk0["content_ltks"] == "slow red fox"
+        assert chunk0["q_4_vec"] == [0.0, 0.0, 0.0, 1.0]
+        assert store.update({"doc_id": "d1"}, {"available_int": 0}, INDEX, KB)
+        assert store.get_total(search(store, [], {"available_int": 1})) == 2
+
+        assert store.delete({"doc_id": "d0"}, INDEX, KB) == 2
+        other = LocalDocStore(str(tmp_path))
+        assert other.get_total(search(other, [])) == 2
+        assert other.get_chunk_ids(search(other, [MatchTextExpr(["content_ltks"], "fox", 100)])) == []
+
+    def test_reinsert_replaces_vectors(self, store):
+        """Test that a chunk inserted again without a vector loses the one it had, while updates keep it"""
+        assert store.update({"id": "c1"}, {"content_ltks": "a lazy red dog"}, INDEX, KB)
+        assert store.get("c1", INDEX, [KB])["q_4_vec"] == [0.0, 1.0, 0.0, 0.0]
+        assert store.insert([{k: v for k, v in chunk(1, "a lazy brown dog", None).items() if k != "q_4_vec"}], INDEX, KB) == []
+        assert "q_4_vec" not in store.get("c1", INDEX, [KB])
+        dense = MatchDenseExpr("q_4_vec", [0, 1, 0, 0], "float", "cosine", 10, {"similarity": 0.5})
+        assert store.get_chunk_ids(search(store, [dense])) == ["c2"]
+
+    def test_compaction_crash_safe(self, store, tmp_path, monkeypatch):
+        """Test that a compaction dying before its log is swapped leaves the store readable, and a later one finishes"""
+        monkeypatch.setattr(local_conn, "COMPACT_MIN_RECORDS", 8)
+        replace = os.replace
+        crashes = []
+
+        def crash(src, dst):
+            # dies between the vector files and the log
+            if not dst.endswith(".jsonl"):
+                return replace(src, dst)
+            crashes.append(dst)
+            raise OSError("killed")
+
+        monkeypatch.setattr(local_conn.os, "replace", crash)
+        for n in range(6):
+            assert store.insert([chunk(0, "the quick brown fox", [1, 0, 0, n])], INDEX, KB) == []
+        assert crashes
+        expected = {i: store.get(f"c{i}", INDEX, [KB])["q_4_vec"] for i in range(4)}
+        assert expected[0] == [1.0, 0.0, 0.0, 5.0]
+        reopened = LocalDocStore(str(tmp_path))
+        assert {i: reopened.get(f"c{i}", INDEX, [KB])["q_4_vec"] for i in range(4)} == expected
+
+        monkeypatch.setattr(local_conn.os, "replace", replace)
+        assert store.insert([chunk(1, "a lazy brown dog", [0, 1, 0, 0])], INDEX, KB) == []
+        assert store._index(INDEX).gen == 1
+        assert sorted(f for f in os.listdir(tmp_path / INDEX) if f.endswith(".f32")) == ["q_4_vec.1.f32"]
+        for s in [store, reopened, LocalDocStore(str(tmp_path))]:
+            assert {i: s.get(f"c{i}", INDEX, [KB])["q_4_vec"] for i in range(4)} == expected
+            dense = MatchDenseExpr("q_4_vec", [0, 1, 0, 0], "float", "cosine", 1, {"similarity": 0.5})
+            assert s.get_chunk_ids(search(s, [dense])) == ["c1"]
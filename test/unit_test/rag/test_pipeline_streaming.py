@@ -0,0 +1,182 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import json
+
+import pytest
+import trio
+
+from rag.flow import pipeline
+from rag.flow.base import ProcessBase, ProcessParamBase
+from rag.flow.pipeline import Pipeline
+
+TIMING = {"_created_time", "_elapsed_time"}
+
+
+class FakeRedis:
+    def __init__(self):
+        self.kv = {}
+
+    def get(self, key):
+        return self.kv.get(key)
+
+    def set_obj(self, key, obj, exp=None):
+        self.kv[key] = json.dumps(obj)
+
+
+class FakeTaskService:
+    def __init__(self):
+        self.progress = []
+
+    def update_progress(self, id, info):
+        self.progress.append(info)
+
+
+class StageParam(ProcessParamBase):
+    def check(self):
+        pass
+
+
+class Stage(ProcessBase):
+    """Records the chunks it got in and out, shared by all the stages of a pipeline."""
+
+    def __init__(self, canvas, id, events, fail_at=None):
+        super().__init__(canvas, id, StageParam())
+        self.events = events
+        self.fail_at = fail_at
+
+
+class Source(Stage):
+    component_name = "Source"
+
+    async def _invoke(self, **kwargs):
+        self.set_output("output_format", "chunks")
+        self.set_output("chunks", [{"text": f"chunk {i}"} for i in range(kwargs["n"])])
+
+
+class Upper(Stage):
+    component_name = "Upper"
+
+    def chunk_wise(self, upstream_id):
+        return True
+
+    async def _invoke(self, **kwargs):
+        chunks = [dict(ck) for ck in kwargs["chunks"]]
+        for ck in chunks:
+            if ck["text"] == self.fail_at:
+                raise ValueError(f"can't handle {ck['text']}")
+            self.events.append((self._id, ck["text"]))
+            await trio.sleep(0.001)
+            ck["upper"] = ck["text"].upper()
+        self.set_output("chunks", chunks)
+
+
+class Count(Upper):
+    """Counts tokens, like the embedding of the tokenizer."""
+
+    component_name = "Count"
+
+    async def _invoke(self, **kwargs):
+        await super()._invoke(**kwargs)
+        self.set_output("token_consumption", sum(len(ck["text"]) for ck in self.output("chunks")))
+
+    def merge_outputs(self, outputs):
+        merged = super().merge_outputs(outputs)
+        merged["token_consumption"] = sum(o["token_consumption"] for o in outputs)
+        return merged
+
+
+class Join(Stage):
+    component_name = "Join"
+
+    async def _invoke(self, **kwargs):
+        self.set_output("text", "\n".join(ck["upper"] for ck in kwargs["chunks"]))
+
+
+def make_pipeline(monkeypatch, streaming, stages, fail_at=None):
+    monkeypatch.setattr(pipeline, "REDIS_CONN", FakeRedis())
+    monkeypatch.setattr(pipeline, "has_canceled", lambda task_id: False)
+    monkeypatch.setattr(pipeline, "TaskService", FakeTaskService())
+    pipe = Pipeline.__new__(Pipeline)
+    pipe.path, pipe.error, pipe.task_id = [], "", "task"
+    pipe._doc_id, pipe._flow_id, pipe._kb_id = None, "flow", None
+    pipe._streaming = streaming
+    pipe.dsl = {"components": {}}
+    pipe.events = []
+    ids = ["File"] + [f"{cls.__name__}:{i}" for i, cls in enumerate(stages)]
+    pipe.components = {}
+    for i, (id, cls) in enumerate(zip(ids, [Source] + stages)):
+        pipe.components[id] = {"downstream": ids[i + 1 : i + 2], "upstream": ids[max(i - 1, 0) : i]}
+        pipe.components[id]["obj"] = cls(pipe, id, pipe.events, fail_at=fail_at)
+    return pipe
+
+
+def run(pipe, n):
+    return trio.run(lambda: pipe.run(n=n))
+
+
+def outputs(pipe):
+    return {id: {k: v for k, v in cpn["obj"].output().items() if k not in TIMING} for id, cpn in pipe.components.items()}
+
+
+STAGES = [Upper, Upper, Count, Join]
+
+
+@pytest.fixture
+def batch(monkeypatch):
+    monkeypatch.setattr(pipeline, "PIPELINE_STREAM_BATCH", 4)
+    monkeypatch.setattr(pipeline, "PIPELINE_STREAM_BUFFER", 1)
+
+
+class TestPipelineStreaming:
+
+    @pytest.mark.parametrize("n", [0, 1, 3, 4, 5, 41])
+    def test_same_as_batch(self, monkeypatch, batch, n):
+        """Test that every component ends with the output it has when run on all the chunks at once"""
+        batch_pipe = make_pipeline(monkeypatch, False, STAGES)
+        expected = run(batch_pipe, n)
+        stream_pipe = make_pipeline(monkeypatch, True, STAGES)
+        res = run(stream_pipe, n)
+        assert {k: v for k, v in res.items() if k not in TIMING} == {k: v for k, v in expected.items() if k not in TIMING}
+        assert outputs(stream_pipe) == outputs(batch_pipe)
+        assert stream_pipe.path == batch_pipe.path
+        assert not stream_pipe.error
+
+    def test_overlapped_and_bounded(self, monkeypatch, batch):
+        """Test that later stages start on the first chunks while earlier ones are on the last, a few batches apart"""
+        pipe = make_pipeline(monkeypatch, True, STAGES)
+        run(pipe, 100)
+        first = [i for i, (id, _) in enumerate(pipe.events) if id == "Upper:0"]
+        last = [i for i, (id, _) in enumerate(pipe.events) if id == "Count:2"]
+        assert last[0] < first[-1]
+        done, ahead = set(), 0
+        for id, text in pipe.events:
+            done.add((id, text))
+            if id == "Upper:0":
+                ahead = max(ahead, sum(1 for i, t in done if i == "Upper:0") - sum(1 for i, t in done if i == "Count:2"))
+        # batches held in the channels and by the stages themselves
+        assert ahead <= 4 * (3 * 1 + 3)
+
+    def test_error(self, monkeypatch, batch):
+        """Test that a stage failing half way stops the stream and fails the pipeline as in batch mode"""
+        batch_pipe = make_pipeline(monkeypatch, False, STAGES, fail_at="chunk 17")
+        assert run(batch_pipe, 40) == {}
+        stream_pipe = make_pipeline(monkeypatch, True, STAGES, fail_at="chunk 17")
+        assert run(stream_pipe, 40) == {}
+        assert stream_pipe.error == batch_pipe.error == "[ERROR]can't handle chunk 17"
+        assert stream_pipe.path == batch_pipe.path
+        assert ("Upper:0", "chunk 39") not in stream_pipe.events
+        assert pipeline.TaskService.progress[-1] == {"progress": -1, "progress_msg": "[ERROR]: [ERROR]can't handle chunk 17"}
@@ -0,0 +1,160 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import numpy as np
+import pytest
+import trio
+
+from rag import raptor
+from rag.raptor import RecursiveAbstractiveProcessing4TreeOrganizedRetrieval as Raptor
+
+DIM = 8
+
+
+class FakeChat:
+    llm_name = "chat"
+    max_length = 8192
+
+    def __init__(self):
+        self.prompts = []
+
+    def chat(self, system, history, gen_conf):
+        self.prompts.append(history[0]["content"])
+        return f"summary {len(self.prompts)}"
+
+
+class FakeEmbedding:
+    llm_name = "embd"
+    tenant_id = "tenant"
+
+    def encode(self, texts):
+        return [np.ones(DIM) / np.sqrt(DIM) for _ in texts], len(texts)
+
+
+@pytest.fixture(autouse=True)
+def no_caches(monkeypatch):
+    monkeypatch.setattr(raptor, "get_llm_cache", lambda *args: None)
+    monkeypatch.setattr(raptor, "set_llm_cache", lambda *args: None)
+    monkeypatch.setattr(raptor, "get_embed_cache", lambda *args: None)
+    monkeypatch.setattr(raptor, "set_embed_cache", lambda *args: None)
+
+
+def blobs(n_blobs, per_blob, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(scale=20, size=(n_blobs, 4))
+    return np.concatenate([c + rng.normal(size=(per_blob, 4)) for c in centers])
+
+
+def axis(i, noise=0.0):
+    v = np.zeros(DIM)
+    v[i] = 1
+    v[(i + 1) % DIM] = noise
+    return v
+
+
+def make_raptor(cluster_search="exhaustive", chat=None):
+    return Raptor(16, chat or FakeChat(), FakeEmbedding(), "{cluster_content}", max_token=256, cluster_search=cluster_search)
+
+
+class TestClusterSearch:
+
+    def test_exhaustive(self):
+        """Test that the exhaustive search gives the count of well separated clusters"""
+        assert make_raptor()._get_optimal_clusters(blobs(5, 20), 0) == 5
+
+    @pytest.mark.parametrize("n_blobs", [1, 3, 5, 9])
+    def test_fast_matches_exhaustive(self, n_blobs):
+        """Test that the coarse to fine search finds the count the exhaustive one does"""
+        embeddings = blobs(n_blobs, 15, seed=n_blobs)
+        assert make_raptor("fast")._get_optimal_clusters(embeddings, 0) == make_raptor()._get_optimal_clusters(embeddings, 0)
+
+    def test_fast_parallel(self, monkeypatch):
+        """Test that candidates fitted in parallel processes give the same count"""
+        monkeypatch.setattr(raptor, "RAPTOR_PARALLEL_MIN_SIZE", 0)
+        monkeypatch.setattr(raptor, "RAPTOR_CLUSTER_JOBS", 2)
+        assert make_raptor("fast")._get_optimal_clusters(blobs(4, 20), 0) == 4
+
+    def test_fast_sampled(self, monkeypatch):
+        """Test that large layers are scored on a sample"""
+        monkeypatch.setattr(raptor, "RAPTOR_BIC_SAMPLE_SIZE", 150)
+        sizes = []
+        fit_bic = raptor._fit_bic
+
+        def recording_fit_bic(embeddings, n, random_state):
+            sizes.append(len(embeddings))
+            return fit_bic(embeddings, n, random_state)
+
+        monkeypatch.setattr(raptor, "_fit_bic", recording_fit_bic)
+        assert make_raptor("fast")._get_optimal_clusters(blobs(3, 100), 0) == 3
+        assert set(sizes) == {150}
+
+    def test_too_few_to_split(self):
+        """Test that a layer of at most two chunks is one cluster"""
+        assert make_raptor("fast")._get_optimal_clusters(blobs(2, 1), 0) == 1
+
+
+class TestIncrementalUpdate:
+
+    def tree(self):
+        leaves = [(f"leaf {i}", axis(i // 3, 0.1 * (i % 3))) for i in range(6)]
+        clusters = [("summary a", axis(0), [0, 1, 2]), ("summary b", axis(1), [3, 4, 5])]
+        return leaves, clusters
+
+    def test_new_leaf(self):
+        """Test that a new leaf joins the closest cluster, which is the only one summarized again"""
+        leaves, clusters = self.tree()
+        leaves.append(("leaf 6", axis(1, 0.2)))
+        chat = FakeChat()
+        r = make_raptor(chat=chat)
+        chunks = trio.run(r.update, leaves, clusters, 0)
+
+        assert chunks[:len(leaves)] == leaves
+        assert chunks[len(leaves)][0] == "summary a"
+        assert r.members[len(leaves)] == [0, 1, 2]
+        assert chunks[len(leaves) + 1][0] == "summary 1"
+        assert r.members[len(leaves) + 1] == [3, 4, 5, 6]
+        assert all(f"leaf {i}" in chat.prompts[0] for i in [3, 4, 5, 6]) and "leaf 0" not in chat.prompts[0]
+        # the rebuilt layer above: both bottom clusters summarized into the root
+        assert len(chat.prompts) == 2
+        assert r.members[len(chunks) - 1] == [len(leaves), len(leaves) + 1]
+
+    def test_removed_leaf(self):
+        """Test that a cluster which lost a leaf is summarized again without it"""
+        leaves, clusters = self.tree()
+        leaves = leaves[:5]
+        clusters[1] = ("summary b", axis(1), [3, 4, None])
+        chat = FakeChat()
+        r = make_raptor(chat=chat)
+        chunks = trio.run(r.update, leaves, clusters, 0)
+
+        assert [c[0] for c in chunks[len(leaves):len(leaves) + 2]] == ["summary a", "summary 1"]
+        assert r.members[len(leaves) + 1] == [3, 4]
+        assert "leaf 5" not in chat.prompts[0]
+
+    def test_unchanged(self):
+        """Test that the bottom layer is kept when nothing changed"""
+        leaves, clusters = self.tree()
+        chat = FakeChat()
+        chunks = trio.run(make_raptor(chat=chat).update, leaves, clusters, 0)
+        assert [c[0] for c in chunks[len(leaves):]] == ["summary a", "summary b", "summary 1"]
+        assert len(chat.prompts) == 1
+
+    def test_too_many_new_leaves(self):
+        """Test that a full rebuild is asked for when too many leaves are new"""
+        leaves, clusters = self.tree()
+        leaves += [(f"leaf {i}", axis(2)) for i in range(6, 9)]
+        assert trio.run(make_raptor().update, leaves, clusters, 0) is None
+        assert trio.run(make_raptor().update, leaves, [], 0) is None
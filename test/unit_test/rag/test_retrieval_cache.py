@@ -0,0 +1,99 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import pytest
+
+from rag.utils import retrieval_cache
+from rag.utils.local_conn import LocalDocStore
+from rag.utils.retrieval_cache import RetrievalCache
+
+INDEX = "ragflow_tenant"
+KB = "kb1"
+OTHER_KB = "kb2"
+
+
+class FakeRedis:
+    def __init__(self):
+        self.kv = {}
+
+    def get(self, key):
+        return self.kv.get(key)
+
+    def mget(self, keys):
+        return [self.kv.get(k) for k in keys]
+
+    def set(self, key, value, exp=None):
+        self.kv[key] = value
+        return True
+
+    def incrby(self, key, amount, exp=None):
+        self.kv[key] = str(int(self.kv.get(key) or 0) + amount)
+        return int(self.kv[key])
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(retrieval_cache, "REDIS_CONN", FakeRedis())
+    monkeypatch.setattr(retrieval_cache, "RETRIEVAL_CACHE_WRITE_SETTLE", 0)
+    return RetrievalCache(ttl=300, enabled=True)
+
+
+@pytest.fixture
+def store(tmp_path, cache):
+    s = LocalDocStore(str(tmp_path))
+    s.createIdx(INDEX, KB, 4)
+    s.insert([{"id": f"c{i}", "doc_id": f"d{i}", "kb_id": KB, "docnm_kwd": f"doc{i}.txt", "content_ltks": "brown fox",
+               "content_with_weight": "brown fox", "q_4_vec": [1, 0, 0, 0], "available_int": 1} for i in range(2)], INDEX, KB)
+    return s
+
+
+def cached(cache, kb_ids):
+    key = cache.key(kb_ids, question="brown fox", top=10)
+    cache.set(key, {"total": 2, "chunks": [{"chunk_id": "c0", "docnm_kwd": "doc0.txt"}]})
+    return key
+
+
+class TestRetrievalCache:
+
+    def test_rename_invalidates(self, cache, store):
+        """Test that renaming a document, like any docStore update, drops the cached results of its knowledge base"""
+        key, other = cached(cache, [KB]), cached(cache, [OTHER_KB])
+        store.update({"doc_id": "d0"}, {"docnm_kwd": "renamed.txt", "title_tks": "renamed"}, INDEX, KB)
+        assert cache.key([KB], question="brown fox", top=10) != key
+        assert cache.get(cache.key([KB], question="brown fox", top=10)) is None
+        assert cache.key([OTHER_KB], question="brown fox", top=10) == other
+
+    def test_delete_invalidates(self, cache, store):
+        key = cached(cache, [KB, OTHER_KB])
+        assert store.delete({"doc_id": "d1"}, INDEX, KB) == 1
+        assert cache.key([KB, OTHER_KB], question="brown fox", top=10) != key
+
+    def test_insert_invalidates(self, cache, store):
+        """Test that rows inserted without a knowledge base argument bump the ones they belong to"""
+        key = cached(cache, [OTHER_KB])
+        store.insert([{"id": "c9", "doc_id": "d9", "kb_id": OTHER_KB, "content_ltks": "fox", "available_int": 1}], INDEX)
+        assert cache.key([OTHER_KB], question="brown fox", top=10) != key
+
+    def test_not_cached_before_refresh(self, cache, store, monkeypatch):
+        """Test that results aren't cached until a write had the time to become searchable"""
+        monkeypatch.setattr(retrieval_cache, "RETRIEVAL_CACHE_WRITE_SETTLE", 2)
+        key = cached(cache, [KB])
+        store.update({"doc_id": "d0"}, {"docnm_kwd": "renamed.txt"}, INDEX, KB)
+        assert cache.key([KB], question="brown fox", top=10) is None
+        assert cache.key([OTHER_KB], question="brown fox", top=10) is not None
+        # the flag of the write expires
+        retrieval_cache.REDIS_CONN.kv.pop(retrieval_cache._written_key(KB))
+        assert cache.key([KB], question="brown fox", top=10) not in (None, key)
@@ -0,0 +1,114 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import logging
+import re
+import zipfile
+from io import BytesIO
+
+import pytest
+from openpyxl import Workbook, load_workbook
+
+from rag.app.table import Excel
+
+
+def save(wb):
+    out = BytesIO()
+    wb.save(out)
+    return out.getvalue()
+
+
+def merged_sheet():
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["Region", "City", "Sales"])
+    for r in [["East", "Boston", 1], ["North", "Oslo", 2], [None, "Bergen", 3], [None, "Tromso", 4], ["South", "Rome", 5], [None, "Naples", 6]]:
+        ws.append(r)
+    ws.merge_cells("A3:A5")
+    ws.merge_cells("A6:A7")
+    return save(wb)
+
+
+def multi_level_header_sheet():
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["Name", "Scores", None])
+    ws.append([None, "Math", "Art"])
+    ws.merge_cells("A1:A2")
+    ws.merge_cells("B1:C1")
+    for r in [["Ann", 90, 80], ["Bob", 70, 60]]:
+        ws.append(r)
+    return save(wb)
+
+
+def no_dimension_sheet():
+    wb = Workbook()
+    ws = wb.active
+    # Without a dimension, rows are as wide as their last cell: the header is narrower than the data.
+    ws.append(["Name", "City"])
+    ws.append(["Ann", "Oslo", 30])
+    ws.append(["Bob", "Rome"])
+    src, out = zipfile.ZipFile(BytesIO(save(wb))), BytesIO()
+    with zipfile.ZipFile(out, "w") as dst:
+        for item in src.infolist():
+            data = src.read(item.filename)
+            if item.filename == "xl/worksheets/sheet1.xml":
+                data = re.sub(rb"<dimension [^>]*/>", b"", data)
+            dst.writestr(item, data)
+    return out.getvalue()
+
+
+SHEETS = {
+    "merged": (merged_sheet, ["Region", "City", "Sales"], [["East", "Boston", 1], ["North", "Oslo", 2], ["North", "Bergen", 3],
+                                                           ["North", "Tromso", 4], ["South", "Rome", 5], ["South", "Naples", 6]]),
+    "multi_level_header": (multi_level_header_sheet, ["Name", "Scores-Math", "Scores-Art"], [["Ann", 90, 80], ["Bob", 70, 60]]),
+    "no_dimension": (no_dimension_sheet, ["Name", "City", "Column_3"], [["Ann", "Oslo", 30], ["Bob", "Rome", None]]),
+}
+
+
+def parse(binary):
+    return Excel()("sheet.xlsx", binary, callback=lambda *args, **kwargs: None)
+
+
+def records(dfs):
+    assert len(dfs) == 1
+    df = dfs[0].astype(object).where(dfs[0].notna(), None)
+    return list(df.columns), df.values.tolist()
+
+
+class TestExcel:
+
+    def test_read_only_sheets_expose_xml(self):
+        """Test that the pinned openpyxl gives read-only sheets the raw xml table parsing scans"""
+        wb = load_workbook(BytesIO(merged_sheet()), read_only=True)
+        assert all(Excel._has_raw_xml(ws) for ws in wb.worksheets)
+        wb.close()
+
+    @pytest.mark.parametrize("name", SHEETS)
+    def test_streamed(self, name):
+        """Test that sheets streamed in read-only mode keep their merged cells and width"""
+        make, headers, rows = SHEETS[name]
+        assert records(parse(make())) == (headers, rows)
+
+    @pytest.mark.parametrize("name", SHEETS)
+    def test_fallback_matches_streamed(self, name, monkeypatch, caplog):
+        """Test that without the raw xml the whole workbook is loaded, loudly, with the same result"""
+        make, headers, rows = SHEETS[name]
+        monkeypatch.setattr(Excel, "_has_raw_xml", staticmethod(lambda ws: False))
+        with caplog.at_level(logging.ERROR):
+            res = parse(make())
+        assert "the whole workbook is loaded instead" in caplog.text
+        assert records(res) == (headers, rows)
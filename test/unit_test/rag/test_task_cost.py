@@ -0,0 +1,75 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import random
+
+import pytest
+
+from rag.utils.task_cost import page_cost, rows_per_task, split_by_cost, split_evenly
+
+TEXT = {"width": 595, "height": 842, "text": True, "images": 0}
+SCAN = {"width": 595, "height": 842, "text": False, "images": 1}
+
+
+def contiguous(ranges, n):
+    return ranges[0][0] == 0 and ranges[-1][1] == n and all(a[1] == b[0] and a[0] < a[1] for a, b in zip(ranges, ranges[1:]))
+
+
+class TestTaskCost:
+
+    def test_page_cost(self):
+        assert page_cost(SCAN) > 3 * page_cost(TEXT)
+        assert page_cost(TEXT, "paper") < page_cost(TEXT)
+        assert page_cost({**TEXT, "width": 2 * 595}) == pytest.approx(2 * page_cost(TEXT))
+        assert page_cost({**TEXT, "images": 3}) > page_cost(TEXT)
+        assert page_cost(None) == page_cost(TEXT)
+
+    def test_small_text_pdf_not_split(self):
+        assert split_by_cost([page_cost(TEXT)] * 20, 60) == [(0, 20)]
+
+    def test_scan_split_in_even_tasks(self):
+        costs = [page_cost(SCAN)] * 400
+        ranges = split_by_cost(costs, 60)
+        assert contiguous(ranges, 400)
+        sizes = [e - s for s, e in ranges]
+        assert max(sizes) - min(sizes) <= 1
+        assert max(sum(costs[s:e]) for s, e in ranges) <= 60 + costs[0]
+
+    @pytest.mark.parametrize("seed", range(5))
+    def test_balanced(self, seed):
+        """Test that mixed pages are cut in ranges of even cost, heavy pages in shorter ranges"""
+        rng = random.Random(seed)
+        profiles = [SCAN if rng.random() < 0.3 else TEXT for _ in range(rng.randint(50, 500))]
+        costs = [page_cost(p) for p in profiles]
+        ranges = split_by_cost(costs, 60)
+        assert contiguous(ranges, len(costs))
+        task_costs = [sum(costs[s:e]) for s, e in ranges]
+        assert len(ranges) == -(-sum(costs) // 60)
+        # off the even share by a page at most on each side
+        share = sum(costs) / len(ranges)
+        assert all(abs(c - share) <= 2 * max(costs) for c in task_costs)
+
+    def test_more_tasks_than_pages(self):
+        assert split_by_cost([1000.0] * 3, 60) == [(0, 1), (1, 2), (2, 3)]
+        assert split_by_cost([], 60) == []
+
+    def test_rows(self):
+        assert rows_per_task(60) == 3000
+        assert rows_per_task(0) == 3000
+        ranges = split_evenly(10001, 3000)
+        assert contiguous(ranges, 10001) and len(ranges) == 4
+        assert {e - s for s, e in ranges} <= {2500, 2501}
+        assert split_evenly(0, 3000) == []